@@ -1,3 +1,4 @@
 from .patch_obj_aligner_default import _C as config
 from .patch_obj_aligner_default import update_config
-from .patch_obj_aligner_default import update_config_room_retrival
\ No newline at end of file
+from .patch_obj_aligner_default import update_config_room_retrival
+from .patch_obj_aligner_default import update_config_device
\ No newline at end of file
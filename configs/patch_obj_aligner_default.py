@@ -7,6 +7,14 @@ from utils import common
 
 _C = CN()
 
+# device
+_C.device = CN()
+_C.device.name = 'auto' # auto (cuda if available), cuda, cuda:<idx> or cpu
+_C.device.num_threads = 0 # intra-op threads on cpu, 0 keeps the torch default
+_C.device.num_interop_threads = 0
+_C.device.channels_last = False # channels-last memory format of the image backbone
+_C.device.autocast_bf16 = False # bfloat16 autocast of the patch path and scene graph encoder at inference
+
 # dataset
 _C.data = CN()
 _C.data.name = "Scan3R"
@@ -29,6 +37,8 @@ _C.data.img_encoding.record_feature = False
 _C.data.img_encoding.use_feature = False
 _C.data.img_encoding.preload_feature = False
 _C.data.img_encoding.feature_dir = ''
+_C.data.img_encoding.use_feature_store = False # memory-mapped store in feature_dir/store_<split>
+_C.data.img_encoding.feature_store_dtype = 'float16'
 
 _C.data.cross_scene = CN()
 _C.data.cross_scene.use_cross_scene = False
@@ -41,6 +51,19 @@ _C.data.scene_graph.obj_img_patch = ""
 _C.data.scene_graph.obj_patch_num = 1
 _C.data.scene_graph.obj_topk = 1
 _C.data.scene_graph.use_predicted = False
+_C.data.scene_graph.use_sg_store = False # memory-mapped scene graph store shared by workers
+_C.data.scene_graph.use_sg_bundle = False # preprocessed bundle of preprocessing/scan3r/build_sg_bundle.py
+
+## range images of the LipLoc datasets, projection parameters are set in the LipLoc configs
+_C.data.pointcloud = CN()
+_C.data.pointcloud.use_range_cache = True # computed range images memory-mapped from <range_name>/cache
+_C.data.pointcloud.range_num_workers = 4 # processes computing the range images missing from the cache
+
+## data loaders of training and evaluation, workers are set in train.num_workers and val.num_workers
+_C.data.loader = CN()
+_C.data.loader.persistent_workers = True # keep the workers and their loaded dataset state across epochs
+_C.data.loader.prefetch_factor = 2 # batches loaded in advance by each worker
+_C.data.loader.pin_memory = True # page-locked batches for faster copies to cuda, ignored on cpu
 
 _C.data.auxiliary = CN()
 _C.data.auxiliary.use_patch_depth = False
@@ -98,6 +121,12 @@ _C.train.optim.weight_decay = 0.0001
 _C.train.optim.max_epoch = 10000
 _C.train.optim.free_backbone_epoch = 10000
 _C.train.optim.grad_acc_steps = 1
+## mixed precision and activation checkpointing
+_C.train.amp = CN()
+_C.train.amp.enabled = False # autocast of the train and val steps
+_C.train.amp.dtype = 'auto' # auto (bf16 on cpu, fp16 on cuda), bf16 or fp16; fp16 is trained with loss scaling
+_C.train.grad_checkpointing = False # recompute activations of the GCViT levels and scene graph encoders in backward
+_C.train.empty_cache_steps = 0 # release the cached cuda memory every n iterations, 0 never
 ## loss
 _C.train.loss = CN()
 _C.train.loss.use_temporal = False
@@ -106,6 +135,7 @@ _C.train.loss.alpha = 0.5 # for contrastive loss
 _C.train.loss.temperature = 0.1
 _C.train.loss.margin = 0.1 # for triplet loss
 _C.train.loss.epsilon = 1e-8 
+_C.train.loss.use_sparse_assoc = False # no dense e1i/e1j/e2j/f1j matrices, for ICLLossBothSidesSumOutLogBatch
 ### global descriptor loss
 _C.train.loss.use_global_descriptor = False
 _C.train.loss.global_loss_coef = 0.5
@@ -126,6 +156,8 @@ _C.train.data_aug.use_aug_3D = False
 _C.train.data_aug.pcs = CN()
 _C.train.data_aug.pcs.granularity = [0.05]
 _C.train.data_aug.pcs.magnitude = [0.]
+_C.train.data_aug.pcs.noise_pool_size = 0 # smoothed noise volumes reused across batches, 0 for fresh noise per scene
+_C.train.data_aug.pcs.noise_pool_extent = 12. # meters covered by a pooled volume, larger scenes get fresh noise
 # for validation
 _C.val = CN()
 _C.val.batch_size = 1
@@ -135,6 +167,21 @@ _C.val.room_retrieval = CN()
 _C.val.room_retrieval.retrieval = False
 _C.val.room_retrieval.epsilon_th = 0.8
 _C.val.room_retrieval.method_name = ''
+## cache of normalized 3D object embeddings, scene graphs are static at eval time
+_C.val.room_retrieval.use_sg_emb_cache = False
+_C.val.room_retrieval.sg_emb_cache_dir = '' # relative to data_root_dir/files if not absolute
+## cache of whole-scan embeddings of the LidarCLIP / LipLoc baselines, one row per scan
+_C.val.room_retrieval.use_scan_emb_cache = True
+_C.val.room_retrieval.scan_emb_cache_dir = '' # relative to data_root_dir/files if not absolute
+## approximate object index, patches vote for scans and only a shortlist is scored exactly
+_C.val.room_retrieval.ann = CN()
+_C.val.room_retrieval.ann.use_ann = False
+_C.val.room_retrieval.ann.num_lists = 64
+_C.val.room_retrieval.ann.num_subvectors = 8
+_C.val.room_retrieval.ann.num_codes = 256
+_C.val.room_retrieval.ann.nprobe = 8
+_C.val.room_retrieval.ann.top_k_objs = 16
+_C.val.room_retrieval.ann.shortlist = 10
 
 # others
 _C.other = CN()
@@ -202,4 +249,14 @@ def update_config_room_retrival(cfg, filename, ensure_dir=True):
 
     cfg.freeze()
     
-    return cfg
\ No newline at end of file
+    return cfg
+def update_config_device(cfg, device=None, num_threads=None):
+    # device options given on the command line override the config file
+    cfg.defrost()
+    if device is not None:
+        cfg.device.name = device
+    if num_threads is not None:
+        cfg.device.num_threads = num_threads
+    cfg.freeze()
+    
+    return cfg
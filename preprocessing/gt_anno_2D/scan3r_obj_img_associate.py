@@ -5,6 +5,8 @@ import numpy as np
 import torch
 import torch.utils.data as data
 import argparse
+import time
+from multiprocessing import Pool
 import cv2
 from tqdm import tqdm
 import sys
@@ -68,48 +70,62 @@ class Scan3ROBJAssociator():
         # get related files
         scan_id = self.scan_ids[scan_idx]
         # get frame annotations
+        timings = {}
+        start_time = time.time()
         frame_idxs = scan3r.load_frame_idxs(self.scans_scenes_dir, scan_id, step)
         gt_2D_obj_anno_imgs = scan3r.load_gt_2D_anno(self.data_root_dir, scan_id, step)
+        timings['load'] = time.time() - start_time
         
+        # majority vote of all patches of all images at once
+        start_time = time.time()
         patch_annos_scan = {}
-        # iterate over images
-        for frame_idx in frame_idxs:
-            gt_2D_obj_anno_img = gt_2D_obj_anno_imgs[frame_idx]
-            patch_annos = np.zeros((self.image_patch_h, self.image_patch_w), dtype=np.int32)
-            # iterate over patches within one image
-            for patch_h_i in range(self.image_patch_h):
-                h_start = round(patch_h_i * self.patch_h_size)
-                h_end = round((patch_h_i+1) * self.patch_h_size)
-                for patch_w_j in range(self.image_patch_w):
-                    w_start = round(patch_w_j * self.patch_w_size)
-                    w_end = round((patch_w_j+1) * self.patch_w_size)
-                    patch_size = (w_end - w_start) * (h_end - h_start)
-                    patch_anno = gt_2D_obj_anno_img[h_start:h_end, w_start:w_end]
-                    obj_ids, counts = np.unique(patch_anno.reshape(-1), return_counts=True)
-                    max_idx = np.argmax(counts)
-                    max_count = counts[max_idx]
-                    if(max_count > th*patch_size):
-                        patch_annos[patch_h_i,patch_w_j] = obj_ids[max_idx]
-            
-            patch_annos_scan[frame_idx] = patch_annos   
-                    
-        return patch_annos_scan
+        if len(frame_idxs) > 0:
+            patch_annos = scan3r.annotate_patches(
+                np.stack([gt_2D_obj_anno_imgs[frame_idx] for frame_idx in frame_idxs]),
+                self.image_patch_h, self.image_patch_w, th)
+            patch_annos_scan = {frame_idx: patch_annos[i] for i, frame_idx in enumerate(frame_idxs)}
+        timings['anno'] = time.time() - start_time
+        return patch_annos_scan, timings
     
-    def annotate_scans(self):
+    def annotate_scans(self, num_workers=0):
         self.patch_annos_scans = {}
-        for scan_idx in tqdm(range(len(self.scan_ids))):
-            patch_annos_scan = self.annotate(scan_idx, self.step)
+        tot_timings = {}
+        if num_workers > 0:
+            pool = Pool(num_workers, initializer=init_worker, initargs=(self,))
+            results = pool.imap(annotate_scan_job, range(len(self.scan_ids)))
+        else:
+            init_worker(self)
+            results = map(annotate_scan_job, range(len(self.scan_ids)))
+        for scan_idx, (patch_annos_scan, timings) in enumerate(tqdm(results, total=len(self.scan_ids))):
             self.patch_annos_scans[scan_idx] = patch_annos_scan
+            for key, value in timings.items():
+                tot_timings[key] = tot_timings.get(key, 0.) + value
+        if num_workers > 0:
+            pool.close()
+            pool.join()
+        print('[INFO] {} split, {} scans, time per scan: {}'.format(self.split, len(self.scan_ids),
+            ', '.join('{} {:.2f}s'.format(key, value / max(len(self.scan_ids), 1)) for key, value in tot_timings.items())))
             
         # save file
         for scan_idx in tqdm(range(len(self.scan_ids))):
             scan_id = self.scan_ids[scan_idx]
             patch_anno_file = osp.join(self.anno_out_dir, scan_id+".pkl")
             common.write_pkl_data(self.patch_annos_scans[scan_idx], patch_anno_file)
+
+## associator of the worker processes, set once by the pool initializer
+worker_associator = None
+
+def init_worker(associator):
+    global worker_associator
+    worker_associator = associator
+
+def annotate_scan_job(scan_idx):
+    return worker_associator.annotate(scan_idx, worker_associator.step)
         
 def parse_args():
     parser = argparse.ArgumentParser(description='Preprocess Scan3R')
     parser.add_argument('--config', type=str, default='', help='Path to the config file')
+    parser.add_argument('--num_workers', type=int, default=0, help='processes, 0 to annotate in the main process')
     return parser.parse_known_args()
         
 if __name__ == '__main__':
@@ -123,7 +139,7 @@ if __name__ == '__main__':
     cfg = update_config(config, cfg_file, ensure_dir = False)
     split = "validation"
     scan3r_img_projector = Scan3ROBJAssociator(Data_ROOT_DIR, split=split, cfg=cfg)
-    scan3r_img_projector.annotate_scans()
+    scan3r_img_projector.annotate_scans(args.num_workers)
     split = "train"
     scan3r_img_projector = Scan3ROBJAssociator(Data_ROOT_DIR, split=split, cfg=cfg)
-    scan3r_img_projector.annotate_scans()
\ No newline at end of file
+    scan3r_img_projector.annotate_scans(args.num_workers)
\ No newline at end of file
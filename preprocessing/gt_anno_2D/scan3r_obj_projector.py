@@ -5,6 +5,9 @@ import numpy as np
 import torch
 import torch.utils.data as data
 import argparse
+import time
+from functools import partial
+from multiprocessing import Pool
 import cv2
 import open3d as o3d
 # import open3d.visualization.rendering as rendering
@@ -14,10 +17,14 @@ ws_dir = osp.dirname(osp.dirname(osp.dirname(osp.abspath(__file__))))
 print(ws_dir)
 sys.path.append(ws_dir)
 
+from configs import config, update_config
 from utils import common, scan3r
+from utils.open3d import MeshRaycaster
+from utils.projection_store import ProjectionStore, projection_store_dir
 
 class Scan3RIMGProjector():
-    def __init__(self, data_root_dir, split, use_rescan=False):
+    def __init__(self, data_root_dir, split, use_rescan=False, patch_w=None, patch_h=None, patch_th=0.2,
+                 save_obj_id_jpg=False, save_pkl=True, frames_per_chunk=8, ray_stride=1):
         self.split = split
         self.use_rescan = use_rescan
         self.data_root_dir = data_root_dir
@@ -51,6 +58,27 @@ class Scan3RIMGProjector():
         common.ensure_dir(self.save_color_dir)
         common.ensure_dir(self.save_obj_dir)
         common.ensure_dir(self.save_pkl_dir)
+        # lossless uint16 object-id maps, read by scan3r.load_gt_2D_anno
+        self.projection_store = ProjectionStore(projection_store_dir(data_root_dir))
+        # jpg object-id maps are lossy, only written on request for visualization
+        self.save_obj_id_jpg = save_obj_id_jpg
+        # the scene-level pkl, read by the object visual embedding and patch depth generators, holds all maps
+        # of a scan in memory; skip it with --no_save_pkl when those readers are not run
+        self.save_pkl = save_pkl
+        # frames cast together, bounds the memory of the rays and maps of a chunk
+        self.frames_per_chunk = frames_per_chunk
+        # one ray every ray_stride pixels, > 1 only for patch annotation without the full maps
+        self.ray_stride = ray_stride
+        assert self.ray_stride == 1 or patch_w is not None, 'strided rays only give patch annotations'
+        
+        # patch annotation computed in the same pass, as by Scan3ROBJAssociator
+        self.patch_w = patch_w
+        self.patch_h = patch_h
+        self.patch_th = patch_th
+        if self.patch_w is not None:
+            self.patch_anno_folder_name = "patch_anno_{}_{}".format(self.patch_w, self.patch_h)
+            self.anno_out_dir = osp.join(self.scans_dir, 'files', 'patch_anno', self.patch_anno_folder_name)
+            common.ensure_dir(self.anno_out_dir)
       
     def __len__(self):
         return len(self.scan_ids)
@@ -72,91 +100,128 @@ class Scan3RIMGProjector():
         plydata_npy = np.load(osp.join(self.scans_scenes_dir, scan_id, "data.npy"))
         obj_labels = plydata_npy['objectId']
     
-        # load mesh
-        mesh = o3d.io.read_triangle_mesh(mesh_file)
-        mesh_triangles = np.asarray(mesh.triangles)
-        colors = np.asarray(mesh.vertex_colors)*255.0
-        colors = colors.round()
-        num_triangles = mesh_triangles.shape[0]
-        
-        # load scene 
+        # load mesh and scene
         mesh = o3d.io.read_triangle_mesh(mesh_file)
-        mesh_triangles = np.asarray(mesh.triangles)
-        colors = np.asarray(mesh.vertex_colors)*255.0
-        colors = colors.round()
-        scene = o3d.t.geometry.RaycastingScene()
-        scene.add_triangles(o3d.t.geometry.TriangleMesh.from_legacy(mesh))
+        raycaster = MeshRaycaster(mesh, obj_labels)
         
         # get frame_indexes
         frame_idxs = scan3r.load_frame_idxs(self.scans_scenes_dir, scan_id)
         poses = scan3r.load_all_poses(self.scans_scenes_dir, scan_id, frame_idxs)
+        projected_idxs = list(range(0, len(poses), step))
+        projected_frame_idxs = [frame_idxs[idx] for idx in projected_idxs]
         
-        # project 3D model
+        # full maps streamed to disk chunk by chunk, none of them with strided rays
+        save_maps = self.ray_stride == 1
+        if save_maps:
+            save_scan_color_dir = osp.join(self.save_color_dir, scan_id)
+            common.ensure_dir(save_scan_color_dir)
+            if self.save_obj_id_jpg:
+                save_scan_obj_dir = osp.join(self.save_obj_dir, scan_id)
+                common.ensure_dir(save_scan_obj_dir)
+            scan_maps = self.projection_store.openScan(scan_id, len(projected_idxs), img_height, img_width)
         obj_id_imgs = {}
-        color_imgs = {}
-        for idx in range(0, len(poses), step):
-            frame_idx = frame_idxs[idx]
-            img_pose = poses[idx]
-            img_pose_inv = np.linalg.inv(img_pose)
-            color_map, obj_id_map = self.segmentResult(
-                scene, intrinsics, img_pose_inv, img_width, img_height, 
-                mesh_triangles, num_triangles, colors, obj_labels
-            )
-            obj_id_imgs[frame_idx] = obj_id_map
-            color_imgs[frame_idx] = color_map
+        patch_annos_scan = {}
+        
+        # project 3D model, frames_per_chunk poses per cast
+        timings = {'raycast': 0., 'anno': 0., 'save': 0.}
+        for start in range(0, len(projected_idxs), self.frames_per_chunk):
+            chunk_idxs = projected_idxs[start:start + self.frames_per_chunk]
+            chunk_frame_idxs = projected_frame_idxs[start:start + self.frames_per_chunk]
+            start_time = time.time()
+            rays = raycaster.createRays(intrinsics, [np.linalg.inv(poses[idx]) for idx in chunk_idxs],
+                                        img_width, img_height, self.ray_stride)
+            obj_id_maps, color_maps = raycaster.cast(rays, return_colors=save_maps)
+            timings['raycast'] += time.time() - start_time
             
-        # save 
-        save_scan_color_dir = osp.join(self.save_color_dir, scan_id)
-        save_scan_obj_dir = osp.join(self.save_obj_dir, scan_id)
-        common.ensure_dir(save_scan_color_dir)
-        common.ensure_dir(save_scan_obj_dir)
-        ## save image-level annotation for visualization
-        for frame_idx in obj_id_imgs:
-            obj_id_img = obj_id_imgs[frame_idx]
-            color_img = color_imgs[frame_idx]
+            ## patch annotation from the projected maps, without reading them back
+            if self.patch_w is not None:
+                start_time = time.time()
+                patch_annos = scan3r.annotate_patches(obj_id_maps, self.patch_h, self.patch_w, self.patch_th)
+                patch_annos_scan.update(zip(chunk_frame_idxs, patch_annos))
+                timings['anno'] += time.time() - start_time
             
-            img_name = "frame-"+str(frame_idx)+".jpg"
-            obj_id_img_file = osp.join(save_scan_obj_dir, img_name)
-            color_img_file = osp.join(save_scan_color_dir, img_name)
-            cv2.imwrite(obj_id_img_file, obj_id_img)
-            cv2.imwrite(color_img_file, color_img)
-        ## save scene-level pkl file for efficient loading
-        save_scan_pkl_dir = osp.join(self.save_pkl_dir, "{}.pkl".format(scan_id))
-        common.write_pkl_data(obj_id_imgs, save_scan_pkl_dir)
+            if not save_maps:
+                continue
+            start_time = time.time()
+            ## save image-level annotation for visualization
+            for frame_idx, obj_id_map, color_map in zip(chunk_frame_idxs, obj_id_maps, color_maps):
+                img_name = "frame-"+str(frame_idx)+".jpg"
+                cv2.imwrite(osp.join(save_scan_color_dir, img_name), color_map)
+                if self.save_obj_id_jpg:
+                    cv2.imwrite(osp.join(save_scan_obj_dir, img_name), obj_id_map)
+                if self.save_pkl:
+                    obj_id_imgs[frame_idx] = obj_id_map
+            ## lossless uint16 maps
+            self.projection_store.setFrames(scan_id, scan_maps, start, obj_id_maps)
+            timings['save'] += time.time() - start_time
             
-    def segmentResult(self, scene, intrinsics, extrinsics, width, height,
-                      mesh_triangles, num_triangles, colors, obj_ids):
-        
-        rays = o3d.t.geometry.RaycastingScene.create_rays_pinhole(
-            intrinsic_matrix = intrinsics.astype(np.float64),
-            extrinsic_matrix = extrinsics.astype(np.float64),
-            width_px = width, height_px = height
-        )
-        
-        ans = scene.cast_rays(rays)
-        hit_triangles_ids = ans['primitive_ids'].numpy()
-        hit_triangles_ids_valid_masks = (hit_triangles_ids<num_triangles)
-        hit_triangles_ids_valid = hit_triangles_ids[hit_triangles_ids_valid_masks]
-        hit_triangles_valid = mesh_triangles[hit_triangles_ids_valid]
-        hit_points_ids_valid = hit_triangles_valid[:,0]
+        # save 
+        start_time = time.time()
+        if save_maps:
+            self.projection_store.closeScan(scan_id, projected_frame_idxs, scan_maps)
+        ## save scene-level pkl file
+        if self.save_pkl and save_maps:
+            save_scan_pkl_dir = osp.join(self.save_pkl_dir, "{}.pkl".format(scan_id))
+            common.write_pkl_data(obj_id_imgs, save_scan_pkl_dir)
+        if self.patch_w is not None:
+            patch_anno_file = osp.join(self.anno_out_dir, scan_id+".pkl")
+            common.write_pkl_data(patch_annos_scan, patch_anno_file)
+        timings['save'] += time.time() - start_time
+        if self.patch_w is None:
+            del timings['anno']
+        return timings
         
-        color_map = np.zeros((height,width,3), dtype=np.uint8) # for visualization
-        obj_id_map = np.zeros((height,width), dtype=np.int32) #
-        color_map[hit_triangles_ids_valid_masks] = colors[hit_points_ids_valid]
-        obj_id_map[hit_triangles_ids_valid_masks] = obj_ids[hit_points_ids_valid]
-        return color_map, obj_id_map
-    
+## projector of the worker processes, set once by the pool initializer
+worker_projector = None
+
+def init_worker(projector):
+    global worker_projector
+    worker_projector = projector
+
+def project_scan_job(scan_idx, step):
+    return worker_projector.project(scan_idx, step=step)
+
+def project_scans(projector, step=1, num_workers=0):
+    # scans in a process pool, raycasting and annotation timings summed over scans
+    tot_timings = {}
+    if num_workers > 0:
+        pool = Pool(num_workers, initializer=init_worker, initargs=(projector,))
+        results = pool.imap_unordered(partial(project_scan_job, step=step), range(len(projector.scan_ids)))
+    else:
+        init_worker(projector)
+        results = (project_scan_job(scan_idx, step) for scan_idx in range(len(projector.scan_ids)))
+    for timings in tqdm(results, total=len(projector.scan_ids)):
+        for key, value in timings.items():
+            tot_timings[key] = tot_timings.get(key, 0.) + value
+    if num_workers > 0:
+        pool.close()
+        pool.join()
+    print('[INFO] {} split, {} scans, time per scan: {}'.format(projector.split, len(projector.scan_ids),
+        ', '.join('{} {:.2f}s'.format(key, value / max(len(projector.scan_ids), 1)) for key, value in tot_timings.items())))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Project 3RScan object ids to the frames')
+    parser.add_argument('--config', type=str, default='', help='config file, annotates image patches in the same pass if given')
+    parser.add_argument('--step', type=int, default=1)
+    parser.add_argument('--num_workers', type=int, default=0, help='processes, 0 to project in the main process')
+    parser.add_argument('--save_obj_id_jpg', action='store_true', help='also write the lossy jpg object-id maps')
+    parser.add_argument('--no_save_pkl', action='store_true', help='do not write the scene-level pkl of the object-id maps')
+    parser.add_argument('--frames_per_chunk', type=int, default=8, help='frames cast in one call')
+    parser.add_argument('--ray_stride', type=int, default=1, help='pixels between rays, > 1 for patch annotation only')
+    return parser.parse_known_args()
         
 if __name__ == '__main__':
+    args, _ = parse_args()
+    patch_kwargs = {}
+    if args.config:
+        cfg = update_config(config, args.config, ensure_dir = False)
+        patch_kwargs = {'patch_w': cfg.data.img_encoding.patch_w, 'patch_h': cfg.data.img_encoding.patch_h}
     # get Data_ROOT_DIR
     Data_ROOT_DIR = os.getenv('Data_ROOT_DIR')
     # note that the original validation set includes the resplited val and test set
-    scan3r_img_projector = Scan3RIMGProjector(Data_ROOT_DIR, split='validation', use_rescan=True)
-    step=1
-    for idx in tqdm(range(len(scan3r_img_projector.scan_ids))):
-        scan3r_img_projector.project(idx, step=step)
-        
-    scan3r_img_projector = Scan3RIMGProjector(Data_ROOT_DIR, split='train', use_rescan=True)
-    step=1
-    for idx in tqdm(range(len(scan3r_img_projector.scan_ids))):
-        scan3r_img_projector.project(idx, step=step)
\ No newline at end of file
+    for split in ['validation', 'train']:
+        scan3r_img_projector = Scan3RIMGProjector(Data_ROOT_DIR, split=split, use_rescan=True,
+                                                  save_obj_id_jpg=args.save_obj_id_jpg, save_pkl=not args.no_save_pkl,
+                                                  frames_per_chunk=args.frames_per_chunk, ray_stride=args.ray_stride,
+                                                  **patch_kwargs)
+        project_scans(scan3r_img_projector, step=args.step, num_workers=args.num_workers)
@@ -62,9 +62,7 @@ def process_scan(data_dir, rel_data, obj_data, args, cfg, rel2idx):
         
     points = np.stack([ply_data['x'], ply_data['y'], ply_data['z']]).transpose((1, 0))
 
-    object_points = {}
-    for pc_resolution in cfg.preprocess.pc_resolutions:
-        object_points[pc_resolution] = []
+    obj_pcls = []
 
     object_data = obj_data['objects'] 
 
@@ -103,9 +101,7 @@ def process_scan(data_dir, rel_data, obj_data, args, cfg, rel2idx):
         cy = np.mean(hull.points[hull.vertices,1])
         cz = np.mean(hull.points[hull.vertices,2])
 
-        for pc_resolution in object_points.keys():
-            obj_pcl = point_cloud.pcl_farthest_sample(obj_pcl, pc_resolution)
-            object_points[pc_resolution].append(obj_pcl)
+        obj_pcls.append(obj_pcl)
         
         barry_centers.append([cx, cy, cz])
         objects_ids.append(object_id)
@@ -113,6 +109,8 @@ def process_scan(data_dir, rel_data, obj_data, args, cfg, rel2idx):
         objects_cat.append(global_object_id)
         if not cfg.use_predicted : objects_attributes.append(attribute)
     
+    # all objects sampled at once, smaller resolutions are prefixes of the largest one
+    object_points = point_cloud.pcl_farthest_sample_multires(obj_pcls, cfg.preprocess.pc_resolutions)
     for pc_resolution in object_points.keys():
         object_points[pc_resolution] = np.array(object_points[pc_resolution])
     
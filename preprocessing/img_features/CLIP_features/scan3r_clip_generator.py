@@ -7,6 +7,7 @@ from yaml import scan
 vlsg_dir = "/home/yang/big_ssd/Scan3R/VLSG"
 sys.path.insert(0, vlsg_dir)
 from utils import common, scan3r
+from utils.feature_extraction import FeatureExtractor, add_extraction_args
 
 import numpy as np
 import torch
@@ -86,48 +87,33 @@ class Scan3rCLIPGenerator():
         self.clip_preprocess = clip_preprocess
         self.device = torch.device("cuda")
         
-    def inference(self, img_path):
-        img = Image.open(img_path)
-        img_pt = self.clip_preprocess(img).unsqueeze(0).to(self.device)
-
-        start_time = time.time()
-        with torch.no_grad():
-            img_features = self.clip_model.encode_image(img_pt)
-        self.feature_generation_time += time.time() - start_time
-            
-        return img_features
+    def loadImage(self, img_path):
+        # decoded in the DataLoader workers of the feature extractor
+        return self.clip_preprocess(Image.open(img_path))
         
-    def generateFeaturesEachScan(self, scan_id):
-    # generate VLAD for a scan
-    
-        # get load images
-        img_paths = self.image_paths[scan_id]
-        imgs_features = {}
-        for frame_idx in img_paths:
-            img_path = img_paths[frame_idx]
-
-            # inference
-            img_feature = self.inference(img_path)
-            
-            imgs_features[frame_idx] = img_feature.cpu().numpy().reshape(-1)
-            
-        return imgs_features
+    def extractBatch(self, imgs_tensor):
+        img_features = self.clip_model.encode_image(imgs_tensor.to(self.device))
+        return img_features.cpu().numpy().reshape(imgs_tensor.shape[0], -1)
     
-    def generateFeatures(self):
-        img_num = 0
-        self.feature_generation_time = 0.0
-        for scan_id in tqdm(self.scan_ids):
-            imgs_features = self.generateFeaturesEachScan(scan_id)
-            img_num += len(imgs_features)
-            out_file = osp.join(self.out_dir, '{}.pkl'.format(scan_id))
-            common.write_pkl_data(imgs_features, out_file)
+    def generateFeatures(self, batch_size=None, num_workers=4, shard_id=0, num_shards=1, resume=True):
+        batch_size = 32 if batch_size is None else batch_size
+        manifest_key = (self.model_name, self.model_version)
+        feature_extractor = FeatureExtractor(
+            self, self.out_dir, self.split, manifest_key, batch_size=batch_size, num_workers=num_workers,
+            shard_id=shard_id, num_shards=num_shards, resume=resume)
+        feature_extractor.run(self.image_paths)
         # log
-        log_str = "Feature generation time: {:.3f}s for {} images, {:.3f}s per image\n".format(
-            self.feature_generation_time, img_num, self.feature_generation_time / img_num)
         with open(self.log_file, 'a') as f:
-            f.write(log_str)
+            f.write(feature_extractor.timingString() + '\n')
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Scan3R CLIP feature generator')
+    add_extraction_args(parser)
+    return parser.parse_known_args()
 
 def main():
+    args, _ = parse_args()
     from configs import config, update_config
     os.environ['Scan3R_ROOT_DIR'] = "/home/yang/big_ssd/Scan3R/3RScan"
     cfg_file = "/home/yang/big_ssd/Scan3R/VLSG/preprocessing/img_features/CLIP_features/clip_generator_cfg.yaml"
@@ -135,7 +121,8 @@ def main():
     
     scan3r_anyloc_vlad_generator = Scan3rCLIPGenerator(cfg, 'test')
     scan3r_anyloc_vlad_generator.register_model()
-    scan3r_anyloc_vlad_generator.generateFeatures()
+    scan3r_anyloc_vlad_generator.generateFeatures(args.batch_size, args.num_workers, args.shard_id,
+                                                  args.num_shards, not args.no_resume)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
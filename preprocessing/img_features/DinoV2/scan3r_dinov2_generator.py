@@ -8,7 +8,9 @@ from yaml import scan
 ws_dir = osp.dirname(osp.dirname(osp.dirname(osp.dirname(osp.abspath(__file__)))))
 print(ws_dir)
 sys.path.append(ws_dir)
-from utils import common, scan3r
+from utils import common, scan3r, torch_util
+from utils.patch_feature_store import PatchFeatureStore, feature_store_dir
+from utils.feature_extraction import FeatureExtractor, add_extraction_args
 
 import numpy as np
 import numpy as np
@@ -126,6 +128,10 @@ class Scan3rDinov2Generator():
         ## out dir 
         self.out_dir = osp.join(self.scans_files_dir, 'Features2D', self.model_name)
         common.ensure_dir(self.out_dir)
+        ## memory-mapped feature store of the split instead of per-scan pickles
+        self.use_feature_store = cfg.data.img_encoding.use_feature_store
+        self.feature_store = PatchFeatureStore(feature_store_dir(self.out_dir, self.split))
+        self.feature_store_dtype = cfg.data.img_encoding.feature_store_dtype
         
         self.log_file = osp.join(cfg.data.log_dir, "log_file_{}.txt".format(self.split))
         
@@ -133,8 +139,8 @@ class Scan3rDinov2Generator():
         
         desc_layer = 31
         desc_facet = "value"
-        device = torch.device("cuda")
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(self.cfg.device)
+        device = self.device
         
         # Dinov2 extractor
         if "extractor" in globals():
@@ -153,66 +159,39 @@ class Scan3rDinov2Generator():
         feature = self.model.backbone(imgs_tensor)[-1]
         return feature
         
-    def generateFeaturesEachScan(self, scan_id):
-    # generate VLAD for a scan
-        imgs_features = {}
-        # load images
-        img_paths = self.image_paths[scan_id]
-        frame_idxs_list = list(img_paths.keys())
-        frame_idxs_list.sort()
+    def loadImage(self, img_path):
+        # decoded in the DataLoader workers of the feature extractor
+        img  = Image.open(img_path).convert('RGB')
+        h_new, w_new = (self.image_resize_h // 14) * 14, (self.image_resize_w // 14) * 14
+        img_pt = img.resize((w_new, h_new), Image.BICUBIC)
+        if self.img_rotate:
+            img_pt = img_pt.transpose(Image.ROTATE_270)
+        return self.base_tf(img_pt)
         
-        for infer_step_i in range(0, len(frame_idxs_list)//self.inference_step + 1):
-            start_idx = infer_step_i * self.inference_step
-            end_idx = min((infer_step_i + 1) * self.inference_step, len(frame_idxs_list))
-            frame_idxs_sublist = frame_idxs_list[start_idx:end_idx]
-
-            tensor_idxs_to_frame_idxs = {}
-            img_tensors_list = []
-            if len(frame_idxs_sublist) == 0:
-                continue
-            
-            for idx, frame_idx in enumerate(frame_idxs_sublist):
-                img_path = img_paths[frame_idx]
-                img  = Image.open(img_path).convert('RGB')
-                h_new, w_new = (self.image_resize_h // 14) * 14, (self.image_resize_w // 14) * 14
-                img_pt = img.resize((w_new, h_new), Image.BICUBIC)
-                if self.img_rotate:
-                    img_pt = img_pt.transpose(Image.ROTATE_270)
-
-                img_pt = self.base_tf(img_pt)
-                img_tensors_list.append(img_pt)
-                tensor_idxs_to_frame_idxs[idx] = frame_idx
-                
-            imgs_tensor = torch.stack(img_tensors_list, dim=0).float().to(self.device)
-            # inference
-            start_time = time.time()
+    def extractBatch(self, imgs_tensor):
+        imgs_tensor = imgs_tensor.float().to(self.device)
+        with torch_util.autocast(self.device, self.cfg.device.autocast_bf16):
             ret = self.extractor(imgs_tensor) # [num_images, num_patches, desc_dim]  
-            self.feature_generation_time += time.time() - start_time
-            
-            
-            for idx, frame_idx in tensor_idxs_to_frame_idxs.items():
-                imgs_features[frame_idx] = ret[idx].cpu().numpy()
-                
-        return imgs_features
+        return ret.float().cpu().numpy()
     
-    def generateFeatures(self):
-        img_num = 0
-        self.feature_generation_time = 0.0
-        for scan_id in tqdm(self.scan_ids[3:]):
-            with torch.no_grad():
-                imgs_features = self.generateFeaturesEachScan(scan_id)
-            img_num += len(imgs_features)
-            out_file = osp.join(self.out_dir, '{}.pkl'.format(scan_id))
-            common.write_pkl_data(imgs_features, out_file)
+    def generateFeatures(self, batch_size=None, num_workers=4, shard_id=0, num_shards=1, resume=True):
+        batch_size = self.inference_step if batch_size is None else batch_size
+        manifest_key = (self.model_name, self.image_resize_h, self.image_resize_w, self.img_rotate)
+        feature_extractor = FeatureExtractor(
+            self, self.out_dir, self.split, manifest_key, batch_size=batch_size, num_workers=num_workers,
+            shard_id=shard_id, num_shards=num_shards, resume=resume,
+            feature_store=self.feature_store if self.use_feature_store else None,
+            feature_store_dtype=self.feature_store_dtype)
+        feature_extractor.run(self.image_paths)
         # log
-        log_str = "Feature generation time: {:.3f}s for {} images, {:.3f}s per image\n".format(
-            self.feature_generation_time, img_num, self.feature_generation_time / img_num)
         with open(self.log_file, 'a') as f:
-            f.write(log_str)
+            f.write(feature_extractor.timingString() + '\n')
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Preprocess Scan3R')
     parser.add_argument('--config', type=str, default='', help='Path to the config file')
+    parser.add_argument('--splits', type=str, nargs='+', default=['train', 'val', 'test'], help='Splits to extract')
+    add_extraction_args(parser)
     return parser.parse_known_args()
 
 def main():
@@ -224,15 +203,11 @@ def main():
     from configs import config, update_config
     cfg = update_config(config, cfg_file, ensure_dir = False)
     
-    scan3r_gcvit_generator = Scan3rDinov2Generator(cfg, 'train')
-    scan3r_gcvit_generator.register_model()
-    scan3r_gcvit_generator.generateFeatures()
-    scan3r_gcvit_generator = Scan3rDinov2Generator(cfg, 'val')
-    scan3r_gcvit_generator.register_model()
-    scan3r_gcvit_generator.generateFeatures()
-    scan3r_gcvit_generator = Scan3rDinov2Generator(cfg, 'test')
-    scan3r_gcvit_generator.register_model()
-    scan3r_gcvit_generator.generateFeatures()
+    for split in args.splits:
+        scan3r_dinov2_generator = Scan3rDinov2Generator(cfg, split)
+        scan3r_dinov2_generator.register_model()
+        scan3r_dinov2_generator.generateFeatures(args.batch_size, args.num_workers, args.shard_id,
+                                                 args.num_shards, not args.no_resume)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
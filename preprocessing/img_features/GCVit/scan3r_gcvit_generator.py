@@ -6,7 +6,9 @@ from tracemalloc import start
 from yaml import scan
 vlsg_dir = osp.join(osp.dirname(osp.abspath(__file__)), '..', '..', '..')
 sys.path.insert(0, vlsg_dir)
-from utils import common, scan3r
+from utils import common, scan3r, torch_util
+from utils.patch_feature_store import PatchFeatureStore, feature_store_dir
+from utils.feature_extraction import FeatureExtractor, add_extraction_args
 
 import numpy as np
 import cv2
@@ -100,6 +102,10 @@ class Scan3rGCVitGenerator():
         ## out dir 
         self.out_dir = osp.join(self.scans_files_dir, 'Features2D', self.model_name)
         common.ensure_dir(self.out_dir)
+        ## memory-mapped feature store of the split instead of per-scan pickles
+        self.use_feature_store = cfg.data.img_encoding.use_feature_store
+        self.feature_store = PatchFeatureStore(feature_store_dir(self.out_dir, self.split))
+        self.feature_store_dtype = cfg.data.img_encoding.feature_store_dtype
         
         self.log_file = osp.join(cfg.data.log_dir, "log_file_{}.txt".format(self.split))
         
@@ -110,113 +116,46 @@ class Scan3rGCVitGenerator():
         backbone = build_backbone(backbone_cfg.model['backbone'])
         self.backbone = backbone
         self.backbone.eval()
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(self.cfg.device)
         self.backbone.to(self.device)
+        if self.cfg.device.channels_last:
+            self.backbone.to(memory_format=torch.channels_last)
         
     def inference(self, imgs_tensor):
-        feature = self.backbone(imgs_tensor)[-1]
-        return feature
+        if self.cfg.device.channels_last:
+            imgs_tensor = imgs_tensor.contiguous(memory_format=torch.channels_last)
+        with torch_util.autocast(self.device, self.cfg.device.autocast_bf16):
+            feature = self.backbone(imgs_tensor)[-1]
+        return feature.float()
         
-    def generateFeaturesEachScan(self, scan_id):
-    # generate VLAD for a scan
-    
-        # load images
-        img_paths = self.image_paths[scan_id]
-        img_tensors_dict = {}
-        for frame_idx in img_paths:
-            img_path = img_paths[frame_idx]
-            img  = cv2.imread(img_path,cv2.IMREAD_UNCHANGED)
-            img = cv2.resize(img, (self.image_resize_w, self.image_resize_h),  # type: ignore
-                            interpolation=cv2.INTER_LINEAR) # type: ignore
-            if self.img_rotate:
-                img = img.transpose(1, 0, 2)
-                img = np.flip(img, 1)
-                img_tensors_dict[frame_idx] = torch.from_numpy(img.copy()).float().to(self.device)   
-                
-        frame_idxs_list = list(img_paths.keys())
-        imgs_features = {}
-
-        for infer_step_i in range(0, len(frame_idxs_list)//self.inference_step + 1):
-            start_idx = infer_step_i * self.inference_step
-            end_idx = min((infer_step_i + 1) * self.inference_step, len(frame_idxs_list))
-            frame_idxs_sublist = frame_idxs_list[start_idx:end_idx]
-
-            # aggregate tensors
-            tensor_idxs_to_frame_idxs = {}
-            img_tensors_list = []
-            if len(frame_idxs_sublist) == 0:
-                continue
-            for idx, frame_idx in enumerate(frame_idxs_sublist):
-                img_tensors_list.append(img_tensors_dict[frame_idx])
-                tensor_idxs_to_frame_idxs[idx] = frame_idx
-                
-            imgs_tensor = torch.stack(img_tensors_list, dim=0).float().to(self.device)
-            # channel first
-            imgs_tensor = imgs_tensor.permute(0, 3, 1, 2)
-            
-            # inference
-            start_time = time.time()
-            img_feature_cuda = self.inference(imgs_tensor)
-            self.feature_generation_time += time.time() - start_time
-            ## channel last
-            img_feature_cuda = img_feature_cuda.permute(0, 2, 3, 1)
-            img_features_cpu = img_feature_cuda.cpu().numpy()
-            for idx, frame_idx in tensor_idxs_to_frame_idxs.items():
-                imgs_features[frame_idx] = img_features_cpu[idx]
+    def loadImage(self, img_path):
+        # decoded in the DataLoader workers of the feature extractor, channel first
+        img  = cv2.imread(img_path,cv2.IMREAD_UNCHANGED)
+        img = cv2.resize(img, (self.image_resize_w, self.image_resize_h),  # type: ignore
+                        interpolation=cv2.INTER_LINEAR) # type: ignore
+        if self.img_rotate:
+            img = img.transpose(1, 0, 2)
+            img = np.flip(img, 1)
+        return torch.from_numpy(img.copy()).float().permute(2, 0, 1)
         
-        # if False:
-        #     frame_indexs = list(img_paths.keys())
-        #     # aggreate all images to a tensor
-        #     img_tensors_list = []
-        #     for index, frame_idx in enumerate(frame_indexs):
-        #         frame_idx2index = {frame_idx: index }
-        #         img_tensors_list.append(img_tensors_dict[frame_idx])
-        #     imgs_tensor = torch.stack(img_tensors_list, dim=0)
-        #     imgs_tensor_cuda = imgs_tensor
-        #     # inference
-        #     start_time = time.time()
-        #     ## channel first
-        #     imgs_tensor_cuda = imgs_tensor_cuda.permute(0, 3, 1, 2)
-        #     img_features_cuda = self.inference(imgs_tensor_cuda)
-        #     self.feature_generation_time += time.time() - start_time
-        #     ## channel last
-        #     img_features_cuda = img_features_cuda.permute(0, 2, 3, 1)
-        #     img_features = img_features_cuda.cpu().numpy()
-        #     # split features
-        #     for index, frame_idx in enumerate(frame_indexs):
-        #         index = frame_idx2index[frame_idx]
-        #         img_feature = img_features[index]
-        #         imgs_features[frame_idx] = img_feature
-        # else:
-        #     for frame_idx in img_paths:
-        #         img_tensor = img_tensors_dict[frame_idx]
-        #         img_tensor_cuda = img_tensor
-        #         # inference
-        #         start_time = time.time()
-        #         # channel first 
-        #         img_tensor_cuda = img_tensor_cuda.permute(2, 0, 1)
-        #         img_feature_cuda = self.inference(img_tensor_cuda.unsqueeze(0))
-        #         self.feature_generation_time += time.time() - start_time
-        #         ## channel last
-        #         img_feature_cuda = img_feature_cuda.permute(0, 2, 3, 1)
-        #         img_feature = img_feature_cuda[0].cpu().numpy()
-        #         imgs_features[frame_idx] = img_feature
-        return imgs_features
+    def extractBatch(self, imgs_tensor):
+        img_feature_cuda = self.inference(imgs_tensor.to(self.device))
+        ## channel last
+        img_feature_cuda = img_feature_cuda.permute(0, 2, 3, 1)
+        return img_feature_cuda.cpu().numpy()
     
-    def generateFeatures(self):
-        img_num = 0
-        self.feature_generation_time = 0.0
-        for scan_id in tqdm(self.scan_ids):
-            with torch.no_grad():
-                imgs_features = self.generateFeaturesEachScan(scan_id)
-            img_num += len(imgs_features)
-            out_file = osp.join(self.out_dir, '{}.pkl'.format(scan_id))
-            common.write_pkl_data(imgs_features, out_file)
+    def generateFeatures(self, batch_size=None, num_workers=4, shard_id=0, num_shards=1, resume=True):
+        batch_size = self.inference_step if batch_size is None else batch_size
+        manifest_key = (self.model_name, self.cfg.model.pretrained, self.image_resize_h, self.image_resize_w, self.img_rotate)
+        feature_extractor = FeatureExtractor(
+            self, self.out_dir, self.split, manifest_key, batch_size=batch_size, num_workers=num_workers,
+            shard_id=shard_id, num_shards=num_shards, resume=resume,
+            feature_store=self.feature_store if self.use_feature_store else None,
+            feature_store_dtype=self.feature_store_dtype)
+        feature_extractor.run(self.image_paths)
         # log
-        log_str = "Feature generation time: {:.3f}s for {} images, {:.3f}s per image\n".format(
-            self.feature_generation_time, img_num, self.feature_generation_time / img_num)
         with open(self.log_file, 'a') as f:
-            f.write(log_str)
+            f.write(feature_extractor.timingString() + '\n')
             
 # args
 def parse_args():
@@ -226,6 +165,7 @@ def parse_args():
     parser.add_argument('--split', type=str, default='test', help='split')
     # add args of root dir
     parser.add_argument('--root_dir', type=str, default='', help='root dir')
+    add_extraction_args(parser)
         
     args = parser.parse_args()
     return args
@@ -240,7 +180,8 @@ def main():
     cfg = update_config(config, cfg_file, ensure_dir = False)
     scan3r_gcvit_generator = Scan3rGCVitGenerator(cfg, split)
     scan3r_gcvit_generator.register_model()
-    scan3r_gcvit_generator.generateFeatures()
+    scan3r_gcvit_generator.generateFeatures(args.batch_size, args.num_workers, args.shard_id,
+                                            args.num_shards, not args.no_resume)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -7,6 +7,7 @@ from yaml import scan
 vlsg_dir = "/home/yang/big_ssd/Scan3R/VLSG"
 sys.path.insert(0, vlsg_dir)
 from utils import common, scan3r
+from utils.feature_extraction import FeatureExtractor, add_extraction_args
 
 import numpy as np
 import torch
@@ -114,15 +115,11 @@ class Scan3rOpenSegGenerator():
         self.openseg_model = tf2.saved_model.load(self.model_path,
                     tags=[tf.saved_model.tag_constants.SERVING],)
         
-    def inference(self, img_path):
-        np_image_string = read_bytes(img_path)
-
-        start_time = time.time()
+    def inference(self, np_image_string):
         results = self.openseg_model.signatures['serving_default'](
                 inp_image_bytes=tf.convert_to_tensor(np_image_string),
                 inp_text_emb = self.text_emb)
         image_embedding_feat = results['ppixel_ave_feat'] # 1x640x640x768
-        self.feature_generation_time += time.time() - start_time
     
         img_info = results['image_info']
         crop_sz = [
@@ -142,37 +139,32 @@ class Scan3rOpenSegGenerator():
                 patches_embedding[h_i, w_i] = patch_embedding
         return patches_embedding
         
-    def generateFeaturesEachScan(self, scan_id):
-    # generate VLAD for a scan
-    
-        # get load images
-        img_paths = self.image_paths[scan_id]
-        imgs_features = {}
-        for frame_idx in img_paths:
-            img_path = img_paths[frame_idx]
-
-            # inference
-            img_feature = self.inference(img_path)
-            
-            imgs_features[frame_idx] = img_feature
-            
-        return imgs_features
+    def loadImage(self, img_path):
+        # the saved model decodes the image, the DataLoader workers only prefetch its bytes
+        return read_bytes(img_path)
+        
+    def extractBatch(self, imgs_bytes):
+        return np.stack([self.inference(np_image_string) for np_image_string in imgs_bytes])
     
-    def generateFeatures(self):
-        img_num = 0
-        self.feature_generation_time = 0.0
-        for scan_id in tqdm(self.scan_ids):
-            imgs_features = self.generateFeaturesEachScan(scan_id)
-            img_num += len(imgs_features)
-            out_file = osp.join(self.out_dir, '{}.pkl'.format(scan_id))
-            common.write_pkl_data(imgs_features, out_file)
+    def generateFeatures(self, batch_size=None, num_workers=4, shard_id=0, num_shards=1, resume=True):
+        batch_size = 8 if batch_size is None else batch_size
+        manifest_key = (self.model_name, self.model_version, self.image_patch_h, self.image_patch_w)
+        feature_extractor = FeatureExtractor(
+            self, self.out_dir, self.split, manifest_key, batch_size=batch_size, num_workers=num_workers,
+            shard_id=shard_id, num_shards=num_shards, resume=resume)
+        feature_extractor.run(self.image_paths)
         # log
-        log_str = "Feature generation time: {:.3f}s for {} images, {:.3f}s per image\n".format(
-            self.feature_generation_time, img_num, self.feature_generation_time / img_num)
         with open(self.log_file, 'a') as f:
-            f.write(log_str)
+            f.write(feature_extractor.timingString() + '\n')
+
+def parse_args():
+    import argparse
+    parser = argparse.ArgumentParser(description='Scan3R OpenSeg feature generator')
+    add_extraction_args(parser)
+    return parser.parse_known_args()
 
 def main():
+    args, _ = parse_args()
     from configs import config, update_config
     os.environ['Scan3R_ROOT_DIR'] = "/home/yang/big_ssd/Scan3R/3RScan"
     cfg_file = "/home/yang/big_ssd/Scan3R/VLSG/preprocessing/img_features/OpenSegFeatures/openseg_generator_cfg.yaml"
@@ -180,7 +172,8 @@ def main():
     
     scan3r_openseg_generator = Scan3rOpenSegGenerator(cfg, 'test')
     scan3r_openseg_generator.register_model()
-    scan3r_openseg_generator.generateFeatures()
+    scan3r_openseg_generator.generateFeatures(args.batch_size, args.num_workers, args.shard_id,
+                                              args.num_shards, not args.no_resume)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -83,53 +83,30 @@ class Scan3rEvaGenerator():
         self.clip_model.eval()
         self.clip_model.to(self.device)
         
-    def inference(self, img_path):
+    def loadImage(self, img_path):
+        # decoded in the DataLoader workers of the feature extractor
         img = Image.open(img_path)
         img = img.convert('RGB')
         # resize 
         img = img.resize((224, 224))
-        # to tensor
-        img_pt = T.ToTensor()(img).to(self.device).unsqueeze(0)
-        # # already channel first
-        # img_pt = img_pt.permute(0, 3, 1, 2)
-
-        start_time = time.time()
-        with torch.no_grad():
-            img_features = self.clip_model.encode_image(img_pt)
-        self.feature_generation_time += time.time() - start_time
-            
-        return img_features
+        # to tensor, already channel first
+        return T.ToTensor()(img)
         
-    def generateFeaturesEachScan(self, scan_id):
-    # generate VLAD for a scan
+    def extractBatch(self, imgs_tensor):
+        img_features = self.clip_model.encode_image(imgs_tensor.to(self.device))
+        return img_features.cpu().numpy().reshape(imgs_tensor.shape[0], -1)
     
-        # get load images
-        img_paths = self.image_paths[scan_id]
-        imgs_features = {}
-        for frame_idx in img_paths:
-            img_path = img_paths[frame_idx]
-
-            # inference
-            img_feature = self.inference(img_path)
-            
-            imgs_features[frame_idx] = img_feature.cpu().numpy().reshape(-1)
-            
-        return imgs_features
-    
-    def generateFeatures(self):
-        import common, scan3r
-        img_num = 0
-        self.feature_generation_time = 0.0
-        for scan_id in tqdm(self.scan_ids):
-            imgs_features = self.generateFeaturesEachScan(scan_id)
-            img_num += len(imgs_features)
-            out_file = osp.join(self.out_dir, '{}.pkl'.format(scan_id))
-            common.write_pkl_data(imgs_features, out_file)
+    def generateFeatures(self, batch_size=None, num_workers=4, shard_id=0, num_shards=1, resume=True):
+        from utils.feature_extraction import FeatureExtractor
+        batch_size = 32 if batch_size is None else batch_size
+        manifest_key = (self.model_name,)
+        feature_extractor = FeatureExtractor(
+            self, self.out_dir, self.split, manifest_key, batch_size=batch_size, num_workers=num_workers,
+            shard_id=shard_id, num_shards=num_shards, resume=resume)
+        feature_extractor.run(self.image_paths)
         # log
-        log_str = "Feature generation time: {:.3f}s for {} images, {:.3f}s per image\n".format(
-            self.feature_generation_time, img_num, self.feature_generation_time / img_num)
         with open(self.log_file, 'a') as f:
-            f.write(log_str)
+            f.write(feature_extractor.timingString() + '\n')
             
 # args
 def parse_args():
@@ -149,6 +126,12 @@ def parse_args():
     parser.add_argument('--ckpt', type=str, default='', help='ckpt')
     # log dir
     parser.add_argument('--log_dir', type=str, default='', help='log dir')
+    # feature extraction, as utils.feature_extraction.add_extraction_args, utils is on the path only after parsing
+    parser.add_argument('--batch_size', type=int, default=None, help='images per backbone batch across scans')
+    parser.add_argument('--num_workers', type=int, default=4, help='image decoding workers')
+    parser.add_argument('--shard_id', type=int, default=0, help='shard of the scans processed here')
+    parser.add_argument('--num_shards', type=int, default=1, help='number of processes/nodes the scans are split across')
+    parser.add_argument('--no_resume', action='store_true', help='extract the scans of the manifest again')
         
     args = parser.parse_args()
     return args
@@ -182,7 +165,8 @@ def main(args):
     
     scan3r_anyloc_vlad_generator = Scan3rEvaGenerator(cfg, split, device, uni3d_dir, log_dir)
     scan3r_anyloc_vlad_generator.register_model(ckpt)
-    scan3r_anyloc_vlad_generator.generateFeatures()
+    scan3r_anyloc_vlad_generator.generateFeatures(args.batch_size, args.num_workers, args.shard_id,
+                                                  args.num_shards, not args.no_resume)
     
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,50 @@
+import os.path as osp
+import sys
+import argparse
+import numpy as np
+from tqdm import tqdm
+ws_dir = osp.dirname(osp.dirname(osp.dirname(osp.abspath(__file__))))
+sys.path.append(ws_dir)
+from utils import common
+from utils.patch_feature_store import PatchFeatureStore, feature_store_dir
+from configs import update_config, config
+
+# convert the per-scan feature pickles of data.img_encoding.feature_dir into the
+# memory-mapped PatchFeatureStore of a split (ref scans and their rescans)
+
+def get_split_scans(scans_files_dir, split, resplit):
+    refscans2scans = {}
+    for scan_data in common.load_json(osp.join(scans_files_dir, '3RScan.json')):
+        refscans2scans[scan_data['reference']] = [scan_data['reference']] + [scan['reference'] for scan in scan_data['scans']]
+    ref_scans = np.genfromtxt(osp.join(scans_files_dir, 'orig', '{}_{}scans.txt'.format(split, resplit)), dtype=str)
+    scan_ids = []
+    for ref_scan in ref_scans:
+        scan_ids += refscans2scans[ref_scan]
+    return scan_ids
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build 2D patch feature store')
+    parser.add_argument('--config', type=str, default='', help='Path to the config file')
+    parser.add_argument('--split', type=str, default='train', help='Split of the scans')
+    return parser.parse_known_args()
+
+if __name__ == '__main__':
+    args, _ = parse_args()
+    cfg = update_config(config, args.config, ensure_dir = False)
+    scans_files_dir = osp.join(cfg.data.root_dir, 'files')
+    feature_folder = osp.join(scans_files_dir, cfg.data.img_encoding.feature_dir)
+    resplit = 'resplit_' if cfg.data.resplit else ''
+    
+    feature_store = PatchFeatureStore(feature_store_dir(feature_folder, args.split))
+    feature_store.openWrite(cfg.data.img_encoding.feature_store_dtype)
+    for scan_id in tqdm(get_split_scans(scans_files_dir, args.split, resplit)):
+        features_file = osp.join(feature_folder, '{}.pkl'.format(scan_id))
+        if scan_id in feature_store:
+            continue
+        if not osp.isfile(features_file):
+            print('[WARNING] No features for {}, skipped'.format(scan_id))
+            continue
+        feature_store.add(scan_id, common.load_pkl_data(features_file))
+    feature_store.closeWrite()
+    print('[INFO] {} frames of {} scans in {}'.format(
+        feature_store.index['num_rows'], len(feature_store.index['scans']), feature_store.store_dir))
@@ -0,0 +1,61 @@
+import os.path as osp
+import sys
+import time
+import argparse
+from functools import partial
+from multiprocessing import Pool
+from tqdm import tqdm
+import numpy as np
+ws_dir = osp.dirname(osp.dirname(osp.dirname(osp.abspath(__file__))))
+sys.path.append(ws_dir)
+from utils import common, scan3r
+from utils.frame_index import FrameIndex, frame_index_file
+
+# pack the frame ids, poses, quaternion + translation vectors and intrinsics of every scan of
+# <data_dir>/scenes into files/frame_index.npz, read by scan3r.load_frame_* instead of globbing
+# the sequence folders and parsing one pose file per frame
+
+def index_scan(scans_scenes_dir, scan_id):
+    frame_idxs = scan3r.read_frame_idxs(scans_scenes_dir, scan_id)
+    poses = np.array([scan3r.read_pose(scans_scenes_dir, scan_id, frame_idx).reshape(4, 4) for frame_idx in frame_idxs])
+    quat_trans = np.array([scan3r.pose_to_quat_trans(pose) for pose in poses])
+    color_info = scan3r.read_intrinsics(scans_scenes_dir, scan_id, 'color')
+    depth_info = scan3r.read_intrinsics(scans_scenes_dir, scan_id, 'depth')
+    return scan_id, frame_idxs, poses, quat_trans, color_info, depth_info
+
+def index_scan_job(scan_id, scans_scenes_dir):
+    try:
+        return index_scan(scans_scenes_dir, scan_id)
+    except Exception as e:
+        print('[WARNING] {} not indexed, read from its files: {}'.format(scan_id, e))
+        return None
+
+def get_scans(data_dir):
+    # ref scans and rescans of 3RScan.json with a sequence folder
+    scan_ids = []
+    for scan_data in common.load_json(osp.join(data_dir, 'files', '3RScan.json')):
+        scan_ids += [scan_data['reference']] + [scan['reference'] for scan in scan_data['scans']]
+    return [scan_id for scan_id in scan_ids if osp.isdir(osp.join(data_dir, 'scenes', scan_id, 'sequence'))]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the Scan3R frame index')
+    parser.add_argument('--data_dir', type=str, required=True, help='3RScan root with scenes/ and files/')
+    parser.add_argument('--num_workers', type=int, default=0, help='processes reading the scans')
+    return parser.parse_known_args()
+
+if __name__ == '__main__':
+    args, _ = parse_args()
+    scans_scenes_dir = osp.join(args.data_dir, 'scenes')
+    scan_ids = get_scans(args.data_dir)
+
+    start_time = time.time()
+    job = partial(index_scan_job, scans_scenes_dir=scans_scenes_dir)
+    if args.num_workers > 0:
+        with Pool(args.num_workers) as pool:
+            scans = list(tqdm(pool.imap(job, scan_ids), total=len(scan_ids)))
+    else:
+        scans = [job(scan_id) for scan_id in tqdm(scan_ids)]
+    scans = [scan for scan in scans if scan is not None]
+    FrameIndex.write(frame_index_file(scans_scenes_dir), scans)
+    print('[INFO] {} frames of {} scans indexed in {:.1f}s to {}'.format(
+        sum(len(scan[1]) for scan in scans), len(scans), time.time() - start_time, frame_index_file(scans_scenes_dir)))
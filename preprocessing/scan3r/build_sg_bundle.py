@@ -0,0 +1,88 @@
+import os.path as osp
+from tqdm import tqdm
+import numpy as np 
+import argparse
+import sys
+ws_dir = osp.dirname(osp.dirname(osp.dirname(osp.abspath(__file__))))
+print(ws_dir)
+sys.path.append(ws_dir)
+from utils import common, scan3r
+from utils.scene_graph_store import SceneGraphBundle, bundle_points_key, bundle_dir
+from configs import config, update_config
+
+# pack the scene graphs of a split (written by preprocess_scan3r.py) with the scene centers,
+# nyu40 categories and centered object points of every resolution into one memory-mapped bundle
+
+def get_split_scans(root_dir, files_dir_mode, split, resplit):
+    # ref scans of the split and their rescans, same order as the datasets
+    all_scan_data = common.load_json(osp.join(root_dir, 'files', '3RScan.json'))
+    refscans2scans = {}
+    for scan_data in all_scan_data:
+        refscans2scans[scan_data['reference']] = [scan_data['reference']] + [scan['reference'] for scan in scan_data['scans']]
+    ref_scans_split = np.genfromtxt(osp.join(files_dir_mode, '{}_{}scans.txt'.format(split, resplit)), dtype=str)
+    scan_ids = []
+    for ref_scan in ref_scans_split:
+        scan_ids += refscans2scans[ref_scan]
+    return scan_ids
+
+def process_scan(data_dir, files_dir_mode, data_file, scan_id, objs_nyu40, pc_resolutions, use_attr_feats):
+    # Centering, the only full point cloud load of the scan
+    points = scan3r.load_plydata_npy(osp.join(data_dir, 'scenes', scan_id, 'data.npy'), obj_ids = None)
+    pcl_center = np.mean(points, axis=0)
+    scene_graph_dict = common.load_pkl_data(osp.join(files_dir_mode, data_file, '{}.pkl'.format(scan_id)))
+    
+    data_dict = {}
+    data_dict['objects_id'] = np.asarray(scene_graph_dict['objects_id'], dtype=np.int64)
+    data_dict['objects_cat'] = np.asarray(scene_graph_dict['objects_cat'], dtype=np.int64)
+    data_dict['objects_nyu40'] = np.array([objs_nyu40[obj_id] for obj_id in data_dict['objects_id']], dtype=np.int64)
+    data_dict['rel_trans'] = scene_graph_dict['rel_trans']
+    if use_attr_feats:
+        data_dict['bow_vec_object_attr_feats'] = scene_graph_dict['bow_vec_object_attr_feats']
+    data_dict['bow_vec_object_edge_feats'] = scene_graph_dict['bow_vec_object_edge_feats']
+    data_dict['edges'] = np.asarray(scene_graph_dict['edges'], dtype=np.int64)
+    data_dict['pcl_center'] = pcl_center
+    for pc_resolution in pc_resolutions:
+        obj_points = scene_graph_dict['obj_points'][pc_resolution] - pcl_center
+        data_dict[bundle_points_key(pc_resolution)] = obj_points.astype(np.float32)
+    return data_dict
+
+def build_bundle(cfg, split, mode = 'orig', data_file = 'data'):
+    out_dirname = '' if cfg.scan_type == 'scan' else 'out'
+    out_dirname = osp.join(out_dirname, 'predicted') if cfg.use_predicted else out_dirname
+    data_dir = osp.join(cfg.data.root_dir, out_dirname)
+    files_dir_mode = osp.join(data_dir, 'files', mode)
+    resplit = 'resplit_' if cfg.data.resplit else ''
+    pc_resolutions = sorted(cfg.preprocess.pc_resolutions)
+    use_attr_feats = not cfg.use_predicted
+    
+    # nyu40 category of every object
+    objs_nyu40 = {}
+    for scan_item in common.load_json(osp.join(data_dir, 'files', 'objects.json'))['scans']:
+        objs_nyu40[scan_item['scan']] = {int(obj_item['id']): int(obj_item['nyu40']) for obj_item in scan_item['objects']}
+    
+    scene_graphs = {}
+    for scan_id in tqdm(get_split_scans(cfg.data.root_dir, files_dir_mode, split, resplit)):
+        # scans without enough objects were dropped by preprocess_scan3r.py
+        if not osp.isfile(osp.join(files_dir_mode, data_file, '{}.pkl'.format(scan_id))):
+            print('[WARNING] No scene graph for {}, skipped'.format(scan_id))
+            continue
+        scene_graphs[scan_id] = process_scan(data_dir, files_dir_mode, data_file, scan_id, 
+                                             objs_nyu40[scan_id], pc_resolutions, use_attr_feats)
+    
+    out_dir = bundle_dir(files_dir_mode, data_file, split, resplit)
+    bundle = SceneGraphBundle(out_dir, pc_resolutions, use_attr_feats)
+    bundle.write(scene_graphs, list(scene_graphs.keys()))
+    print('[INFO] Wrote bundle of {} scans to {}'.format(len(scene_graphs), out_dir))
+    
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build Scan3R scene graph bundle')
+    parser.add_argument('--config', type=str, default='', help='Path to the config file')
+    parser.add_argument('--split', type=str, default='train', help='Split of the scans')
+    parser.add_argument('--mode', type=str, default='orig', help='Data mode of the scene graphs')
+    return parser.parse_known_args()
+
+if __name__ == '__main__':
+    args, _ = parse_args()
+    cfg = update_config(config, args.config, ensure_dir = False)
+    data_file = 'data_rel9' if cfg.model.rel_dim == 9 else 'data'
+    build_bundle(cfg, args.split, args.mode, data_file)
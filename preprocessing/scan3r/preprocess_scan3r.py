@@ -1,9 +1,11 @@
-import os 
+import os
 import os.path as osp
-from re import sub
-from sympy import root
+import time
+import zlib
+from functools import partial
+from multiprocessing import Pool
 from tqdm import tqdm
-import numpy as np 
+import numpy as np
 from scipy.spatial import ConvexHull
 import argparse
 import random
@@ -16,13 +18,20 @@ from utils import common, point_cloud, scan3r
 from configs import config, update_config
 
 
+def group_points_by_object(object_ids):
+    # point idxs of every object id with one argsort instead of a full scan per object,
+    # stable so that idxs stay ascending as with np.where
+    order = np.argsort(object_ids, kind='stable')
+    unique_ids, starts = np.unique(object_ids[order], return_index=True)
+    return {int(object_id): idxs for object_id, idxs in zip(unique_ids, np.split(order, starts[1:]))}
+
 def process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms = None):
     scan_id = rel_data['scan']
 
     if len(rel_data['relationships']) == 0:
         return -1
 
-    objects_ids = [] 
+    objects_ids = []
     global_objects_ids = []
     objects_cat = []
     objects_attributes = []
@@ -30,88 +39,84 @@ def process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms = No
 
     ply_data_npy_file = osp.join(data_dir, 'scenes', scan_id, 'data.npy')
     ply_data = None
-    if( osp.isfile(ply_data_npy_file)): 
+    if( osp.isfile(ply_data_npy_file)):
         ply_data = np.load(ply_data_npy_file)
     else:
         # Load scene pcl
-        ply_data = scan3r.save_ply_data(osp.join(data_dir, 'scenes'), 
+        ply_data = scan3r.save_ply_data(osp.join(data_dir, 'scenes'),
             scan_id, "labels.instances.align.annotated.v2.ply", ply_data_npy_file)
-        
+
     points = np.stack([ply_data['x'], ply_data['y'], ply_data['z']]).transpose((1, 0))
+    object_pt_idxs = group_points_by_object(ply_data['objectId'])
+    no_points = np.zeros((0,), dtype=np.int64)
 
-    object_points = {}
-    pc_resolutions = cfg.preprocess.pc_resolutions
-    # sort pc_resolutions in descending order
-    pc_resolutions.sort(reverse=True)
-    for pc_resolution in pc_resolutions:
-        object_points[pc_resolution] = []
+    pc_resolutions = sorted(cfg.preprocess.pc_resolutions, reverse=True)
+    obj_pcls = []
+
+    object_data = obj_data['objects']
 
-    object_data = obj_data['objects'] 
-    
     for idx, object in enumerate(object_data):
         if not cfg.use_predicted : attribute = [item for sublist in object['attributes'].values() for item in sublist]
 
         object_id = int(object['id'])
-        object_id_for_pcl = int(object['id'])
-        
+
         global_object_id = int(object['global_id'])
-        obj_pt_idx = np.where(ply_data['objectId'] == object_id)
-        obj_pcl = points[obj_pt_idx]
+        obj_pcl = points[object_pt_idxs.get(object_id, no_points)]
 
         if obj_pcl.shape[0] < cfg.preprocess.min_obj_points: continue
-        
+
         hull = ConvexHull(obj_pcl)
         cx = np.mean(hull.points[hull.vertices,0])
         cy = np.mean(hull.points[hull.vertices,1])
         cz = np.mean(hull.points[hull.vertices,2])
 
-        for pc_resolution in pc_resolutions:
-            obj_pcl = point_cloud.pcl_farthest_sample(obj_pcl, pc_resolution)
-            object_points[pc_resolution].append(obj_pcl)
-        
+        obj_pcls.append(obj_pcl)
         barry_centers.append([cx, cy, cz])
         objects_ids.append(object_id)
         global_objects_ids.append(global_object_id)
         objects_cat.append(global_object_id)
         if not cfg.use_predicted : objects_attributes.append(attribute)
-    
+
+    # all objects sampled at once, smaller resolutions are prefixes of the largest one
+    object_points = point_cloud.pcl_farthest_sample_multires(obj_pcls, pc_resolutions)
     for pc_resolution in pc_resolutions:
         object_points[pc_resolution] = np.array(object_points[pc_resolution])
-    
+
     if len(objects_ids) < 2:
         return -1
-    
+
     object_id2idx = {}  # convert object id to the index in the tensor
     for index, v in enumerate(objects_ids):
         object_id2idx[v] = index
+    objects_ids_set = set(objects_ids)
 
     relationships = rel_data['relationships']
     triples = []
     pairs = []
+    pairs_set = set()
     edges_cat = []
 
     for idx, triple in enumerate(relationships):
         sub = int(triple[0])
         obj = int(triple[1])
-        rel_id = int(triple[2])  
+        rel_id = int(triple[2])
         rel_name = triple[3] if rel_transforms is None else rel_transforms[triple[3]]
 
-        if rel_name in list(rel2idx.keys()):
+        if rel_name in rel2idx:
             rel_id = int(rel2idx[rel_name])
-            
-            if sub in objects_ids and obj in objects_ids:
+
+            if sub in objects_ids_set and obj in objects_ids_set:
                 if rel_name == 'inside':
                     assert False
-                
+
                 assert rel_id <= len(rel2idx)
                 triples.append([sub, obj, rel_id])
                 edges_cat.append(rel2idx[rel_name])
-                
-                if triple[:2] not in pairs:
-                    pairs.append([sub, obj])
 
-    # if len(pairs) == 0:
-    #     return -1
+                # membership of the raw json pair, as a list compared to the int pairs
+                if tuple(triple[:2]) not in pairs_set:
+                    pairs.append([sub, obj])
+                    pairs_set.add((sub, obj))
 
     # Root Object - object with highest outgoing degree
     all_edge_objects_ids = np.array(pairs).flatten()
@@ -123,29 +128,17 @@ def process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms = No
     root_obj_idx = object_id2idx[root_obj_id]
 
     # Calculate barry center and relative translation
-    rel_trans = []
-    for barry_center in barry_centers:
-        rel_trans.append(np.subtract(barry_centers[root_obj_idx], barry_center))
-    
-    rel_trans = np.array(rel_trans)
-    
+    rel_trans = np.subtract(barry_centers[root_obj_idx], np.array(barry_centers))
+
     for i in objects_ids:
         for j in objects_ids:
-            if i == j or [i, j] in pairs: continue
+            if i == j or (i, j) in pairs_set: continue
             triples.append([i, j, rel2idx['none']]) # supplement the 'none' relation
             pairs.append(([i, j]))
+            pairs_set.add((i, j))
             edges_cat.append(rel2idx['none'])
-    
-    s, o = np.split(np.array(pairs), 2, axis=1)  # All have shape (T, 1)
-    s, o = [np.squeeze(x, axis=1) for x in [s, o]]  # Now have shape (T,)
-
-    for index, v in enumerate(s):
-        s[index] = object_id2idx[v]  # s_idx
-    
-    for index, v in enumerate(o):
-        o[index] = object_id2idx[v]  # o_idx
-    
-    edges = np.stack((s, o), axis=1) 
+
+    edges = np.array([object_id2idx[v] for v in np.array(pairs).flatten()]).reshape(-1, 2)
 
     data_dict = {}
     data_dict['scan_id'] = scan_id
@@ -165,57 +158,6 @@ def process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms = No
     data_dict['root_obj_id'] = root_obj_id
     return data_dict
 
-def process_data(cfg, rel2idx, rel_transforms = None, mode = 'orig', split = 'train', data_file = 'data'):
-    use_predicted = cfg.use_predicted
-    scan_type = cfg.scan_type
-    anchor_type_name = cfg.preprocess.anchor_type_name
-    out_dirname = '' if scan_type == 'scan' else 'out'
-    out_dirname = osp.join(out_dirname, 'predicted') if use_predicted else out_dirname
-    data_dir = osp.join(cfg.data.root_dir, out_dirname)
-    data_write_dir = osp.join(data_dir, 'files', mode)
-    
-    common.ensure_dir(data_write_dir)
-    common.ensure_dir(osp.join(data_write_dir, data_file))
-    
-    print('[INFO] Processing subscans from {} split'.format(split))
-    
-    rel_json_filename = 'relationships.json' if scan_type == 'scan' else 'relationships_subscenes_{}.json'.format(split)
-    obj_json_filename = 'objects.json' if scan_type == 'scan' else 'objects_subscenes_{}.json'.format(split)
-    resplit = 'resplit_' if cfg.data.resplit else ''
-    scan_ids_filename = '{}_{}scans.txt'.format(split, resplit) if scan_type == 'scan' else '{}_scans_subscenes.txt'.format(split)
-
-    rel_json = common.load_json(osp.join(data_dir, 'files', rel_json_filename))['scans']
-    obj_json = common.load_json(osp.join(data_dir, 'files', obj_json_filename))['scans']
-
-    subscan_ids_generated = np.genfromtxt(osp.join(data_dir, 'files', scan_ids_filename), dtype=str)  
-    subscan_ids_processed = []
-    
-    subRescan_ids_generated = []
-    scans_dir = cfg.data.root_dir
-    scans_files_dir = osp.join(scans_dir, 'files')
-    all_scan_data = common.load_json(osp.join(scans_files_dir, '3RScan.json'))
-    # get rescans
-    for scan_data in all_scan_data:
-        ref_scan_id = scan_data['reference']
-        if ref_scan_id in subscan_ids_generated:
-            rescan_ids = [scan['reference'] for scan in scan_data['scans']]
-            subRescan_ids_generated += rescan_ids + [ref_scan_id]
-    subscan_ids_generated = subRescan_ids_generated
-
-    for subscan_id in tqdm(subscan_ids_generated[:]):
-        obj_data = [obj_data for obj_data in obj_json if obj_data['scan'] == subscan_id][0]
-        rel_data = [rel_data for rel_data in rel_json if rel_data['scan'] == subscan_id][0]
-        data_dict = process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms=rel_transforms)
-        
-        if type(data_dict) == int: continue
-
-        common.write_pkl_data(data_dict, osp.join(data_write_dir, data_file, data_dict['scan_id'] + '.pkl'))
-        subscan_ids_processed.append(subscan_id)
-    
-    subscan_ids = np.array(subscan_ids_processed) 
-
-    return data_dir, data_write_dir, mode, subscan_ids
-
 def make_bow_vector(sentence, word_2_idx):
     # create a vector of zeros of vocab size = len(word_to_idx)
     vec = np.zeros(len(word_2_idx))
@@ -227,91 +169,194 @@ def make_bow_vector(sentence, word_2_idx):
             vec[word_2_idx[word]]+=1
     return vec
 
-def calculate_bow_node_edge_feats(data_write_dir, rel2idx, scan_ids, data_file):
-    print('[INFO] Starting BOW Feature Calculation For Node Edge Features...')
-    
-    scan_ids = sorted([scan_id for scan_id in scan_ids])
+def bow_matrix(rows, words, word_2_idx, num_rows):
+    # (num_rows, V) word counts of every row, one bincount instead of a vector per row
+    for word in words:
+        if word not in word_2_idx:
+            print(word)
+            raise ValueError('houston we have a problem')
+    word_idxs = np.array([word_2_idx[word] for word in words], dtype=np.int64)
+    vocab_size = len(word_2_idx)
+    counts = np.bincount(np.asarray(rows, dtype=np.int64) * vocab_size + word_idxs, minlength=num_rows * vocab_size)
+    return counts.reshape(num_rows, vocab_size).astype(np.float64)
 
+def bow_node_edge_feats(data_dict, rel2idx):
+    # names of the outgoing relations of every object, the relation of edge idx is read from triples[idx]
     idx_2_rel = {idx : relation_name for relation_name, idx in rel2idx.items()}
-    
     wordToIx = {}
     for key in rel2idx.keys():
         wordToIx[key] = len(wordToIx)
+    edges = data_dict['edges']
+    rel_names = [idx_2_rel[data_dict['triples'][idx][2]] for idx in range(len(edges))]
+    return bow_matrix(edges[:, 0], rel_names, wordToIx, len(data_dict['objects_id']))
+
+def bow_node_attr_feats(data_dict, word_2_ix):
+    attributes = data_dict['object_attributes']
+    rows = [obj_idx for obj_idx, object_attr in enumerate(attributes) for _ in object_attr]
+    words = [attr for object_attr in attributes for attr in object_attr]
+    return bow_matrix(rows, words, word_2_ix, len(attributes))
+
+def scan_attr_words(data_dict):
+    # attributes of the scan in order of first occurrence, for the vocabulary
+    return list(dict.fromkeys(attr for object_attr in data_dict['object_attributes'] for attr in object_attr))
+
+def seed_scan(seed, scan_id):
+    # per-scan seeds, results do not depend on the worker or the order scans are processed in
+    scan_seed = (seed + zlib.crc32(scan_id.encode())) % 2**32
+    random.seed(scan_seed)
+    np.random.seed(scan_seed)
+
+def process_scan_job(scan_item, data_dir, data_write_dir, data_file, cfg, rel2idx, rel_transforms, word_2_ix):
+    scan_id, rel_data, obj_data = scan_item
+    seed_scan(cfg.seed, scan_id)
+    data_dict = process_scan(data_dir, rel_data, obj_data, cfg, rel2idx, rel_transforms=rel_transforms)
+    if type(data_dict) == int:
+        return scan_id, None
+
+    scan_info = {'attr_words': [], 'attr_vocab_size': None}
+    if not cfg.use_predicted:
+        scan_info['attr_words'] = scan_attr_words(data_dict)
+        # attributes outside the vocabulary extend it, the features are written once it is complete
+        if all(attr in word_2_ix for attr in scan_info['attr_words']):
+            data_dict['bow_vec_object_attr_feats'] = bow_node_attr_feats(data_dict, word_2_ix)
+            scan_info['attr_vocab_size'] = len(word_2_ix)
+    data_dict['bow_vec_object_edge_feats'] = bow_node_edge_feats(data_dict, rel2idx)
+    assert data_dict['bow_vec_object_edge_feats'].shape[0] == data_dict['objects_count']
+
+    common.write_pkl_data(data_dict, osp.join(data_write_dir, data_file, data_dict['scan_id'] + '.pkl'))
+    return scan_id, scan_info
+
+class PreprocessManifest():
+    r"""Processed scans of a split, preprocessing resumes from the scans it lists.
+
+    Maps every processed scan to None if it was dropped, or to its attribute words and
+    the vocabulary size its attribute features were written with.
+    """
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self.scans = {}
+
+    def load(self):
+        if osp.isfile(self.filename):
+            manifest = common.load_pkl_data(self.filename)
+            # restart if the scans were processed with other settings
+            if manifest['key'] == self.key:
+                self.scans = manifest['scans']
+
+    def save(self):
+        filename_tmp = self.filename + '.tmp'
+        common.write_pkl_data({'key': self.key, 'scans': self.scans}, filename_tmp)
+        os.replace(filename_tmp, self.filename)
+
+def get_split_scans(cfg, data_dir, split):
+    scan_type = cfg.scan_type
+    resplit = 'resplit_' if cfg.data.resplit else ''
+    scan_ids_filename = '{}_{}scans.txt'.format(split, resplit) if scan_type == 'scan' else '{}_scans_subscenes.txt'.format(split)
+    subscan_ids_generated = set(np.atleast_1d(np.genfromtxt(osp.join(data_dir, 'files', scan_ids_filename), dtype=str)).tolist())
 
-    print('[INFO] Size of Node Edge Vocabulary - {}'.format(len(wordToIx)))
-    print('[INFO] Generated Vocabulary, Calculating BOW Features...')
-    for scan_id in scan_ids:
-        data_dict_filename = osp.join(data_write_dir, data_file, '{}.pkl'.format(scan_id))
-        data_dict = common.load_pkl_data(data_dict_filename)
-        
-        edge = data_dict['edges']
-        objects_ids = data_dict['objects_id']
-        triples = data_dict['triples']
-        edges = data_dict['edges']
-
-        entities_edge_names = [None] * len(objects_ids)
-        for idx in range(len(edges)):
-            edge = edges[idx]
-            entity_idx = edge[0]
-            rel_name = idx_2_rel[triples[idx][2]]
-
-            if rel_name == 'inside':
-                print(scan_id)
-
-            if entities_edge_names[entity_idx] is None:
-                entities_edge_names[entity_idx] = [rel_name]
-            else:
-                entities_edge_names[entity_idx].append(rel_name)
-            
-        entity_edge_feats = None
-        for entity_edge_names in entities_edge_names:
-            entity_edge_feat = np.expand_dims(make_bow_vector(entity_edge_names, wordToIx), 0)
-            entity_edge_feats = entity_edge_feat if entity_edge_feats is None else np.concatenate((entity_edge_feats, entity_edge_feat), axis = 0)
-
-        data_dict['bow_vec_object_edge_feats'] = entity_edge_feats
-        assert data_dict['bow_vec_object_edge_feats'].shape[0] == data_dict['objects_count']
-        
-        common.write_pkl_data(data_dict, data_dict_filename)
-    
-    print('[INFO] Completed BOW Feature Calculation For Node Edge Features.')
+    subRescan_ids_generated = []
+    scans_files_dir = osp.join(cfg.data.root_dir, 'files')
+    all_scan_data = common.load_json(osp.join(scans_files_dir, '3RScan.json'))
+    # get rescans
+    for scan_data in all_scan_data:
+        ref_scan_id = scan_data['reference']
+        if ref_scan_id in subscan_ids_generated:
+            rescan_ids = [scan['reference'] for scan in scan_data['scans']]
+            subRescan_ids_generated += rescan_ids + [ref_scan_id]
+    return subRescan_ids_generated
 
-def calculate_bow_node_attr_feats(data_write_dir, scan_ids, data_file, word_2_ix):
-    print('[INFO] Starting BOW Feature Calculation For Node Attribute Features...')
-    
-    scan_ids = sorted([scan_id for scan_id in scan_ids])
-    for scan_id in tqdm(scan_ids):
-        data_dict_filename = osp.join(data_write_dir, data_file, '{}.pkl'.format(scan_id))
-        data_dict = common.load_pkl_data(data_dict_filename)
-        attributes = data_dict['object_attributes']
+def index_scans(json_scans):
+    # first entry of every scan, as the lookup it replaces
+    scans_index = {}
+    for scan_data in json_scans:
+        scans_index.setdefault(scan_data['scan'], scan_data)
+    return scans_index
 
-        for object_attr in attributes:
-            for attr in object_attr:
-                if attr not in word_2_ix:
-                    word_2_ix[attr] = len(word_2_ix)
+def process_data(cfg, rel2idx, rel_transforms = None, mode = 'orig', split = 'train', data_file = 'data',
+                 word_2_ix = None, num_workers = 0, resume = True):
+    use_predicted = cfg.use_predicted
+    scan_type = cfg.scan_type
+    out_dirname = '' if scan_type == 'scan' else 'out'
+    out_dirname = osp.join(out_dirname, 'predicted') if use_predicted else out_dirname
+    data_dir = osp.join(cfg.data.root_dir, out_dirname)
+    data_write_dir = osp.join(data_dir, 'files', mode)
+    word_2_ix = {} if word_2_ix is None else word_2_ix
 
-    print('[INFO] Size of Node Attribute Vocabulary - {}'.format(len(word_2_ix)))
-    print('[INFO] Generated Vocabulary, Calculating BOW Features...')
+    common.ensure_dir(data_write_dir)
+    common.ensure_dir(osp.join(data_write_dir, data_file))
+
+    print('[INFO] Processing subscans from {} split'.format(split))
+
+    rel_json_filename = 'relationships.json' if scan_type == 'scan' else 'relationships_subscenes_{}.json'.format(split)
+    obj_json_filename = 'objects.json' if scan_type == 'scan' else 'objects_subscenes_{}.json'.format(split)
+    rel_json = index_scans(common.load_json(osp.join(data_dir, 'files', rel_json_filename))['scans'])
+    obj_json = index_scans(common.load_json(osp.join(data_dir, 'files', obj_json_filename))['scans'])
+
+    subscan_ids_generated = get_split_scans(cfg, data_dir, split)
+
+    manifest_key = (list(rel2idx.keys()), sorted(cfg.preprocess.pc_resolutions), cfg.preprocess.min_obj_points,
+                    use_predicted, cfg.seed, len(word_2_ix))
+    manifest = PreprocessManifest(osp.join(data_write_dir, 'manifest_{}_{}.pkl'.format(data_file, split)), manifest_key)
+    if resume:
+        manifest.load()
+    scan_items = [(subscan_id, rel_json[subscan_id], obj_json[subscan_id])
+                  for subscan_id in subscan_ids_generated if subscan_id not in manifest.scans]
+    print('[INFO] {} scans to process, {} done before'.format(len(scan_items), len(subscan_ids_generated) - len(scan_items)))
+
+    start_time = time.time()
+    job = partial(process_scan_job, data_dir=data_dir, data_write_dir=data_write_dir, data_file=data_file, cfg=cfg,
+                  rel2idx=rel2idx, rel_transforms=rel_transforms, word_2_ix=word_2_ix)
+    if num_workers > 0:
+        pool = Pool(num_workers)
+        results = pool.imap_unordered(job, scan_items)
+    else:
+        pool = None
+        results = map(job, scan_items)
+    for scan_id, scan_info in tqdm(results, total=len(scan_items)):
+        manifest.scans[scan_id] = scan_info
+        manifest.save()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    process_time = time.time() - start_time
+    print('[INFO] Processed {} scans in {:.1f}s ({:.2f} scans/s) with {} workers'.format(
+        len(scan_items), process_time, len(scan_items) / max(process_time, 1e-6), num_workers))
+
+    subscan_ids = np.array([subscan_id for subscan_id in subscan_ids_generated if manifest.scans.get(subscan_id) is not None])
+    if not use_predicted:
+        finalize_bow_node_attr_feats(osp.join(data_write_dir, data_file), manifest, subscan_ids, word_2_ix)
+
+    return data_dir, data_write_dir, mode, subscan_ids
 
+def finalize_bow_node_attr_feats(data_dir, manifest, scan_ids, word_2_ix):
+    # vocabulary extended with the unseen attributes of the scans in sorted order,
+    # only scans written with another vocabulary are rewritten
+    scan_ids = sorted([scan_id for scan_id in scan_ids])
     for scan_id in scan_ids:
-        data_dict_filename = osp.join(data_write_dir, data_file, '{}.pkl'.format(scan_id))
+        for attr in manifest.scans[scan_id]['attr_words']:
+            if attr not in word_2_ix:
+                word_2_ix[attr] = len(word_2_ix)
+    print('[INFO] Size of Node Attribute Vocabulary - {}'.format(len(word_2_ix)))
+
+    scan_ids_outdated = [scan_id for scan_id in scan_ids if manifest.scans[scan_id]['attr_vocab_size'] != len(word_2_ix)]
+    for scan_id in tqdm(scan_ids_outdated):
+        data_dict_filename = osp.join(data_dir, '{}.pkl'.format(scan_id))
         data_dict = common.load_pkl_data(data_dict_filename)
-        attributes = data_dict['object_attributes']
-
-        bow_vec_attrs = None
-        for object_attr in attributes:
-            bow_vec_attr = np.expand_dims(make_bow_vector(object_attr, word_2_ix), 0)
-            bow_vec_attrs = bow_vec_attr if bow_vec_attrs is None else np.concatenate((bow_vec_attrs, bow_vec_attr), axis = 0)
-        
-        data_dict['bow_vec_object_attr_feats'] = bow_vec_attrs
-        assert bow_vec_attrs.shape[0] == data_dict['objects_count']
+        data_dict['bow_vec_object_attr_feats'] = bow_node_attr_feats(data_dict, word_2_ix)
+        assert data_dict['bow_vec_object_attr_feats'].shape[0] == data_dict['objects_count']
         common.write_pkl_data(data_dict, data_dict_filename)
-    
+        manifest.scans[scan_id]['attr_vocab_size'] = len(word_2_ix)
+        manifest.save()
+
     print('[INFO] Completed BOW Feature Calculation For Node Attribute Features.')
-    
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Preprocess Scan3R')
     parser.add_argument('--config', type=str, default='', help='Path to the config file')
     parser.add_argument('--split', type=str, default='train', help='Seed for random number generator')
+    parser.add_argument('--num_workers', type=int, default=None, help='processes, num_workers of the config by default')
+    parser.add_argument('--no_resume', action='store_true', help='reprocess scans already in the manifest')
     return parser.parse_known_args()
 
 if __name__ == '__main__':
@@ -319,21 +364,21 @@ if __name__ == '__main__':
     args, _ = parse_args()
     cfg_file = args.config
     split = args.split
-    
+
     # cfg = CN()
     # cfg.defrost()
     # cfg.set_new_allowed(True)
     # cfg.merge_from_file(cfg_file)
     cfg = update_config(config, cfg_file, ensure_dir = False)
+    num_workers = cfg.get('num_workers', 0) if args.num_workers is None else args.num_workers
 
-    random.seed(cfg.seed)
     root_dir = cfg.data.root_dir
     REL2IDX_SCANNET8 = common.name2idx(osp.join(root_dir, 'files/scannet8_relationships.txt'))
     REL2IDX_SCANNET41 = common.name2idx(osp.join(root_dir, 'files/relationships.txt'))
     CLASS2IDX_SCANNET20 = common.name2idx(osp.join(root_dir, 'files/scannet20_classes.txt'))
     rel2idx_8 = REL2IDX_SCANNET8
     rel2idx_41 = REL2IDX_SCANNET41
-    
+
     # whether use 8  rel or 40 rel
     if cfg.model.rel_dim == 9:
         rel2idx = rel2idx_8
@@ -344,14 +389,12 @@ if __name__ == '__main__':
         rel2idx = rel2idx_41
         rel_transform = None
         data_file = 'data'
-    data_dir, data_write_dir, mode, scan_ids = process_data(cfg, rel2idx, rel_transform, split=split, data_file=data_file)
-
-    data_write_dir = osp.join(root_dir, 'files', 'orig')
-    common.ensure_dir(data_write_dir)
     # obj attributes
     OBJ_ATTR_FILENAME = osp.join(root_dir, 'files', 'obj_attr.pkl')
-    word_2_ix = common.load_pkl_data(OBJ_ATTR_FILENAME)
-    if not cfg.use_predicted : calculate_bow_node_attr_feats(data_write_dir, 
-                                        scan_ids, data_file= data_file, word_2_ix = word_2_ix)
-    # relationships
-    calculate_bow_node_edge_feats(data_write_dir, rel2idx, scan_ids, data_file= data_file)
\ No newline at end of file
+    word_2_ix = common.load_pkl_data(OBJ_ATTR_FILENAME) if not cfg.use_predicted else {}
+
+    start_time = time.time()
+    # scene graphs and their BOW features are written once per scan
+    data_dir, data_write_dir, mode, scan_ids = process_data(cfg, rel2idx, rel_transform, split=split, data_file=data_file,
+        word_2_ix=word_2_ix, num_workers=num_workers, resume=not args.no_resume)
+    print('[INFO] Preprocessed {} scans of {} split in {:.1f}s'.format(len(scan_ids), split, time.time() - start_time))
@@ -25,7 +25,9 @@ workspace_dir = osp.dirname(osp.dirname(osp.dirname(osp.dirname(osp.dirname(osp.
 src_dir = osp.join(workspace_dir, 'src')
 sys.path.append(workspace_dir)
 sys.path.append(src_dir)
-from utils import common, scan3r
+from utils import common, scan3r, torch_util
+from utils.crop_embedding import CropEmbedder
+from functools import partial
 
 # Dino v2
 from dinov2_utils import DinoV2ExtractFeatures
@@ -71,7 +73,7 @@ num_of_levels = 3
 feat_dim = 1536
 
 class ObjVisualEmbGen(data.Dataset):
-    def __init__(self, cfg, split, vis=False):
+    def __init__(self, cfg, split, vis=False, batch_size=64, num_threads=4):
         self.cfg = cfg
         
         # undefined patch anno id
@@ -161,26 +163,27 @@ class ObjVisualEmbGen(data.Dataset):
         common.ensure_dir(self.obj_visual_emb_dir)
         
         # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(self.cfg.device)
         
         desc_layer = 31
         desc_facet = "value"
-        device = torch.device("cuda")
-        self.device = torch.device("cuda")
         
         # Dinov2 extractor
         if "extractor" in globals():
             print(f"Extractor already defined, skipping")
         else:
             self.extractor = DinoV2ExtractFeatures("dinov2_vitg14", desc_layer,
-                desc_facet, use_cls = True , device=device)
+                desc_facet, use_cls = True , device=self.device)
 
         self.base_tf = tvf.Compose([
             tvf.ToTensor(),
             tvf.Normalize(mean=[0.485, 0.456, 0.406], 
                             std=[0.229, 0.224, 0.225])
         ])
+        
+        # crops of all objects of a scan grouped by frame, in batches of batch_size crops
+        self.crop_embedder = CropEmbedder(self.extract_cls_token, self.crop_multi_level, batch_size=batch_size,
+                                          num_threads=num_threads, device=self.device)
             
         self.time_used = 0.
                 
@@ -222,55 +225,46 @@ class ObjVisualEmbGen(data.Dataset):
                 obj_image_votes_topK[obj_id] = sorted_frame_idxs[:self.cfg.data.obj_img.topk]
             else:
                 obj_image_votes_topK[obj_id] = sorted_frame_idxs
-        ## get obj visual emb
-        obj_visual_emb = {}
-        for obj_id in obj_image_votes_topK:
-            obj_image_votes_topK_frames = obj_image_votes_topK[obj_id]
-            obj_visual_emb[obj_id] = {}
-            for frame_idx in obj_image_votes_topK_frames:
-                obj_visual_emb[obj_id][frame_idx] = self.generate_visual_emb(
-                    scan_id, frame_idx, obj_id, obj_anno_2D[frame_idx])    
+        ## get obj visual emb, every frame decoded once for all its objects
+        start = time.time()
+        obj_visual_emb = self.crop_embedder.embedScan(
+            partial(self.load_frame, scan_id, obj_anno_2D), obj_image_votes_topK)
+        self.time_used += time.time() - start
         obj_patch_info = {
             'obj_visual_emb': obj_visual_emb,
             'obj_image_votes_topK': obj_image_votes_topK,
         }
         return obj_patch_info
     
-    def generate_visual_emb(self, scan_id, frame_idx, obj_id, gt_anno):
-        if self.img_rotate:
-            obj_2D_anno_f_rot = gt_anno.transpose(1, 0)
-            obj_2D_anno_f_rot = np.flip(obj_2D_anno_f_rot, 1)
-        # load image
-        image_path = self.image_path[scan_id][frame_idx]
-        image = Image.open(image_path)
+    def load_frame(self, scan_id, obj_anno_2D, frame_idx):
+        # image and obj anno of a frame, rotated as the image patches
+        gt_anno = obj_anno_2D[frame_idx]
+        image = Image.open(self.image_path[scan_id][frame_idx])
         if self.img_rotate:
+            gt_anno = np.flip(gt_anno.transpose(1, 0), 1)
             image = image.transpose(Image.ROTATE_270)
+        image.load()
         if self.vis:
             image.show()
-            cv2.imshow("obj_2D_anno_f_rot", np.array(obj_2D_anno_f_rot))
-        # get obj mask
-        obj_mask = obj_2D_anno_f_rot == obj_id
-        # extract multi-level crop dinov2 features
-        start = time.time()
+            cv2.imshow("obj_2D_anno_f_rot", np.array(gt_anno))
+        return image, gt_anno
+    
+    def crop_multi_level(self, image, obj_mask):
+        # multi-level crops of an obj around its mask
+        mask_tensor = torch.from_numpy(obj_mask).float()
         images_crops = []
         for level in range(num_of_levels):
-            mask_tensor = torch.from_numpy(obj_mask).float()
             x1, y1, x2, y2 = mask2box_multi_level(mask_tensor, level, multi_level_expansion_ratio)
             cropped_img = image.crop((x1, y1, x2, y2))
             cropped_img = cropped_img.resize((224, 224), Image.BICUBIC)
-            img_pt = self.base_tf(cropped_img)
-            images_crops.append(img_pt)
-        # extract clip emb
-        if(len(images_crops) > 0):
-            image_input =torch.stack(images_crops).to(self.device)
-            with torch.no_grad():
-                ret = self.extractor(image_input) # [num_levels, 1+num_patches, desc_dim]  
-                # get cls token
-                cls_token = ret[:, 0, :]
-                # get mean of all patches
-                mean_patch = cls_token.mean(dim=0)
-        self.time_used += time.time() - start
-        return mean_patch.cpu().detach().numpy()
+            images_crops.append(self.base_tf(cropped_img))
+        return images_crops
+    
+    def extract_cls_token(self, images_crops):
+        # dinov2 cls token of every crop, [num_crops, desc_dim]
+        with torch_util.autocast(self.device, self.cfg.device.autocast_bf16):
+            ret = self.extractor(images_crops) # [num_crops, 1+num_patches, desc_dim]
+        return ret[:, 0, :]
         
     def __len__(self):
         return len(self.data_items)
@@ -279,6 +273,8 @@ def parse_args():
     parser = argparse.ArgumentParser(description='Preprocess Scan3R')
     parser.add_argument('--config', type=str, default='', help='Path to the config file')
     parser.add_argument('--split', type=str, default='train', help='split')
+    parser.add_argument('--batch_size', type=int, default=64, help='crops per extractor batch')
+    parser.add_argument('--num_threads', type=int, default=4, help='threads decoding and cropping frames')
     return parser.parse_known_args()
     
 if __name__ == '__main__':
@@ -289,7 +285,7 @@ if __name__ == '__main__':
     cfg = update_config(config, cfg_file, ensure_dir = False)
     
     split = args.split
-    scan3r_ds = ObjVisualEmbGen(cfg, split=split, vis = False)
+    scan3r_ds = ObjVisualEmbGen(cfg, split=split, vis = False, batch_size=args.batch_size, num_threads=args.num_threads)
     scan3r_ds.generateObjVisualEmb()
     print("Time used: ", scan3r_ds.time_used)
     with open("./time_used_{}.txt".format(split), "w") as f:
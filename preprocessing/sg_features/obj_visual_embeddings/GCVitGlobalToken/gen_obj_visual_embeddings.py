@@ -27,6 +27,8 @@ sys.path.append(src_dir)
 
 from models.GCVit.models import gc_vit
 from utils import common, scan3r
+from utils.crop_embedding import CropEmbedder
+from functools import partial
 
 def _to_channel_last(x):
     """
@@ -50,7 +52,7 @@ def _to_channel_first(x):
     return x.permute(0, 3, 1, 2)
 
 class ObjVisualEmbGen(data.Dataset):
-    def __init__(self, cfg, split, vis=False):
+    def __init__(self, cfg, split, vis=False, batch_size=64, num_threads=4):
         self.cfg = cfg
         
         # undefined patch anno id
@@ -152,6 +154,10 @@ class ObjVisualEmbGen(data.Dataset):
         backbone = build_backbone(backbone_cfg.model['backbone'])
         self.backbone = backbone
         self.backbone.to(self.device)
+        
+        # crops of all objects of a scan grouped by frame, in batches of batch_size crops
+        self.crop_embedder = CropEmbedder(self.extract_global_query, self.crop_obj, batch_size=batch_size,
+                                          num_threads=num_threads, device=self.device)
 
     def load3DSceneGraphs(self):
         # load 3D obj semantic annotations
@@ -208,56 +214,45 @@ class ObjVisualEmbGen(data.Dataset):
                 obj_image_votes_topK[obj_id] = sorted_frame_idxs[:self.cfg.data.obj_img.topk]
             else:
                 obj_image_votes_topK[obj_id] = sorted_frame_idxs
-        ## get obj visual emb
-        obj_visual_emb = {}
-        for obj_id in obj_image_votes_topK:
-            obj_image_votes_topK_frames = obj_image_votes_topK[obj_id]
-            obj_visual_emb[obj_id] = {}
-            for frame_idx in obj_image_votes_topK_frames:
-                obj_visual_emb[obj_id][frame_idx] = self.generate_visual_emb(
-                    scan_id, frame_idx, obj_id, obj_anno_2D[frame_idx])    
+        ## get obj visual emb, every frame decoded once for all its objects
+        obj_visual_emb = self.crop_embedder.embedScan(
+            partial(self.load_frame, scan_id, obj_anno_2D), obj_image_votes_topK)
         obj_patch_info = {
             'obj_visual_emb': obj_visual_emb,
             'obj_image_votes_topK': obj_image_votes_topK,
         }
         return obj_patch_info
     
-    def generate_visual_emb(self, scan_id, frame_idx, obj_id, gt_anno):
-        if self.img_rotate:
-            obj_2D_anno_f_rot = gt_anno.transpose(1, 0)
-            obj_2D_anno_f_rot = np.flip(obj_2D_anno_f_rot, 1)
-        # load image
-        image_path = self.image_path[scan_id][frame_idx]
-        image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    def load_frame(self, scan_id, obj_anno_2D, frame_idx):
+        # image and obj anno of a frame, rotated as the image patches
+        gt_anno = obj_anno_2D[frame_idx]
+        image = cv2.imread(self.image_path[scan_id][frame_idx], cv2.IMREAD_UNCHANGED)
         if self.img_rotate:
-            image = image.transpose(1, 0, 2)
-            image = np.flip(image, 1)
-        # get obj crop
-        obj_mask = obj_2D_anno_f_rot == obj_id
+            gt_anno = np.flip(gt_anno.transpose(1, 0), 1)
+            image = np.flip(image.transpose(1, 0, 2), 1)
+        return image, gt_anno
+    
+    def crop_obj(self, image, obj_mask):
+        # get obj crop, None for objs smaller than 60 pixels
         locs = np.where(obj_mask)
         min_w, max_w = np.min(locs[1]), np.max(locs[1])
         min_h, max_h = np.min(locs[0]), np.max(locs[0])
         if max_w - min_w < 60 or max_h - min_h < 60:
             return None
-        else:
-            obj_crop = image[min_h:max_h, min_w:max_w]
+        obj_crop = image[min_h:max_h, min_w:max_w]
         if self.vis:
             cv2.imshow("Sheep", obj_crop)
             cv2.waitKey(0)
-            
         # resize to 224x224
         obj_crop = cv2.resize(obj_crop, (224, 224), interpolation=cv2.INTER_AREA)
-        obj_crop_tensor = torch.from_numpy(obj_crop).to(self.device).float()
-        obj_crop_tensor = obj_crop_tensor.unsqueeze(0)
-        obj_crop_tensor = _to_channel_first(obj_crop_tensor)
-        global_query = self.backbone.forward_global_query(obj_crop_tensor) # (1, 1, 16, 49, 32)
-        global_query = global_query.squeeze(0).squeeze(0) # (16, 49, 32)
-        global_query = global_query.permute(0, 2, 1) # (16, 32, 49)
-        global_query = global_query.view(global_query.size(0)*global_query.size(1), 7, 7) # (16, 32, 49)
-        ## average pooling
-        global_pool = F.avg_pool2d(global_query, global_query.size()[1:])
-        global_pool_flat = global_pool.view(-1)
-        return global_pool_flat.cpu().detach().numpy()
+        return [_to_channel_first(torch.from_numpy(obj_crop).float().unsqueeze(0))[0]]
+    
+    def extract_global_query(self, obj_crops):
+        global_query = self.backbone.forward_global_query(obj_crops) # (B, 1, 16, 49, 32)
+        global_query = global_query.squeeze(1) # (B, 16, 49, 32)
+        ## average pooling over the 7x7 tokens, (B, 16*32)
+        global_pool = global_query.mean(dim=2)
+        return global_pool.flatten(1)
 
         
     def __len__(self):
@@ -0,0 +1,161 @@
+import argparse
+import copy
+import os.path as osp
+import sys
+import time
+import torch
+import torch.nn.functional as F
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import torch_util
+from models.patch_SGIE_aligner import PatchSGIEAligner, _to_channel_first, _to_channel_last
+from models.GCVit.models import gc_vit
+from benchmark.bench_cpu_throughput import sampleSceneGraphs
+
+# training step of EpochBasedTrainer on a synthetic batch of images and scene graphs: step time and
+# peak memory of the step before (fp32, backward(retain_graph=True), cache flushed every iteration)
+# vs the freed graph, autocast and activation checkpointing of the GCViT levels and MultiModalEncoder.
+# Activation memory is the peak of the live tensors saved for backward, so that it is measured on cpu
+# as well; on cuda the peak allocated memory is reported too.
+
+class ActivationMemory():
+    r"""Live bytes of the tensors saved for backward (parameters excluded), and their peak."""
+    def __init__(self, model):
+        self.param_ptrs = set(param.data_ptr() for param in model.parameters())
+        self.storages = {}
+        self.bytes = 0
+        self.peak = 0
+
+    def pack(self, tensor):
+        storage = tensor.untyped_storage()
+        key = storage.data_ptr()
+        if key in self.param_ptrs:
+            return tensor
+        if key not in self.storages:
+            self.storages[key] = 0
+            self.bytes += storage.nbytes()
+            self.peak = max(self.peak, self.bytes)
+        self.storages[key] += 1
+        return SavedTensor(self, key, storage.nbytes(), tensor)
+
+    def unpack(self, saved):
+        return saved.tensor if isinstance(saved, SavedTensor) else saved
+
+    def release(self, key, nbytes):
+        self.storages[key] -= 1
+        if self.storages[key] == 0:
+            del self.storages[key]
+            self.bytes -= nbytes
+
+class SavedTensor():
+    def __init__(self, memory, key, nbytes, tensor):
+        self.memory, self.key, self.nbytes, self.tensor = memory, key, nbytes, tensor
+
+    def __del__(self):
+        self.memory.release(self.key, self.nbytes)
+
+def buildModel(sg_modules):
+    # GCViT-T as in the cascade mask rcnn config, built directly without mmdet
+    backbone = gc_vit.GCViT(dim=64, mlp_ratio=3.0, depths=[3, 4, 19, 5], num_heads=[2, 4, 8, 16], drop_path_rate=0.)
+    return PatchSGIEAligner(backbone, num_reduce=0, backbone_dim=backbone.num_features[-1], img_transpose=True,
+                            patch_hidden_dims=[512], patch_encoder_dim=400, num_patch_gcn_layers=4,
+                            obj_embedding_dim=100*len(sg_modules), obj_embedding_hidden_dims=[512, 512],
+                            obj_encoder_dim=400, sg_modules=sg_modules, sg_rel_dim=41, attr_dim=164,
+                            img_feat_dim=1536, drop=0., use_temporal=False)
+
+def trainStep(model, images, scene_graphs, labels):
+    # patch-object contrastive loss over all objects of the batch
+    features = _to_channel_last(model.backbone(_to_channel_first(images))[-1])
+    patch_features = model.patch_encoder(model.reduce_layers(features))
+    patch_features = _to_channel_last(model.patch_gcn(_to_channel_first(patch_features))).flatten(0, 2)
+    obj_features = model.obj_embedding_encoder(model.forward_scene_graph({'scene_graphs': scene_graphs}))
+    logits = F.normalize(patch_features, dim=-1) @ F.normalize(obj_features, dim=-1).T / 0.1
+    loss = F.cross_entropy(logits.float(), labels)
+    return {'patch_features': patch_features}, {'loss': loss}
+
+def runMode(model, init_state, inputs, device, num_steps, retain_graph, use_amp, amp_dtype, grad_checkpointing):
+    model.load_state_dict(init_state)
+    model.train()
+    torch_util.set_grad_checkpointing(model, grad_checkpointing)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    grad_scaler = torch_util.grad_scaler(device, use_amp and amp_dtype == torch.float16)
+    memory = ActivationMemory(model)
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    step_times, losses, grads = [], [], None
+    # output_dict of the previous step stays alive while the next one runs, as in train_epoch
+    output_dict = None
+    with torch.autograd.graph.saved_tensors_hooks(memory.pack, memory.unpack):
+        for step in range(num_steps):
+            torch_util.synchronize(device)
+            start_time = time.time()
+            with torch_util.autocast(device, use_amp, amp_dtype):
+                output_dict, result_dict = trainStep(model, *inputs)
+            if retain_graph:
+                result_dict['loss'].backward(retain_graph=True)
+            else:
+                grad_scaler.scale(result_dict['loss']).backward()
+            if grads is None:
+                grads = torch.cat([param.grad.flatten() / grad_scaler.get_scale() for param in model.parameters()
+                                   if param.grad is not None])
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
+            optimizer.zero_grad()
+            if retain_graph:
+                torch_util.empty_cache(device)
+            torch_util.synchronize(device)
+            step_times.append(time.time() - start_time)
+            losses.append(result_dict['loss'].item())
+    peak_allocated = torch.cuda.max_memory_allocated(device) if device.type == 'cuda' else None
+    # first step is warmup
+    step_time = sum(step_times[1:]) / max(1, len(step_times) - 1)
+    return step_time, memory.peak, peak_allocated, losses[0], grads
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--device', type=str, default='auto')
+    parser.add_argument('--num_images', type=int, default=1)
+    parser.add_argument('--patch_h', type=int, default=9)
+    parser.add_argument('--patch_w', type=int, default=16)
+    parser.add_argument('--num_scans', type=int, default=2)
+    parser.add_argument('--objs_per_scan', type=int, default=40)
+    parser.add_argument('--num_steps', type=int, default=3)
+    parser.add_argument('--amp_dtype', type=str, default='auto', help='auto, bf16 or fp16')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    torch.manual_seed(42)
+    device = torch_util.get_device(args.device)
+    amp_dtype = torch_util.amp_dtype(device, args.amp_dtype)
+    model = buildModel(['point', 'gat', 'rel', 'attr']).to(device)
+    init_state = copy.deepcopy(model.state_dict())
+    images = torch.rand(args.num_images, args.patch_h*32, args.patch_w*32, 3) # (B, H, W, C)
+    scene_graphs = sampleSceneGraphs(args.num_scans, args.objs_per_scan)
+    num_objs = scene_graphs['tot_obj_pts'].shape[0]
+    labels = torch.randint(0, num_objs, (args.num_images*args.patch_h*args.patch_w,))
+    inputs = tuple(torch_util.to_device((images, scene_graphs, labels), device))
+
+    amp_name = 'bf16' if amp_dtype == torch.bfloat16 else 'fp16'
+    modes = [('before', True, False, False),
+             ('fp32', False, False, False),
+             ('fp32+ckpt', False, False, True),
+             (amp_name, False, True, False),
+             (amp_name + '+ckpt', False, True, True)]
+    print('{} images of {}x{}, {} objects, {} on {}'.format(
+        args.num_images, args.patch_h*32, args.patch_w*32, num_objs, 'train step', device))
+    print('{:>12} {:>10} {:>9} {:>10} {:>10} {:>10} {:>10}'.format(
+        'mode', 's/step', 'speedup', 'act MB', 'peak MB', 'loss', 'grad diff'))
+    time_ref, grads_ref = None, None
+    for mode, retain_graph, use_amp, grad_checkpointing in modes:
+        step_time, act_bytes, peak_allocated, loss, grads = runMode(
+            model, init_state, inputs, device, args.num_steps, retain_graph, use_amp, amp_dtype, grad_checkpointing)
+        if time_ref is None:
+            time_ref, grads_ref = step_time, grads
+        grad_diff = ((grads - grads_ref).norm() / grads_ref.norm()).item()
+        print('{:>12} {:>10.2f} {:>8.2f}x {:>10.1f} {:>10} {:>10.4f} {:>10.2e}'.format(
+            mode, step_time, time_ref / step_time, act_bytes / 2**20,
+            '-' if peak_allocated is None else '{:.1f}'.format(peak_allocated / 2**20), loss, grad_diff))
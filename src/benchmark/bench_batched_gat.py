@@ -0,0 +1,73 @@
+import argparse
+import os.path as osp
+import sys
+import time
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from models.sgaligner.src.aligner.networks.gat import MultiGAT, batch_graph_edges
+
+# per-graph MultiGAT calls vs one call over the disjoint union of all graphs
+
+def sampleGraphs(num_graphs, min_objs=10, max_objs=60, edges_per_obj=3, feat_dim=3):
+    obj_counts = torch.randint(min_objs, max_objs, (num_graphs,))
+    edge_counts = obj_counts * edges_per_obj
+    # edges with node idxs local to each graph, as in the scene graph collate
+    edges = torch.cat([torch.randint(0, int(num_objs), (int(num_edges), 2))
+                       for num_objs, num_edges in zip(obj_counts, edge_counts)])
+    x = torch.randn(int(obj_counts.sum()), feat_dim)
+    return x, edges, obj_counts.reshape(-1, 1).numpy(), edge_counts.reshape(-1, 1).numpy()
+
+def perGraphForward(model, x, edges, obj_counts, edge_counts):
+    structure_embed = []
+    start_object_idx, start_edge_idx = 0, 0
+    for object_count, edges_count in zip(obj_counts[:, 0], edge_counts[:, 0]):
+        edges_graph = torch.transpose(edges[start_edge_idx: start_edge_idx + edges_count], 0, 1).long()
+        structure_embed.append(model(x[start_object_idx: start_object_idx + object_count], edges_graph))
+        start_object_idx += object_count
+        start_edge_idx += edges_count
+    return torch.cat(structure_embed)
+
+def batchedForward(model, x, edges, obj_counts, edge_counts):
+    return model(x, batch_graph_edges(edges, obj_counts, edge_counts))
+
+def timeit(func, repeats, device):
+    func()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.time()
+    for _ in range(repeats):
+        out = func()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.time() - start) / repeats, out
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_graphs', type=int, nargs='+', default=[10, 50, 100, 250, 500])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    torch.manual_seed(42)
+    device = torch.device(args.device)
+    # same config as the gat module of MultiModalEncoder
+    model = MultiGAT(n_units=[3, 128, 128], n_heads=[2, 2]).to(device).eval()
+    print('{:>8} {:>8} {:>14} {:>14} {:>9} {:>10}'.format(
+        'graphs', 'objs', 'per-graph(ms)', 'batched(ms)', 'speedup', 'max diff'))
+    with torch.no_grad():
+        for num_graphs in args.num_graphs:
+            x, edges, obj_counts, edge_counts = sampleGraphs(num_graphs)
+            x, edges = x.to(device), edges.to(device)
+            time_loop, out_loop = timeit(
+                lambda: perGraphForward(model, x, edges, obj_counts, edge_counts), args.repeats, device)
+            time_batched, out_batched = timeit(
+                lambda: batchedForward(model, x, edges, obj_counts, edge_counts), args.repeats, device)
+            max_diff = (out_loop - out_batched).abs().max().item()
+            print('{:>8} {:>8} {:>14.2f} {:>14.2f} {:>8.1f}x {:>10.2e}'.format(
+                num_graphs, x.shape[0], time_loop * 1000, time_batched * 1000, time_loop / time_batched, max_diff))
@@ -0,0 +1,197 @@
+import argparse
+import os.path as osp
+import random
+import sys
+import time
+import numpy as np
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import room_scoring
+from datasets.scan3r_objpair_XTAE_SGI import PatchObjectPairXTAESGIDataSet
+
+# micro-benchmark of the patch-object association part of collate_fn
+# loop: per-patch python loops (previous implementation), vec: index arrays + broadcasting
+
+def loopObjPatchAssociationScan(self, scan_id, candidate_scans, gt_2D_anno_flat, sg_obj_idxs):
+    obj_3D_idx2info = {}
+    obj_3D_id2idx_cur_scan = {}
+    scans_sg_obj_idxs = []
+    candata_scan_obj_idxs = {}
+    all_candi_scans = [scan_id] + candidate_scans
+    reweight_matrix_scans = {candi_scan_id: None for candi_scan_id in all_candi_scans}
+    n_scenes_per_sem = None
+    cadidate_scans_semantic_ids = []
+
+    idx = 0
+    for obj_id in self.scene_graphs[scan_id]['obj_ids']:
+        obj_3D_idx2info[idx] = self.obj_3D_anno[scan_id][obj_id]
+        obj_3D_id2idx_cur_scan[obj_id] = idx
+        scans_sg_obj_idxs.append(sg_obj_idxs[scan_id][obj_id])
+        cadidate_scans_semantic_ids.append(self.obj_3D_anno[scan_id][obj_id][2])
+        candata_scan_obj_idxs.setdefault(scan_id, []).append(idx)
+        idx += 1
+    for cand_scan_id in candidate_scans:
+        for obj_id in self.scene_graphs[cand_scan_id]['obj_ids']:
+            obj_3D_idx2info[idx] = self.obj_3D_anno[cand_scan_id][obj_id]
+            scans_sg_obj_idxs.append(sg_obj_idxs[cand_scan_id][obj_id])
+            cadidate_scans_semantic_ids.append(self.obj_3D_anno[cand_scan_id][obj_id][2])
+            candata_scan_obj_idxs.setdefault(cand_scan_id, []).append(idx)
+            idx += 1
+        candata_scan_obj_idxs[cand_scan_id] = torch.Tensor(candata_scan_obj_idxs[cand_scan_id]).long()
+    candata_scan_obj_idxs[scan_id] = torch.Tensor(candata_scan_obj_idxs[scan_id]).long()
+    scans_sg_obj_idxs = torch.from_numpy(np.array(scans_sg_obj_idxs, dtype=np.int32)).long()
+    cadidate_scans_semantic_ids = torch.from_numpy(np.array(cadidate_scans_semantic_ids, dtype=np.int32)).long()
+    if self.use_tf_idf:
+        candi_sem_counts = torch.from_numpy(
+            self.scan_sem_counts[[self.scan_id2sem_row[candi_scan_id] for candi_scan_id in all_candi_scans]])
+        n_scenes_per_sem = (candi_sem_counts > 0).sum(dim=0)
+        candi_scans_obj_count = [len(self.scene_graphs[candi_scan_id]['obj_ids']) for candi_scan_id in all_candi_scans]
+        obj_scan_rows = torch.repeat_interleave(
+            torch.arange(len(all_candi_scans)), torch.tensor(candi_scans_obj_count))
+        reweight_matrix = room_scoring.tf_idf_object_weights(
+            candi_sem_counts, cadidate_scans_semantic_ids, obj_scan_rows)
+        reweight_matrix_scans = dict(zip(all_candi_scans, torch.split(reweight_matrix, candi_scans_obj_count)))
+    num_objs = idx
+    gt_patch_cates = np.zeros(self.num_patch, dtype=np.uint8)
+    e1i_matrix = np.zeros( (self.num_patch, num_objs), dtype=np.uint8)
+    e2j_matrix = np.ones( (self.num_patch, num_objs), dtype=np.uint8)
+    for patch_h_i in range(self.patch_h):
+        patch_h_shift = patch_h_i*self.patch_w
+        for patch_w_j in range(self.patch_w):
+            patch_idx = patch_h_shift + patch_w_j
+            obj_id = gt_2D_anno_flat[patch_idx]
+            if obj_id != self.undefined and (obj_id in obj_3D_id2idx_cur_scan):
+                obj_idx = obj_3D_id2idx_cur_scan[obj_id]
+                e1i_matrix[patch_idx, obj_idx] = 1
+                e2j_matrix[patch_idx, obj_idx] = 0
+                gt_patch_cates[patch_idx] = self.obj_3D_anno[scan_id][obj_id][2]
+            else:
+                gt_patch_cates[patch_idx] = self.undefined
+    e1j_matrix = np.zeros( (self.num_patch, self.num_patch), dtype=np.uint8)
+    for patch_h_i in range(self.patch_h):
+        patch_h_shift = patch_h_i*self.patch_w
+        for patch_w_j in range(self.patch_w):
+            obj_id = gt_2D_anno_flat[patch_h_shift + patch_w_j]
+            if obj_id != self.undefined and obj_id in obj_3D_id2idx_cur_scan:
+                e1j_matrix[patch_h_shift+patch_w_j, :] = np.logical_and(
+                    gt_2D_anno_flat != self.undefined, gt_2D_anno_flat != obj_id)
+            else:
+                e1j_matrix[patch_h_shift+patch_w_j, :] = 1
+    obj_cates_arr = np.array([obj_3D_idx2info[obj_idx][2] for obj_idx in range(len(obj_3D_idx2info))])
+    f1j_matrix = obj_cates_arr.reshape(1, -1) != obj_cates_arr.reshape(-1, 1)
+    return {
+        'e1i_matrix': torch.from_numpy(e1i_matrix).float(),
+        'e1j_matrix': torch.from_numpy(e1j_matrix).float(),
+        'e2j_matrix': torch.from_numpy(e2j_matrix).float(),
+        'f1j_matrix': torch.from_numpy(f1j_matrix).float(),
+        'gt_patch_cates': gt_patch_cates,
+        'scans_sg_obj_idxs': scans_sg_obj_idxs,
+        'cadidate_scans_semantic_ids': cadidate_scans_semantic_ids,
+        'candata_scan_obj_idxs': candata_scan_obj_idxs,
+        'reweight_matrix_scans': reweight_matrix_scans,
+        'n_scenes_per_sem': n_scenes_per_sem,
+    }
+
+def buildSyntheticDataset(num_scans, patch_h, patch_w, use_tf_idf, max_objs=60):
+    dataset = PatchObjectPairXTAESGIDataSet.__new__(PatchObjectPairXTAESGIDataSet)
+    dataset.undefined = 0
+    dataset.patch_h, dataset.patch_w = patch_h, patch_w
+    dataset.num_patch = patch_h * patch_w
+    dataset.use_tf_idf = use_tf_idf
+    dataset.use_sparse_assoc = False
+    dataset.all_scans_split = ['scan_{:04d}'.format(i) for i in range(num_scans)]
+    dataset.scene_graphs = {}
+    dataset.obj_3D_anno = {}
+    for scan_id in dataset.all_scans_split:
+        num_objs = random.randint(10, max_objs)
+        obj_ids = np.sort(np.random.choice(np.arange(1, 3 * max_objs), num_objs, replace=False))
+        dataset.scene_graphs[scan_id] = {'obj_ids': obj_ids, 'tot_obj_count': num_objs, 'scene_ids': [scan_id]}
+        dataset.obj_3D_anno[scan_id] = {obj_id: (scan_id, obj_id, random.randint(1, 40)) for obj_id in obj_ids}
+    dataset.buildSceneGraphIndex()
+    return dataset
+
+def sampleBatch(dataset, batch_size, num_candidates, frames_per_scan):
+    # frames of the same scan are consecutive data items, as in val
+    scans = random.sample(dataset.all_scans_split, max(batch_size // frames_per_scan, 1))
+    scans_batch = [scans[i % len(scans)] for i in range(batch_size)]
+    candidates_pool = [scan for scan in dataset.all_scans_split if scan not in scans]
+    candidate_scans = {scan_id: random.sample(candidates_pool, num_candidates) for scan_id in scans}
+    # patch annos with undefined patches and ids not in the scene graph
+    annos = []
+    for scan_id in scans_batch:
+        obj_ids = dataset.scene_graphs[scan_id]['obj_ids']
+        anno = np.random.choice(np.concatenate([obj_ids, [0, 0, 999]]), dataset.num_patch)
+        annos.append(anno.astype(np.int32))
+    scene_graph_scans = list(set(scans + [scan for scan_list in candidate_scans.values() for scan in scan_list]))
+    return scans_batch, candidate_scans, annos, scene_graph_scans
+
+def sgObjIdxs(dataset, scene_graph_scans):
+    sg_obj_idxs, sg_obj_idxs_tensor = {}, {}
+    sg_obj_idx_start = 0
+    for scan_id in scene_graph_scans:
+        obj_ids = dataset.scene_graphs[scan_id]['obj_ids']
+        objs_count = len(obj_ids)
+        sg_obj_idxs_tensor[scan_id] = torch.arange(sg_obj_idx_start, sg_obj_idx_start+objs_count).long()
+        sg_obj_idxs[scan_id] = dict(zip(obj_ids.tolist(), range(sg_obj_idx_start, sg_obj_idx_start+objs_count)))
+        sg_obj_idx_start += objs_count
+    return sg_obj_idxs, sg_obj_idxs_tensor
+
+def checkSame(assoc_loop, assoc_vec):
+    for key in ['e1i_matrix', 'e1j_matrix', 'e2j_matrix', 'f1j_matrix',
+                'scans_sg_obj_idxs', 'cadidate_scans_semantic_ids']:
+        assert torch.equal(assoc_loop[key], assoc_vec[key]), key
+    assert np.array_equal(assoc_loop['gt_patch_cates'], assoc_vec['gt_patch_cates'])
+    assert list(assoc_loop['candata_scan_obj_idxs'].keys()) == list(assoc_vec['candata_scan_obj_idxs'].keys())
+    for scan_id in assoc_loop['candata_scan_obj_idxs']:
+        assert torch.equal(assoc_loop['candata_scan_obj_idxs'][scan_id], assoc_vec['candata_scan_obj_idxs'][scan_id])
+
+def run(dataset, batch_size, num_candidates, frames_per_scan, repeats):
+    time_loop, time_vec = 0., 0.
+    for _ in range(repeats):
+        scans_batch, candidate_scans, annos, scene_graph_scans = sampleBatch(dataset, batch_size, num_candidates, frames_per_scan)
+        start = time.time()
+        sg_obj_idxs, _ = sgObjIdxs(dataset, scene_graph_scans)
+        assoc_loop = [loopObjPatchAssociationScan(dataset, scan_id, candidate_scans[scan_id], anno, sg_obj_idxs)
+                      for scan_id, anno in zip(scans_batch, annos)]
+        time_loop += time.time() - start
+        start = time.time()
+        _, sg_obj_idxs_tensor = sgObjIdxs(dataset, scene_graph_scans)
+        candi_objs_cache = {}
+        assoc_vec = [dataset.generateObjPatchAssociationScan(
+                        scan_id, candidate_scans[scan_id], anno, sg_obj_idxs_tensor, candi_objs_cache)
+                     for scan_id, anno in zip(scans_batch, annos)]
+        time_vec += time.time() - start
+        for assoc_loop_i, assoc_vec_i in zip(assoc_loop, assoc_vec):
+            checkSame(assoc_loop_i, assoc_vec_i)
+    return time_loop / repeats, time_vec / repeats
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[8, 16, 32, 64])
+    parser.add_argument('--num_candidates', type=int, nargs='+', default=[10, 50, 100, 300])
+    parser.add_argument('--patch_h', type=int, default=32)
+    parser.add_argument('--patch_w', type=int, default=18)
+    parser.add_argument('--frames_per_scan', type=int, default=4)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--use_tf_idf', action='store_true')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    random.seed(42)
+    np.random.seed(42)
+    num_scans = max(args.batch_sizes) + max(args.num_candidates) + 1
+    dataset = buildSyntheticDataset(num_scans, args.patch_h, args.patch_w, args.use_tf_idf)
+    print('{:>6} {:>6} {:>12} {:>12} {:>10} {:>10}'.format(
+        'batch', 'cands', 'loop(ms)', 'vec(ms)', 'speedup', 'samples/s'))
+    for batch_size in args.batch_sizes:
+        for num_candidates in args.num_candidates:
+            time_loop, time_vec = run(
+                dataset, batch_size, num_candidates, args.frames_per_scan, args.repeats)
+            print('{:>6} {:>6} {:>12.2f} {:>12.2f} {:>9.1f}x {:>10.1f}'.format(
+                batch_size, num_candidates, time_loop * 1000, time_vec * 1000,
+                time_loop / time_vec, batch_size / time_vec))
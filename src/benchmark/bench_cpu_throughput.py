@@ -0,0 +1,123 @@
+import argparse
+import os.path as osp
+import sys
+import time
+import torch
+import torch.nn.functional as F
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import torch_util
+from models.patch_SGIE_aligner import PatchSGIEAligner, _to_channel_first, _to_channel_last
+from models.GCVit.models import gc_vit
+
+# images/s of PatchSGIEAligner on CPU across thread counts, fp32 vs bfloat16 autocast and channels-last,
+# with the same per-image forward as RoomRetrivalScore.model_forward and randomly initialized weights
+
+def buildModel(backbone_type, sg_modules):
+    if backbone_type == 'gcvit':
+        # GCViT-T as in the cascade mask rcnn config, built directly without mmdet
+        backbone = gc_vit.GCViT(dim=64, mlp_ratio=3.0, depths=[3, 4, 19, 5], num_heads=[2, 4, 8, 16], drop_path_rate=0.)
+        backbone_dim = backbone.num_features[-1]
+    else:
+        # pre-extracted DinoV2 patch features
+        backbone, backbone_dim = None, 1536
+    return PatchSGIEAligner(backbone, num_reduce=0, backbone_dim=backbone_dim, img_transpose=True,
+                            patch_hidden_dims=[512], patch_encoder_dim=400, num_patch_gcn_layers=4,
+                            obj_embedding_dim=100*len(sg_modules), obj_embedding_hidden_dims=[512, 512],
+                            obj_encoder_dim=400, sg_modules=sg_modules, sg_rel_dim=41, attr_dim=164,
+                            img_feat_dim=1536, drop=0., use_temporal=False).eval()
+
+def sampleInputs(backbone_type, num_images, patch_h, patch_w, backbone_dim):
+    if backbone_type == 'gcvit':
+        return torch.rand(num_images, patch_h*32, patch_w*32, 3) # (B, H, W, C)
+    return torch.randn(num_images, patch_h, patch_w, backbone_dim) # (B, P_H, P_W, D)
+
+def sampleSceneGraphs(num_scans, objs_per_scan, num_points=512, edges_per_obj=3, rel_dim=41, attr_dim=164):
+    obj_counts = torch.randint(objs_per_scan // 2, objs_per_scan * 3 // 2, (num_scans,))
+    edge_counts = obj_counts * edges_per_obj
+    num_objs = int(obj_counts.sum())
+    # edges with node idxs local to each graph, as in the scene graph collate
+    edges = torch.cat([torch.randint(0, int(n_objs), (int(n_edges), 2)) for n_objs, n_edges in zip(obj_counts, edge_counts)])
+    return {'batch_size': num_scans, 'edges': edges,
+            'graph_per_obj_count': obj_counts.reshape(-1, 1).numpy(),
+            'graph_per_edge_count': edge_counts.reshape(-1, 1).numpy(),
+            'tot_obj_pts': torch.randn(num_objs, num_points, 3), 'tot_rel_pose': torch.randn(num_objs, 3),
+            'tot_bow_vec_object_edge_feats': torch.rand(num_objs, rel_dim),
+            'tot_bow_vec_object_attr_feats': torch.rand(num_objs, attr_dim)}
+
+def patchForward(model, inputs, channels_last):
+    # image by image, as in room retrieval
+    patch_features_list = []
+    for i in range(inputs.shape[0]):
+        if model.backbone is not None:
+            image = _to_channel_first(inputs[i:i+1])
+            if channels_last:
+                image = image.contiguous(memory_format=torch.channels_last)
+            features = _to_channel_last(model.backbone(image)[-1])
+        else:
+            features = inputs[i:i+1]
+        patch_features = model.patch_encoder(model.reduce_layers(features))
+        patch_features = _to_channel_last(model.patch_gcn(_to_channel_first(patch_features)))
+        patch_features_list.append(patch_features.float().flatten(1, 2))
+    return torch.cat(patch_features_list)
+
+def sceneGraphForward(model, scene_graphs):
+    obj_3D_embeddings = model.obj_embedding_encoder(model.forward_scene_graph({'scene_graphs': scene_graphs}))
+    return F.normalize(obj_3D_embeddings.float(), dim=-1)
+
+def timeit(func, repeats):
+    out = func()
+    start = time.time()
+    for _ in range(repeats):
+        func()
+    return (time.time() - start) / repeats, out
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backbone', type=str, default='feature', choices=['feature', 'gcvit'],
+                        help='pre-extracted patch features or the GCViT backbone on images')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--num_interop_threads', type=int, default=0)
+    parser.add_argument('--num_images', type=int, default=8)
+    parser.add_argument('--patch_h', type=int, default=16)
+    parser.add_argument('--patch_w', type=int, default=9)
+    parser.add_argument('--num_scans', type=int, default=10)
+    parser.add_argument('--objs_per_scan', type=int, default=40)
+    parser.add_argument('--repeats', type=int, default=3)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    torch.manual_seed(42)
+    device = torch.device('cpu')
+    torch_util.set_cpu_threads(num_interop_threads=args.num_interop_threads)
+    model = buildModel(args.backbone, ['point', 'gat', 'rel', 'attr'])
+    backbone_dim = model.backbone.num_features[-1] if model.backbone is not None else 1536
+    inputs = sampleInputs(args.backbone, args.num_images, args.patch_h, args.patch_w, backbone_dim)
+    scene_graphs = sampleSceneGraphs(args.num_scans, args.objs_per_scan)
+    num_objs = scene_graphs['tot_obj_pts'].shape[0]
+
+    # channels-last only changes the convolutions of the backbone
+    modes = [('fp32', False, False), ('bf16', True, False)]
+    if model.backbone is not None:
+        modes += [('fp32-cl', False, True), ('bf16-cl', True, True)]
+    print('{:>8} {:>8} {:>10} {:>10} {:>12} {:>12}'.format(
+        'threads', 'mode', 'images/s', 'objs/s', 'patch diff', 'obj diff'))
+    with torch.no_grad():
+        for num_threads in args.threads:
+            torch_util.set_cpu_threads(num_threads)
+            ref_patch, ref_obj = None, None
+            for mode, autocast_bf16, channels_last in modes:
+                if model.backbone is not None:
+                    model.backbone.to(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+                with torch_util.autocast(device, autocast_bf16):
+                    time_patch, out_patch = timeit(lambda: patchForward(model, inputs, channels_last), args.repeats)
+                    time_sg, out_obj = timeit(lambda: sceneGraphForward(model, scene_graphs), args.repeats)
+                if ref_patch is None:
+                    ref_patch, ref_obj = out_patch, out_obj
+                print('{:>8} {:>8} {:>10.1f} {:>10.0f} {:>12.2e} {:>12.2e}'.format(
+                    num_threads, mode, args.num_images / time_patch, num_objs / time_sg,
+                    (out_patch - ref_patch).abs().max().item(), (out_obj - ref_obj).abs().max().item()))
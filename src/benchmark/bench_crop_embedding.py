@@ -0,0 +1,125 @@
+import argparse
+import os
+import os.path as osp
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils.crop_embedding import CropEmbedder
+
+# (obj, frame) pairs/s of the multi-level crop embedding of the object visual features, one frame
+# decode and one extractor call per pair vs frame-grouped decoding and batched crops, with a small
+# CPU stand-in extractor on synthetic frames and object-id maps
+
+MEAN = torch.tensor([0.485, 0.456, 0.406]).reshape(3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).reshape(3, 1, 1)
+
+class StandInExtractor(nn.Module):
+    # patchify + MLP + mean pooling, (B, 3, 224, 224) -> (B, D)
+    def __init__(self, dim=128):
+        super().__init__()
+        self.patch_embed = nn.Conv2d(3, dim, kernel_size=14, stride=14)
+        self.mlp = nn.Sequential(nn.Linear(dim, dim * 2), nn.GELU(), nn.Linear(dim * 2, dim))
+
+    def forward(self, x):
+        x = self.patch_embed(x).flatten(2).transpose(1, 2)
+        return (x + self.mlp(x)).mean(dim=1)
+
+def sampleScan(out_dir, num_frames, objs_per_frame, width=960, height=540):
+    # frames of random boxes, every box an object with its own id in the object-id map
+    image_paths, obj_annos = {}, {}
+    for frame_i in range(num_frames):
+        frame_idx = '{:06d}'.format(frame_i)
+        # smooth regions with sensor-like noise, decoding about as slow as a 3RScan frame
+        image = np.random.randint(0, 255, (height // 8, width // 8, 3)).repeat(8, 0).repeat(8, 1)
+        image = np.clip(image + np.random.normal(0, 12, image.shape), 0, 255).astype(np.uint8)
+        obj_anno = np.zeros((height, width), dtype=np.int32)
+        for obj_id in np.random.choice(np.arange(1, objs_per_frame * 3), objs_per_frame, replace=False):
+            h, w = np.random.randint(40, height // 2), np.random.randint(40, width // 2)
+            y, x = np.random.randint(0, height - h), np.random.randint(0, width - w)
+            obj_anno[y:y + h, x:x + w] = obj_id
+        image_paths[frame_idx] = osp.join(out_dir, 'frame-{}.color.jpg'.format(frame_idx))
+        Image.fromarray(image).save(image_paths[frame_idx], quality=90)
+        obj_annos[frame_idx] = obj_anno
+    return image_paths, obj_annos
+
+def topKFrames(obj_annos, topk):
+    obj_image_votes = {}
+    for frame_idx, obj_anno in obj_annos.items():
+        obj_ids, counts = np.unique(obj_anno, return_counts=True)
+        for obj_id, count in zip(obj_ids, counts):
+            if obj_id != 0:
+                obj_image_votes.setdefault(obj_id, {})[frame_idx] = count
+    return {obj_id: sorted(votes, key=votes.get, reverse=True)[:topk] for obj_id, votes in obj_image_votes.items()}
+
+def multiLevelCrops(image, obj_mask, num_levels=3, expansion_ratio=0.2):
+    # the multi-level crops of the Dinov2 object visual embeddings
+    cols, rows = np.nonzero(obj_mask.any(axis=0))[0], np.nonzero(obj_mask.any(axis=1))[0]
+    x1, x2, y1, y2 = cols.min(), cols.max() + 1, rows.min(), rows.max() + 1
+    crops = []
+    for level in range(num_levels):
+        x_exp, y_exp = int((x2 - x1) * expansion_ratio) * level, int((y2 - y1) * expansion_ratio) * level
+        box = (max(0, x1 - x_exp), max(0, y1 - y_exp), min(obj_mask.shape[1], x2 + x_exp), min(obj_mask.shape[0], y2 + y_exp))
+        crop = image.crop(box).resize((224, 224), Image.BICUBIC)
+        crop = torch.from_numpy(np.array(crop)).permute(2, 0, 1).float() / 255.
+        crops.append((crop - MEAN) / STD)
+    return crops
+
+def loadFrame(image_paths, obj_annos, frame_idx):
+    image = Image.open(image_paths[frame_idx]).convert('RGB')
+    return image, obj_annos[frame_idx]
+
+def perPairEmbed(extractor, image_paths, obj_annos, obj_frames):
+    # the previous generator, one decode and one extractor call per (obj, frame)
+    obj_visual_emb = {}
+    for obj_id, frame_idxs in obj_frames.items():
+        obj_visual_emb[obj_id] = {}
+        for frame_idx in frame_idxs:
+            image, obj_anno = loadFrame(image_paths, obj_annos, frame_idx)
+            with torch.no_grad():
+                embs = extractor(torch.stack(multiLevelCrops(image, obj_anno == obj_id)))
+            obj_visual_emb[obj_id][frame_idx] = embs.mean(dim=0).numpy()
+    return obj_visual_emb
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_frames', type=int, default=60)
+    parser.add_argument('--objs_per_frame', type=int, default=6)
+    parser.add_argument('--topk', type=int, default=10)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[32, 96])
+    parser.add_argument('--num_threads', type=int, default=4)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    torch.manual_seed(42)
+    extractor = StandInExtractor().eval()
+    with tempfile.TemporaryDirectory() as out_dir:
+        image_paths, obj_annos = sampleScan(out_dir, args.num_frames, args.objs_per_frame)
+        obj_frames = topKFrames(obj_annos, args.topk)
+        num_pairs = sum(len(frame_idxs) for frame_idxs in obj_frames.values())
+        print('{} frames, {} objects, {} (obj, frame) pairs'.format(len(image_paths), len(obj_frames), num_pairs))
+
+        start_time = time.time()
+        ref_emb = perPairEmbed(extractor, image_paths, obj_annos, obj_frames)
+        time_ref = time.time() - start_time
+        print('{:>16} {:>10} {:>9} {:>12}'.format('mode', 'pairs/s', 'speedup', 'max diff'))
+        print('{:>16} {:>10.1f} {:>8.1f}x {:>12}'.format('per pair', num_pairs / time_ref, 1., '-'))
+        for batch_size in args.batch_sizes:
+            crop_embedder = CropEmbedder(extractor, multiLevelCrops, batch_size=batch_size, num_threads=args.num_threads)
+            start_time = time.time()
+            obj_emb = crop_embedder.embedScan(lambda frame_idx: loadFrame(image_paths, obj_annos, frame_idx), obj_frames)
+            time_batched = time.time() - start_time
+            max_diff = max(np.abs(obj_emb[obj_id][frame_idx] - ref_emb[obj_id][frame_idx]).max()
+                           for obj_id in obj_frames for frame_idx in obj_frames[obj_id])
+            print('{:>16} {:>10.1f} {:>8.1f}x {:>12.2e}'.format('batch {}'.format(batch_size),
+                                                              num_pairs / time_batched, time_ref / time_batched, max_diff))
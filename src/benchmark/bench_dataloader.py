@@ -0,0 +1,87 @@
+import argparse
+import os.path as osp
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import common, torch_util
+from utils.timer import Timer
+
+# epoch boundaries of build_dataloader with fresh vs persistent workers: wait for the first batch of
+# each epoch and the data wait vs compute split of the Timer of the trainer, on a synthetic dataset
+# whose workers load scene graph data lazily, as the datasets do with the stores they open per worker.
+# The data/compute split is the one of the last epoch.
+
+class LazySceneGraphDataset(torch.utils.data.Dataset):
+    def __init__(self, sg_file, num_samples, sample_dim):
+        self.sg_file = sg_file
+        self.num_samples = num_samples
+        self.sample_dim = sample_dim
+        self.scene_graphs = None
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        # loaded on first access in each worker process
+        if self.scene_graphs is None:
+            self.scene_graphs = common.load_pkl_data(self.sg_file)
+        scene_graph = self.scene_graphs[idx % len(self.scene_graphs)]
+        return torch.from_numpy(scene_graph['obj_pts'][:, :self.sample_dim].mean(axis=0))
+
+def writeSceneGraphs(sg_file, num_scans, objs_per_scan, num_points):
+    rng = np.random.RandomState(0)
+    scene_graphs = [{'obj_pts': rng.randn(objs_per_scan * num_points, 3).astype(np.float32),
+                     'obj_ids': np.arange(objs_per_scan)} for _ in range(num_scans)]
+    common.write_pkl_data(scene_graphs, sg_file)
+
+def runEpochs(data_loader, num_epochs, compute_time):
+    first_batch_waits, timer = [], Timer()
+    for epoch in range(num_epochs):
+        timer.reset()
+        for iteration, batch in enumerate(data_loader):
+            timer.add_data_time()
+            if iteration == 0:
+                first_batch_waits.append(timer.total_data_time)
+            timer.add_prepare_time()
+            # stand-in for the train step
+            time.sleep(compute_time)
+            timer.add_process_time()
+    return first_batch_waits, timer
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_workers', type=int, default=2)
+    parser.add_argument('--num_epochs', type=int, default=3)
+    parser.add_argument('--num_samples', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_scans', type=int, default=1000)
+    parser.add_argument('--objs_per_scan', type=int, default=40)
+    parser.add_argument('--num_points', type=int, default=512)
+    parser.add_argument('--compute_time', type=float, default=0.02, help='seconds per train step')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sg_file = osp.join(tmp_dir, 'scene_graphs.pkl')
+        writeSceneGraphs(sg_file, args.num_scans, args.objs_per_scan, args.num_points)
+        dataset = LazySceneGraphDataset(sg_file, args.num_samples, 3)
+        modes = [('fresh workers', False, 2), ('persistent', True, 2), ('persistent, prefetch 4', True, 4)]
+        print('{} workers, {} epochs of {} batches'.format(args.num_workers, args.num_epochs, args.num_samples // args.batch_size))
+        print('{:>24} {:>26} {:>10} {:>10} {:>8}'.format('mode', 'first batch wait/epoch s', 'data s/it', 'comp s/it', 'data %'))
+        for mode, persistent_workers, prefetch_factor in modes:
+            data_loader = torch_util.build_dataloader(dataset, batch_size=args.batch_size, num_workers=args.num_workers,
+                                                      shuffle=True, persistent_workers=persistent_workers,
+                                                      prefetch_factor=prefetch_factor)
+            first_batch_waits, timer = runEpochs(data_loader, args.num_epochs, args.compute_time)
+            print('{:>24} {:>26} {:>10.3f} {:>10.3f} {:>7.0%}'.format(
+                mode, ' '.join('{:.2f}'.format(wait) for wait in first_batch_waits),
+                timer.get_data_time(), timer.get_process_time(), timer.get_data_ratio()))
+            del data_loader
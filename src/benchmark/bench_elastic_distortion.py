@@ -0,0 +1,103 @@
+import argparse
+import os.path as osp
+import random
+import sys
+import time
+import numpy as np
+import scipy.ndimage
+import scipy.interpolate
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils.elastic_distortion import ElasticDistortion, elastic_distortion, smooth_noise, noise_dims
+
+# ms per collated batch of the elastic distortion of the object points, the scipy version on the
+# union of the scenes of the batch as collateBatchDicts did vs the torch version per scene, with
+# fresh and pooled noise, on synthetic scene graphs
+
+def scipyElasticDistortion(coords, granularity, magnitude, noise=None):
+    # ElasticDistortion.elastic_distortion of the datasets before, noise given for the comparison
+    coords = coords.numpy()
+    blurx = np.ones((3, 1, 1, 1)).astype("float32") / 3
+    blury = np.ones((1, 3, 1, 1)).astype("float32") / 3
+    blurz = np.ones((1, 1, 3, 1)).astype("float32") / 3
+    coords_min = coords.min(0)
+    noise_dim = ((coords - coords_min).max(0) // granularity).astype(int) + 3
+    noise = np.random.randn(*noise_dim, 3).astype(np.float32) if noise is None else noise
+    for _ in range(2):
+        noise = scipy.ndimage.convolve(noise, blurx, mode="constant", cval=0)
+        noise = scipy.ndimage.convolve(noise, blury, mode="constant", cval=0)
+        noise = scipy.ndimage.convolve(noise, blurz, mode="constant", cval=0)
+    ax = [np.linspace(d_min, d_max, d)
+          for d_min, d_max, d in zip(coords_min - granularity, coords_min + granularity * (noise_dim - 2), noise_dim)]
+    interp = scipy.interpolate.RegularGridInterpolator(ax, noise, bounds_error=0, fill_value=0)
+    coords = coords + interp(coords) * magnitude
+    return torch.tensor(coords).float()
+
+def sampleBatch(num_scenes, objs_per_scene, num_points):
+    # object points of scenes of a few meters, each scene graph in its own frame as 3RScan scans
+    scenes = []
+    for _ in range(num_scenes):
+        extent = np.random.uniform([3., 3., 2.], [8., 7., 3.])
+        centers = np.random.uniform(0, extent, (objs_per_scene, 3)) + np.random.uniform(-20, 20, 3)
+        sizes = np.random.uniform(0.1, 1.0, (objs_per_scene, 1, 3))
+        scenes.append(torch.from_numpy(centers[:, None] + np.random.uniform(-0.5, 0.5, (objs_per_scene, num_points, 3)) * sizes).float())
+    return torch.cat(scenes), [objs_per_scene * num_points] * num_scenes
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scenes', type=int, default=8, help='scene graphs of a collated batch')
+    parser.add_argument('--objs_per_scene', type=int, default=30)
+    parser.add_argument('--num_points', type=int, default=512)
+    parser.add_argument('--granularity', type=float, nargs='+', default=[0.2, 0.8])
+    parser.add_argument('--magnitude', type=float, nargs='+', default=[0.4, 1.6])
+    parser.add_argument('--noise_pool_size', type=int, default=8)
+    parser.add_argument('--num_batches', type=int, default=10)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    torch.manual_seed(42)
+    random.seed(42)
+    obj_pts, scene_counts = sampleBatch(args.num_scenes, args.objs_per_scene, args.num_points)
+    pcs_flatten = obj_pts.reshape(-1, 3)
+    print('{} scenes, {} points'.format(args.num_scenes, pcs_flatten.shape[0]))
+
+    # same noise, same distortion
+    max_diff = 0.
+    for granularity, magnitude in zip(args.granularity, args.magnitude):
+        _, dims = noise_dims(pcs_flatten, granularity)
+        noise = np.random.randn(*dims.tolist(), 3).astype(np.float32)
+        ref = scipyElasticDistortion(pcs_flatten, granularity, magnitude, noise)
+        distorted = elastic_distortion(pcs_flatten, granularity, magnitude, smooth_noise(torch.from_numpy(noise)))
+        max_diff = max(max_diff, float((distorted - ref).abs().max()))
+    print('torch vs scipy on the same noise: max diff {:.2e} m'.format(max_diff))
+
+    def scipyUnion(pcs_pos):
+        # ElasticDistortion.__call__ of the datasets before
+        if random.random() < 0.95:
+            for granularity, magnitude in zip(args.granularity, args.magnitude):
+                pcs_pos = scipyElasticDistortion(pcs_pos, granularity, magnitude)
+        return pcs_pos
+
+    per_scene = ElasticDistortion(True, args.granularity, args.magnitude)
+    pooled = ElasticDistortion(True, args.granularity, args.magnitude, noise_pool_size=args.noise_pool_size,
+                               noise_pool_extent=10.)
+    pooled.noisePool(0)
+    modes = [('scipy, union', scipyUnion),
+             ('torch, union', ElasticDistortion(True, args.granularity, args.magnitude)),
+             ('torch, per scene', lambda pcs_pos: per_scene(pcs_pos, scene_counts)),
+             ('torch, pooled', lambda pcs_pos: pooled(pcs_pos, scene_counts))]
+    print('{:>18} {:>12} {:>9}'.format('mode', 'ms/batch', 'speedup'))
+    time_ref = None
+    for mode, distort in modes:
+        start_time = time.time()
+        for _ in range(args.num_batches):
+            distort(pcs_flatten)
+        time_mode = (time.time() - start_time) / args.num_batches
+        time_ref = time_mode if time_ref is None else time_ref
+        print('{:>18} {:>12.1f} {:>8.1f}x'.format(mode, 1e3 * time_mode, time_ref / time_mode))
@@ -0,0 +1,145 @@
+import argparse
+import os.path as osp
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torchvision import transforms as tvf
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import common
+from utils.feature_extraction import FeatureExtractor
+
+# frames/s of the 2D feature generators, synchronous decoding and per-scan batches as the previous
+# generators vs the FeatureExtractor with DataLoader decoding and cross-scan batches, with a small
+# CPU stand-in backbone on synthetic scans, then resume and sharding of the extraction
+
+class StandInBackbone(nn.Module):
+    # patchify + MLP, (B, 3, H, W) -> (B, H/14 * W/14, D) patch features
+    def __init__(self, dim=128):
+        super().__init__()
+        self.patch_embed = nn.Conv2d(3, dim, kernel_size=14, stride=14)
+        self.mlp = nn.Sequential(nn.Linear(dim, dim * 2), nn.GELU(), nn.Linear(dim * 2, dim))
+
+    def forward(self, x):
+        x = self.patch_embed(x).flatten(2).transpose(1, 2)
+        return x + self.mlp(x)
+
+class StandInAdapter():
+    # the DinoV2 generator preprocessing with the stand-in backbone
+    def __init__(self, backbone, resize_w=224, resize_h=126):
+        self.backbone = backbone
+        self.resize_w = resize_w
+        self.resize_h = resize_h
+        self.base_tf = tvf.Compose([tvf.ToTensor(), tvf.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
+
+    def loadImage(self, img_path):
+        img = Image.open(img_path).convert('RGB').resize((self.resize_w, self.resize_h), Image.BICUBIC)
+        return self.base_tf(img.transpose(Image.ROTATE_270))
+
+    def extractBatch(self, imgs_tensor):
+        return self.backbone(imgs_tensor).numpy()
+
+def sampleScans(out_dir, num_scans, frames_per_scan, width=960, height=540):
+    image_paths = {}
+    for scan_i in range(num_scans):
+        scan_id = 'scan_{:03d}'.format(scan_i)
+        common.ensure_dir(osp.join(out_dir, scan_id))
+        # some scans have a few frames only, as 3RScan rescans
+        num_frames = np.random.randint(frames_per_scan // 4, frames_per_scan + 1)
+        image_paths[scan_id] = {}
+        for frame_i in range(num_frames):
+            frame_idx = '{:06d}'.format(frame_i)
+            # smooth regions with sensor-like noise, decoding about as slow as a 3RScan frame
+            image = np.random.randint(0, 255, (height // 8, width // 8, 3)).repeat(8, 0).repeat(8, 1)
+            image = np.clip(image + np.random.normal(0, 12, image.shape), 0, 255).astype(np.uint8)
+            image_paths[scan_id][frame_idx] = osp.join(out_dir, scan_id, 'frame-{}.color.jpg'.format(frame_idx))
+            Image.fromarray(image).save(image_paths[scan_id][frame_idx], quality=90)
+    return image_paths
+
+def perScanExtract(adapter, image_paths, out_dir, batch_size):
+    # the previous generators, images of a scan decoded in the main thread and batched within the scan
+    for scan_id, img_paths in image_paths.items():
+        frame_idxs = sorted(img_paths.keys())
+        imgs_features = {}
+        for start in range(0, len(frame_idxs), batch_size):
+            frame_idxs_sublist = frame_idxs[start:start + batch_size]
+            imgs_tensor = torch.stack([adapter.loadImage(img_paths[frame_idx]) for frame_idx in frame_idxs_sublist])
+            with torch.no_grad():
+                features = adapter.extractBatch(imgs_tensor)
+            for frame_idx, feature in zip(frame_idxs_sublist, features):
+                imgs_features[frame_idx] = feature
+        common.write_pkl_data(imgs_features, osp.join(out_dir, '{}.pkl'.format(scan_id)))
+
+def maxDiff(image_paths, ref_dir, out_dir):
+    max_diff = 0.
+    for scan_id in image_paths:
+        ref_features = common.load_pkl_data(osp.join(ref_dir, '{}.pkl'.format(scan_id)))
+        features = common.load_pkl_data(osp.join(out_dir, '{}.pkl'.format(scan_id)))
+        assert sorted(features.keys()) == sorted(ref_features.keys())
+        for frame_idx in ref_features:
+            max_diff = max(max_diff, float(np.abs(features[frame_idx] - ref_features[frame_idx]).max()))
+    return max_diff
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scans', type=int, default=12)
+    parser.add_argument('--frames_per_scan', type=int, default=24)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--num_workers', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--num_shards', type=int, default=3)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    torch.manual_seed(42)
+    adapter = StandInAdapter(StandInBackbone().eval())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = sampleScans(osp.join(tmp_dir, 'scenes'), args.num_scans, args.frames_per_scan)
+        num_frames = sum(len(img_paths) for img_paths in image_paths.values())
+        print('{} scans, {} frames'.format(len(image_paths), num_frames))
+
+        ref_dir = osp.join(tmp_dir, 'ref')
+        common.ensure_dir(ref_dir)
+        start_time = time.time()
+        perScanExtract(adapter, image_paths, ref_dir, args.batch_size)
+        time_ref = time.time() - start_time
+        print('{:>16} {:>10} {:>9} {:>12}'.format('mode', 'frames/s', 'speedup', 'max diff'))
+        print('{:>16} {:>10.1f} {:>8.1f}x {:>12}'.format('per scan', num_frames / time_ref, 1., '-'))
+        for num_workers in args.num_workers:
+            out_dir = osp.join(tmp_dir, 'workers_{}'.format(num_workers))
+            feature_extractor = FeatureExtractor(adapter, out_dir, 'bench', 'stand-in', batch_size=args.batch_size,
+                                                 num_workers=num_workers)
+            start_time = time.time()
+            feature_extractor.run(image_paths)
+            time_extract = time.time() - start_time
+            print('{:>16} {:>10.1f} {:>8.1f}x {:>12.2e}'.format('{} workers'.format(num_workers), num_frames / time_extract,
+                                                              time_ref / time_extract, maxDiff(image_paths, ref_dir, out_dir)))
+            print(feature_extractor.timingString())
+
+        # resume after a crash, the scans of the manifest are not extracted again
+        out_dir = osp.join(tmp_dir, 'resume')
+        FeatureExtractor(adapter, out_dir, 'bench', 'stand-in', batch_size=args.batch_size, num_workers=0).run(
+            {scan_id: image_paths[scan_id] for scan_id in list(image_paths)[:len(image_paths) // 2]})
+        todo_scan_ids = FeatureExtractor(adapter, out_dir, 'bench', 'stand-in', batch_size=args.batch_size,
+                                         num_workers=0).run(image_paths)
+        assert len(todo_scan_ids) == len(image_paths) - len(image_paths) // 2
+        print('resume: {} of {} scans extracted again, max diff {:.2e}'.format(
+            len(todo_scan_ids), len(image_paths), maxDiff(image_paths, ref_dir, out_dir)))
+
+        # shards of several processes/nodes cover every scan once
+        out_dir = osp.join(tmp_dir, 'shards')
+        shard_scan_ids = []
+        for shard_id in range(args.num_shards):
+            shard_scan_ids += FeatureExtractor(adapter, out_dir, 'bench', 'stand-in', batch_size=args.batch_size,
+                                               num_workers=0, shard_id=shard_id, num_shards=args.num_shards).run(image_paths)
+        assert sorted(shard_scan_ids) == sorted(image_paths.keys())
+        print('{} shards: every scan extracted once, max diff {:.2e}'.format(
+            args.num_shards, maxDiff(image_paths, ref_dir, out_dir)))
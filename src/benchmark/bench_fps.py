@@ -0,0 +1,98 @@
+import argparse
+import os
+import os.path as osp
+import sys
+import time
+import numpy as np
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import point_cloud
+
+# per-object chained FPS of every resolution vs one batched FPS run of all objects of a scan,
+# on object point clouds of 3RScan scans (scenes/<scan_id>/data.npy) or synthetic ones of similar sizes
+
+def loadScanObjects(data_dir, num_scans, min_obj_points):
+    scans_dir = osp.join(data_dir, 'scenes')
+    scan_ids = sorted(scan_id for scan_id in os.listdir(scans_dir) if osp.isfile(osp.join(scans_dir, scan_id, 'data.npy')))
+    scans_objects = []
+    for scan_id in scan_ids[:num_scans]:
+        ply_data = np.load(osp.join(scans_dir, scan_id, 'data.npy'))
+        points = np.stack([ply_data['x'], ply_data['y'], ply_data['z']]).transpose((1, 0))
+        object_ids, counts = np.unique(ply_data['objectId'], return_counts=True)
+        scans_objects.append([points[ply_data['objectId'] == object_id]
+                              for object_id, count in zip(object_ids, counts) if object_id != 0 and count >= min_obj_points])
+    return scans_objects
+
+def sampleScanObjects(num_scans, objs_per_scan, min_obj_points):
+    # log-normal object sizes, a few thousand points for most objects and walls/floors of 10^4-10^5
+    scans_objects = []
+    for _ in range(num_scans):
+        counts = np.clip(np.random.lognormal(np.log(2500), 1.2, objs_per_scan), min_obj_points, 150000).astype(int)
+        scans_objects.append([np.random.rand(count, 3).astype(np.float32) * np.random.uniform(0.2, 3.0) for count in counts])
+    return scans_objects
+
+def chainedSample(objects, pc_resolutions):
+    # previous preprocessing, every resolution sampled from the one above
+    object_points = {pc_resolution: [] for pc_resolution in pc_resolutions}
+    for obj_pcl in objects:
+        for pc_resolution in pc_resolutions:
+            obj_pcl = point_cloud.pcl_farthest_sample(obj_pcl, pc_resolution)
+            object_points[pc_resolution].append(obj_pcl)
+    return object_points
+
+def checkFPSOrder(objects, npoint):
+    # batched FPS order matches the single-cloud one from the same start points
+    start_idxs = np.random.randint(0, [obj_pcl.shape[0] for obj_pcl in objects])
+    fps_idxs = point_cloud.farthest_point_sample_batch(objects, npoint, start_idxs)
+    randint = np.random.randint
+    try:
+        for obj_pcl, start_idx, idxs in zip(objects, start_idxs, fps_idxs):
+            if obj_pcl.shape[0] < npoint:
+                continue
+            np.random.randint = lambda low, high: start_idx
+            _, ref_idxs = point_cloud.pcl_farthest_sample(obj_pcl, npoint, return_idxs=True)
+            if not np.array_equal(ref_idxs, idxs):
+                return False
+    finally:
+        np.random.randint = randint
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, default='', help='3RScan root, synthetic objects if empty')
+    parser.add_argument('--num_scans', type=int, default=5)
+    parser.add_argument('--objs_per_scan', type=int, default=40)
+    parser.add_argument('--min_obj_points', type=int, default=50)
+    parser.add_argument('--pc_resolutions', type=int, nargs='+', default=[512, 256, 128, 64])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    pc_resolutions = sorted(args.pc_resolutions, reverse=True)
+    if args.data_dir:
+        scans_objects = loadScanObjects(args.data_dir, args.num_scans, args.min_obj_points)
+    else:
+        scans_objects = sampleScanObjects(args.num_scans, args.objs_per_scan, args.min_obj_points)
+    counts = np.concatenate([[obj_pcl.shape[0] for obj_pcl in objects] for objects in scans_objects])
+    print('{} scans, {} objects, points per object: median {}, max {}'.format(
+        len(scans_objects), counts.shape[0], int(np.median(counts)), counts.max()))
+    print('FPS order matches single-cloud FPS: {}'.format(checkFPSOrder(scans_objects[0], pc_resolutions[0])))
+
+    start_time = time.time()
+    for objects in scans_objects:
+        chainedSample(objects, pc_resolutions)
+    time_chained = (time.time() - start_time) / len(scans_objects)
+    print('{:>8} {:>16} {:>16} {:>9}'.format('threads', 'chained(s/scan)', 'batched(s/scan)', 'speedup'))
+    for num_threads in args.threads:
+        torch.set_num_threads(num_threads)
+        start_time = time.time()
+        for objects in scans_objects:
+            point_cloud.pcl_farthest_sample_multires(objects, pc_resolutions)
+        time_batched = (time.time() - start_time) / len(scans_objects)
+        print('{:>8} {:>16.3f} {:>16.3f} {:>8.1f}x'.format(num_threads, time_chained, time_batched, time_chained / time_batched))
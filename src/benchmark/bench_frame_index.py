@@ -0,0 +1,98 @@
+import argparse
+import os.path as osp
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from scipy.spatial.transform import Rotation as R
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import common, scan3r, frame_index
+
+# scans/s of the frame metadata reads of dataset construction (frame paths, quat+trans poses of
+# all frames, depth intrinsics), from the sequence folders vs from files/frame_index.npz, on a
+# synthetic 3RScan tree
+
+INFO = '''m_versionNumber = 4
+m_colorWidth = 960
+m_colorHeight = 540
+m_depthWidth = 224
+m_depthHeight = 172
+m_calibrationColorIntrinsic = 756.8 0 492.9 0 0 756.8 270.4 0 0 0 1 0 0 0 0 1
+m_calibrationDepthIntrinsic = 177.1 0 112.5 0 0 240.0 86.3 0 0 0 1 0 0 0 0 1
+'''
+
+def sampleTree(data_dir, num_scans, frames_per_scan):
+    scan_ids = ['scan_{:03d}'.format(scan_i) for scan_i in range(num_scans)]
+    for scan_id in scan_ids:
+        sequence_dir = osp.join(data_dir, 'scenes', scan_id, 'sequence')
+        common.ensure_dir(sequence_dir)
+        with open(osp.join(sequence_dir, '_info.txt'), 'w') as f:
+            f.write(INFO)
+        for frame_i in range(np.random.randint(frames_per_scan // 2, frames_per_scan + 1)):
+            open(osp.join(sequence_dir, 'frame-{:06d}.color.jpg'.format(frame_i)), 'w').close()
+            pose = np.eye(4)
+            pose[:3, :3] = R.random().as_matrix()
+            pose[:3, 3] = np.random.uniform(-5, 5, 3)
+            np.savetxt(osp.join(sequence_dir, 'frame-{:06d}.pose.txt'.format(frame_i)), pose, fmt='%f')
+    common.ensure_dir(osp.join(data_dir, 'files'))
+    common.write_json([{'reference': scan_id, 'scans': []} for scan_id in scan_ids], osp.join(data_dir, 'files', '3RScan.json'))
+    return scan_ids
+
+def loadMetadata(data_dir, scan_ids, step):
+    # the frame metadata reads of Scan3RSceneGraphDataset and Scan3rLidarClipDataset
+    scans_scenes_dir = osp.join(data_dir, 'scenes')
+    metadata = {}
+    for scan_id in scan_ids:
+        image_paths = scan3r.load_frame_paths(data_dir, scan_id, step)
+        frame_idxs = scan3r.load_frame_idxs(scans_scenes_dir, scan_id)
+        image_poses = scan3r.load_frame_poses(scans_scenes_dir, scan_id, frame_idxs, type='quat_trans')
+        intrinsics = scan3r.load_intrinsics(scans_scenes_dir, scan_id, type='depth')
+        metadata[scan_id] = (image_paths, image_poses, intrinsics)
+    return metadata
+
+def sameMetadata(metadata, ref_metadata):
+    for scan_id, (image_paths, image_poses, intrinsics) in ref_metadata.items():
+        assert metadata[scan_id][0] == image_paths
+        assert list(metadata[scan_id][1].keys()) == list(image_poses.keys())
+        assert all(np.array_equal(metadata[scan_id][1][frame_idx], pose) for frame_idx, pose in image_poses.items())
+        assert metadata[scan_id][2]['width'] == intrinsics['width'] and metadata[scan_id][2]['height'] == intrinsics['height']
+        assert np.array_equal(metadata[scan_id][2]['intrinsic_mat'], intrinsics['intrinsic_mat'])
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scans', type=int, default=40)
+    parser.add_argument('--frames_per_scan', type=int, default=200)
+    parser.add_argument('--step', type=int, default=1)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    with tempfile.TemporaryDirectory() as data_dir:
+        scan_ids = sampleTree(data_dir, args.num_scans, args.frames_per_scan)
+        start_time = time.time()
+        ref_metadata = loadMetadata(data_dir, scan_ids, args.step)
+        time_ref = time.time() - start_time
+        num_frames = sum(len(metadata[1]) for metadata in ref_metadata.values())
+        print('{} scans, {} frames'.format(len(scan_ids), num_frames))
+
+        start_time = time.time()
+        subprocess.run([sys.executable, osp.join(ws_dir, 'preprocessing', 'scan3r', 'build_frame_index.py'),
+                        '--data_dir', data_dir], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time_build = time.time() - start_time
+        # a new process, the index is loaded on the first read
+        frame_index._frame_indexes.clear()
+        start_time = time.time()
+        metadata = loadMetadata(data_dir, scan_ids, args.step)
+        time_index = time.time() - start_time
+        sameMetadata(metadata, ref_metadata)
+        print('{:>16} {:>10} {:>9}'.format('mode', 'scans/s', 'speedup'))
+        print('{:>16} {:>10.1f} {:>8.1f}x'.format('sequence files', len(scan_ids) / time_ref, 1.))
+        print('{:>16} {:>10.1f} {:>8.1f}x   same metadata, index built once in {:.1f}s'.format(
+            'frame index', len(scan_ids) / time_index, time_ref / time_index, time_build))
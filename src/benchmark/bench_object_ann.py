@@ -0,0 +1,116 @@
+import argparse
+import os.path as osp
+import sys
+import time
+import torch
+import torch.nn.functional as F
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import room_scoring
+from utils.object_index import IVFPQIndex, scan_votes, shortlist_scans
+
+# recall vs latency of room retrieval with the approximate object index against exhaustive scoring
+# synthetic rooms: objects are noisy copies of category prototypes,
+# query patches are noisy copies of objects of the target room plus background patches
+
+def buildSyntheticRooms(num_scans, objs_per_scan, dim, num_classes=40, obj_noise=0.6):
+    prototypes = F.normalize(torch.randn(num_classes, dim), dim=-1)
+    obj_counts = torch.randint(objs_per_scan // 2, objs_per_scan * 3 // 2, (num_scans,))
+    num_objs = int(obj_counts.sum())
+    obj_cates = torch.randint(0, num_classes, (num_objs,))
+    obj_embeddings = F.normalize(prototypes[obj_cates] + obj_noise * torch.randn(num_objs, dim) / dim ** 0.5 * 4, dim=-1)
+    return obj_embeddings, obj_counts
+
+def sampleQueries(obj_embeddings, obj_counts, num_queries, num_patches, patch_noise=1.2, background=0.5):
+    starts = room_scoring.segment_starts(obj_counts)
+    dim = obj_embeddings.shape[1]
+    target_segs = torch.randint(0, obj_counts.shape[0], (num_queries,))
+    patches = []
+    for seg in target_segs.tolist():
+        obj_idxs = starts[seg] + torch.randint(0, int(obj_counts[seg]), (num_patches,))
+        patch = obj_embeddings[obj_idxs] + patch_noise * torch.randn(num_patches, dim) / dim ** 0.5 * 4
+        is_background = torch.rand(num_patches) < background
+        patch[is_background] = torch.randn(int(is_background.sum()), dim)
+        patches.append(F.normalize(patch, dim=-1))
+    return torch.stack(patches), target_segs
+
+def exhaustiveRetrieval(patches, obj_embeddings, seg_ids, num_scans, max_k):
+    topk_segs = []
+    for batch_i in range(patches.shape[0]):
+        patch_scan_sim, _ = room_scoring.patch_scan_similarity(
+            patches[batch_i:batch_i+1], obj_embeddings, seg_ids, num_scans)
+        topk_segs.append(torch.topk(patch_scan_sim.sum(dim=1)[0], max_k).indices)
+    return torch.stack(topk_segs)
+
+def annRetrieval(index, patches, obj_embeddings, obj_counts, seg_ids, starts, num_scans,
+                 nprobe, top_k_objs, shortlist_size, max_k):
+    batch_size, num_patches = patches.shape[:2]
+    obj_scores, obj_rows = index.search(patches.reshape(batch_size*num_patches, -1), top_k_objs, nprobe)
+    obj_segs = torch.where(obj_rows >= 0, seg_ids[obj_rows.clamp(min=0)], obj_rows)
+    votes = scan_votes(obj_scores.reshape(batch_size, num_patches, -1),
+                       obj_segs.reshape(batch_size, num_patches, -1), num_scans)
+    shortlists = shortlist_scans(votes, shortlist_size)
+    topk_segs = []
+    for batch_i in range(batch_size):
+        shortlist = shortlists[batch_i]
+        obj_idxs = torch.cat([torch.arange(starts[seg], starts[seg] + obj_counts[seg]) for seg in shortlist.tolist()])
+        patch_scan_sim, _ = room_scoring.patch_scan_similarity(patches[batch_i:batch_i+1], obj_embeddings[obj_idxs],
+            room_scoring.segment_ids(obj_counts[shortlist]), shortlist.shape[0])
+        order = torch.argsort(patch_scan_sim.sum(dim=1)[0], descending=True)[:max_k]
+        topk_segs.append(shortlist[order])
+    return torch.stack(topk_segs)
+
+def recallAtK(topk_segs, target_segs, top_k_list):
+    hits = topk_segs == target_segs.reshape(-1, 1)
+    return {k: hits[:, :k].any(dim=1).float().mean().item() for k in top_k_list}
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scans', type=int, nargs='+', default=[500, 2000, 5000])
+    parser.add_argument('--objs_per_scan', type=int, default=40)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--num_queries', type=int, default=64)
+    parser.add_argument('--num_patches', type=int, default=32*18)
+    parser.add_argument('--num_lists', type=int, default=256)
+    parser.add_argument('--num_subvectors', type=int, default=16)
+    parser.add_argument('--nprobes', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--shortlists', type=int, nargs='+', default=[5, 20, 50])
+    parser.add_argument('--top_k_objs', type=int, default=16)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    torch.manual_seed(42)
+    top_k_list = [1, 3, 5]
+    for num_scans in args.num_scans:
+        obj_embeddings, obj_counts = buildSyntheticRooms(num_scans, args.objs_per_scan, args.dim)
+        seg_ids = room_scoring.segment_ids(obj_counts)
+        starts = room_scoring.segment_starts(obj_counts)
+        patches, target_segs = sampleQueries(obj_embeddings, obj_counts, args.num_queries, args.num_patches)
+
+        start_time = time.time()
+        index = IVFPQIndex(args.num_lists, args.num_subvectors)
+        index.train(obj_embeddings)
+        index.add(obj_embeddings, torch.arange(obj_embeddings.shape[0]))
+        print('\n{} scans, {} objects, index built in {:.1f}s'.format(num_scans, obj_embeddings.shape[0], time.time() - start_time))
+        print('{:>10} {:>8} {:>10} {:>8} {:>8} {:>8} {:>10}'.format(
+            'method', 'nprobe', 'shortlist', 'R@1', 'R@3', 'R@5', 'ms/query'))
+
+        start_time = time.time()
+        topk_segs = exhaustiveRetrieval(patches, obj_embeddings, seg_ids, num_scans, max(top_k_list))
+        latency = (time.time() - start_time) / args.num_queries * 1000
+        recall = recallAtK(topk_segs, target_segs, top_k_list)
+        print('{:>10} {:>8} {:>10} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.2f}'.format(
+            'exhaustive', '-', '-', recall[1], recall[3], recall[5], latency))
+        for nprobe in args.nprobes:
+            for shortlist_size in args.shortlists:
+                start_time = time.time()
+                topk_segs = annRetrieval(index, patches, obj_embeddings, obj_counts, seg_ids, starts, num_scans,
+                                         nprobe, args.top_k_objs, shortlist_size, max(top_k_list))
+                latency = (time.time() - start_time) / args.num_queries * 1000
+                recall = recallAtK(topk_segs, target_segs, top_k_list)
+                print('{:>10} {:>8} {:>10} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.2f}'.format(
+                    'ivfpq', nprobe, shortlist_size, recall[1], recall[3], recall[5], latency))
@@ -0,0 +1,101 @@
+import argparse
+import os.path as osp
+import sys
+import tempfile
+import time
+from functools import partial
+import numpy as np
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import scan3r
+from utils.range_image_cache import RangeImageCache, load_range_images
+
+# range images of the LipLoc datasets: ms per scan of the argsort z-ordering of createRangeImage
+# before vs the scatter-min z-buffer, and dataset startup computing all scans vs reading them
+# back from the range image cache, on synthetic scan point clouds
+
+def argsortRangeImage(pcs, colors, center, fov_up, fov_down, proj_W, proj_H, range):
+    # scan3r.createRangeImage before, points written in decreasing depth
+    fov_up = fov_up / 180.0 * np.pi
+    fov_down = fov_down / 180.0 * np.pi
+    fov = abs(fov_down) + abs(fov_up)
+    current_vertex = pcs - center
+    depth = np.linalg.norm(current_vertex[:, :3], 2, axis=1)
+    is_in_range = (depth > range[0]) & (depth < range[1])
+    current_vertex = current_vertex[is_in_range]
+    colors = colors[is_in_range]
+    depth = depth[is_in_range]
+    yaw = -np.arctan2(current_vertex[:, 1], current_vertex[:, 0])
+    pitch = np.arcsin(current_vertex[:, 2] / depth)
+    proj_x = np.floor(0.5 * (yaw / np.pi + 1.0) * proj_W)
+    proj_x = np.maximum(0, np.minimum(proj_W - 1, proj_x)).astype(np.int32)
+    proj_y = np.floor((1.0 - (pitch + abs(fov_down)) / fov) * proj_H)
+    proj_y = np.maximum(0, np.minimum(proj_H - 1, proj_y)).astype(np.int32)
+    order = np.argsort(depth)[::-1]
+    depth, proj_y, proj_x, colors = depth[order], proj_y[order], proj_x[order], colors[order, :]
+    proj_range = np.zeros((proj_H, proj_W, 3), dtype=np.uint8)
+    proj_color = np.zeros((proj_H, proj_W, 3), dtype=np.uint8)
+    proj_range[proj_y, proj_x] = np.stack(((depth / range[1] * 255).astype(np.uint8),) * 3, axis=-1)
+    proj_color[proj_y, proj_x] = colors
+    return proj_range, proj_color
+
+def sampleScan(num_points, seed):
+    # points on the walls, floor and ceiling of a room, (N, 4) with the 3RScan object id column
+    rng = np.random.RandomState(seed)
+    extent = rng.uniform([3., 3., 2.4], [8., 7., 3.])
+    pcs = rng.uniform(0, 1, (num_points, 3)) * extent
+    face = rng.randint(0, 6, num_points)
+    pcs[np.arange(num_points), face % 3] = np.where(face < 3, 0., extent[face % 3])
+    pcs = np.concatenate([pcs, rng.randint(0, 50, (num_points, 1))], axis=1)
+    return pcs, rng.randint(0, 256, (num_points, 3)).astype(np.uint8)
+
+def scanRange(scan_id, num_points, range_fn, params):
+    pcs, colors = sampleScan(num_points, int(scan_id.split('_')[1]))
+    return range_fn(pcs, colors, pcs.mean(axis=0), *params)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scans', type=int, default=32)
+    parser.add_argument('--num_points', type=int, default=200000)
+    parser.add_argument('--num_workers', type=int, default=4)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    params = (45.0, -45.0, 360, 90, [0.2, 8.0])
+    scan_ids = ['scan_{:03d}'.format(scan_i) for scan_i in range(args.num_scans)]
+
+    # same images, z-ordering only
+    max_diff = 0
+    time_argsort = time_zbuffer = 0.
+    for scan_id in scan_ids:
+        pcs, colors = sampleScan(args.num_points, int(scan_id.split('_')[1]))
+        center = pcs.mean(axis=0)
+        start_time = time.time()
+        ref = argsortRangeImage(pcs, colors, center, *params)
+        time_argsort += time.time() - start_time
+        start_time = time.time()
+        images = scan3r.createRangeImage(pcs, colors, center, *params)
+        time_zbuffer += time.time() - start_time
+        max_diff = max(max_diff, max(int(np.abs(image.astype(int) - ref_image).max()) for image, ref_image in zip(images, ref)))
+    print('{} scans of {} points, z-buffer vs argsort max diff {}'.format(args.num_scans, args.num_points, max_diff))
+    print('{:>24} {:>10} {:>9}'.format('mode', 'ms/scan', 'speedup'))
+    print('{:>24} {:>10.1f} {:>8.1f}x'.format('argsort', 1e3 * time_argsort / args.num_scans, 1.))
+    print('{:>24} {:>10.1f} {:>8.1f}x'.format('scatter-min', 1e3 * time_zbuffer / args.num_scans, time_argsort / time_zbuffer))
+
+    # dataset startup
+    with tempfile.TemporaryDirectory() as cache_root:
+        modes = [('before, sequential', partial(scanRange, num_points=args.num_points, range_fn=argsortRangeImage, params=params), 0, None),
+                 ('cold cache, {} workers'.format(args.num_workers), partial(scanRange, num_points=args.num_points, range_fn=scan3r.createRangeImage, params=params), args.num_workers, 'cache'),
+                 ('warm cache', partial(scanRange, num_points=args.num_points, range_fn=scan3r.createRangeImage, params=params), args.num_workers, 'cache')]
+        time_ref = None
+        for mode, job, num_workers, cache_name in modes:
+            cache = RangeImageCache(osp.join(cache_root, cache_name), ['bench']) if cache_name else None
+            start_time = time.time()
+            depth_imgs, color_imgs = load_range_images(job, scan_ids, cache, num_workers)
+            time_mode = time.time() - start_time
+            time_ref = time_mode if time_ref is None else time_ref
+            print('{:>24} {:>10.1f} {:>8.1f}x'.format(mode, 1e3 * time_mode / args.num_scans, time_ref / time_mode))
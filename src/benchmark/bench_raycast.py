@@ -0,0 +1,130 @@
+import argparse
+import os.path as osp
+import sys
+import time
+import numpy as np
+import open3d as o3d
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+from utils import scan3r
+from utils.open3d import MeshRaycaster
+
+# frames/s of the ground-truth 2D projection, one cast per frame vs frames_per_chunk poses per cast,
+# and strided rays at the patch grid, on a 3RScan scan (scenes/<scan_id>) or a synthetic room
+
+def loadScan(data_dir, scan_id, num_frames):
+    scans_scenes_dir = osp.join(data_dir, 'scenes')
+    camera_info = scan3r.load_intrinsics(scans_scenes_dir, scan_id)
+    mesh = o3d.io.read_triangle_mesh(osp.join(scans_scenes_dir, scan_id, "labels.instances.annotated.v2.ply"))
+    obj_labels = np.load(osp.join(scans_scenes_dir, scan_id, "data.npy"))['objectId']
+    frame_idxs = scan3r.load_frame_idxs(scans_scenes_dir, scan_id)[:num_frames]
+    poses = scan3r.load_all_poses(scans_scenes_dir, scan_id, frame_idxs)
+    return mesh, obj_labels, camera_info['intrinsic_mat'], int(camera_info['width']), int(camera_info['height']), poses
+
+def sampleRoom(num_objects, num_frames, width=960, height=540):
+    # walls of a 6x5x3m room and random boxes and spheres, every object with its own label
+    room = o3d.geometry.TriangleMesh.create_box(6., 5., 3.).subdivide_midpoint(4)
+    room.triangles = o3d.utility.Vector3iVector(np.asarray(room.triangles)[:, ::-1])
+    meshes, labels = [room], [np.ones(len(room.vertices), dtype=np.int32)]
+    for obj_i in range(num_objects):
+        size = np.random.uniform(0.2, 1.0)
+        obj = o3d.geometry.TriangleMesh.create_sphere(size / 2, 20) if obj_i % 2 else \
+            o3d.geometry.TriangleMesh.create_box(size, size, size).subdivide_midpoint(3)
+        obj.translate(np.random.uniform([0.5, 0.5, 0.], [5.5, 4.5, 2.]))
+        meshes.append(obj)
+        labels.append(np.full(len(obj.vertices), obj_i + 2, dtype=np.int32))
+    mesh = meshes[0]
+    for obj in meshes[1:]:
+        mesh += obj
+    mesh.vertex_colors = o3d.utility.Vector3dVector(np.random.rand(len(mesh.vertices), 3))
+    intrinsics = np.array([[756., 0., 492.], [0., 756., 270.], [0., 0., 1.]])
+    # cameras inside the room looking at random points, camera to world poses
+    poses = []
+    for _ in range(num_frames):
+        eye = np.random.uniform([1., 1., 1.], [5., 4., 2.])
+        forward = np.random.uniform([0., 0., 0.], [6., 5., 3.]) - eye
+        forward /= np.linalg.norm(forward)
+        right = np.cross(forward, [0., 0., 1.])
+        right /= np.linalg.norm(right)
+        pose = np.eye(4)
+        pose[:3, :3] = np.stack([right, np.cross(forward, right), forward], axis=1)
+        pose[:3, 3] = eye
+        poses.append(pose)
+    return mesh, np.concatenate(labels), intrinsics, width, height, poses
+
+def legacyProjectFrames(raycaster, mesh, vertex_labels, intrinsics, extrinsics_list, width, height):
+    # rays created, cast and looked up frame by frame, as Scan3RIMGProjector.segmentResult did
+    mesh_triangles = np.asarray(mesh.triangles)
+    colors = (np.asarray(mesh.vertex_colors) * 255.0).round()
+    obj_id_maps = []
+    for extrinsics in extrinsics_list:
+        rays = o3d.t.geometry.RaycastingScene.create_rays_pinhole(
+            intrinsic_matrix = intrinsics.astype(np.float64), extrinsic_matrix = extrinsics.astype(np.float64),
+            width_px = width, height_px = height)
+        hit_triangles_ids = raycaster.scene.cast_rays(rays)['primitive_ids'].numpy()
+        valid = hit_triangles_ids < mesh_triangles.shape[0]
+        hit_points_ids_valid = mesh_triangles[hit_triangles_ids[valid]][:, 0]
+        color_map = np.zeros((height, width, 3), dtype=np.uint8)
+        obj_id_map = np.zeros((height, width), dtype=np.int32)
+        color_map[valid] = colors[hit_points_ids_valid]
+        obj_id_map[valid] = vertex_labels[hit_points_ids_valid]
+        obj_id_maps.append(obj_id_map)
+    return np.stack(obj_id_maps)
+
+def projectFrames(raycaster, intrinsics, extrinsics_list, width, height, frames_per_chunk, ray_stride=1):
+    obj_id_maps = []
+    for start in range(0, len(extrinsics_list), frames_per_chunk):
+        rays = raycaster.createRays(intrinsics, extrinsics_list[start:start + frames_per_chunk], width, height, ray_stride)
+        obj_id_maps.append(raycaster.cast(rays, return_colors=ray_stride == 1)[0])
+    return np.concatenate(obj_id_maps)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_dir', type=str, default='', help='3RScan root, synthetic room if empty')
+    parser.add_argument('--scan_id', type=str, default='')
+    parser.add_argument('--num_frames', type=int, default=64)
+    parser.add_argument('--num_objects', type=int, default=40)
+    parser.add_argument('--frames_per_chunk', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--ray_strides', type=int, nargs='+', default=[4, 10])
+    parser.add_argument('--patch_w', type=int, default=16)
+    parser.add_argument('--patch_h', type=int, default=9)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    np.random.seed(42)
+    if args.data_dir:
+        mesh, obj_labels, intrinsics, width, height, poses = loadScan(args.data_dir, args.scan_id, args.num_frames)
+    else:
+        mesh, obj_labels, intrinsics, width, height, poses = sampleRoom(args.num_objects, args.num_frames)
+    raycaster = MeshRaycaster(mesh, obj_labels)
+    extrinsics_list = [np.linalg.inv(pose) for pose in poses]
+    print('{} triangles, {} frames of {}x{}'.format(raycaster.num_triangles, len(poses), width, height))
+
+    # one cast per frame, as the projector before batching
+    start_time = time.time()
+    ref_maps = legacyProjectFrames(raycaster, mesh, obj_labels, intrinsics, extrinsics_list, width, height)
+    time_ref = time.time() - start_time
+    ref_patch_annos = scan3r.annotate_patches(ref_maps, args.patch_h, args.patch_w)
+    print('{:>24} {:>10} {:>9} {:>14}'.format('mode', 'frames/s', 'speedup', 'patch agree'))
+    print('{:>24} {:>10.1f} {:>8.1f}x {:>14}'.format('per frame', len(poses) / time_ref, 1., '-'))
+    for frames_per_chunk in [1] + args.frames_per_chunk:
+        start_time = time.time()
+        obj_id_maps = projectFrames(raycaster, intrinsics, extrinsics_list, width, height, frames_per_chunk)
+        time_chunk = time.time() - start_time
+        assert np.array_equal(obj_id_maps, ref_maps)
+        print('{:>24} {:>10.1f} {:>8.1f}x {:>14}'.format('{} frames/cast'.format(frames_per_chunk),
+                                                        len(poses) / time_chunk, time_ref / time_chunk, 'same maps'))
+    # strided rays with patch annotation, agreement with the full resolution patch labels
+    for ray_stride in args.ray_strides:
+        frames_per_chunk = max(args.frames_per_chunk)
+        start_time = time.time()
+        obj_id_maps = projectFrames(raycaster, intrinsics, extrinsics_list, width, height, frames_per_chunk, ray_stride)
+        patch_annos = scan3r.annotate_patches(obj_id_maps, args.patch_h, args.patch_w)
+        time_stride = time.time() - start_time
+        print('{:>24} {:>10.1f} {:>8.1f}x {:>13.1f}%'.format('stride {}, {} frames/cast'.format(ray_stride, frames_per_chunk),
+                                                            len(poses) / time_stride, time_ref / time_stride,
+                                                            100. * np.mean(patch_annos == ref_patch_annos)))
@@ -0,0 +1,132 @@
+import argparse
+import os.path as osp
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import torch
+
+src_dir = osp.dirname(osp.dirname(osp.abspath(__file__)))
+ws_dir = osp.dirname(src_dir)
+sys.path.append(src_dir)
+sys.path.append(ws_dir)
+sys.path.append(osp.join(ws_dir, 'preprocessing', 'scan3r'))
+from utils import common
+from utils.scene_graph_store import SceneGraphBundle, bundle_dir
+from yacs.config import CfgNode as CN
+from datasets.scan3r_objpair_XTAE_SGI import PatchObjectPairXTAESGIDataSet
+from build_sg_bundle import process_scan
+
+# start-up time of the scene graph loading of the val/test dataset:
+# per-scan scene point cloud + pickle (previous) vs the preprocessed scene graph bundle
+# synthetic scans are written to a tmp dir with the layout of the preprocessed Scan3R data
+
+PC_RESOLUTIONS = [64, 128, 256, 512]
+
+def writeSyntheticScans(data_dir, num_scans, scene_points, max_objs, rel_dim=41, attr_dim=164):
+    files_dir_mode = osp.join(data_dir, 'files', 'orig')
+    common.ensure_dir(osp.join(files_dir_mode, 'data'))
+    scan_ids = ['scan_{:04d}'.format(i) for i in range(num_scans)]
+    objs_json = []
+    for scan_id in scan_ids:
+        num_objs = random.randint(10, max_objs)
+        obj_ids = np.sort(np.random.choice(np.arange(1, 3 * max_objs), num_objs, replace=False))
+        ply_data = np.zeros(scene_points, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('objectId', 'i4')])
+        for axis in ['x', 'y', 'z']:
+            ply_data[axis] = np.random.rand(scene_points) * 5
+        ply_data['objectId'] = np.random.choice(obj_ids, scene_points)
+        common.ensure_dir(osp.join(data_dir, 'scenes', scan_id))
+        np.save(osp.join(data_dir, 'scenes', scan_id, 'data.npy'), ply_data)
+        num_edges = num_objs * (num_objs - 1)
+        scene_graph_dict = {
+            'objects_id': obj_ids, 'objects_cat': np.random.randint(0, 160, num_objs),
+            'edges': np.random.randint(0, num_objs, (num_edges, 2)),
+            'obj_points': {pc_resolution: np.random.rand(num_objs, pc_resolution, 3).astype(np.float32) * 5
+                           for pc_resolution in PC_RESOLUTIONS},
+            'bow_vec_object_attr_feats': np.random.randint(0, 2, (num_objs, attr_dim)).astype(np.float64),
+            'bow_vec_object_edge_feats': np.random.randint(0, 5, (num_objs, rel_dim)).astype(np.float64),
+            'rel_trans': np.random.randn(num_objs, 3)}
+        common.write_pkl_data(scene_graph_dict, osp.join(files_dir_mode, 'data', '{}.pkl'.format(scan_id)))
+        objs_json.append({'scan': scan_id, 'objects': [{'id': str(obj_id), 'nyu40': str(random.randint(1, 40))} 
+                                                       for obj_id in obj_ids]})
+    common.write_json({'scans': objs_json}, osp.join(data_dir, 'files', 'objects.json'))
+    with open(osp.join(data_dir, 'files', 'scannet40_classes.txt'), 'w') as f:
+        f.write('\n'.join('{}\tclass_{}'.format(idx, idx) for idx in range(1, 41)))
+    return scan_ids
+
+def buildBundle(data_dir, scan_ids, split):
+    files_dir_mode = osp.join(data_dir, 'files', 'orig')
+    objs_nyu40 = {}
+    for scan_item in common.load_json(osp.join(data_dir, 'files', 'objects.json'))['scans']:
+        objs_nyu40[scan_item['scan']] = {int(obj_item['id']): int(obj_item['nyu40']) for obj_item in scan_item['objects']}
+    scene_graphs = {scan_id: process_scan(data_dir, files_dir_mode, 'data', scan_id, objs_nyu40[scan_id], PC_RESOLUTIONS, True)
+                    for scan_id in scan_ids}
+    SceneGraphBundle(bundle_dir(files_dir_mode, 'data', split), PC_RESOLUTIONS).write(scene_graphs, scan_ids)
+
+def makeDataset(data_dir, scan_ids, split, pc_res, use_sg_bundle):
+    # only the attributes load3DSceneGraphs needs, the rest of the dataset is not built
+    cfg = CN()
+    cfg.sgaligner = CN()
+    cfg.sgaligner.train = CN({'pc_res': pc_res})
+    cfg.sgaligner.val = CN({'pc_res': pc_res})
+    cfg.sgaligner.model = CN({'rel_dim': 41})
+    dataset = PatchObjectPairXTAESGIDataSet.__new__(PatchObjectPairXTAESGIDataSet)
+    dataset.cfg = cfg
+    dataset.split = split
+    dataset.resplit = ''
+    dataset.use_predicted = False
+    dataset.use_sg_store = False
+    dataset.use_sg_bundle = use_sg_bundle
+    dataset.scans_files_dir = osp.join(data_dir, 'files')
+    dataset.scans_files_dir_mode = osp.join(data_dir, 'files', 'orig')
+    dataset.scans_scenes_dir = osp.join(data_dir, 'scenes')
+    dataset.all_scans_split = scan_ids
+    return dataset
+
+def checkSame(dataset_pkl, dataset_bundle):
+    for scan_id in dataset_pkl.all_scans_split:
+        sg_pkl, sg_bundle = dataset_pkl.scene_graphs[scan_id], dataset_bundle.scene_graphs[scan_id]
+        for key in ['obj_ids', 'global_obj_ids', 'pcl_center', 'tot_obj_pts', 'edges', 'tot_rel_pose',
+                    'tot_bow_vec_object_attr_feats', 'tot_bow_vec_object_edge_feats', 'obj_sem_ids']:
+            assert np.array_equal(np.asarray(sg_pkl[key]), np.asarray(sg_bundle[key])), key
+        assert dataset_pkl.obj_3D_anno[scan_id] == {obj_id: dataset_bundle.obj_3D_anno[scan_id][obj_id] 
+                                                    for obj_id in sg_pkl['obj_ids'].tolist()}
+    assert np.array_equal(dataset_pkl.scan_sem_counts, dataset_bundle.scan_sem_counts)
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_scans', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--scene_points', type=int, default=200000)
+    parser.add_argument('--max_objs', type=int, default=40)
+    parser.add_argument('--pc_res', type=int, default=512)
+    parser.add_argument('--split', type=str, default='val')
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    random.seed(42)
+    np.random.seed(42)
+    print('{:>6} {:>12} {:>12} {:>12} {:>9}'.format('scans', 'pkl(s)', 'build(s)', 'bundle(s)', 'speedup'))
+    for num_scans in args.num_scans:
+        data_dir = tempfile.mkdtemp()
+        try:
+            scan_ids = writeSyntheticScans(data_dir, num_scans, args.scene_points, args.max_objs)
+            start = time.time()
+            dataset_pkl = makeDataset(data_dir, scan_ids, args.split, args.pc_res, False)
+            dataset_pkl.load3DSceneGraphs()
+            time_pkl = time.time() - start
+            # one-off preprocessing
+            start = time.time()
+            buildBundle(data_dir, scan_ids, args.split)
+            time_build = time.time() - start
+            start = time.time()
+            dataset_bundle = makeDataset(data_dir, scan_ids, args.split, args.pc_res, True)
+            dataset_bundle.load3DSceneGraphs()
+            time_bundle = time.time() - start
+            checkSame(dataset_pkl, dataset_bundle)
+            print('{:>6} {:>12.2f} {:>12.2f} {:>12.3f} {:>8.1f}x'.format(
+                num_scans, time_pkl, time_build, time_bundle, time_pkl / time_bundle))
+        finally:
+            shutil.rmtree(data_dir)
@@ -9,6 +9,12 @@ def seed_worker(worker_id):
     numpy.random.seed(worker_seed)
     random.seed(worker_seed)
 
+def loader_options(cfg):
+    # persistent workers, prefetching and pinned memory of cfg.data.loader
+    return {'persistent_workers': cfg.data.loader.persistent_workers,
+            'prefetch_factor': cfg.data.loader.prefetch_factor,
+            'pin_memory': cfg.data.loader.pin_memory}
+
 def get_train_val_data_loader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
     train_dataset = Dataset(cfg, split='train')
     train_dataloader = torch_util.build_dataloader(train_dataset, 
@@ -16,16 +22,16 @@ def get_train_val_data_loader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
                                                    num_workers=cfg.train.num_workers, 
                                                    shuffle=True,
                                                    collate_fn=train_dataset.collate_fn, 
-                                                   pin_memory=True, 
-                                                   drop_last=True)
+                                                   drop_last=True,
+                                                   **loader_options(cfg))
     val_dataset = Dataset(cfg, split='val')
     val_dataloader = torch_util.build_dataloader(val_dataset, 
                                                  batch_size=cfg.val.batch_size, 
                                                  num_workers=cfg.val.num_workers, 
                                                  shuffle=False,
                                                  collate_fn=val_dataset.collate_fn, 
-                                                 pin_memory=True, 
-                                                 drop_last=True)
+                                                 drop_last=True,
+                                                 **loader_options(cfg))
 
     return train_dataloader, val_dataloader
 
@@ -36,8 +42,8 @@ def get_train_dataloader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
                                                    num_workers=cfg.train.num_workers, 
                                                    shuffle=True,
                                                    collate_fn=train_dataset.collate_fn, 
-                                                   pin_memory=True, 
-                                                   drop_last=True)
+                                                   drop_last=True,
+                                                   **loader_options(cfg))
     return train_dataset, train_dataloader
 
 def get_val_dataloader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
@@ -47,8 +53,8 @@ def get_val_dataloader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
                                                  num_workers=cfg.val.num_workers, 
                                                  shuffle=False,
                                                 collate_fn=val_dataset.collate_fn, 
-                                                pin_memory=True, 
-                                                drop_last=True)
+                                                drop_last=True,
+                                                **loader_options(cfg))
     return val_dataset, val_dataloader
 
 def get_test_dataloader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
@@ -58,8 +64,8 @@ def get_test_dataloader(cfg, Dataset = PatchObjectPairXTAESGIDataSet):
                                                   num_workers=cfg.val.num_workers, 
                                                   shuffle=False,
                                                   collate_fn=test_dataset.collate_fn, 
-                                                  pin_memory=True, 
-                                                  drop_last=True)
+                                                  drop_last=True,
+                                                  **loader_options(cfg))
     return test_dataset, test_dataloader
 
     
@@ -8,6 +8,7 @@ import torch.utils.data as data
 import cv2
 import sys
 import tqdm
+from functools import partial
 import albumentations as A
 
 from yaml import scan
@@ -15,6 +16,7 @@ dataset_dir = osp.dirname(osp.abspath(__file__))
 src_dir = osp.dirname(dataset_dir)
 sys.path.append(src_dir)
 from utils import common, scan3r, open3d, torch_util
+from utils.range_image_cache import RangeImageCache, range_image_key, load_range_images
 from datasets.loaders import get_val_dataloader
 
 def get_transforms(mode, size):
@@ -34,6 +36,25 @@ def get_transforms(mode, size):
             ]
         )
 
+def load_scan_range(scan_id, scans_scenes_dir, trans_rescan2ref, use_mesh, 
+                    fov_up, fov_down, range_min, range_max, range_W, range_H):
+    # depth and color range images of a scan, a function for the process pool
+    if use_mesh:
+        mesh_file = osp.join(scans_scenes_dir, scan_id, "labels.instances.annotated.v2.ply")
+        proj_range, proj_color = scan3r.loadScanMeshRange(mesh_file, fov_up, fov_down, range_min, range_max, range_H, range_W)
+        return proj_range, proj_color
+    else:
+        # load scan pcs
+        pcs_with_color = scan3r.load_scan_pcs(
+                scans_scenes_dir, scan_id, trans_rescan2ref, color=True)
+        pcs = pcs_with_color[:,:4]
+        colors = pcs_with_color[:,4:]
+        # project range image
+        pcs_center  = np.mean(pcs, axis=0)
+        proj_range, proj_color = scan3r.createRangeImage(
+            pcs, colors, pcs_center, fov_up, fov_down, range_W, range_H, [range_min, range_max])
+        return proj_range, proj_color
+
 class Scan3rLipLocDataset(data.Dataset):
     def __init__(self, cfg, split):
         self.cfg = cfg
@@ -152,43 +173,30 @@ class Scan3rLipLocDataset(data.Dataset):
                 range_depth_file = osp.join(self.range_folder_depth, scan_id+'.png')
                 self.range_imgs[scan_id] = cv2.imread(range_depth_file, cv2.IMREAD_UNCHANGED)
         else:
-            fov_up = self.cfg.data.pointcloud.fov_up
-            fov_down = self.cfg.data.pointcloud.fov_down
-            range_min = self.cfg.data.pointcloud.range_min 
-            range_max = self.cfg.data.pointcloud.range_max
-            range_W = self.cfg.data.pointcloud.range_W
-            range_H = self.cfg.data.pointcloud.range_H
-            for scan_id in self.scan_ids:
-                proj_range, proj_color = self.loadScanRange(scan_id, fov_up, fov_down, range_min, range_max, range_W, range_H)
-                # record range image
-                self.range_imgs[scan_id] = proj_range
-                if save_range:
+            # computed in a process pool, read back memory-mapped from the range image cache
+            pointcloud_cfg = self.cfg.data.pointcloud
+            cache = RangeImageCache(osp.join(self.range_folder, 'cache'), range_image_key(pointcloud_cfg)) \
+                if pointcloud_cfg.use_range_cache else None
+            job = partial(load_scan_range, scans_scenes_dir=self.scans_scenes_dir, 
+                          trans_rescan2ref=self.trans_rescan2ref, use_mesh=pointcloud_cfg.use_mesh, 
+                          fov_up=pointcloud_cfg.fov_up, fov_down=pointcloud_cfg.fov_down, 
+                          range_min=pointcloud_cfg.range_min, range_max=pointcloud_cfg.range_max, 
+                          range_W=pointcloud_cfg.range_W, range_H=pointcloud_cfg.range_H)
+            self.range_imgs, color_imgs = load_range_images(job, self.scan_ids, cache, pointcloud_cfg.range_num_workers)
+            if save_range:
+                for scan_id in self.scan_ids:
                     # save range image
                     range_depth_file = osp.join(self.range_folder_depth, scan_id+'.png')
-                    cv2.imwrite(range_depth_file, proj_range)
+                    cv2.imwrite(range_depth_file, self.range_imgs[scan_id])
                     # save color image
                     range_color_file = osp.join(self.range_folder_color, scan_id+'.png')
-                    proj_color_bgr = cv2.cvtColor(proj_color, cv2.COLOR_RGB2BGR)
+                    proj_color_bgr = cv2.cvtColor(np.asarray(color_imgs[scan_id]), cv2.COLOR_RGB2BGR)
                     cv2.imwrite(range_color_file, proj_color_bgr)
     
     def loadScanRange(self, scan_id, fov_up, fov_down, range_min, range_max, range_W, range_H):
-        if self.cfg.data.pointcloud.use_mesh:
-            mesh_file = osp.join(self.scans_scenes_dir, scan_id, "labels.instances.annotated.v2.ply")
-            proj_range, proj_color = scan3r.loadScanMeshRange(mesh_file, fov_up, fov_down, range_min, range_max, range_H, range_W)
-            return proj_range, proj_color
-        else:
-            # load scan pcs
-            pcs_with_color = scan3r.load_scan_pcs(
-                    self.scans_scenes_dir, scan_id, self.trans_rescan2ref, color=True)
-            pcs = pcs_with_color[:,:4]
-            colors = pcs_with_color[:,4:]
-            # project range image
-            pcs_center  = np.mean(pcs, axis=0)
-            proj_range, proj_color = scan3r.createRangeImage(
-                pcs, colors, pcs_center, fov_up, fov_down, range_W, range_H, [range_min, range_max])
-            return proj_range, proj_color
+        return load_scan_range(scan_id, self.scans_scenes_dir, self.trans_rescan2ref, self.cfg.data.pointcloud.use_mesh, 
+                               fov_up, fov_down, range_min, range_max, range_W, range_H)
 
-    
     def sampleCrossTime(self, scan_id):
         candidate_scans = []
         ref_scan = self.scans2refscans[scan_id]
@@ -19,7 +19,10 @@ from yaml import scan
 
 sys.path.append('..')
 sys.path.append('../..')
-from utils import common, scan3r
+from utils import common, scan3r, room_scoring
+from utils.elastic_distortion import ElasticDistortion
+from utils.scene_graph_store import SceneGraphStore, SceneGraphBundle, bundle_points_key, bundle_dir, store_dir
+from utils.patch_feature_store import PatchFeatureStore, feature_store_dir
 
 
 def getPatchAnno(gt_anno_2D, patch_w, patch_h, th = 0.5):
@@ -44,70 +47,6 @@ def getPatchAnno(gt_anno_2D, patch_w, patch_h, th = 0.5):
                 patch_annos[patch_h_i,patch_w_j] = obj_ids[max_idx]
     return patch_annos
 
-class ElasticDistortion: # from torch-points3d
-    """Apply elastic distortion on sparse coordinate space. First projects the position onto a 
-    voxel grid and then apply the distortion to the voxel grid.
-
-    Parameters
-    ----------
-    granularity: List[float]
-        Granularity of the noise in meters
-    magnitude:List[float]
-        Noise multiplier in meters
-    Returns
-    -------
-    data: Data
-        Returns the same data object with distorted grid
-    """
-
-    def __init__(
-        self, apply_distorsion: bool = True, granularity: list = [0.2, 0.8], magnitude=[0.4, 1.6],
-    ):
-        assert len(magnitude) == len(granularity)
-        self._apply_distorsion = apply_distorsion
-        self._granularity = granularity
-        self._magnitude = magnitude
-
-    @staticmethod
-    def elastic_distortion(coords, granularity, magnitude):
-        coords = coords.numpy()
-        blurx = np.ones((3, 1, 1, 1)).astype("float32") / 3
-        blury = np.ones((1, 3, 1, 1)).astype("float32") / 3
-        blurz = np.ones((1, 1, 3, 1)).astype("float32") / 3
-        coords_min = coords.min(0)
-
-        # Create Gaussian noise tensor of the size given by granularity.
-        noise_dim = ((coords - coords_min).max(0) // granularity).astype(int) + 3
-        noise = np.random.randn(*noise_dim, 3).astype(np.float32)
-
-        # Smoothing.
-        for _ in range(2):
-            noise = scipy.ndimage.filters.convolve(noise, blurx, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blury, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blurz, mode="constant", cval=0)
-
-        # Trilinear interpolate noise filters for each spatial dimensions.
-        ax = [
-            np.linspace(d_min, d_max, d)
-            for d_min, d_max, d in zip(coords_min - granularity, coords_min + granularity * (noise_dim - 2), noise_dim)
-        ]
-        interp = scipy.interpolate.RegularGridInterpolator(ax, noise, bounds_error=0, fill_value=0)
-        coords = coords + interp(coords) * magnitude
-        return torch.tensor(coords).float()
-
-    def __call__(self, pcs_pos):
-        # coords = pcs_pos / self._spatial_resolution
-        if self._apply_distorsion:
-            if random.random() < 0.95:
-                for i in range(len(self._granularity)):
-                    pcs_pos = ElasticDistortion.elastic_distortion(pcs_pos, self._granularity[i], self._magnitude[i],)
-        return pcs_pos
-
-    def __repr__(self):
-        return "{}(apply_distorsion={}, granularity={}, magnitude={})".format(
-            self.__class__.__name__, self._apply_distorsion, self._granularity, self._magnitude,
-        )
-
 class PatchObjectPairXTAESGIDataSet(data.Dataset):
     def __init__(self, cfg, split):
         self.cfg = cfg
@@ -125,6 +64,8 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         self.sgaliner_model_name = cfg.sgaligner.model_name
         self.scan_type = cfg.sgaligner.scan_type
         self.sgaligner_modules = cfg.sgaligner.modules
+        self.use_sg_store = cfg.data.scene_graph.use_sg_store
+        self.use_sg_bundle = cfg.data.scene_graph.use_sg_bundle
         
         # data dir
         self.data_root_dir = cfg.data.root_dir
@@ -163,6 +104,11 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         self.num_scenes = cfg.data.cross_scene.num_scenes
         self.num_negative_samples = cfg.data.cross_scene.num_negative_samples
         self.use_tf_idf = cfg.data.cross_scene.use_tf_idf
+        # only sparse patch labels in the assoc data, for the batched loss
+        self.use_sparse_assoc = cfg.train.loss.use_sparse_assoc
+        # the other losses read the dense matrices
+        assert not self.use_sparse_assoc or cfg.train.loss.loss_type == 'ICLLossBothSidesSumOutLogBatch', \
+            'use_sparse_assoc is only supported by the ICLLossBothSidesSumOutLogBatch loss'
         
         # if split is val, then use all object from other scenes as negative samples
         # if room_retrieval, then use load additional data items
@@ -215,13 +161,20 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         self.use_2D_feature = cfg.data.img_encoding.use_feature
         self.preload_2D_feature = cfg.data.img_encoding.preload_feature
         self.patch_feature_folder = osp.join(self.scans_files_dir, self.cfg.data.img_encoding.feature_dir)
+        self.use_feature_store = cfg.data.img_encoding.use_feature_store
+        self.patch_feature_store = None
         self.patch_features = {}
         self.patch_features_paths = {}
         if self.use_2D_feature:
+            if self.use_feature_store:
+                # memory-mapped store of the split, preloading only keeps views of its rows
+                self.patch_feature_store = PatchFeatureStore(feature_store_dir(self.patch_feature_folder, split))
+                self.patch_feature_store.load()
+                self.preload_2D_feature = True
             if self.preload_2D_feature:
                 for scan_id in self.scan_ids:
                     self.patch_features[scan_id] = scan3r.load_patch_feature_scans(
-                        self.data_root_dir, self.patch_feature_folder, scan_id, self.step)
+                        self.data_root_dir, self.patch_feature_folder, scan_id, self.step, self.patch_feature_store)
             else:
                 for scan_id in self.scan_ids:
                     self.patch_features_paths[scan_id] = osp.join(self.patch_feature_folder, "{}.pkl".format(scan_id))
@@ -277,6 +230,8 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
             apply_distorsion=cfg.train.data_aug.use_aug_3D,
             granularity=cfg.train.data_aug.pcs.granularity,
             magnitude=cfg.train.data_aug.pcs.magnitude,
+            noise_pool_size=cfg.train.data_aug.pcs.noise_pool_size,
+            noise_pool_extent=cfg.train.data_aug.pcs.noise_pool_extent,
         )
             
         # fix candidate scan for val&test split for room retrieval
@@ -306,60 +261,149 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
             raise ValueError("Invalid rel_dim")
         
         self.scene_graphs = {}
-        for scan_id in self.all_scans_split:
-            # Centering
-            points = scan3r.load_plydata_npy(osp.join(self.scans_scenes_dir, '{}/data.npy'.format(scan_id)), obj_ids = None)
-            pcl_center = np.mean(points, axis=0)
-            # scene graph info
-            scene_graph_dict = common.load_pkl_data(osp.join(self.scans_files_dir_mode, '{}/{}.pkl'.format(sg_filename, scan_id)))
-            object_ids = scene_graph_dict['objects_id']
-            global_object_ids = scene_graph_dict['objects_cat']
-            edges = scene_graph_dict['edges']
-            object_points = scene_graph_dict['obj_points'][self.pc_resolution] - pcl_center
-            # load data to tensor
-            object_points = torch.from_numpy(object_points).type(torch.FloatTensor)
-            edges = torch.from_numpy(edges)
-            if not self.use_predicted:
-                bow_vec_obj_attr_feats = torch.from_numpy(scene_graph_dict['bow_vec_object_attr_feats'])
-            else:
-                bow_vec_obj_attr_feats = torch.zeros(object_points.shape[0], rel_dim)
-            bow_vec_obj_edge_feats = torch.from_numpy(scene_graph_dict['bow_vec_object_edge_feats'])
-            rel_pose = torch.from_numpy(scene_graph_dict['rel_trans'])
-            # aggreate data 
-            data_dict = {} 
-            data_dict['obj_ids'] = object_ids
-            data_dict['tot_obj_pts'] = object_points
-            data_dict['graph_per_obj_count'] = np.array([object_points.shape[0]])
-            data_dict['graph_per_edge_count'] = np.array([edges.shape[0]])
-            data_dict['tot_obj_count'] = object_points.shape[0]
-            data_dict['tot_bow_vec_object_attr_feats'] = bow_vec_obj_attr_feats
-            data_dict['tot_bow_vec_object_edge_feats'] = bow_vec_obj_edge_feats
-            data_dict['tot_rel_pose'] = rel_pose
-            data_dict['edges'] = edges    
-            data_dict['global_obj_ids'] = global_object_ids
-            data_dict['scene_ids'] = [scan_id]        
-            data_dict['pcl_center'] = pcl_center
-            # get scene graph
-            self.scene_graphs[scan_id] = data_dict
+        self.sg_bundle = None
+        if self.use_sg_bundle:
+            self.loadSceneGraphBundle(sg_filename, rel_dim)
+        elif self.use_sg_store:
+            # packed store of all scene graphs of the split, memory-mapped and shared by workers
+            self.sg_store = SceneGraphStore(store_dir(
+                self.scans_files_dir_mode, sg_filename, self.split, self.pc_resolution, self.resplit))
+            if self.sg_store.exists():
+                self.sg_store.load()
+            if not all(scan_id in self.sg_store for scan_id in self.all_scans_split):
+                scene_graphs = {scan_id: self.loadSceneGraphScan(scan_id, sg_filename, rel_dim) 
+                                for scan_id in self.all_scans_split}
+                self.sg_store.write(scene_graphs, self.all_scans_split)
+                del scene_graphs
+                self.sg_store.load()
+            for scan_id in self.all_scans_split:
+                data_dict = self.sg_store.scan(scan_id)
+                obj_count = data_dict['obj_ids'].shape[0]
+                data_dict['graph_per_obj_count'] = np.array([obj_count])
+                data_dict['graph_per_edge_count'] = np.array([data_dict['edges'].shape[0]])
+                data_dict['tot_obj_count'] = obj_count
+                data_dict['scene_ids'] = [scan_id]
+                self.scene_graphs[scan_id] = data_dict
+        else:
+            for scan_id in self.all_scans_split:
+                self.scene_graphs[scan_id] = self.loadSceneGraphScan(scan_id, sg_filename, rel_dim)
             
         # load 3D obj semantic annotations
         self.obj_3D_anno = {}
-        self.objs_config_file = osp.join(self.scans_files_dir, 'objects.json')
-        objs_configs = common.load_json(self.objs_config_file)['scans']
-        scans_objs_info = {}
-        for scan_item in objs_configs:
-            scan_id = scan_item['scan']
-            objs_info = scan_item['objects']
-            scans_objs_info[scan_id] = objs_info
-        for scan_id in self.all_scans_split:
-            self.obj_3D_anno[scan_id] = {}
-            for obj_item in scans_objs_info[scan_id]:
-                obj_id = int(obj_item['id'])
-                obj_nyu_category = int(obj_item['nyu40'])
-                self.obj_3D_anno[scan_id][obj_id] = (scan_id, obj_id, obj_nyu_category)
+        if self.sg_bundle is not None:
+            ## categories of the scene graph objects come with the bundle
+            for scan_id in self.all_scans_split:
+                obj_cates = self.sg_bundle.scan(scan_id, ['objects_id', 'objects_nyu40'])
+                self.obj_3D_anno[scan_id] = {obj_id: (scan_id, obj_id, obj_nyu_category) for obj_id, obj_nyu_category
+                                             in zip(obj_cates['objects_id'].tolist(), obj_cates['objects_nyu40'].tolist())}
+        else:
+            self.objs_config_file = osp.join(self.scans_files_dir, 'objects.json')
+            objs_configs = common.load_json(self.objs_config_file)['scans']
+            scans_objs_info = {}
+            for scan_item in objs_configs:
+                scan_id = scan_item['scan']
+                objs_info = scan_item['objects']
+                scans_objs_info[scan_id] = objs_info
+            for scan_id in self.all_scans_split:
+                self.obj_3D_anno[scan_id] = {}
+                for obj_item in scans_objs_info[scan_id]:
+                    obj_id = int(obj_item['id'])
+                    obj_nyu_category = int(obj_item['nyu40'])
+                    self.obj_3D_anno[scan_id][obj_id] = (scan_id, obj_id, obj_nyu_category)
         
         ## category id to name
         self.obj_nyu40_id2name = common.idx2name(osp.join(self.scans_files_dir, 'scannet40_classes.txt'))
+        
+        self.buildSceneGraphIndex()
+        
+    def loadSceneGraphBundle(self, sg_filename, rel_dim):
+        # preprocessed bundle of the split, no scene point cloud or per-scan pickle is loaded
+        bundle_folder = bundle_dir(self.scans_files_dir_mode, sg_filename, self.split, self.resplit)
+        self.sg_bundle = SceneGraphBundle(bundle_folder)
+        assert self.sg_bundle.exists(), \
+            'no scene graph bundle in {}, run preprocessing/scan3r/build_sg_bundle.py'.format(bundle_folder)
+        self.sg_bundle.load()
+        assert self.pc_resolution in self.sg_bundle.pc_resolutions(), \
+            'pc_res {} not in the scene graph bundle'.format(self.pc_resolution)
+        points_key = bundle_points_key(self.pc_resolution)
+        keys = ['objects_id', 'objects_cat', 'rel_trans', 'bow_vec_object_edge_feats', 'edges', 'pcl_center', points_key]
+        if not self.use_predicted:
+            keys.append('bow_vec_object_attr_feats')
+        for scan_id in self.all_scans_split:
+            # views into the memory-mapped columns, pages are read when a batch touches them
+            scene_graph = self.sg_bundle.scan(scan_id, keys)
+            obj_count = scene_graph['objects_id'].shape[0]
+            data_dict = {}
+            data_dict['obj_ids'] = scene_graph['objects_id']
+            data_dict['tot_obj_pts'] = scene_graph[points_key]
+            data_dict['graph_per_obj_count'] = np.array([obj_count])
+            data_dict['graph_per_edge_count'] = np.array([scene_graph['edges'].shape[0]])
+            data_dict['tot_obj_count'] = obj_count
+            if not self.use_predicted:
+                data_dict['tot_bow_vec_object_attr_feats'] = scene_graph['bow_vec_object_attr_feats']
+            else:
+                data_dict['tot_bow_vec_object_attr_feats'] = np.zeros((obj_count, rel_dim), dtype=np.float32)
+            data_dict['tot_bow_vec_object_edge_feats'] = scene_graph['bow_vec_object_edge_feats']
+            data_dict['tot_rel_pose'] = scene_graph['rel_trans']
+            data_dict['edges'] = scene_graph['edges']
+            data_dict['global_obj_ids'] = scene_graph['objects_cat']
+            data_dict['scene_ids'] = [scan_id]
+            data_dict['pcl_center'] = scene_graph['pcl_center']
+            self.scene_graphs[scan_id] = data_dict
+        
+    def loadSceneGraphScan(self, scan_id, sg_filename, rel_dim):
+        # Centering
+        points = scan3r.load_plydata_npy(osp.join(self.scans_scenes_dir, '{}/data.npy'.format(scan_id)), obj_ids = None)
+        pcl_center = np.mean(points, axis=0)
+        # scene graph info
+        scene_graph_dict = common.load_pkl_data(osp.join(self.scans_files_dir_mode, '{}/{}.pkl'.format(sg_filename, scan_id)))
+        object_ids = scene_graph_dict['objects_id']
+        global_object_ids = scene_graph_dict['objects_cat']
+        edges = scene_graph_dict['edges']
+        object_points = scene_graph_dict['obj_points'][self.pc_resolution] - pcl_center
+        # load data to tensor
+        object_points = torch.from_numpy(object_points).type(torch.FloatTensor)
+        edges = torch.from_numpy(edges)
+        if not self.use_predicted:
+            bow_vec_obj_attr_feats = torch.from_numpy(scene_graph_dict['bow_vec_object_attr_feats'])
+        else:
+            bow_vec_obj_attr_feats = torch.zeros(object_points.shape[0], rel_dim)
+        bow_vec_obj_edge_feats = torch.from_numpy(scene_graph_dict['bow_vec_object_edge_feats'])
+        rel_pose = torch.from_numpy(scene_graph_dict['rel_trans'])
+        # aggreate data 
+        data_dict = {} 
+        data_dict['obj_ids'] = object_ids
+        data_dict['tot_obj_pts'] = object_points
+        data_dict['graph_per_obj_count'] = np.array([object_points.shape[0]])
+        data_dict['graph_per_edge_count'] = np.array([edges.shape[0]])
+        data_dict['tot_obj_count'] = object_points.shape[0]
+        data_dict['tot_bow_vec_object_attr_feats'] = bow_vec_obj_attr_feats
+        data_dict['tot_bow_vec_object_edge_feats'] = bow_vec_obj_edge_feats
+        data_dict['tot_rel_pose'] = rel_pose
+        data_dict['edges'] = edges    
+        data_dict['global_obj_ids'] = global_object_ids
+        data_dict['scene_ids'] = [scan_id]        
+        data_dict['pcl_center'] = pcl_center
+        return data_dict
+        
+    def buildSceneGraphIndex(self):
+        ## semantic category of scene graph objects and scan-by-category count matrix for tf-idf
+        self.scan_id2sem_row = {}
+        self.scan_sem_counts = np.zeros((len(self.all_scans_split), room_scoring.NUM_NYU40_CLASSES), dtype=np.int64)
+        for row, scan_id in enumerate(self.all_scans_split):
+            obj_sem_ids = np.array([self.obj_3D_anno[scan_id][obj_id][2] 
+                                    for obj_id in self.scene_graphs[scan_id]['obj_ids']], dtype=np.int64)
+            self.scene_graphs[scan_id]['obj_sem_ids'] = obj_sem_ids
+            self.scan_id2sem_row[scan_id] = row
+            self.scan_sem_counts[row] = room_scoring.scan_sem_counts(obj_sem_ids)
+        
+        ## obj id -> idx of obj in the scene graph of each scan, -1 for ids not in the scene graph
+        self.scan_obj_id2idx = {}
+        for scan_id in self.all_scans_split:
+            obj_ids = np.asarray(self.scene_graphs[scan_id]['obj_ids'], dtype=np.int64)
+            obj_id2idx = np.full(obj_ids.max() + 1 if obj_ids.shape[0] > 0 else 1, -1, dtype=np.int64)
+            obj_id2idx[obj_ids] = np.arange(obj_ids.shape[0])
+            self.scan_obj_id2idx[scan_id] = obj_id2idx
 
 
     def sampleCandidateScenesForEachScan(self, scan_id, num_scenes):
@@ -509,165 +553,140 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
                 data_dict['patch_features_path'] = self.patch_features_paths[scan_id][frame_idx]
         return data_dict
     
-    def generateObjPatchAssociationDataDict(self, data_item, candidate_scans, sg_obj_idxs):
+    def generateObjPatchAssociationDataDict(self, data_item, candidate_scans, sg_obj_idxs_tensor, candi_objs_cache=None):
         scan_id = data_item['scan_id']
         if candidate_scans is None:
             candidate_scans_cur = []
         else:
             candidate_scans_cur = candidate_scans[scan_id]
         gt_2D_anno_flat = data_item['obj_2D_patch_anno_flatten']
-        assoc_data_dict = self.generateObjPatchAssociationScan(scan_id, candidate_scans_cur, gt_2D_anno_flat, sg_obj_idxs)
+        assoc_data_dict = self.generateObjPatchAssociationScan(
+            scan_id, candidate_scans_cur, gt_2D_anno_flat, sg_obj_idxs_tensor, candi_objs_cache)
         
         # temporal 
         if self.temporal:
             scan_id_temporal = data_item['scan_id_temporal']
             assoc_data_dict_temporal = self.generateObjPatchAssociationScan(
-                scan_id_temporal, candidate_scans_cur, gt_2D_anno_flat, sg_obj_idxs)
+                scan_id_temporal, candidate_scans_cur, gt_2D_anno_flat, sg_obj_idxs_tensor, candi_objs_cache)
             return assoc_data_dict, assoc_data_dict_temporal
         else:
             return assoc_data_dict, None
-        
-    def generateObjPatchAssociationScan(self, scan_id, candidate_scans, gt_2D_anno_flat, sg_obj_idxs):
-        obj_3D_idx2info = {} # for objs in current scene and other scenes
-        obj_3D_id2idx_cur_scan = {} # for objs in current scene
-        scans_sg_obj_idxs = [] # for current scene and other scenes
-        candata_scan_obj_idxs = {}
+    
+    def generateCandidateObjsScan(self, scan_id, candidate_scans, sg_obj_idxs_tensor):
+        # objs of current scene first, then objs of candidate scenes
+        all_candi_scans = [scan_id] + candidate_scans
+        candi_scans_obj_count = [len(self.scene_graphs[candi_scan_id]['obj_ids']) for candi_scan_id in all_candi_scans]
+        candi_scans_obj_start = np.cumsum([0] + candi_scans_obj_count)
         
         # for tf_idf
-        all_candi_scans = [scan_id] + candidate_scans
-        N_scenes = 1 + len(candidate_scans)
-        n_scenes_per_sem = {} # number of scans containing certain semantic category
-        n_words_per_scene = {candi_scan_id: 0 for candi_scan_id in all_candi_scans} # number of words in each scene
-        n_word_scene = {candi_scan_id: {} for candi_scan_id in all_candi_scans} # number of words for each semantic in each scene
         reweight_matrix_scans = {candi_scan_id: None for candi_scan_id in all_candi_scans}
-        cadidate_scans_semantic_ids = []
+        n_scenes_per_sem = None
         
-        ## cur scan objs
-        objs_ids_cur_scan = self.scene_graphs[scan_id]['obj_ids']
-        idx = 0
-        for obj_id in objs_ids_cur_scan:
-            obj_3D_idx2info[idx] = self.obj_3D_anno[scan_id][obj_id]
-            obj_3D_id2idx_cur_scan[obj_id] = idx
-            scans_sg_obj_idxs.append(sg_obj_idxs[scan_id][obj_id])
-            cadidate_scans_semantic_ids.append(self.obj_3D_anno[scan_id][obj_id][2])
-            if scan_id not in candata_scan_obj_idxs:
-                candata_scan_obj_idxs[scan_id] = []
-            candata_scan_obj_idxs[scan_id].append(idx)
-            idx += 1 
-            
-            if self.use_tf_idf:
-                obj_nyu_category = self.obj_3D_anno[scan_id][obj_id][2]
-                if obj_nyu_category not in n_word_scene[scan_id]:
-                    n_word_scene[scan_id][obj_nyu_category] = 0
-                n_word_scene[scan_id][obj_nyu_category] += 1
-                n_words_per_scene[scan_id] += 1
-                if obj_nyu_category not in n_scenes_per_sem:
-                    n_scenes_per_sem[obj_nyu_category] = set()
-                n_scenes_per_sem[obj_nyu_category].add(scan_id)
-        ## other scans objs
-        for cand_scan_id in candidate_scans:
-            objs_ids_cand_scan = self.scene_graphs[cand_scan_id]['obj_ids']
-            for obj_id in objs_ids_cand_scan:
-                obj_3D_idx2info[idx] = self.obj_3D_anno[cand_scan_id][obj_id]
-                scans_sg_obj_idxs.append(sg_obj_idxs[cand_scan_id][obj_id])
-                cadidate_scans_semantic_ids.append(
-                    self.obj_3D_anno[cand_scan_id][obj_id][2])
-                if cand_scan_id not in candata_scan_obj_idxs:
-                    candata_scan_obj_idxs[cand_scan_id] = []
-                candata_scan_obj_idxs[cand_scan_id].append(idx)
-                idx += 1
-                
-                if self.use_tf_idf:
-                    obj_nyu_category = self.obj_3D_anno[cand_scan_id][obj_id][2]
-                    if obj_nyu_category not in n_word_scene[cand_scan_id]:
-                        n_word_scene[cand_scan_id][obj_nyu_category] = 0
-                    n_word_scene[cand_scan_id][obj_nyu_category] += 1
-                    n_words_per_scene[cand_scan_id] += 1
-                    if obj_nyu_category not in n_scenes_per_sem:
-                        n_scenes_per_sem[obj_nyu_category] = set()
-                    n_scenes_per_sem[obj_nyu_category].add(cand_scan_id)
-                
-            candata_scan_obj_idxs[cand_scan_id] = torch.Tensor(
-                candata_scan_obj_idxs[cand_scan_id]).long()
-        candata_scan_obj_idxs[scan_id] = torch.Tensor(candata_scan_obj_idxs[scan_id]).long()
-        ## to numpy
-        scans_sg_obj_idxs = np.array(scans_sg_obj_idxs, dtype=np.int32)
-        cadidate_scans_semantic_ids = np.array(cadidate_scans_semantic_ids, dtype=np.int32)
-        ## to torch
-        scans_sg_obj_idxs = torch.from_numpy(scans_sg_obj_idxs).long()
+        ## idx of objs in the union scene graphs, idx of objs of each scan in the candidate objs
+        scans_sg_obj_idxs = torch.cat([sg_obj_idxs_tensor[candi_scan_id] for candi_scan_id in all_candi_scans]).long()
+        candata_scan_obj_idxs = {candi_scan_id: torch.arange(candi_scans_obj_start[i], candi_scans_obj_start[i+1]).long()
+                                 for i, candi_scan_id in enumerate(all_candi_scans)}
+        cadidate_scans_semantic_ids = np.concatenate(
+            [self.scene_graphs[candi_scan_id]['obj_sem_ids'] for candi_scan_id in all_candi_scans])
         cadidate_scans_semantic_ids = torch.from_numpy(cadidate_scans_semantic_ids).long()
-        ## calculate tf_idf reweight matrix for each object in each scene
+        ## calculate tf_idf reweight matrix for each object in each scene, from the precomputed count matrix
         if self.use_tf_idf:
-            for cand_scan_id in all_candi_scans:
-                objs_ids_cand_scan = self.scene_graphs[cand_scan_id]['obj_ids']
-                reweight_matrix_scans[cand_scan_id] = torch.zeros(len(objs_ids_cand_scan))
-                obj_idx = 0
-                for obj_id in objs_ids_cand_scan:
-                    obj_nyu_category = self.obj_3D_anno[cand_scan_id][obj_id][2]
-                    n_word_scene_obj = n_word_scene[cand_scan_id][obj_nyu_category]
-                    n_words_curr_scene = n_words_per_scene[cand_scan_id]
-                    n_scenes_per_sem_obj = len(n_scenes_per_sem[obj_nyu_category])
-                    idf = np.log(N_scenes / n_scenes_per_sem_obj)
-                    tf_idf =n_word_scene_obj / n_words_curr_scene * idf
-                    reweight_matrix_scans[cand_scan_id][obj_idx] =  max( tf_idf, 1e-3)
-                    obj_idx += 1
-        ## generate obj patch association
-        ## From 2D to 3D, denote as e1i_matrix, e1j_matrix, e2j_matrix      
-        ## e1i_matrix,(num_patch, num_3D_obj), record 2D-3D patch-object pairs
-        ## e2j_matrix,(num_patch, num_3D_obj), record 2D-3D patch-object unpairs
-        num_objs = idx
-        gt_patch_cates = np.zeros(self.num_patch, dtype=np.uint8)
-        e1i_matrix = np.zeros( (self.num_patch, num_objs), dtype=np.uint8)
-        e2j_matrix = np.ones( (self.num_patch, num_objs), dtype=np.uint8)
-        for patch_h_i in range(self.patch_h):
-            patch_h_shift = patch_h_i*self.patch_w
-            for patch_w_j in range(self.patch_w):
-                patch_idx = patch_h_shift + patch_w_j
-                obj_id = gt_2D_anno_flat[patch_idx]
-                if obj_id != self.undefined and (obj_id in obj_3D_id2idx_cur_scan):
-                    obj_idx = obj_3D_id2idx_cur_scan[obj_id]
-                    e1i_matrix[patch_h_shift+patch_w_j, obj_idx] = 1 # mark 2D-3D patch-object pairs
-                    e2j_matrix[patch_h_shift+patch_w_j, obj_idx] = 0 # mark 2D-3D patch-object unpairs
-                    gt_patch_cates[patch_idx] = self.obj_3D_anno[scan_id][obj_id][2]
-                else:
-                    gt_patch_cates[patch_idx] = self.undefined
-        ## e1j_matrix, (num_patch, num_patch), mark unpaired patch-patch pair for image patches
-        e1j_matrix = np.zeros( (self.num_patch, self.num_patch), dtype=np.uint8)
-        for patch_h_i in range(self.patch_h):
-            patch_h_shift = patch_h_i*self.patch_w
-            for patch_w_j in range(self.patch_w):
-                obj_id = gt_2D_anno_flat[patch_h_shift + patch_w_j]
-                if obj_id != self.undefined and obj_id in obj_3D_id2idx_cur_scan:
-                    e1j_matrix[patch_h_shift+patch_w_j, :] = np.logical_and(
-                        gt_2D_anno_flat != self.undefined, gt_2D_anno_flat != obj_id
-                    )
-                else:
-                     e1j_matrix[patch_h_shift+patch_w_j, :] = 1
+            candi_sem_counts = torch.from_numpy(
+                self.scan_sem_counts[[self.scan_id2sem_row[candi_scan_id] for candi_scan_id in all_candi_scans]])
+            n_scenes_per_sem = (candi_sem_counts > 0).sum(dim=0) # (K,), number of scans containing each category
+            obj_scan_rows = torch.repeat_interleave(
+                torch.arange(len(all_candi_scans)), torch.tensor(candi_scans_obj_count))
+            reweight_matrix = room_scoring.tf_idf_object_weights(
+                candi_sem_counts, cadidate_scans_semantic_ids, obj_scan_rows)
+            reweight_matrix_scans = dict(zip(all_candi_scans, torch.split(reweight_matrix, candi_scans_obj_count)))
         ## From 3D to 2D, denote as f1i_matrix, f1j_matrix, f2j_matrix
         ## f1i_matrix = e1i_matrix.T, thus skip
         ## f2j_matrix = e2j_matrix.T, thus skip
         ## f1j_matrix
-        obj_cates = [obj_3D_idx2info[obj_idx][2] for obj_idx in range(len(obj_3D_idx2info))]
-        obj_cates_arr = np.array(obj_cates)
-        f1j_matrix = obj_cates_arr.reshape(1, -1) != obj_cates_arr.reshape(-1, 1)
+        f1j_matrix = None
+        if not self.use_sparse_assoc:
+            f1j_matrix = (cadidate_scans_semantic_ids.reshape(1, -1) != cadidate_scans_semantic_ids.reshape(-1, 1)).float()
         
-        assoc_data_dict = {
-            'e1i_matrix': torch.from_numpy(e1i_matrix).float(),
-            'e1j_matrix': torch.from_numpy(e1j_matrix).float(),
-            'e2j_matrix': torch.from_numpy(e2j_matrix).float(),
-            'f1j_matrix': torch.from_numpy(f1j_matrix).float(),
-            'gt_patch_cates': gt_patch_cates,
+        candi_objs_dict = {
+            'num_objs': int(candi_scans_obj_start[-1]),
+            'f1j_matrix': f1j_matrix,
             'scans_sg_obj_idxs': scans_sg_obj_idxs,
             'cadidate_scans_semantic_ids': cadidate_scans_semantic_ids,
             'candata_scan_obj_idxs': candata_scan_obj_idxs,
             'reweight_matrix_scans': reweight_matrix_scans,
             'n_scenes_per_sem': n_scenes_per_sem,
         }
+        return candi_objs_dict
+        
+    def generateObjPatchAssociationScan(self, scan_id, candidate_scans, gt_2D_anno_flat, sg_obj_idxs_tensor, 
+                                        candi_objs_cache=None):
+        # candidate objs only depend on the scan and its candidates, shared by frames of the same scan in a batch
+        candi_objs_key = (scan_id, tuple(candidate_scans))
+        if candi_objs_cache is not None and candi_objs_key in candi_objs_cache:
+            candi_objs_dict = candi_objs_cache[candi_objs_key]
+        else:
+            candi_objs_dict = self.generateCandidateObjsScan(scan_id, candidate_scans, sg_obj_idxs_tensor)
+            if candi_objs_cache is not None:
+                candi_objs_cache[candi_objs_key] = candi_objs_dict
+        num_objs = candi_objs_dict['num_objs']
+        ## generate obj patch association
+        ## patch anno -> idx of obj in current scan, -1 if undefined or not in the scene graph
+        gt_2D_anno_flat = np.asarray(gt_2D_anno_flat).astype(np.int64)
+        obj_id2idx_cur_scan = self.scan_obj_id2idx[scan_id]
+        in_table = (gt_2D_anno_flat >= 0) & (gt_2D_anno_flat < obj_id2idx_cur_scan.shape[0])
+        patch_obj_idxs = np.where(
+            in_table, obj_id2idx_cur_scan[np.where(in_table, gt_2D_anno_flat, 0)], -1)
+        patch_valid = (gt_2D_anno_flat != self.undefined) & (patch_obj_idxs >= 0)
+        valid_patch_idxs = np.nonzero(patch_valid)[0]
+        valid_obj_idxs = patch_obj_idxs[valid_patch_idxs]
+        ## From 2D to 3D, denote as e1i_matrix, e1j_matrix, e2j_matrix      
+        ## e1i_matrix,(num_patch, num_3D_obj), record 2D-3D patch-object pairs
+        ## e2j_matrix,(num_patch, num_3D_obj), record 2D-3D patch-object unpairs
+        gt_patch_cates = np.full(self.num_patch, self.undefined, dtype=np.uint8)
+        gt_patch_cates[valid_patch_idxs] = self.scene_graphs[scan_id]['obj_sem_ids'][valid_obj_idxs]
+        ## sparse labels, the batched loss derives all the matrices below from them
+        ## patch_obj_idxs, (num_patch), idx of the matched obj in the candidate objs, -1 if none
+        ## patch_anno, (num_patch), annotated obj id, -1 if undefined
+        patch_obj_idxs_sparse = torch.from_numpy(np.where(patch_valid, patch_obj_idxs, -1))
+        patch_anno = torch.from_numpy(np.where(gt_2D_anno_flat != self.undefined, gt_2D_anno_flat, -1))
+        
+        assoc_data_dict = {
+            'patch_obj_idxs': patch_obj_idxs_sparse,
+            'patch_anno': patch_anno,
+            'gt_patch_cates': gt_patch_cates,
+            'scans_sg_obj_idxs': candi_objs_dict['scans_sg_obj_idxs'],
+            'cadidate_scans_semantic_ids': candi_objs_dict['cadidate_scans_semantic_ids'],
+            'candata_scan_obj_idxs': candi_objs_dict['candata_scan_obj_idxs'],
+            'reweight_matrix_scans': candi_objs_dict['reweight_matrix_scans'],
+            'n_scenes_per_sem': candi_objs_dict['n_scenes_per_sem'],
+        }
+        if self.use_sparse_assoc:
+            return assoc_data_dict
+        
+        valid_patch_idxs_t, valid_obj_idxs_t = torch.from_numpy(valid_patch_idxs), torch.from_numpy(valid_obj_idxs)
+        e1i_matrix = torch.zeros( (self.num_patch, num_objs), dtype=torch.float)
+        e2j_matrix = torch.ones( (self.num_patch, num_objs), dtype=torch.float)
+        e1i_matrix[valid_patch_idxs_t, valid_obj_idxs_t] = 1 # mark 2D-3D patch-object pairs
+        e2j_matrix[valid_patch_idxs_t, valid_obj_idxs_t] = 0 # mark 2D-3D patch-object unpairs
+        ## e1j_matrix, (num_patch, num_patch), mark unpaired patch-patch pair for image patches
+        ## rows of valid patches: other patches with a different defined anno, other rows: all ones
+        e1j_matrix = np.logical_and(
+            (gt_2D_anno_flat != self.undefined).reshape(1, -1), 
+            gt_2D_anno_flat.reshape(1, -1) != gt_2D_anno_flat.reshape(-1, 1))
+        e1j_matrix[~patch_valid] = True
+        assoc_data_dict['e1i_matrix'] = e1i_matrix
+        assoc_data_dict['e1j_matrix'] = torch.from_numpy(e1j_matrix).float()
+        assoc_data_dict['e2j_matrix'] = e2j_matrix
+        assoc_data_dict['f1j_matrix'] = candi_objs_dict['f1j_matrix']
         return assoc_data_dict
     
     def aggretateDataDicts(self, data_dict, key, mode):
         if mode == 'torch_cat':
-            return torch.cat([data[key] for data in data_dict])
+            values = [data[key] for data in data_dict]
+            # views of the memory-mapped scene graph store, one copy into the batch
+            if isinstance(values[0], np.ndarray):
+                return torch.from_numpy(np.concatenate(values))
+            return torch.cat(values)
         elif mode == 'torch_stack':
             return torch.stack([data[key] for data in data_dict])
         elif mode == 'np_concat':
@@ -677,49 +696,7 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         else:
             raise NotImplementedError
     
-    def collateBatchDicts(self, batch):
-        scans_batch = [data['scan_id'] for data in batch]
-        
-        # sample candidate scenes for each scan
-        if self.use_cross_scene:
-            if self.split == 'train':
-                candidate_scans, union_scans = self.sampleCandidateScenesForScans(scans_batch, self.num_scenes)
-            else:
-                candidate_scans = {}
-                for scan_id in scans_batch:
-                    candidate_scans[scan_id] = self.candidate_scans[scan_id]
-                union_scans = list(set(scans_batch + [scan for scan_list in candidate_scans.values() for scan in scan_list]))
-            # candidate_scans, union_scans = self.sampleCandidateScenesForScans(scans_batch, self.num_scenes)
-        else:
-            candidate_scans, union_scans = None, scans_batch
-        
-        batch_size = len(batch)
-        data_dict = {}
-        data_dict['batch_size'] = batch_size
-        data_dict['temporal'] = self.temporal
-        # frame info 
-        data_dict['scan_ids'] = np.stack([data['scan_id'] for data in batch])
-        if self.temporal:
-            data_dict['scan_ids_temp'] = np.stack([data['scan_id_temporal'] for data in batch])
-        data_dict['frame_idxs'] = np.stack([data['frame_idx'] for data in batch])
-        # 2D img info
-        if self.use_2D_feature:
-            patch_features_batch = np.stack([data['patch_features'] for data in batch]) # (B, P_H, P_W, D)
-            data_dict['patch_features'] = torch.from_numpy(patch_features_batch).float() # (B, H, W, C)
-        else:
-            images_batch = np.stack([data['image'] for data in batch])
-            data_dict['images'] = torch.from_numpy(images_batch).float() # (B, H, W, C)
-            if self.cfg.data.img_encoding.record_feature:
-                data_dict['patch_features_paths'] = [data['patch_features_path'] for data in batch]
-        data_dict['obj_2D_patch_anno_flatten_list'] = \
-            [ torch.from_numpy(data['obj_2D_patch_anno_flatten']) for data in batch] # B - [N_P]
-        # 3D scene graph info
-        ## scene graph info
-        ### include temporal scans 
-        if self.temporal:
-            scene_graph_scans = list(set(union_scans + [data['scan_id_temporal'] for data in batch]))
-        else:
-            scene_graph_scans = union_scans
+    def collateSceneGraphs(self, scene_graph_scans):
         scene_graph_infos = [self.scene_graphs[scan_id] for scan_id in scene_graph_scans]
         scene_graphs_ = {}
         scans_size = len(scene_graph_infos)
@@ -738,16 +715,23 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         scene_graphs_['global_obj_ids'] = self.aggretateDataDicts(scene_graph_infos, 'global_obj_ids', 'np_concat')
         scene_graphs_['scene_ids'] = self.aggretateDataDicts(scene_graph_infos, 'scene_ids', 'np_stack')
         scene_graphs_['pcl_center'] = self.aggretateDataDicts(scene_graph_infos, 'pcl_center', 'np_stack')
+        scene_graphs_['obj_sem_ids'] = torch.from_numpy(
+            self.aggretateDataDicts(scene_graph_infos, 'obj_sem_ids', 'np_concat'))
+        scene_graphs_['scan_sem_counts'] = torch.from_numpy(
+            self.scan_sem_counts[[self.scan_id2sem_row[scan_id] for scan_id in scene_graph_scans]])
         ### 3D pcs data augmentation by elastic distortion
         if self.use_aug and self.split == 'train':
             num_obs = scene_graphs_['tot_obj_pts'].shape[1]
             pcs_flatten = scene_graphs_['tot_obj_pts'].reshape(-1, 3)
-            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten)
+            # distorted scene by scene, on the grid of every scene's own bounding box
+            scene_counts = np.asarray(scene_graphs_['tot_obj_count']).reshape(-1) * num_obs
+            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten, scene_counts.tolist())
             scene_graphs_['tot_obj_pts'] = pcs_distorted_flatten.reshape(-1, num_obs, 3)
-        ### img patch features 
+        ### img patch features, packed as (O, V, D) multi-view features with a (O, V) view mask
         if 'img_patch' in self.sgaligner_modules:
-            obj_img_patches = {}
-            obj_img_poses = {}
+            identity_pos = np.array([0, 0, 0, 1, 0, 0, 0], dtype=np.float32).reshape(1, -1)
+            obj_img_patch_embs_all = []
+            obj_img_poses_all = []
             obj_count_ = 0
             for scan_idx, scan_id in enumerate(scene_graphs_['scene_ids']):
                 scan_id = scan_id[0]
@@ -758,21 +742,10 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
                 obj_img_patches_scan = obj_img_patches_scan_tops['obj_visual_emb']
                 obj_top_frames = obj_img_patches_scan_tops['obj_image_votes_topK']
                 
-                obj_img_patches[scan_id] = {}
-                obj_img_poses[scan_id] = {}
                 for obj_id in obj_ids:
-                    if obj_id not in obj_top_frames:
-                        obj_img_patch_embs = np.zeros((1, self.img_patch_feat_dim))
-                        obj_img_patches[scan_id][obj_id] = torch.from_numpy(obj_img_patch_embs).float()
-                        if self.use_pos_enc:
-                            identity_pos = np.array([0, 0, 0, 1, 0, 0, 0]).reshape(1, -1)
-                            obj_img_poses[scan_id][obj_id] = torch.from_numpy(identity_pos).float()
-                        continue
-                    
                     obj_img_patch_embs_list = []
                     obj_img_poses_list = []
-                    obj_frames = obj_top_frames[obj_id][:self.obj_topk] if len(obj_top_frames[obj_id]) >= self.obj_topk \
-                        else obj_top_frames[obj_id]
+                    obj_frames = obj_top_frames[obj_id][:self.obj_topk] if obj_id in obj_top_frames else []
                     for frame_idx in obj_frames:
                         if obj_img_patches_scan[obj_id][frame_idx] is not None:
                             embs_frame = obj_img_patches_scan[obj_id][frame_idx]
@@ -780,25 +753,75 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
                             obj_img_patch_embs_list.append(embs_frame)
                             if self.use_pos_enc:
                                 obj_img_poses_list.append(self.image_poses[scan_id][frame_idx])
-                        
+                    # objs without views get a single zero view
                     if len(obj_img_patch_embs_list) == 0:
-                        obj_img_patch_embs = np.zeros((1, self.img_patch_feat_dim))
-                        if self.use_pos_enc:
-                            obj_img_poses_arr = np.array([0, 0, 0, 1, 0, 0, 0]).reshape(1, -1)
+                        obj_img_patch_embs_all.append(np.zeros((1, self.img_patch_feat_dim), dtype=np.float32))
+                        obj_img_poses_all.append(identity_pos)
                     else:
-                        obj_img_patch_embs = np.concatenate(obj_img_patch_embs_list, axis=0)
+                        obj_img_patch_embs_all.append(np.concatenate(obj_img_patch_embs_list, axis=0))
                         if self.use_pos_enc:
-                            obj_img_poses_arr = np.stack(obj_img_poses_list, axis=0)
-                        
-                    obj_img_patches[scan_id][obj_id] = torch.from_numpy(obj_img_patch_embs).float()
-                    if self.use_pos_enc:
-                        obj_img_poses[scan_id][obj_id] = torch.from_numpy(obj_img_poses_arr).float()
+                            obj_img_poses_all.append(np.stack(obj_img_poses_list, axis=0))
                     
                 obj_count_ += scene_graphs_['tot_obj_count'][scan_idx]
-            scene_graphs_['obj_img_patches'] = obj_img_patches
+            
+            views_count = np.array([embs.shape[0] for embs in obj_img_patch_embs_all])
+            num_objs, num_views = len(obj_img_patch_embs_all), views_count.max()
+            obj_img_patches_packed = np.zeros((num_objs, num_views, self.img_patch_feat_dim), dtype=np.float32)
+            for obj_idx, embs in enumerate(obj_img_patch_embs_all):
+                obj_img_patches_packed[obj_idx, :embs.shape[0]] = embs
+            scene_graphs_['obj_img_patches_packed'] = torch.from_numpy(obj_img_patches_packed)
+            scene_graphs_['obj_img_views_mask'] = torch.from_numpy(np.arange(num_views)[None] < views_count[:, None])
             if self.use_pos_enc:
-                scene_graphs_['obj_img_poses'] = obj_img_poses
+                obj_img_poses_packed = np.zeros((num_objs, num_views, 7), dtype=np.float32)
+                for obj_idx, poses in enumerate(obj_img_poses_all):
+                    obj_img_poses_packed[obj_idx, :poses.shape[0]] = poses
+                scene_graphs_['obj_img_poses_packed'] = torch.from_numpy(obj_img_poses_packed)
+        return scene_graphs_
+    
+    def collateBatchDicts(self, batch):
+        scans_batch = [data['scan_id'] for data in batch]
         
+        # sample candidate scenes for each scan
+        if self.use_cross_scene:
+            if self.split == 'train':
+                candidate_scans, union_scans = self.sampleCandidateScenesForScans(scans_batch, self.num_scenes)
+            else:
+                candidate_scans = {}
+                for scan_id in scans_batch:
+                    candidate_scans[scan_id] = self.candidate_scans[scan_id]
+                union_scans = list(set(scans_batch + [scan for scan_list in candidate_scans.values() for scan in scan_list]))
+            # candidate_scans, union_scans = self.sampleCandidateScenesForScans(scans_batch, self.num_scenes)
+        else:
+            candidate_scans, union_scans = None, scans_batch
+        
+        batch_size = len(batch)
+        data_dict = {}
+        data_dict['batch_size'] = batch_size
+        data_dict['temporal'] = self.temporal
+        # frame info 
+        data_dict['scan_ids'] = np.stack([data['scan_id'] for data in batch])
+        if self.temporal:
+            data_dict['scan_ids_temp'] = np.stack([data['scan_id_temporal'] for data in batch])
+        data_dict['frame_idxs'] = np.stack([data['frame_idx'] for data in batch])
+        # 2D img info
+        if self.use_2D_feature:
+            patch_features_batch = np.stack([data['patch_features'] for data in batch]) # (B, P_H, P_W, D)
+            data_dict['patch_features'] = torch.from_numpy(patch_features_batch).float() # (B, H, W, C)
+        else:
+            images_batch = np.stack([data['image'] for data in batch])
+            data_dict['images'] = torch.from_numpy(images_batch).float() # (B, H, W, C)
+            if self.cfg.data.img_encoding.record_feature:
+                data_dict['patch_features_paths'] = [data['patch_features_path'] for data in batch]
+        data_dict['obj_2D_patch_anno_flatten_list'] = \
+            [ torch.from_numpy(data['obj_2D_patch_anno_flatten']) for data in batch] # B - [N_P]
+        # 3D scene graph info
+        ## scene graph info
+        ### include temporal scans 
+        if self.temporal:
+            scene_graph_scans = list(set(union_scans + [data['scan_id_temporal'] for data in batch]))
+        else:
+            scene_graph_scans = union_scans
+        scene_graphs_ = self.collateSceneGraphs(scene_graph_scans)
         data_dict['scene_graphs'] = scene_graphs_
         
         ## obj info
@@ -809,19 +832,18 @@ class PatchObjectPairXTAESGIDataSet(data.Dataset):
         sg_obj_idx_start = 0
         for scan_idx, scan_id in enumerate(scene_graphs_['scene_ids']):
             scan_id = scan_id[0]
-            sg_obj_idxs[scan_id] = {}
             objs_count = scene_graphs_['tot_obj_count'][scan_idx]
             # sg_obj_idxs_tensor[scan_id] = torch.from_numpy(
             #      scene_graphs_['obj_ids'][sg_obj_idx_start: sg_obj_idx_start+objs_count]).long()
-            sg_obj_idxs_tensor[scan_id] = torch.from_numpy(
-                 np.arange(sg_obj_idx_start, sg_obj_idx_start+objs_count)).long()
-            for sg_obj_idx in range(sg_obj_idx_start, sg_obj_idx_start+objs_count):
-                obj_id = scene_graphs_['obj_ids'][sg_obj_idx]
-                sg_obj_idxs[scan_id][obj_id] = sg_obj_idx
+            sg_obj_idxs_tensor[scan_id] = torch.arange(sg_obj_idx_start, sg_obj_idx_start+objs_count).long()
+            sg_obj_idxs[scan_id] = dict(zip(
+                scene_graphs_['obj_ids'][sg_obj_idx_start: sg_obj_idx_start+objs_count].tolist(), 
+                range(sg_obj_idx_start, sg_obj_idx_start+objs_count)))
             sg_obj_idx_start += objs_count
+        candi_objs_cache = {}
         for data in batch:
             assoc_data_dict_curr, assoc_data_dict_temporal_curr = \
-                self.generateObjPatchAssociationDataDict(data, candidate_scans, sg_obj_idxs)
+                self.generateObjPatchAssociationDataDict(data, candidate_scans, sg_obj_idxs_tensor, candi_objs_cache)
             assoc_data_dict.append(assoc_data_dict_curr)
             assoc_data_dict_temporal.append(assoc_data_dict_temporal_curr)
         data_dict['assoc_data_dict'] = assoc_data_dict
@@ -20,6 +20,7 @@ from yaml import scan
 sys.path.append('..')
 sys.path.append('../..')
 from utils import common, scan3r
+from utils.elastic_distortion import ElasticDistortion
 
 
 def getPatchAnno(gt_anno_2D, patch_w, patch_h, th = 0.5):
@@ -44,70 +45,6 @@ def getPatchAnno(gt_anno_2D, patch_w, patch_h, th = 0.5):
                 patch_annos[patch_h_i,patch_w_j] = obj_ids[max_idx]
     return patch_annos
 
-class ElasticDistortion: # from torch-points3d
-    """Apply elastic distortion on sparse coordinate space. First projects the position onto a 
-    voxel grid and then apply the distortion to the voxel grid.
-
-    Parameters
-    ----------
-    granularity: List[float]
-        Granularity of the noise in meters
-    magnitude:List[float]
-        Noise multiplier in meters
-    Returns
-    -------
-    data: Data
-        Returns the same data object with distorted grid
-    """
-
-    def __init__(
-        self, apply_distorsion: bool = True, granularity: list = [0.2, 0.8], magnitude=[0.4, 1.6],
-    ):
-        assert len(magnitude) == len(granularity)
-        self._apply_distorsion = apply_distorsion
-        self._granularity = granularity
-        self._magnitude = magnitude
-
-    @staticmethod
-    def elastic_distortion(coords, granularity, magnitude):
-        coords = coords.numpy()
-        blurx = np.ones((3, 1, 1, 1)).astype("float32") / 3
-        blury = np.ones((1, 3, 1, 1)).astype("float32") / 3
-        blurz = np.ones((1, 1, 3, 1)).astype("float32") / 3
-        coords_min = coords.min(0)
-
-        # Create Gaussian noise tensor of the size given by granularity.
-        noise_dim = ((coords - coords_min).max(0) // granularity).astype(int) + 3
-        noise = np.random.randn(*noise_dim, 3).astype(np.float32)
-
-        # Smoothing.
-        for _ in range(2):
-            noise = scipy.ndimage.filters.convolve(noise, blurx, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blury, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blurz, mode="constant", cval=0)
-
-        # Trilinear interpolate noise filters for each spatial dimensions.
-        ax = [
-            np.linspace(d_min, d_max, d)
-            for d_min, d_max, d in zip(coords_min - granularity, coords_min + granularity * (noise_dim - 2), noise_dim)
-        ]
-        interp = scipy.interpolate.RegularGridInterpolator(ax, noise, bounds_error=0, fill_value=0)
-        coords = coords + interp(coords) * magnitude
-        return torch.tensor(coords).float()
-
-    def __call__(self, pcs_pos):
-        # coords = pcs_pos / self._spatial_resolution
-        if self._apply_distorsion:
-            if random.random() < 0.95:
-                for i in range(len(self._granularity)):
-                    pcs_pos = ElasticDistortion.elastic_distortion(pcs_pos, self._granularity[i], self._magnitude[i],)
-        return pcs_pos
-
-    def __repr__(self):
-        return "{}(apply_distorsion={}, granularity={}, magnitude={})".format(
-            self.__class__.__name__, self._apply_distorsion, self._granularity, self._magnitude,
-        )
-
 class SceneGraphPairDataset(data.Dataset):
     def __init__(self, cfg, split):
         self.cfg = cfg
@@ -287,6 +224,8 @@ class SceneGraphPairDataset(data.Dataset):
             apply_distorsion=cfg.train.data_aug.use_aug_3D,
             granularity=cfg.train.data_aug.pcs.granularity,
             magnitude=cfg.train.data_aug.pcs.magnitude,
+            noise_pool_size=cfg.train.data_aug.pcs.noise_pool_size,
+            noise_pool_extent=cfg.train.data_aug.pcs.noise_pool_extent,
         )
             
         # fix candidate scan for val&test split for room retrieval
@@ -713,7 +652,9 @@ class SceneGraphPairDataset(data.Dataset):
         if self.use_aug and self.split == 'train':
             num_obs = scene_graphs_['tot_obj_pts'].shape[1]
             pcs_flatten = scene_graphs_['tot_obj_pts'].reshape(-1, 3)
-            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten)
+            # distorted scene by scene, on the grid of every scene's own bounding box
+            scene_counts = np.asarray(scene_graphs_['tot_obj_count']).reshape(-1) * num_obs
+            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten, scene_counts.tolist())
             scene_graphs_['tot_obj_pts'] = pcs_distorted_flatten.reshape(-1, num_obs, 3)
         ### img patch features 
         if 'img_patch' in self.sg_encoder_modules:
@@ -110,7 +110,9 @@ class ScannetPatchObjDataset(data.Dataset):
         self.elastic_distortion = scannet_utils.ElasticDistortion(
             apply_distorsion=cfg.train.data_aug.use_aug_3D,
             granularity=cfg.train.data_aug.pcs.granularity,
-            magnitude=cfg.train.data_aug.pcs.magnitude)
+            magnitude=cfg.train.data_aug.pcs.magnitude,
+            noise_pool_size=cfg.train.data_aug.pcs.noise_pool_size,
+            noise_pool_extent=cfg.train.data_aug.pcs.noise_pool_extent)
         
         # fix candidate scan for val&test split for room retrieval
         if self.split == 'val' or self.split == 'test':
@@ -422,7 +424,9 @@ class ScannetPatchObjDataset(data.Dataset):
         if self.use_aug and self.split == 'train':
             num_obs = scene_graphs_['tot_obj_pts'].shape[1]
             pcs_flatten = scene_graphs_['tot_obj_pts'].reshape(-1, 3)
-            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten)
+            # distorted scene by scene, on the grid of every scene's own bounding box
+            scene_counts = np.asarray(scene_graphs_['tot_obj_count']).reshape(-1) * num_obs
+            pcs_distorted_flatten = self.elastic_distortion(pcs_flatten, scene_counts.tolist())
             scene_graphs_['tot_obj_pts'] = pcs_distorted_flatten.reshape(-1, num_obs, 3)
         ### img patch features 
         if 'img_patch' in self.sgaligner_modules:
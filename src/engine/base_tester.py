@@ -37,9 +37,8 @@ class BaseTester(abc.ABC):
         message = 'Configs:\n' + json.dumps(cfg, indent=4)
         self.logger.info(message)
 
-        # cuda and distributed
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        # device
+        self.device = torch_util.setup_device(cfg.device)
         
         self.cudnn_deterministic = cudnn_deterministic
         self.seed = cfg.seed
@@ -40,16 +40,26 @@ class BaseTrainer(abc.ABC):
         self.writer = SummaryWriter(log_dir=cfg.event_dir)
         self.logger.info(f'Tensorboard is enabled. Write events to {cfg.event_dir}.')
 
-        # cuda 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
-
-        self.logger.info('Using Single-GPU mode')
+        # device, from the command line if given
+        self.device = torch_util.setup_device(cfg.device, getattr(self.args, 'device', None))
+        if self.device.type == 'cuda':
+            self.logger.info('Using Single-GPU mode')
+        else:
+            self.logger.info('Using CPU mode with {} threads'.format(torch.get_num_threads()))
         self.cudnn_deterministic = cudnn_deterministic
         self.autograd_anomaly_detection = autograd_anomaly_detection
         self.seed = cfg.seed
         torch_util.initialize(self.seed, self.cudnn_deterministic, self.autograd_anomaly_detection)
 
+        # mixed precision, loss scaling is only needed by float16
+        self.use_amp = cfg.train.amp.enabled
+        self.amp_dtype = torch_util.amp_dtype(self.device, cfg.train.amp.dtype) if self.use_amp else torch.float32
+        self.grad_scaler = torch_util.grad_scaler(self.device, self.amp_dtype == torch.float16)
+        if self.use_amp:
+            self.logger.info('Mixed precision training in {}.'.format(self.amp_dtype))
+        self.grad_checkpointing = cfg.train.grad_checkpointing
+        self.empty_cache_steps = cfg.train.empty_cache_steps
+
         # basic config
         self.snapshot_dir = cfg.snapshot_dir
         self.log_steps = self.args.log_steps
@@ -98,6 +108,8 @@ class BaseTrainer(abc.ABC):
         state_dict['optimizer'] = self.optimizer.state_dict()
         if self.scheduler is not None:
             state_dict['scheduler'] = self.scheduler.state_dict()
+        if self.grad_scaler.is_enabled():
+            state_dict['grad_scaler'] = self.grad_scaler.state_dict()
         torch.save(state_dict, snapshot_filename)
         self.logger.info('Snapshot saved to "{}"'.format(snapshot_filename))
 
@@ -140,6 +152,9 @@ class BaseTrainer(abc.ABC):
         if 'scheduler' in state_dict and self.scheduler is not None:
             self.scheduler.load_state_dict(state_dict['scheduler'])
             self.logger.info('Scheduler has been loaded.')
+        if 'grad_scaler' in state_dict and self.grad_scaler.is_enabled():
+            self.grad_scaler.load_state_dict(state_dict['grad_scaler'])
+            self.logger.info('Grad scaler has been loaded.')
 
     def register_model(self, model):
         r"""Register model. DDP is automatically used."""
@@ -170,11 +185,26 @@ class BaseTrainer(abc.ABC):
     def get_lr(self):
         return self.optimizer.param_groups[0]['lr']
 
+    def autocast(self):
+        r"""Mixed precision context of the train and val steps, a no-op if disabled."""
+        return torch_util.autocast(self.device, self.use_amp, self.amp_dtype)
+
+    def backward(self, loss):
+        r"""Backward of the loss, scaled in float16. The graph is freed."""
+        self.grad_scaler.scale(loss).backward()
+
     def optimizer_step(self, iteration):
         if iteration % self.grad_acc_steps == 0:
-            self.optimizer.step()
+            # the scaler unscales the gradients and skips float16 steps with inf/nan gradients
+            self.grad_scaler.step(self.optimizer)
+            self.grad_scaler.update()
             self.optimizer.zero_grad()
 
+    def empty_cache(self, iteration):
+        r"""Release cached accelerator memory every empty_cache_steps iterations."""
+        if self.empty_cache_steps > 0 and iteration % self.empty_cache_steps == 0:
+            torch_util.empty_cache(self.device)
+
     def save_state(self, key, value):
         self.saved_states[key] = torch_util.release_cuda(value)
 
@@ -215,6 +245,11 @@ class BaseTrainer(abc.ABC):
         for key, value in event_dict.items():
             self.writer.add_scalar(f'{phase}/{key}', value, index)
 
+    def write_time_event(self, phase, timer, index):
+        r"""Write TensorBoard event of the data loading wait vs compute time per iteration."""
+        self.write_event(f'{phase}_time', {'data': timer.get_data_time(), 'prepare': timer.get_prepare_time(),
+                                           'process': timer.get_process_time(), 'data_ratio': timer.get_data_ratio()}, index)
+
     @abc.abstractmethod
     def run(self):
         raise NotImplemented
@@ -65,7 +65,8 @@ class EpochBasedTrainer(BaseTrainer):
         pass
 
     def check_gradients(self, epoch, iteration, data_dict, output_dict, result_dict):
-        if not self.run_grad_check:
+        # float16 gradients are scaled, steps with invalid ones are skipped by the grad scaler
+        if not self.run_grad_check or self.grad_scaler.is_enabled():
             return
         if not self.check_invalid_gradients():
             self.logger.error('Epoch: {}, iter: {}, invalid gradients.'.format(epoch, iteration))
@@ -81,23 +82,28 @@ class EpochBasedTrainer(BaseTrainer):
         self.before_train_epoch(self.epoch)
         self.optimizer.zero_grad()
         total_iterations = len(self.train_loader)
+        # timings of the epoch, the first batch also waits for the loader workers to start
+        self.timer.reset()
 
         for iteration, data_dict in enumerate(self.train_loader):
+            self.timer.add_data_time()
             self.inner_iteration = iteration + 1
             self.iteration += 1
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             self.before_train_step(self.epoch, self.inner_iteration, data_dict)
             self.timer.add_prepare_time()
 
             # forward
-            output_dict, result_dict = self.train_step(self.epoch, self.inner_iteration, data_dict)
+            with self.autocast():
+                output_dict, result_dict = self.train_step(self.epoch, self.inner_iteration, data_dict)
             # backward & optimization
-            result_dict['loss'].backward(retain_graph=True)
+            self.backward(result_dict['loss'])
             self.after_backward(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             self.check_gradients(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             self.optimizer_step(self.epoch)
 
             # after training
+            torch_util.synchronize(self.device)
             self.timer.add_process_time()
             self.after_train_step(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             result_dict = self.release_tensors(result_dict)
@@ -119,8 +125,11 @@ class EpochBasedTrainer(BaseTrainer):
                 )
                 self.logger.info(message)
                 self.write_event('train', summary_dict, self.iteration)
+                self.write_time_event('train', self.timer, self.iteration)
             
-            torch.cuda.empty_cache()
+            self.empty_cache(self.iteration)
+            # logging is neither data loading nor compute
+            self.timer.record_time()
             
         
         
@@ -144,12 +153,14 @@ class EpochBasedTrainer(BaseTrainer):
         pbar = tqdm.tqdm(enumerate(self.val_loader), total=total_iterations)
 
         for iteration, data_dict in pbar:
+            timer.add_data_time()
             self.inner_iteration = iteration + 1
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             self.before_val_step(self.epoch, self.inner_iteration, data_dict)
             timer.add_prepare_time()
-            output_dict, result_dict = self.val_step(self.epoch, self.inner_iteration, data_dict)
-            torch.cuda.synchronize()
+            with self.autocast():
+                output_dict, result_dict = self.val_step(self.epoch, self.inner_iteration, data_dict)
+            torch_util.synchronize(self.device)
             timer.add_process_time()
             self.after_val_step(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             result_dict = self.release_tensors(result_dict)
@@ -163,7 +174,8 @@ class EpochBasedTrainer(BaseTrainer):
                 timer=timer,
             )
             pbar.set_description(message)
-            torch.cuda.empty_cache()
+            self.empty_cache(self.inner_iteration)
+            timer.record_time()
         
         summary_dict = summary_board.summary()
         message = '[Val] ' + get_log_string(summary_dict, epoch=self.epoch, timer=timer)
@@ -174,6 +186,7 @@ class EpochBasedTrainer(BaseTrainer):
 
         self.logger.critical(message)
         self.write_event('val', summary_dict, self.epoch)
+        self.write_time_event('val', timer, self.epoch)
         self.set_train_mode()
     
     def set_train_mode(self):
@@ -191,6 +204,9 @@ class EpochBasedTrainer(BaseTrainer):
         elif self.args.snapshot is not None:
             self.load_snapshot(self.args.snapshot)
         
+        if self.grad_checkpointing:
+            torch_util.set_grad_checkpointing(self.model)
+            self.logger.info('Activation checkpointing enabled.')
         self.set_train_mode()
         while self.epoch < self.max_epoch:
             self.epoch += 1
@@ -81,7 +81,7 @@ class RegistrationEvaluator(abc.ABC):
                             self.cfg.backbone.num_stages, self.cfg.backbone.init_voxel_size, 
                             self.cfg.backbone.init_radius, self.neighbor_limits)
             # output dict
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             try:
                 output_dict = self.model(data_dict)
             except:
@@ -44,19 +44,19 @@ class SingleTester(BaseTester):
         for iteration, data_dict in pbar:
             # on start
             self.iteration = iteration + 1
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             self.before_test_step(self.iteration, data_dict)
             # test step
-            torch.cuda.synchronize()
+            torch_util.synchronize(self.device)
             self.timer.add_prepare_time()
             output_dict = self.test_step(self.iteration, data_dict)
-            torch.cuda.synchronize()
+            torch_util.synchronize(self.device)
             self.timer.add_process_time()
             # eval step
             results_dict = self.eval_step(self.iteration, data_dict, output_dict)
             message = f'{self.timer.tostring()}'
             pbar.set_description(message)
-            torch.cuda.empty_cache()
+            torch_util.empty_cache(self.device)
         
         self.after_test_epoch()
 
@@ -11,6 +11,7 @@
 
 import torch
 import torch.nn as nn
+import torch.utils.checkpoint as checkpoint
 from timm.models.layers import trunc_normal_, DropPath, to_2tuple
 from mmcv.runner import load_checkpoint
 from mmdet.models.builder import BACKBONES
@@ -722,6 +723,8 @@ class GCViT(nn.Module):
             self.add_module(layer_name, layer)
 
         self.frozen_stages = frozen_stages
+        # recompute the activations of each level in backward, set by torch_util.set_grad_checkpointing
+        self.grad_checkpointing = False
         if pretrained is not None:
             self.init_weights(pretrained)
 
@@ -779,7 +782,10 @@ class GCViT(nn.Module):
     def forward_tokens(self, x):
         outs = []
         for idx, level in enumerate(self.levels):
-            x, xo = level(x)
+            if self.grad_checkpointing and torch.is_grad_enabled():
+                x, xo = checkpoint.checkpoint(level, x, use_reentrant=False)
+            else:
+                x, xo = level(x)
             if idx in self.out_indices:
                 norm_layer = getattr(self, f'norm{idx}')
                 x_out = norm_layer(xo)
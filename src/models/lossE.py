@@ -15,6 +15,15 @@ def get_loss(cfg):
             global_loss_coef = cfg.train.loss.global_loss_coef,
             global_desc_temp = cfg.train.loss.global_desc_temp
             )
+    elif loss_type == 'ICLLossBothSidesSumOutLogBatch':
+        return ICLLossBothSidesSumOutLogBatch(
+            use_temporal = cfg.train.loss.use_temporal,
+            temperature = cfg.train.loss.temperature, 
+            alpha = cfg.train.loss.alpha,
+            use_global_descriptor = cfg.train.loss.use_global_descriptor,
+            global_loss_coef = cfg.train.loss.global_loss_coef,
+            global_desc_temp = cfg.train.loss.global_desc_temp
+            )
     else:
         raise ValueError('Unknown loss type: {}'.format(loss_type))
     
@@ -152,34 +161,29 @@ class ICLLossBothSidesSumOutLog(nn.Module):
             loc_sucess_batch = is_success if loc_sucess_batch is None else torch.cat([loc_sucess_batch, is_success])
         return loss_batch, loc_sucess_batch
             
+    def forward_batch(self, embs, data_dict, key=''):
+        # calculate patch loss for each item in the batch, concatenated
+        loss_batch_all, matched_success_batch_all = None, None
+        for batch_i in range(data_dict['batch_size']):
+            # get assoc data
+            assoc_data_dict = data_dict['assoc_data_dict{}'.format(key)][batch_i]
+            # get loss
+            loss_batch, matched_success_batch = self.forward_item(embs, assoc_data_dict, batch_i, key=key)
+            if loss_batch is not None:
+                loss_batch_all = loss_batch if loss_batch_all is None else torch.cat([loss_batch_all, loss_batch])
+                matched_success_batch_all = matched_success_batch if matched_success_batch_all is None \
+                    else torch.cat([matched_success_batch_all, matched_success_batch])
+        return loss_batch_all, matched_success_batch_all
+            
     def forward(self, embs, data_dict):
         # calculate patch loss for each batch
-        batch_size = data_dict['batch_size']
-        
         loss_batch_NT, loss_batch_T = None, None
         matched_success_batch_NT, matched_success_batch_T = None, None
         
-        for batch_i in range(batch_size):
-            # dataitem info
-            scan_id = data_dict['scan_ids'][batch_i]
-            # get assoc data
-            assoc_data_dict = data_dict['assoc_data_dict'][batch_i]
-            # get loss
-            loss_batch, matched_success_batch = self.forward_item(embs, assoc_data_dict, batch_i)
-            if loss_batch is not None:
-                loss_batch_NT = loss_batch if loss_batch_NT is None else torch.cat([loss_batch_NT, loss_batch])
-                matched_success_batch_NT = matched_success_batch if matched_success_batch_NT is None \
-                    else torch.cat([matched_success_batch_NT, matched_success_batch])
-                    
-            # temporal 
-            if self.use_temporal:
-                assoc_data_dict = data_dict['assoc_data_dict_temp'][batch_i]
-                loss_batch, matched_success_batch = self.forward_item(
-                    embs, assoc_data_dict, batch_i, key='_temp')
-                if loss_batch is not None:
-                    loss_batch_T = loss_batch if loss_batch_T is None else torch.cat([loss_batch_T, loss_batch])
-                    matched_success_batch_T = matched_success_batch if matched_success_batch_T is None \
-                        else torch.cat([matched_success_batch_T, matched_success_batch])
+        loss_batch_NT, matched_success_batch_NT = self.forward_batch(embs, data_dict)
+        # temporal 
+        if self.use_temporal:
+            loss_batch_T, matched_success_batch_T = self.forward_batch(embs, data_dict, key='_temp')
         
         # calculate loss for patch object match
         loss_dict = {}
@@ -221,6 +225,79 @@ class ICLLossBothSidesSumOutLog(nn.Module):
              
         return loss_dict
     
+def pad_batch(tensors, value=0):
+    # list of B tensors with different sizes -> (B, max sizes), padded with value
+    max_shape = [max(tensor.shape[dim] for tensor in tensors) for dim in range(tensors[0].dim())]
+    padded = tensors[0].new_full([len(tensors)] + max_shape, value)
+    for batch_i, tensor in enumerate(tensors):
+        padded[(batch_i,) + tuple(slice(0, size) for size in tensor.shape)] = tensor
+    return padded
+
+class ICLLossBothSidesSumOutLogBatch(ICLLossBothSidesSumOutLog):
+    r"""ICLLossBothSidesSumOutLog in one pass over the padded batch, from sparse labels.
+    
+    Takes the per-patch gt obj idx (patch_obj_idxs), the per-patch annotated obj id
+    (patch_anno) and the per-obj category (cadidate_scans_semantic_ids) of the assoc data
+    instead of the dense e1i/e1j/e2j/f1j matrices, the masks are derived on the device.
+    """
+    def forward_batch(self, embs, data_dict, key=''):
+        batch_size = data_dict['batch_size']
+        assoc_data_dicts = data_dict['assoc_data_dict{}'.format(key)]
+        patch_obj_sim_list = embs['patch_obj_sim{}'.format(key)][:batch_size]
+        device = patch_obj_sim_list[0].device
+        
+        # pad objs of each item to the max number of candidate objs, (B, N_P, O), (B, N_P, N_P), (B, O, O)
+        patch_obj_sim = pad_batch(patch_obj_sim_list)
+        patch_patch_sim = torch.stack(embs['patch_patch_sim{}'.format(key)][:batch_size])
+        obj_obj_sim = pad_batch(embs['obj_obj_sim{}'.format(key)][:batch_size])
+        num_objs = patch_obj_sim.shape[2]
+        obj_valid = pad_batch([torch.ones(sim.shape[1], dtype=torch.bool, device=device) 
+                               for sim in patch_obj_sim_list], False) # (B, O)
+        # sparse labels
+        gt_obj_idxs = torch.stack([assoc['patch_obj_idxs'] for assoc in assoc_data_dicts]).to(device).long() # (B, N_P)
+        patch_anno = torch.stack([assoc['patch_anno'] for assoc in assoc_data_dicts]).to(device) # (B, N_P)
+        obj_cates = pad_batch([assoc['cadidate_scans_semantic_ids'].to(device) for assoc in assoc_data_dicts], -1) # (B, O)
+        e1i_valid = gt_obj_idxs >= 0 # (B, N_P)
+        if not e1i_valid.any():
+            return None, None
+        gt_obj_idxs_clamp = gt_obj_idxs.clamp(min=0)
+        
+        # masks of the dense matrices
+        e1i_mask = (gt_obj_idxs_clamp.unsqueeze(-1) == torch.arange(num_objs, device=device)) \
+            & e1i_valid.unsqueeze(-1) # (B, N_P, O)
+        e2j_mask = ~e1i_mask & obj_valid.unsqueeze(1) # (B, N_P, O)
+        e1j_mask = ((patch_anno >= 0).unsqueeze(1) & (patch_anno.unsqueeze(1) != patch_anno.unsqueeze(2))) \
+            | ~e1i_valid.unsqueeze(-1) # (B, N_P, N_P)
+        f1j_mask = (obj_cates.unsqueeze(1) != obj_cates.unsqueeze(2)) \
+            & obj_valid.unsqueeze(1) & obj_valid.unsqueeze(2) # (B, O, O)
+        
+        # calculate exp similarity of patch-object and patch-patch
+        patch_obj_sim_exp = torch.exp(patch_obj_sim / self.temp)
+        patch_patch_sim_exp = torch.exp(patch_patch_sim / self.temp)
+        zero = torch.zeros((), dtype=patch_obj_sim_exp.dtype, device=device)
+        
+        # calculate 2D-to-3D loss
+        delta_E1i_E2i = torch.where(e1i_mask, patch_obj_sim_exp, zero).sum(dim=-1) # (B, N_P)
+        sum_delta_E1i_E1j = torch.where(e1j_mask, patch_patch_sim_exp, zero).sum(dim=-1) # (B, N_P)
+        sum_delta_E1i_E2j = torch.where(e2j_mask, patch_obj_sim_exp, zero).sum(dim=-1) # (B, N_P)
+        loss_patch_side = delta_E1i_E2i / (delta_E1i_E2i + sum_delta_E1i_E1j 
+                                           + sum_delta_E1i_E2j + self.epsilon)
+        
+        # calculate 3D-to-2D loss
+        obj_obj_sim_exp = torch.exp(obj_obj_sim / self.temp)
+        delta_F1i_F2i = delta_E1i_E2i # (B, N_P)
+        delta_F1i_F1j_all_objs = torch.where(f1j_mask, obj_obj_sim_exp, zero).sum(dim=-1) # (B, O)
+        sum_delta_F1i_F1j = delta_F1i_F1j_all_objs.gather(1, gt_obj_idxs_clamp) # (B, N_P)
+        delta_F1i_F2j_all_objs = torch.where(e2j_mask, patch_obj_sim_exp, zero).sum(dim=1) # (B, O)
+        sum_delta_F1i_F2j = delta_F1i_F2j_all_objs.gather(1, gt_obj_idxs_clamp) # (B, N_P)
+        loss_obj_side = delta_F1i_F2i / (delta_F1i_F2i + sum_delta_F1i_F1j + sum_delta_F1i_F2j + self.epsilon)
+        
+        loss = -torch.log(loss_patch_side[e1i_valid] + self.epsilon) * self.alpha + \
+            -torch.log(loss_obj_side[e1i_valid] + self.epsilon) * (1 - self.alpha)
+        matched_obj_idxs = torch.argmax(patch_obj_sim.masked_fill(~obj_valid.unsqueeze(1), float('-inf')), dim=-1)
+        matched_obj_labels = (matched_obj_idxs == gt_obj_idxs)[e1i_valid].float()
+        return loss, matched_obj_labels
+    
 class ValidationRoomRetrievalLoss(nn.Module):
     def __init__(self, cfg):
         super(ValidationRoomRetrievalLoss, self).__init__()
@@ -14,7 +14,8 @@ class Attention(nn.Module):
         self.to_qkv = nn.Linear(d_model, inner_dim * 3, bias=True)
         self.to_out = nn.Linear(inner_dim, d_model, bias=False)
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
+        # mask: (B, N), False for padded tokens which are not attended to
         B_, N, C = x.shape
 
         qkv = self.to_qkv(x)
@@ -26,6 +27,8 @@ class Attention(nn.Module):
         logit_scale = torch.clamp(self.logit_scale,
                                   max=torch.log(torch.tensor(1. / 0.01, device=self.logit_scale.device))).exp()
         attn = attn * logit_scale
+        if mask is not None:
+            attn = attn.masked_fill(~mask[:, None, None, :], float('-inf'))
         attn = self.softmax(attn)
 
         out = (attn @ v).transpose(1, 2).reshape(B_, N, C)
@@ -45,9 +48,9 @@ class TransformerEncoderLayer(nn.Module):
         self.acti_layer = acti_layer
         return None
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
         # x: (B, N, d_model)
-        x_attn = x + self.norm(self.self_attn(x))
+        x_attn = x + self.norm(self.self_attn(x, mask))
         x_out = self.acti_layer(x_attn)
         return x_out
     
@@ -99,7 +102,7 @@ class PatchAggregator(nn.Module):
         
         self.transformer_encoder = TransformerEncoderLayer(d_model=d_model, nhead=nhead)
 
-    def forward(self, x):
+    def forward(self, x, mask=None):
         # # x: (batch_size, num_patches, d_model)
         # cls_tokens = self.cls_token.expand(x.size(0), -1, -1)
         # x = torch.cat((cls_tokens, x), dim=1)
@@ -107,8 +110,8 @@ class PatchAggregator(nn.Module):
         # cls_token_output = output[:, 0, :]
         # return cls_token_output
         
-        # x: (batch_size, num_patches, d_model)
-        output = self.transformer_encoder(x)
+        # x: (batch_size, num_patches, d_model), mask: (batch_size, num_patches)
+        output = self.transformer_encoder(x, mask)
         return output
     
 class Mlps(nn.Module):
@@ -18,11 +18,12 @@ import torch.nn.functional as F
 from torch import nn, Tensor
 
 # sgaliner modules 
-from models.sgaligner.src.aligner.networks.gat import MultiGAT
+from models.sgaligner.src.aligner.networks.gat import MultiGAT, batch_graph_edges
 from models.sgaligner.src.aligner.networks.pointnet import PointNetfeat
 from models.sgaligner.src.aligner.networks.pct import NaivePCT
 # model utils
 from model_utils import Attention, TransformerEncoderLayer, Mlps, PatchAggregator
+from utils import torch_util
 
     
 class MultiModalFusion(nn.Module):
@@ -44,7 +45,7 @@ class MultiModalEncoder(nn.Module):
                  hidden_units=[3, 128, 128], heads = [2, 2], emb_dim = 100, pt_out_dim = 256,
                  img_emb_dim = 256,
                  dropout = 0.0, attn_dropout = 0.0, instance_norm = False,
-                 img_aggregation_mode="mean", use_pos_enc=False):
+                 img_aggregation_mode="mean", use_pos_enc=False, gat_batch_graphs=True):
         super(MultiModalEncoder, self).__init__()
         self.modules = modules
         self.pt_out_dim = pt_out_dim
@@ -60,6 +61,10 @@ class MultiModalEncoder(nn.Module):
         self.instance_norm = instance_norm
         self.inner_view_num = len(self.modules) # Point Net + Structure Encoder + Meta Encoder
         self.use_pos_enc = use_pos_enc
+        # run the GAT once over the disjoint union of all graphs instead of graph by graph
+        self.gat_batch_graphs = gat_batch_graphs
+        # recompute the activations of the object, structure and image encoders in backward
+        self.grad_checkpointing = False
         
         if 'point' in self.modules:
             self.object_encoder = PointNetfeat(global_feat=True, batch_norm=True, point_size=3, input_transform=False, feature_transform=False, out_size=self.pt_out_dim)
@@ -109,7 +114,14 @@ class MultiModalEncoder(nn.Module):
         embs = {}
 
         for module in self.modules:
-            if module == 'gat':
+            if module == 'gat' and self.gat_batch_graphs:
+                rel_pose = data_dict['tot_rel_pose'].float()
+                edges = batch_graph_edges(data_dict['edges'], data_dict['graph_per_obj_count'], 
+                                          data_dict['graph_per_edge_count'])
+                structure_embed = self.runCheckpointed(self.structure_encoder, rel_pose, edges)
+                emb = self.structure_embedding(structure_embed)
+            
+            elif module == 'gat':
                 rel_pose = data_dict['tot_rel_pose'].float()
                 structure_embed = None
                 start_object_idx = 0
@@ -133,7 +145,7 @@ class MultiModalEncoder(nn.Module):
             
             elif module in ['point', 'pct']:
                 object_points = data_dict['tot_obj_pts'].permute(0, 2, 1)
-                emb = self.object_encoder(object_points)
+                emb = self.runCheckpointed(self.object_encoder, object_points)
                 emb = self.object_embedding(emb)
 
             elif module == 'rel':
@@ -145,36 +157,10 @@ class MultiModalEncoder(nn.Module):
                 emb = self.meta_embedding_attr(bow_vec_object_attr_feats)
                 
             elif module == 'img_patch':
-                obs_img_patch_emb = None
-                start_object_idx = 0
-                for idx in range(batch_size):
-                    scan_id = data_dict['scene_ids'][idx][0]
-                    obj_count = data_dict['graph_per_obj_count'][idx][0]
-                    obj_ids = data_dict['obj_ids'][start_object_idx: start_object_idx + obj_count]
-                    img_patch_feat_scan = data_dict['obj_img_patches'][scan_id]
-                    for obj in obj_ids:
-                        img_patches = img_patch_feat_scan[obj]
-                        img_patches_encoded = self.img_patch_encoder(img_patches)
-                        if self.use_pos_enc:
-                            img_poses = data_dict['obj_img_poses'][scan_id][obj]
-                            # img_poses = img_poses.unsqueeze(0)
-                            img_patches_encoded = img_patches_encoded + self.pose_encoder(img_poses)
-                        
-                        # aggregate multi-view image features
-                        if self.img_aggregation_mode == "mean":
-                            img_multiview_encode = torch.mean(img_patches_encoded, dim=0, keepdim=True)
-                        elif self.img_aggregation_mode == "max":
-                            img_multiview_encode, _ = torch.max(img_patches_encoded, dim=0, keepdim=True)
-                        elif self.img_aggregation_mode == "transformer":
-                            img_patches_attn = self.multiview_encoder(img_patches_encoded.unsqueeze(0))
-                            img_patches_attn = self.multiview_norm(img_patches_attn)
-                            img_patches_attn = img_patches_attn.squeeze(0)
-                            img_multiview_encode, _ = torch.max(img_patches_encoded + img_patches_attn, dim=0, keepdim=True)
-                        obs_img_patch_emb = torch.cat([img_multiview_encode]) if obs_img_patch_emb is None else \
-                                    torch.cat([obs_img_patch_emb, img_multiview_encode])
-                                    
-                    start_object_idx += obj_count
-                emb = self.img_patch_embedding(obs_img_patch_emb)
+                # datasets still giving per-object dicts are packed here
+                packed = data_dict if 'obj_img_views_mask' in data_dict else self.packObjImgPatches(data_dict)
+                emb = self.runCheckpointed(self.forward_img_patch, packed['obj_img_patches_packed'],
+                                           packed['obj_img_views_mask'], packed.get('obj_img_poses_packed', None))
             else:
                 raise NotImplementedError
             
@@ -190,4 +176,53 @@ class MultiModalEncoder(nn.Module):
         else:
             embs['joint'] = embs[self.modules[0]]
         
-        return embs
\ No newline at end of file
+        return embs
+    
+    def runCheckpointed(self, function, *inputs):
+        if self.grad_checkpointing and torch.is_grad_enabled():
+            # batch norm of the point encoder keeps the running statistics of the first forward
+            batch_norm_modules = function if isinstance(function, nn.Module) else None
+            return torch_util.checkpoint(function, *inputs, batch_norm_modules=batch_norm_modules)
+        return function(*inputs)
+    
+    def packObjImgPatches(self, data_dict):
+        # per-object dicts of multi-view features -> (O, V, D) padded tensor and (O, V) view mask
+        img_patches_list, img_poses_list = [], []
+        start_object_idx = 0
+        for idx in range(data_dict['batch_size']):
+            scan_id = data_dict['scene_ids'][idx][0]
+            obj_count = data_dict['graph_per_obj_count'][idx][0]
+            obj_ids = data_dict['obj_ids'][start_object_idx: start_object_idx + obj_count]
+            for obj in obj_ids:
+                img_patches_list.append(data_dict['obj_img_patches'][scan_id][obj])
+                if self.use_pos_enc:
+                    img_poses_list.append(data_dict['obj_img_poses'][scan_id][obj])
+            start_object_idx += obj_count
+        packed = {}
+        packed['obj_img_patches_packed'] = nn.utils.rnn.pad_sequence(img_patches_list, batch_first=True)
+        views_count = torch.tensor([img_patches.shape[0] for img_patches in img_patches_list], 
+                                   device=packed['obj_img_patches_packed'].device)
+        packed['obj_img_views_mask'] = \
+            torch.arange(packed['obj_img_patches_packed'].shape[1], device=views_count.device)[None] < views_count[:, None]
+        if self.use_pos_enc:
+            packed['obj_img_poses_packed'] = nn.utils.rnn.pad_sequence(img_poses_list, batch_first=True)
+        return packed
+    
+    def forward_img_patch(self, img_patches, views_mask, img_poses=None):
+        # img_patches: (O, V, D) multi-view features of all objects, views_mask: (O, V)
+        img_patches_encoded = self.img_patch_encoder(img_patches) # (O, V, C)
+        if self.use_pos_enc:
+            img_patches_encoded = img_patches_encoded + self.pose_encoder(img_poses)
+        
+        # aggregate multi-view image features
+        views_mask_ = views_mask.unsqueeze(-1) # (O, V, 1)
+        if self.img_aggregation_mode == "mean":
+            img_multiview_encode = (img_patches_encoded * views_mask_).sum(dim=1) / views_mask_.sum(dim=1).clamp(min=1)
+        elif self.img_aggregation_mode == "max":
+            img_multiview_encode = img_patches_encoded.masked_fill(~views_mask_, float('-inf')).max(dim=1)[0]
+        elif self.img_aggregation_mode == "transformer":
+            img_patches_attn = self.multiview_encoder(img_patches_encoded, views_mask)
+            img_patches_attn = self.multiview_norm(img_patches_attn)
+            img_multiview_encode = (img_patches_encoded + img_patches_attn).masked_fill(
+                ~views_mask_, float('-inf')).max(dim=1)[0]
+        return self.img_patch_embedding(img_multiview_encode)
\ No newline at end of file
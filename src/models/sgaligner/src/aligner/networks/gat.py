@@ -24,6 +24,15 @@ class MultiGCN(nn.Module):
                 x = F.dropout(x, self.dropout, training=self.training)
         return x
 
+def batch_graph_edges(edges, graph_obj_counts, graph_edge_counts):
+    r"""Edges (E, 2) of graphs stacked back to back, with node idxs local to each graph,
+    to the (2, E) edge index of their disjoint union (block-diagonal graph)."""
+    graph_obj_counts = torch.as_tensor(graph_obj_counts, dtype=torch.long, device=edges.device).reshape(-1)
+    graph_edge_counts = torch.as_tensor(graph_edge_counts, dtype=torch.long, device=edges.device).reshape(-1)
+    graph_obj_starts = torch.cumsum(graph_obj_counts, dim=0) - graph_obj_counts
+    edge_offsets = torch.repeat_interleave(graph_obj_starts, graph_edge_counts)
+    return (edges.long() + edge_offsets.reshape(-1, 1)).transpose(0, 1).contiguous()
+
 class MultiGAT(nn.Module):
     def __init__(self, n_units=[17, 128, 100], n_heads=[2, 2], dropout=0.0):
         super(MultiGAT, self).__init__()
@@ -28,6 +28,7 @@ from configs import update_config_room_retrival, config
 # tester
 from engine.single_tester import SingleTester
 from utils.summary_board import SummaryBoard
+from utils.retrieval_record import RetrievalRecordWriter, record_dir
 
 # from models.GCVit.models import gc_vit
 from models.patch_SGIE_aligner import PatchSGIEAligner
@@ -69,12 +70,13 @@ class RoomRetrivalScore():
         # results
         self.val_room_retrieval_summary = SummaryBoard(adaptive=True)
         self.test_room_retrieval_summary = SummaryBoard(adaptive=True)
-        self.val_room_retrieval_record = {}
-        self.test_room_retrieval_record = {}
         
         # files
         self.output_dir = osp.join(cfg.output_dir, self.method_name)
         common.ensure_dir(self.output_dir)
+        # retrieval records, streamed to output_dir/retrieval_record_<split> during evaluation
+        self.val_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'val'))
+        self.test_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'test'))
 
     def registerPatchObjectAlignerFromCfg(self, cfg):
         pass
@@ -151,9 +153,8 @@ class RoomRetrivalScore():
             # retrieva_record
             scan_id = data_dict['scan_ids'][batch_i]
             if scan_id not in room_retrieval_record:
-                room_retrieval_record[scan_id] = {'frames_retrieval': {}}
-                room_retrieval_record[scan_id]['candidates_scan_ids'] = data_dict['candidate_scan_ids_list'][batch_i]
-                room_retrieval_record[scan_id]['obj_ids'] = data_dict['obj_3D_ids'][scan_id]
+                room_retrieval_record.addScan(scan_id, candidates_scan_ids = data_dict['candidate_scan_ids_list'][batch_i], 
+                                              obj_ids = data_dict['obj_3D_ids'][scan_id])
             frame_idx = data_dict['frame_idxs'][batch_i]
             frame_retrieval = {
                 'frame_idx': frame_idx,
@@ -163,7 +164,7 @@ class RoomRetrivalScore():
                 'room_score_scans_NT': room_score_scans_NT,
                 'room_score_scans_T': room_score_scans_T,
             }
-            room_retrieval_record[scan_id]['frames_retrieval'][frame_idx] = frame_retrieval
+            room_retrieval_record.addFrame(scan_id, frame_retrieval)
 
         # average over batch
         for k in top_k_list:
@@ -190,9 +191,8 @@ class RoomRetrivalScore():
         # write metric to file
         val_file = osp.join(self.output_dir, 'val_result.txt')
         common.write_to_txt(val_file, val_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_val.pkl')
-        common.write_pkl_data(self.val_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.val_room_retrieval_record.close()
         
         # test 
 
@@ -205,9 +205,8 @@ class RoomRetrivalScore():
         # write metric to file
         test_file = osp.join(self.output_dir, 'test_result.txt')
         common.write_to_txt(test_file, test_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_test.pkl')
-        common.write_pkl_data(self.test_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.test_room_retrieval_record.close()
             
 
 def parse_args(parser=None):
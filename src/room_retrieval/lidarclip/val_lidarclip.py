@@ -20,10 +20,11 @@ sys.path.append(ws_dir)
 # utils
 from utils import common
 from utils import torch_util
+from utils.embedding_cache import ScanEmbeddingCache, files_hash
 from utils.summary_board import SummaryBoard
 # from utils import visualisation
 # config
-from configs import update_config_room_retrival, config
+from configs import update_config_room_retrival, update_config_device, config
 # tester
 from engine.single_tester import SingleTester
 # models
@@ -50,8 +51,7 @@ class RoomRetrivalScore():
         self.split = ds_split
         
         # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(cfg.device)
         
         # dataloader
         start_time = time.time()
@@ -80,6 +80,12 @@ class RoomRetrivalScore():
         self.model.eval()
         self.loss_type = cfg.train.loss.loss_type
         
+        # scan embeddings, each scan is encoded once per checkpoint
+        self.use_scan_emb_cache = cfg.val.room_retrieval.use_scan_emb_cache
+        if self.use_scan_emb_cache:
+            self.registerScanEmbeddingCache(cfg)
+        self.embed3d_time_per_scene = 0.
+        
         # results
         self.val_room_retrieval_summary = SummaryBoard(adaptive = True)
         self.test_room_retrieval_summary = SummaryBoard(adaptive = True)
@@ -106,9 +112,9 @@ class RoomRetrivalScore():
         backbone3d_pretrained_file = cfg.model.backbone3D.pretrained
         dim_3d = cfg.model.backbone3D.dim_3d
         self.backbone3d = LidarEncoderSST(backbone3d_cfg_file, dim_3d)
-        self.backbone3d.load_state_dict(torch.load(backbone3d_pretrained_file), strict=False)
+        self.backbone3d.load_state_dict(torch.load(backbone3d_pretrained_file, map_location=torch.device('cpu')), strict=False)
 
-        # model to cuda 
+        # model to device 
         self.model = self.backbone3d
         if cfg.other.use_resume:
             assert os.path.isfile(cfg.other.resume), "=> no checkpoint found at '{}'".format(cfg.other.resume)
@@ -130,50 +136,62 @@ class RoomRetrivalScore():
             sim_cos = torch.mm(embeddings_2D_norm, embeddings_3D_norm.permute(1, 0)) # cos sim
             return None, sim_cos
 
-    def room_retrieval_scan(self, data_dict, scan_pcs):
-        # room retrieval with scan point cloud
+    def registerScanEmbeddingCache(self, cfg):
+        cache_root = cfg.val.room_retrieval.scan_emb_cache_dir
+        if not osp.isabs(cache_root):
+            cache_root = osp.join(cfg.data.root_dir, 'files', cache_root or 'Features3D/lidarclip_scan_emb_cache')
+        checkpoint_files = [cfg.model.backbone3D.pretrained, cfg.other.resume if cfg.other.use_resume else None]
+        key_items = [files_hash(checkpoint_files), 'lidarclip', cfg.data.name, 
+                     osp.basename(cfg.model.backbone3D.cfg_file), cfg.model.backbone3D.dim_3d]
+        self.scan_emb_cache = ScanEmbeddingCache(cache_root, key_items)
+        
+    def precomputeScanEmbeddings(self, scan_pcs):
+        # encode every scan point cloud of the split once, (1, C) per scan on cpu
+        scan_embeddings = {}
+        if self.use_scan_emb_cache and self.scan_emb_cache.exists():
+            self.scan_emb_cache.load()
+            scan_embeddings = {scan_id: torch.from_numpy(np.array(self.scan_emb_cache.get(scan_id)))
+                               for scan_id in scan_pcs if scan_id in self.scan_emb_cache}
+        scan_ids = [scan_id for scan_id in scan_pcs if scan_id not in scan_embeddings]
+        start_time = time.time()
+        with torch.no_grad():
+            for scan_id in tqdm.tqdm(scan_ids, desc='precompute scan embeddings'):
+                pcs = [torch_util.to_device(scan_pcs[scan_id], self.device).contiguous()]
+                embeddings, _ = self.model_forward(pcs)
+                scan_embeddings[scan_id] = embeddings.reshape(1, -1).float().cpu()
+                if self.use_scan_emb_cache:
+                    self.scan_emb_cache.add(scan_id, scan_embeddings[scan_id].numpy())
+        if self.use_scan_emb_cache and len(scan_ids) > 0:
+            self.scan_emb_cache.save()
+        # encoding time per scan, 0 when all scans come from the cache
+        self.embed3d_time_per_scene = (time.time() - start_time) / max(len(scan_pcs), 1)
+        return scan_embeddings
+        
+    def room_scores(self, img_feature, scan_ids, scan_embeddings):
+        # similarity of one image feature to several scans in one matrix product
+        embeddings_3D = torch.cat([scan_embeddings[scan_id] for scan_id in scan_ids], dim=0) # (S, C)
+        sim_mse, sim_cos = self.sim_calculation_eval(img_feature, embeddings_3D)
+        sim = sim_mse if self.loss_type == 'mse' else sim_cos
+        return dict(zip(scan_ids, sim.reshape(-1).tolist()))
+
+    def room_retrieval_scan(self, data_dict, scan_embeddings):
+        # room retrieval with the precomputed scan point cloud embeddings
         batch_size = data_dict['batch_size']
         top_k_list = [1,3,5]
         top_k_recall_temporal = {"R@{}_T_S".format(k): 0. for k in top_k_list}
         top_k_recall_non_temporal = {"R@{}_NT_S".format(k): 0. for k in top_k_list}
         retrieval_time_temporal = 0.
         retrieval_time_non_temporal = 0.
-        embed3d_time = 0.
-        num_scene = 0
         
         for batch_i in range(batch_size):
-            img_feature = data_dict['img_features'][batch_i].unsqueeze(0)
+            img_feature_cpu = data_dict['img_features'][batch_i].unsqueeze(0).cpu()
             cur_scan_id = data_dict['scan_ids'][batch_i]
             
             # non-temporal retrieval
-            room_score_scans = {}
-            scans_pcs_embeddings = {}
-            ## get cur scan embeddings
-            # curr_scan_pcs = data_dict['curr_scan_pcs_list'][batch_i]
-            curr_scan_pcs = torch_util.to_cuda(scan_pcs[cur_scan_id])
-            start_time = time.time()
-            pcs = [curr_scan_pcs.contiguous()]
-            scans_pcs_embeddings[cur_scan_id], _ = self.model_forward(pcs)
-            embed3d_time += time.time() - start_time
-            num_scene += 1
-            ## get candidate scan embeddings
-            # candidate_scans_pcs = data_dict['candidate_scan_pcs_list'][batch_i]
+            ## calculate similarity to cur scan and candidate scans in cpu
             candidate_scans = data_dict['candidate_scan_ids_list'][batch_i]
-            candidate_scans_pcs = {scan_id: torch_util.to_cuda(scan_pcs[scan_id]) for scan_id in candidate_scans}
-            start_time = time.time()
-            for candidate_scan_id, scans_pcs in candidate_scans_pcs.items():
-                pcs = [scans_pcs.contiguous()]
-                scans_pcs_embeddings[candidate_scan_id], _ = self.model_forward(pcs)
-            embed3d_time += time.time() - start_time
-            num_scene += len(candidate_scans)
-            ## calculate similarity in cpu
-            img_feature_cpu = img_feature.cpu()
-            scans_pcs_embeddings_cpu = torch_util.release_cuda_torch(scans_pcs_embeddings)
             start_time = time.time()
-            for candidate_scan_id, candidate_scan_embeddings in scans_pcs_embeddings_cpu.items():
-                sim_mse, sim_cos = self.sim_calculation_eval(img_feature_cpu, candidate_scan_embeddings)
-                sim = sim_mse if self.loss_type == 'mse' else sim_cos
-                room_score_scans[candidate_scan_id] = sim.max().item()
+            room_score_scans = self.room_scores(img_feature_cpu, [cur_scan_id] + list(candidate_scans), scan_embeddings)
             candidate_sim_cal_time = time.time() - start_time
             ## select top k similar scans
             room_sorted_by_scores =  [item[0] for item in sorted(room_score_scans.items(), key=lambda x: x[1], reverse=True)]
@@ -185,21 +203,12 @@ class RoomRetrivalScore():
                     
             # temporal retrieval
             temporal_scan_id = data_dict['temporal_scan_id_list'][batch_i]
-            ## get temporal depth scan embeddings
-            # temporal_scan_pcs = data_dict['temporal_scan_pcs_list'][batch_i]
-            temporal_scan_pcs = torch_util.to_cuda(scan_pcs[temporal_scan_id])
-            pcs = [temporal_scan_pcs.contiguous()]
-            scans_pcs_embeddings[temporal_scan_id],_ = self.model_forward(pcs)
             ## remove cur scan embeddings
             if cur_scan_id != temporal_scan_id:
-                scans_pcs_embeddings.pop(cur_scan_id)
                 room_score_scans.pop(cur_scan_id)
             ## calculate 
-            scans_pcs_embeddings_cpu = torch_util.release_cuda_torch(scans_pcs_embeddings)
             start_time = time.time()
-            sim_mse, sim_cos = self.sim_calculation_eval(img_feature_cpu, scans_pcs_embeddings_cpu[temporal_scan_id])
-            sim = sim_mse if self.loss_type == 'mse' else sim_cos
-            room_score_scans[temporal_scan_id] = sim.max().item()
+            room_score_scans.update(self.room_scores(img_feature_cpu, [temporal_scan_id], scan_embeddings))
             ## select top k similar scans
             room_sorted_by_scores =  [item[0] for item in sorted(room_score_scans.items(), key=lambda x: x[1], reverse=True)]
             for k in top_k_list:
@@ -218,7 +227,7 @@ class RoomRetrivalScore():
         result = {
             'time_T_S': retrieval_time_temporal,
             'time_NT_S': retrieval_time_non_temporal,
-            'scenegraph_emb_time_per_scene': embed3d_time / num_scene,
+            'scenegraph_emb_time_per_scene': self.embed3d_time_per_scene,
         }
         result.update(top_k_recall_temporal)
         result.update(top_k_recall_non_temporal)
@@ -226,26 +235,28 @@ class RoomRetrivalScore():
 
     def room_retrieval_val_test(self):
         # test
+        test_scan_embeddings = self.precomputeScanEmbeddings(self.test_scan_pcs)
         data_dicts = tqdm.tqdm(enumerate(self.test_data_loader), total=len(self.test_data_loader))
         for iteration, data_dict in data_dicts:
             with torch.no_grad():
-                data_dict = torch_util.to_cuda(data_dict)
-                result = self.room_retrieval_scan(data_dict, self.test_scan_pcs)
+                data_dict = torch_util.to_device(data_dict, self.device)
+                result = self.room_retrieval_scan(data_dict, test_scan_embeddings)
                 self.test_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
         test_items = self.test_room_retrieval_summary.tostringlist()
         # write to file
         test_file = osp.join(self.output_dir, 'test_result.txt')
         common.write_to_txt(test_file, test_items)
         
         # val 
+        val_scan_embeddings = self.precomputeScanEmbeddings(self.val_scan_pcs)
         data_dicts = tqdm.tqdm(enumerate(self.val_data_loader), total=len(self.val_data_loader))
         for iteration, data_dict in data_dicts:
             with torch.no_grad():
-                data_dict = torch_util.to_cuda(data_dict)
-                result = self.room_retrieval_scan(data_dict, self.val_scan_pcs)
+                data_dict = torch_util.to_device(data_dict, self.device)
+                result = self.room_retrieval_scan(data_dict, val_scan_embeddings)
                 self.val_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
             
         val_items = self.val_room_retrieval_summary.tostringlist()
         # write to file
@@ -256,6 +267,8 @@ class RoomRetrivalScore():
 def parse_args(parser=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', dest='config', default='', type=str, help='configuration file name')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
+    parser.add_argument('--num_threads', type=int, default=None, help='intra-op threads on cpu, overrides cfg.device.num_threads')
 
     args = parser.parse_args()
     return parser, args
@@ -264,6 +277,7 @@ def main():
     parser, args = parse_args()
     
     cfg = update_config_room_retrival(config, args.config, ensure_dir=True)
+    cfg = update_config_device(cfg, args.device, args.num_threads)
     
     # copy config file to out dir
     out_dir = osp.join(cfg.output_dir, cfg.val.room_retrieval.method_name)
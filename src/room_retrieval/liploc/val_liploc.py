@@ -20,10 +20,12 @@ sys.path.append(ws_dir)
 # utils
 from utils import common
 from utils import torch_util
+from utils.embedding_cache import ScanEmbeddingCache, files_hash
+from utils.range_image_cache import range_image_key
 from utils.summary_board import SummaryBoard
 # from utils import visualisation
 # config
-from configs import update_config_room_retrival, config
+from configs import update_config_room_retrival, update_config_device, config
 # tester
 from engine.single_tester import SingleTester
 from engine import EpochBasedTrainer
@@ -55,8 +57,7 @@ class RoomRetrivalScore():
         self.split = ds_split
         
         # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(cfg.device)
         
         # dataloader
         start_time = time.time()
@@ -81,6 +82,11 @@ class RoomRetrivalScore():
         self.model.eval()
         self.loss_type = cfg.train.loss.loss_type
         
+        # scan embeddings, each range image is encoded once per checkpoint
+        self.use_scan_emb_cache = cfg.val.room_retrieval.use_scan_emb_cache
+        if self.use_scan_emb_cache:
+            self.registerScanEmbeddingCache(cfg)
+        
         # results
         self.val_room_retrieval_summary = SummaryBoard(adaptive=True)
         self.test_room_retrieval_summary = SummaryBoard(adaptive=True)
@@ -105,9 +111,9 @@ class RoomRetrivalScore():
         # load backbone
         liploc_pretrained_file = cfg.model.backbone3D.pretrained
         self.liploc_model = LipLocModel.Model(LipLoc_CFG)
-        self.liploc_model.load_state_dict(torch.load(liploc_pretrained_file), strict=True)
+        self.liploc_model.load_state_dict(torch.load(liploc_pretrained_file, map_location=torch.device('cpu')), strict=True)
 
-        # model to cuda 
+        # model to device 
         self.model = self.liploc_model
         if cfg.other.use_resume:
             assert os.path.isfile(cfg.other.resume), "=> no checkpoint found at '{}'".format(cfg.other.resume)
@@ -140,8 +146,42 @@ class RoomRetrivalScore():
         camera_imgs_embeddings = self.model.projection_camera(camera_imgs_features)
         return camera_imgs_embeddings
 
-    def room_retrieval_scan(self, data_dict, dataset):
-        # room retrieval with scan point cloud
+    def registerScanEmbeddingCache(self, cfg):
+        cache_root = cfg.val.room_retrieval.scan_emb_cache_dir
+        if not osp.isabs(cache_root):
+            cache_root = osp.join(cfg.data.root_dir, 'files', cache_root or 'Features3D/liploc_scan_emb_cache')
+        checkpoint_files = [cfg.model.backbone3D.pretrained, cfg.other.resume if cfg.other.use_resume else None]
+        # range images depend on the projection parameters
+        key_items = [files_hash(checkpoint_files), 'liploc', LipLoc_CFG.model, cfg.data.name, 
+                     cfg.data.pointcloud.use_saved_range, cfg.data.pointcloud.range_name] + range_image_key(cfg.data.pointcloud)
+        self.scan_emb_cache = ScanEmbeddingCache(cache_root, key_items)
+        
+    def precomputeScanEmbeddings(self, dataset):
+        # encode the range image of every scan of the split once, (C,) per scan on cpu
+        scan_embeddings = {}
+        if self.use_scan_emb_cache and self.scan_emb_cache.exists():
+            self.scan_emb_cache.load()
+            scan_embeddings = {scan_id: torch.from_numpy(np.array(self.scan_emb_cache.get(scan_id))).squeeze(0)
+                               for scan_id in dataset.range_imgs if scan_id in self.scan_emb_cache}
+        scan_ids = [scan_id for scan_id in dataset.range_imgs if scan_id not in scan_embeddings]
+        with torch.no_grad():
+            for scan_id in tqdm.tqdm(scan_ids, desc='precompute scan embeddings'):
+                range_img = torch_util.to_device(dataset.getRangeImagesTensor([scan_id]), self.device)
+                scan_embeddings[scan_id] = self.forward_lidar(range_img).squeeze(0).float().cpu()
+                if self.use_scan_emb_cache:
+                    self.scan_emb_cache.add(scan_id, scan_embeddings[scan_id].numpy()[None])
+        if self.use_scan_emb_cache and len(scan_ids) > 0:
+            self.scan_emb_cache.save()
+        return scan_embeddings
+        
+    def room_scores(self, img_embeddings, scan_ids, scan_embeddings):
+        # similarity of one image embedding to several scans in one matrix product
+        embeddings_3D = torch.stack([scan_embeddings[scan_id] for scan_id in scan_ids]) # (S, C)
+        sim = embeddings_3D@img_embeddings.T
+        return dict(zip(scan_ids, sim.reshape(-1).tolist()))
+
+    def room_retrieval_scan(self, data_dict, scan_embeddings):
+        # room retrieval with the precomputed range image embeddings
         batch_size = data_dict['batch_size']
         top_k_list = [1,3,5]
         top_k_recall_temporal = {"R@{}_T_S".format(k): 0. for k in top_k_list}
@@ -155,29 +195,15 @@ class RoomRetrivalScore():
             cur_scan_id = data_dict['scan_ids'][batch_i]
             
             # non-temporal retrieval
-            room_score_scans = {}
-            scans_embeddings = {}
-            ## get cur scan embeddings
-            cur_range_img =  dataset.getRangeImagesTensor([cur_scan_id])
-            cur_range_img = torch_util.to_cuda(cur_range_img)
-            scans_embeddings[cur_scan_id] = self.forward_lidar(cur_range_img).squeeze(0)
-            ## get candidate scan embeddings
             candidate_scans = data_dict['candidate_scan_ids_list'][batch_i]
-
-            for candidate_scan_id in candidate_scans:
-                range_img = dataset.getRangeImagesTensor([candidate_scan_id])
-                range_img = torch_util.to_cuda(range_img)
-                scans_embeddings[candidate_scan_id] = self.forward_lidar(range_img).squeeze(0)
-            ## calculate similarity
+            ## calculate similarity to cur scan and candidate scans
             start_time = time.time()
-            cur_img_embeddings = self.forward_camera(cur_img).squeeze(0)
+            with torch.no_grad():
+                cur_img_embeddings = self.forward_camera(cur_img).squeeze(0)
             img_forward_time += time.time() - start_time
-            scans_embeddings_cpu = torch_util.release_cuda_torch(scans_embeddings)
             cur_img_embeddings_cpu = torch_util.release_cuda_torch(cur_img_embeddings)
             start_time = time.time()
-            for candidate_scan_id, candidate_scan_embeddings in scans_embeddings_cpu.items():
-                sim = candidate_scan_embeddings@cur_img_embeddings_cpu.T
-                room_score_scans[candidate_scan_id] = sim.max().item()
+            room_score_scans = self.room_scores(cur_img_embeddings_cpu, [cur_scan_id] + list(candidate_scans), scan_embeddings)
             candidate_sim_cal_time = time.time() - start_time
             ## select top k similar scans
             room_sorted_by_scores =  [item[0] for item in sorted(room_score_scans.items(), key=lambda x: x[1], reverse=True)]
@@ -188,18 +214,11 @@ class RoomRetrivalScore():
                     
             # temporal retrieval
             temporal_scan_id = data_dict['temporal_scan_id_list'][batch_i]
-            ## get temporal depth scan embeddings
-            temporal_range_img = dataset.getRangeImagesTensor([temporal_scan_id])
-            temporal_range_img = torch_util.to_cuda(temporal_range_img)
-            scans_embeddings[temporal_scan_id] = self.forward_lidar(temporal_range_img).squeeze(0)
             ## remove cur scan embeddings
-            scans_embeddings.pop(cur_scan_id)
             room_score_scans.pop(cur_scan_id)
             ## calculate similarity
-            scans_embeddings_cpu = torch_util.release_cuda_torch(scans_embeddings)
             start_time = time.time()
-            sim = scans_embeddings_cpu[temporal_scan_id]@cur_img_embeddings_cpu.T
-            room_score_scans[temporal_scan_id] = sim.max().item()
+            room_score_scans.update(self.room_scores(cur_img_embeddings_cpu, [temporal_scan_id], scan_embeddings))
             ## select top k similar scans
             room_sorted_by_scores =  [item[0] for item in sorted(room_score_scans.items(), key=lambda x: x[1], reverse=True)]
             for k in top_k_list:
@@ -226,24 +245,26 @@ class RoomRetrivalScore():
 
     def room_retrieval_val_test(self):
         # val 
+        val_scan_embeddings = self.precomputeScanEmbeddings(self.val_dataset)
         data_dicts = tqdm.tqdm(enumerate(self.val_data_loader), total=len(self.val_data_loader))
         for iteration, data_dict in data_dicts:
-            data_dict = torch_util.to_cuda(data_dict)
-            result = self.room_retrieval_scan(data_dict, self.val_dataset)
+            data_dict = torch_util.to_device(data_dict, self.device)
+            result = self.room_retrieval_scan(data_dict, val_scan_embeddings)
             self.val_room_retrieval_summary.update_from_result_dict(result)
-            torch.cuda.empty_cache()
+            torch_util.empty_cache(self.device)
         val_items = self.val_room_retrieval_summary.tostringlist()
         # write to file
         val_file = osp.join(self.output_dir, 'val_result.txt')
         common.write_to_txt(val_file, val_items)
             
         # test
+        test_scan_embeddings = self.precomputeScanEmbeddings(self.test_dataset)
         data_dicts = tqdm.tqdm(enumerate(self.test_data_loader), total=len(self.test_data_loader))
         for iteration, data_dict in data_dicts:
-            data_dict = torch_util.to_cuda(data_dict)
-            result = self.room_retrieval_scan(data_dict, self.test_dataset)
+            data_dict = torch_util.to_device(data_dict, self.device)
+            result = self.room_retrieval_scan(data_dict, test_scan_embeddings)
             self.test_room_retrieval_summary.update_from_result_dict(result)
-            torch.cuda.empty_cache()
+            torch_util.empty_cache(self.device)
         test_items = self.test_room_retrieval_summary.tostringlist()
         # write to file
         test_file = osp.join(self.output_dir, 'test_result.txt')
@@ -253,6 +274,8 @@ class RoomRetrivalScore():
 def parse_args(parser=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', dest='config', default='', type=str, help='configuration file name')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
+    parser.add_argument('--num_threads', type=int, default=None, help='intra-op threads on cpu, overrides cfg.device.num_threads')
 
     args = parser.parse_args()
     return parser, args
@@ -261,6 +284,7 @@ def main():
     parser, args = parse_args()
     
     cfg = update_config_room_retrival(config, args.config, ensure_dir=True)
+    cfg = update_config_device(cfg, args.device, args.num_threads)
     
     # copy config file to out dir
     out_dir = osp.join(cfg.output_dir, cfg.val.room_retrieval.method_name)
@@ -24,10 +24,11 @@ from utils import common
 from utils import torch_util
 # from utils import visualisation
 # config
-from configs import update_config_room_retrival, config
+from configs import update_config_room_retrival, update_config_device, config
 # tester
 from engine.single_tester import SingleTester
 from utils.summary_board import SummaryBoard
+from utils.retrieval_record import RetrievalRecordWriter, record_dir
 # models
 import torch
 import torch.optim as optim
@@ -99,8 +100,7 @@ class RoomRetrivalScore():
         message = f'Data loader created: {loading_time:.3f}s collapsed.'
         
         # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(cfg.device)
         
         # model
         self.registerPatchObjectAlignerFromCfg(cfg)
@@ -110,12 +110,13 @@ class RoomRetrivalScore():
         # results
         self.val_room_retrieval_summary = SummaryBoard(adaptive=True)
         self.test_room_retrieval_summary = SummaryBoard(adaptive=True)
-        self.val_room_retrieval_record = {}
-        self.test_room_retrieval_record = {}
         
         # files
         self.output_dir = osp.join(cfg.output_dir, self.method_name)
         common.ensure_dir(self.output_dir)
+        # retrieval records, streamed to output_dir/retrieval_record_<split> during evaluation
+        self.val_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'val'))
+        self.test_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'test'))
 
     def load_snapshot(self, snapshot, fix_prefix=True):
         state_dict = torch.load(snapshot, map_location=torch.device('cpu'))
@@ -191,7 +192,7 @@ class RoomRetrivalScore():
         if cfg.other.use_resume:
             assert os.path.isfile(cfg.other.resume), 'Snapshot not found.'
             self.load_snapshot(cfg.other.resume)
-        # model to cuda 
+        # model to device 
         self.model.to(self.device)
         self.model.eval()
 
@@ -298,16 +299,15 @@ class RoomRetrivalScore():
             # retrieva_record
             scan_id = data_dict['scan_ids'][batch_i]
             if scan_id not in room_retrieval_record:
-                room_retrieval_record[scan_id] = {'frames_retrieval': {}}
-                room_retrieval_record[scan_id]['candidates_scan_ids'] = dataset.candidate_scans[scan_id]
-                room_retrieval_record[scan_id]['obj_ids'] = dataset.scene_graphs[scan_id]['obj_ids']
+                room_retrieval_record.addScan(scan_id, candidates_scan_ids = dataset.candidate_scans[scan_id], 
+                                              obj_ids = dataset.scene_graphs[scan_id]['obj_ids'])
             frame_idx = data_dict['frame_idxs'][batch_i]
             frame_retrieval = {
                 'frame_idx': frame_idx,
                 'matched_obj_obj_ids': matched_obj_obj_ids,
                 'room_score_scans_NT': room_score_scans_NT,
             }
-            room_retrieval_record[scan_id]['frames_retrieval'][frame_idx] = frame_retrieval
+            room_retrieval_record.addFrame(scan_id, frame_retrieval)
 
         # average over batch
         for k in top_k_list:
@@ -332,10 +332,10 @@ class RoomRetrivalScore():
         with torch.no_grad():
             data_dicts = tqdm.tqdm(enumerate(self.val_data_loader), total=len(self.val_data_loader))
             for iteration, data_dict in data_dicts:
-                data_dict = torch_util.to_cuda(data_dict)
+                data_dict = torch_util.to_device(data_dict, self.device)
                 result = self.room_retrieval_dict(data_dict, self.val_dataset, self.val_room_retrieval_record, True)
                 self.val_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
                 
                 max_num_candidates, min_num_candidates = get_max_min_num_candidates(
                     data_dict, max_num_candidates, min_num_candidates)
@@ -348,9 +348,8 @@ class RoomRetrivalScore():
         # write metric to file
         val_file = osp.join(self.output_dir, 'val_result.txt')
         common.write_to_txt(val_file, val_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_val.pkl')
-        common.write_pkl_data(self.val_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.val_room_retrieval_record.close()
         
         # test 
         # record number of candidates
@@ -358,10 +357,10 @@ class RoomRetrivalScore():
         with torch.no_grad():
             data_dicts = tqdm.tqdm(enumerate(self.test_data_loader), total=len(self.test_data_loader))
             for iteration, data_dict in data_dicts:
-                data_dict = torch_util.to_cuda(data_dict)
+                data_dict = torch_util.to_device(data_dict, self.device)
                 result = self.room_retrieval_dict(data_dict, self.test_dataset,self.test_room_retrieval_record, True)
                 self.test_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
                 
                 max_num_candidates, min_num_candidates = get_max_min_num_candidates(
                     data_dict, max_num_candidates, min_num_candidates)
@@ -374,14 +373,15 @@ class RoomRetrivalScore():
         # write metric to file
         test_file = osp.join(self.output_dir, 'test_result.txt')
         common.write_to_txt(test_file, test_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_test.pkl')
-        common.write_pkl_data(self.test_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.test_room_retrieval_record.close()
             
 
 def parse_args(parser=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', dest='config', default='', type=str, help='configuration file name')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
+    parser.add_argument('--num_threads', type=int, default=None, help='intra-op threads on cpu, overrides cfg.device.num_threads')
 
     args = parser.parse_args()
     return parser, args
@@ -390,6 +390,7 @@ def main():
     parser, args = parse_args()
     
     cfg = update_config_room_retrival(config, args.config, ensure_dir=True)
+    cfg = update_config_device(cfg, args.device, args.num_threads)
     
     # copy config file to out dir
     out_dir = osp.join(cfg.output_dir, cfg.val.room_retrieval.method_name)
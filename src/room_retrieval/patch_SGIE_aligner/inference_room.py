@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 from enum import unique
 from math import e
 import os 
@@ -24,12 +25,16 @@ sys.path.append(ws_dir)
 # utils
 from utils import common
 from utils import torch_util
+from utils.embedding_cache import ScanEmbeddingCache, files_hash
+from utils import room_scoring
+from utils.object_index import IVFPQIndex, scan_votes, shortlist_scans
 # from utils import visualisation
 # config
-from configs import update_config_room_retrival, config
+from configs import update_config_room_retrival, update_config_device, config
 # tester
 from engine.single_tester import SingleTester
 from utils.summary_board import SummaryBoard
+from utils.retrieval_record import RetrievalRecordWriter, record_dir
 # models
 import torch
 import torch.optim as optim
@@ -85,8 +90,10 @@ class RoomRetrivalScore():
         message = f'Data loader created: {loading_time:.3f}s collapsed.'
         
         # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        self.device = torch_util.setup_device(cfg.device)
+        ## bfloat16 autocast and channels-last backbone of the patch path and scene graph encoder
+        self.autocast_bf16 = cfg.device.autocast_bf16
+        self.channels_last = cfg.device.channels_last
         
         # model
         self.registerPatchObjectAlignerFromCfg(cfg)
@@ -94,15 +101,28 @@ class RoomRetrivalScore():
         self.loss_type = cfg.train.loss.loss_type
         self.use_tf_idf = cfg.data.cross_scene.use_tf_idf
         
+        # scene graph embedding cache
+        self.use_sg_emb_cache = cfg.val.room_retrieval.use_sg_emb_cache
+        if self.use_sg_emb_cache:
+            self.registerSceneGraphEmbeddingCache(cfg)
+        
+        # approximate object index of each split, built from the embedding cache
+        self.ann_cfg = cfg.val.room_retrieval.ann
+        self.use_ann = self.ann_cfg.use_ann
+        if self.use_ann:
+            assert self.use_sg_emb_cache, 'Object index is built from the scene graph embedding cache.'
+        self.obj_indexes = {}
+        
         # results
         self.val_room_retrieval_summary = SummaryBoard(adaptive=True)
         self.test_room_retrieval_summary = SummaryBoard(adaptive=True)
-        self.val_room_retrieval_record = {}
-        self.test_room_retrieval_record = {}
         
         # files
         self.output_dir = osp.join(cfg.output_dir, self.method_name)
         common.ensure_dir(self.output_dir)
+        # retrieval records, streamed to output_dir/retrieval_record_<split> during evaluation
+        self.val_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'val'))
+        self.test_room_retrieval_record = RetrievalRecordWriter(record_dir(self.output_dir, 'test'))
 
     def load_snapshot(self, snapshot, fix_prefix=True):
         state_dict = torch.load(snapshot, map_location=torch.device('cpu'))
@@ -189,10 +209,137 @@ class RoomRetrivalScore():
         if cfg.other.use_resume:
             assert os.path.isfile(cfg.other.resume), 'Snapshot not found.'
             self.load_snapshot(cfg.other.resume)
-        # model to cuda 
+        # model to device 
         self.model.to(self.device)
+        if self.channels_last and self.model.backbone is not None:
+            self.model.backbone.to(memory_format=torch.channels_last)
         self.model.eval()
 
+    def registerSceneGraphEmbeddingCache(self, cfg):
+        cache_root = cfg.val.room_retrieval.sg_emb_cache_dir
+        if not osp.isabs(cache_root):
+            cache_root = osp.join(cfg.data.root_dir, 'files', cache_root or 'Features3D/sg_emb_cache')
+        checkpoint_files = [cfg.other.resume if cfg.other.use_resume else None, 
+                            cfg.sgaligner.pretrained if cfg.sgaligner.use_pretrained else None]
+        ## everything the object embeddings depend on: checkpoint, scene graph data and encoder, autocast
+        multi_view_aggregator = cfg.sgaligner.model.multi_view_aggregator \
+            if hasattr(cfg.sgaligner.model, 'multi_view_aggregator') else None
+        key_items = [files_hash(checkpoint_files), '-'.join(cfg.sgaligner.modules), 
+                     cfg.sgaligner.val.pc_res, cfg.sgaligner.val.data_mode, cfg.sgaligner.model.rel_dim,
+                     cfg.data.scene_graph.obj_img_patch, cfg.data.scene_graph.obj_topk, cfg.sgaligner.use_pos_enc,
+                     cfg.sgaligner.use_predicted, cfg.sgaligner.scan_type, multi_view_aggregator, 
+                     self.autocast_bf16]
+        self.sg_emb_cache = ScanEmbeddingCache(cache_root, key_items)
+        
+    def precomputeSceneGraphEmbeddings(self, dataset):
+        # encode each scan's scene graph once and store the normalized object embeddings
+        if self.sg_emb_cache.exists():
+            self.sg_emb_cache.load()
+        scan_ids = [scan_id for scan_id in dataset.all_scans_split if scan_id not in self.sg_emb_cache]
+        if len(scan_ids) == 0:
+            return
+        with torch.no_grad():
+            for scan_id in tqdm.tqdm(scan_ids, desc='precompute scene graph embeddings'):
+                scene_graphs = dataset.collateSceneGraphs([scan_id])
+                scene_graphs = torch_util.to_device(scene_graphs, self.device)
+                # same autocast as forward_scene_graph_norm, cached and live scores agree
+                with torch_util.autocast(self.device, self.autocast_bf16):
+                    obj_3D_embeddings = self.model.forward_scene_graph({'scene_graphs': scene_graphs})  # (O, C*)
+                    obj_3D_embeddings = self.model.obj_embedding_encoder(obj_3D_embeddings) # (O, C*)
+                obj_3D_embeddings_norm = F.normalize(obj_3D_embeddings.float(), dim=-1)
+                self.sg_emb_cache.add(scan_id, obj_3D_embeddings_norm.cpu().numpy(), 
+                                      ids = dataset.scene_graphs[scan_id]['obj_ids'])
+        self.sg_emb_cache.save()
+        
+    def registerObjectIndex(self, dataset):
+        # index over the objects of all scans of the split, ids are rows of the gathered embeddings
+        scan_ids = list(dataset.all_scans_split)
+        obj_embeddings = torch.from_numpy(self.sg_emb_cache.gather(scan_ids))
+        obj_counts = [self.sg_emb_cache.offsets[scan_id][1] - self.sg_emb_cache.offsets[scan_id][0] 
+                      for scan_id in scan_ids]
+        obj_index = IVFPQIndex(self.ann_cfg.num_lists, self.ann_cfg.num_subvectors, 
+                               self.ann_cfg.num_codes, self.ann_cfg.nprobe)
+        ## in the dir of the embedding cache key (checkpoint, ...), keyed by the split and its scans
+        scans_key = hashlib.sha1('|'.join(scan_ids).encode()).hexdigest()[:16]
+        index_file = osp.join(self.sg_emb_cache.cache_dir, 'ivfpq_{}{}_{}_L{}_M{}_K{}.pkl'.format(
+            dataset.resplit, dataset.split, scans_key, 
+            self.ann_cfg.num_lists, self.ann_cfg.num_subvectors, self.ann_cfg.num_codes))
+        start_time = time.time()
+        if osp.isfile(index_file):
+            obj_index.load(index_file)
+        else:
+            obj_index.train(obj_embeddings)
+            obj_index.add(obj_embeddings, torch.arange(obj_embeddings.shape[0]))
+            obj_index.save(index_file)
+        print('Object index of {} objects in {} scans ready: {:.3f}s.'.format(
+            obj_embeddings.shape[0], len(scan_ids), time.time() - start_time))
+        self.obj_indexes[dataset.split] = {
+            'index': obj_index,
+            'scan_ids': scan_ids,
+            'scan_id2seg': {scan_id: seg for seg, scan_id in enumerate(scan_ids)},
+            'obj_segs': room_scoring.segment_ids(obj_counts),
+            'obj_counts': obj_counts,
+        }
+    
+    def annRoomScores(self, patch_features_norm, candidate_scans_batch, dataset):
+        # patches retrieve top-k objects, vote for scans, the shortlist is scored exactly
+        obj_index_dict = self.obj_indexes[dataset.split]
+        scan_ids, scan_id2seg = obj_index_dict['scan_ids'], obj_index_dict['scan_id2seg']
+        batch_size, num_patches = patch_features_norm.shape[:2]
+        top_k_objs = self.ann_cfg.top_k_objs
+        
+        obj_scores, obj_rows = obj_index_dict['index'].search(
+            patch_features_norm.reshape(batch_size*num_patches, -1), top_k_objs)
+        obj_segs = torch.where(obj_rows >= 0, obj_index_dict['obj_segs'][obj_rows.clamp(min=0)], obj_rows)
+        mask = room_scoring.candidate_mask(candidate_scans_batch, scan_id2seg, len(scan_ids))
+        votes = scan_votes(obj_scores.reshape(batch_size, num_patches, -1), 
+                           obj_segs.reshape(batch_size, num_patches, -1), len(scan_ids), mask)
+        shortlists = shortlist_scans(votes, self.ann_cfg.shortlist) # (B, N)
+        
+        # exact scores of the shortlisted scans
+        room_scores = []
+        for batch_i in range(batch_size):
+            shortlist = [scan_ids[seg] for seg in shortlists[batch_i].tolist() if mask[batch_i, seg]]
+            obj_embeddings_norm = torch.from_numpy(self.sg_emb_cache.gather(shortlist))
+            obj_counts = [obj_index_dict['obj_counts'][scan_id2seg[scan_id]] for scan_id in shortlist]
+            patch_scan_sim, patch_scan_match = room_scoring.patch_scan_similarity(
+                patch_features_norm[batch_i:batch_i+1], obj_embeddings_norm, 
+                room_scoring.segment_ids(obj_counts), len(shortlist)) # (1, P, N)
+            if self.use_tf_idf:
+                obj_sem_ids = torch.from_numpy(np.concatenate(
+                    [dataset.scene_graphs[scan_id]['obj_sem_ids'] for scan_id in shortlist]))
+                sem_counts = torch.from_numpy(
+                    dataset.scan_sem_counts[[dataset.scan_id2sem_row[scan_id] for scan_id in shortlist]])
+                scores = room_scoring.tf_idf_room_scores(patch_scan_sim, patch_scan_match, obj_sem_ids, 
+                    sem_counts, torch.ones((1, len(shortlist)), dtype=torch.bool))[0]
+            else:
+                scores = patch_scan_sim.sum(dim=1)[0]
+            room_scores.append(dict(zip(shortlist, scores.tolist())))
+        return room_scores
+    
+    def annRoomRetrieval(self, patch_features_norm, candidate_scans_batch, target_scan_ids, dataset, top_k_list):
+        start_time = time.time()
+        room_scores = self.annRoomScores(patch_features_norm, candidate_scans_batch, dataset)
+        retrieval_time = time.time() - start_time
+        hits = {k: 0. for k in top_k_list}
+        for room_scores_query, target_scan_id in zip(room_scores, target_scan_ids):
+            room_sorted = sorted(room_scores_query, key=room_scores_query.get, reverse=True)
+            for k in top_k_list:
+                if target_scan_id in room_sorted[:k]:
+                    hits[k] += 1
+        return hits, retrieval_time
+        
+    def forward_scene_graph_norm(self, data_dict):
+        # normalized object embeddings of all scene graphs in the batch, (O, C*)
+        if self.use_sg_emb_cache:
+            scene_ids = [scene_id[0] for scene_id in data_dict['scene_graphs']['scene_ids']]
+            obj_3D_embeddings_norm = torch.from_numpy(self.sg_emb_cache.gather(scene_ids))
+            return obj_3D_embeddings_norm.to(self.device)
+        with torch_util.autocast(self.device, self.autocast_bf16):
+            obj_3D_embeddings = self.model.forward_scene_graph(data_dict)  # (O, C*)
+            obj_3D_embeddings = self.model.obj_embedding_encoder(obj_3D_embeddings) # (O, C*)
+        return F.normalize(obj_3D_embeddings.float(), dim=-1)
+    
     def model_forward(self, data_dict):
         # assert self.cfg.data.img_encoding.use_feature != True, \
         #     'To measure runtime, please dont use pre-calculated features.'
@@ -202,7 +349,7 @@ class RoomRetrivalScore():
         forward_time = 0.
         patch_features_batch = None
         for i in range(batch_size):
-            with torch.no_grad():
+            with torch.no_grad(), torch_util.autocast(self.device, self.autocast_bf16):
                 start_time = time.time()
                 if self.cfg.data.img_encoding.use_feature:
                     features = data_dict['patch_features'][i:i+1]
@@ -210,6 +357,8 @@ class RoomRetrivalScore():
                     images = data_dict['images'] # (B, H, W, C)
                     image = images[i:i+1]
                     image = _to_channel_first(image)
+                    if self.channels_last:
+                        image = image.contiguous(memory_format=torch.channels_last)
                     features = self.model.backbone(image)[-1]
                     features = _to_channel_last(features)
                 patch_features = self.model.reduce_layers(features)
@@ -220,17 +369,15 @@ class RoomRetrivalScore():
                 # to channel last
                 patch_features = _to_channel_last(patch_features)
                 forward_time += time.time() - start_time
-                patch_features = patch_features.flatten(1, 2) # (B, P_H*P_W, C*)
+                patch_features = patch_features.float().flatten(1, 2) # (B, P_H*P_W, C*)
             patch_features_batch = patch_features if patch_features_batch is None \
                 else torch.cat([patch_features_batch, patch_features], dim=0)
         
         # object features
         start_time = time.time()
-        obj_3D_embeddings = self.model.forward_scene_graph(data_dict)  # (O, C*)
-        obj_3D_embeddings = self.model.obj_embedding_encoder(obj_3D_embeddings) # (O, C*)
-        obj_3D_embeddings_norm = F.normalize(obj_3D_embeddings, dim=-1)
+        obj_3D_embeddings_norm = self.forward_scene_graph_norm(data_dict) # (O, C*)
         scenegraph_emb_time = time.time() - start_time
-        num_objs = obj_3D_embeddings.shape[0]
+        num_objs = obj_3D_embeddings_norm.shape[0]
         num_scenes = len(data_dict['scene_graphs']['scene_ids']) 
         return patch_features_batch, obj_3D_embeddings_norm, forward_time, \
             scenegraph_emb_time, num_objs, num_scenes
@@ -244,7 +391,7 @@ class RoomRetrivalScore():
         forward_time = 0.
         patch_features_batch = None
         for i in range(batch_size):
-            with torch.no_grad():
+            with torch.no_grad(), torch_util.autocast(self.device, self.autocast_bf16):
                 start_time = time.time()
                 if self.cfg.data.img_encoding.use_feature:
                     features = data_dict['patch_features'][i:i+1]
@@ -252,19 +399,19 @@ class RoomRetrivalScore():
                     images = data_dict['images'] # (B, H, W, C)
                     image = images[i:i+1]
                     image = _to_channel_first(image)
+                    if self.channels_last:
+                        image = image.contiguous(memory_format=torch.channels_last)
                     features = self.model.backbone(image)[-1]
                     features = _to_channel_last(features)
                 patch_features = self.model.reduce_layers(features)
                 patch_features = self.model.patch_encoder(patch_features)
                 forward_time += time.time() - start_time
-                patch_features = patch_features.flatten(1, 2) # (B, P_H*P_W, C*)
+                patch_features = patch_features.float().flatten(1, 2) # (B, P_H*P_W, C*)
             patch_features_batch = patch_features if patch_features_batch is None \
                 else torch.cat([patch_features_batch, patch_features], dim=0)
         
         # object features
-        obj_3D_embeddings = self.model.forward_scene_graph(data_dict)  # (O, C*)
-        obj_3D_embeddings = self.model.obj_embedding_encoder(obj_3D_embeddings) # (O, C*)
-        obj_3D_embeddings_norm = F.normalize(obj_3D_embeddings, dim=-1)
+        obj_3D_embeddings_norm = self.forward_scene_graph_norm(data_dict) # (O, C*)
         
         # global descriptor
         patch_global_descriptor, obj_global_descriptors = None, None
@@ -276,6 +423,33 @@ class RoomRetrivalScore():
         return patch_features_batch, obj_3D_embeddings_norm, forward_time, patch_global_descriptor, obj_global_descriptors
 
     
+    def matchPatchesToCandidates(self, patch_scan_sim, patch_scan_match, assoc_data_dict, 
+                                 target_scan_id, scan_id2seg, obj_ids_cpu, obj_sem_ids):
+        # patch_scan_sim, patch_scan_match: (P, S) for one query
+        candidates_obj_sg_idxs = assoc_data_dict['scans_sg_obj_idxs'].cpu()
+        cadidate_scans_semantic_ids = assoc_data_dict['cadidate_scans_semantic_ids'].cpu()
+        candidate_segs = torch.tensor([scan_id2seg[scan_id] for scan_id in assoc_data_dict['candata_scan_obj_idxs']])
+        num_objs_all = obj_sem_ids.shape[0]
+        ## candidate idxs of all objects in the batch
+        candidate_idxs_all = torch.full((num_objs_all,), -1, dtype=torch.long)
+        candidate_idxs_all[candidates_obj_sg_idxs] = torch.arange(candidates_obj_sg_idxs.shape[0])
+        
+        ## matched objects between patch and the target room
+        matched_obj_sg_idxs = patch_scan_match[:, scan_id2seg[target_scan_id]]
+        matched_obj_ids = obj_ids_cpu[matched_obj_sg_idxs.numpy()]
+        matched_obj_cates = obj_sem_ids[matched_obj_sg_idxs]
+        ## matched objects between patch and all candidate rooms 
+        best_candidate_segs = candidate_segs[patch_scan_sim[:, candidate_segs].argmax(dim=1)]
+        matched_obj_sg_idxs_allscans = patch_scan_match.gather(1, best_candidate_segs.reshape(-1, 1)).reshape(-1)
+        matched_obj_idxs_allscans = candidate_idxs_all[matched_obj_sg_idxs_allscans]
+        matched_obj_cates_allscans = cadidate_scans_semantic_ids[matched_obj_idxs_allscans]
+        ### is correct for patch and object match of all candidate rooms 
+        ## from the sparse patch labels, the dense e1i_matrix is not in the batch with use_sparse_assoc
+        patch_obj_idxs = assoc_data_dict['patch_obj_idxs'].cpu().numpy()
+        is_patch_correct_allscans = \
+            ((patch_obj_idxs >= 0) & (patch_obj_idxs == matched_obj_idxs_allscans.numpy())).astype(np.float32)
+        return matched_obj_ids, matched_obj_cates, is_patch_correct_allscans, matched_obj_cates_allscans
+    
     def room_retrieval_dict(self, data_dict, dataset, room_retrieval_record, record_retrieval = False):
         
         # room retrieval with scan point cloud
@@ -289,7 +463,6 @@ class RoomRetrivalScore():
         retrieval_time_temporal = 0.
         retrieval_time_non_temporal = 0.
         img_forward_time = 0.
-        matched_obj_idxs, matched_obj_idxs_temp = None, None
         
         obj_ids = data_dict['scene_graphs']['obj_ids']
         obj_ids_cpu = torch_util.release_cuda_torch(obj_ids)
@@ -303,94 +476,99 @@ class RoomRetrivalScore():
             patch_features_batch, obj_3D_embeddings_norm, forward_time, \
                 scenegraph_emb_time, num_objs, num_scenes = \
                     self.model_forward(data_dict)
+        
+        ## start room retrieval in cpu
+        ## all scans of the batch are scored at once, shared by temporal and non-temporal retrieval
+        start_time = time.time()
+        scene_ids = [scene_id[0] for scene_id in data_dict['scene_graphs']['scene_ids']]
+        scan_id2seg = {scan_id: seg for seg, scan_id in enumerate(scene_ids)}
+        num_scans = len(scene_ids)
+        obj_3D_embeddings_norm_cpu = obj_3D_embeddings_norm.cpu()
+        obj_sem_ids = data_dict['scene_graphs']['obj_sem_ids'].cpu()
+        seg_ids = room_scoring.segment_ids(data_dict['scene_graphs']['tot_obj_count'])
+        patch_features_cpu_norm = F.normalize(patch_features_batch.cpu(), dim=-1) # (B, P, C*)
+        patch_scan_sim, patch_scan_match = room_scoring.patch_scan_similarity(
+            patch_features_cpu_norm, obj_3D_embeddings_norm_cpu, seg_ids, num_scans) # (B, P, S)
+        scoring_time = time.time() - start_time
+        
+        # candidates of each query
+        candidate_scans_NT = [list(assoc_data_dict['candata_scan_obj_idxs'].keys()) 
+                              for assoc_data_dict in data_dict['assoc_data_dict']]
+        candidate_scans_T = [list(assoc_data_dict['candata_scan_obj_idxs'].keys()) 
+                              for assoc_data_dict in data_dict['assoc_data_dict_temp']]
+        candidate_mask_NT = room_scoring.candidate_mask(candidate_scans_NT, scan_id2seg, num_scans)
+        candidate_mask_T = room_scoring.candidate_mask(candidate_scans_T, scan_id2seg, num_scans)
+        
+        # room scores
+        if self.use_tf_idf:
+            scan_sem_counts = data_dict['scene_graphs']['scan_sem_counts'].cpu()
+            start_time = time.time()
+            room_scores_NT = room_scoring.tf_idf_room_scores(
+                patch_scan_sim, patch_scan_match, obj_sem_ids, scan_sem_counts, candidate_mask_NT)
+            retrieval_time_non_temporal += time.time() - start_time
+            start_time = time.time()
+            room_scores_T = room_scoring.tf_idf_room_scores(
+                patch_scan_sim, patch_scan_match, obj_sem_ids, scan_sem_counts, candidate_mask_T)
+            retrieval_time_temporal += time.time() - start_time
+        else:
+            start_time = time.time()
+            room_scores_NT = room_scores_T = patch_scan_sim.sum(dim=1) # (B, S)
+            scoring_time += time.time() - start_time
+        
+        frame_matches = []
         for batch_i in range(batch_size):
-            patch_features = patch_features_batch[batch_i]
             # non-temporal
-            room_score_scans_NT = {}
             assoc_data_dict = data_dict['assoc_data_dict'][batch_i]
-            candidates_obj_sg_idxs = assoc_data_dict['scans_sg_obj_idxs']
-            candata_scan_obj_idxs = assoc_data_dict['candata_scan_obj_idxs']
-            cadidate_scans_semantic_ids = assoc_data_dict['cadidate_scans_semantic_ids']
-            if self.use_tf_idf:
-                # reweight_matrix_scans = assoc_data_dict['reweight_matrix_scans']
-                # reweight_matrix_scans = torch_util.release_cuda_torch(reweight_matrix_scans)
-                
-                """
-                nid -> number of patched of class that belongs to object i in image d
-                nd -> number of patches in image d
-                N -> total number of rooms
-                ni -> number of rooms that contains object i
-                """
-                n_scenes_per_sem = assoc_data_dict['n_scenes_per_sem'] # ni
-                n_scenes = len(candata_scan_obj_idxs) #  N
-                
             target_scan_id = data_dict['scan_ids'][batch_i]
-            candidates_objs_embeds_scan = obj_3D_embeddings_norm[candidates_obj_sg_idxs]
-            ## start room retrieval in cpu
-            patch_features_cpu = patch_features.cpu()
-            candata_scan_obj_idxs_cpu = torch_util.release_cuda_torch(candata_scan_obj_idxs)
-            obj_3D_embeddings_norm_cpu_scan = torch_util.release_cuda_torch(candidates_objs_embeds_scan)
-            cadidate_scans_semantic_ids = torch_util.release_cuda_torch(cadidate_scans_semantic_ids)
-            candidates_obj_embeds = {
-                candidate_scan_id: obj_3D_embeddings_norm_cpu_scan[candata_scan_obj_idxs_cpu[candidate_scan_id]] \
-                for candidate_scan_id in candata_scan_obj_idxs_cpu}
-            start_time = time.time()
-            patch_features_cpu_norm = F.normalize(patch_features_cpu, dim=1)
-            for candidate_scan_id in candidates_obj_embeds:
-                candidate_obj_embeds = candidates_obj_embeds[candidate_scan_id]
-                patch_obj_sim = patch_features_cpu_norm@candidate_obj_embeds.T
-                if self.use_tf_idf:
-                    # reweight_obj_matrixs = reweight_matrix_scans[candidate_scan_id] + 0.5
-                    # matched_candidate_objs_idxs = patch_obj_sim.argmax(dim=1)
-                    # matched_sim = patch_obj_sim.gather(1, matched_candidate_objs_idxs.unsqueeze(1)).squeeze(1)
-                    # reweight_patch_obj_sim = matched_sim * reweight_obj_matrixs[matched_candidate_objs_idxs]
-                    # score = reweight_patch_obj_sim.sum().item() / reweight_obj_matrixs.sum().item()
-                    
-                    matched_candidate_objs_idxs = patch_obj_sim.argmax(dim=1)
-                    matched_sim = patch_obj_sim.gather(1, matched_candidate_objs_idxs.unsqueeze(1)).squeeze(1)
-                    
-                    # get semantic category of matched objects
-                    matched_obj_sem_ids = cadidate_scans_semantic_ids[candata_scan_obj_idxs_cpu[candidate_scan_id]][matched_candidate_objs_idxs]
-                    unique_sem_ids, inverse_indices, counts = torch.unique(
-                        matched_obj_sem_ids, return_counts=True, return_inverse=True)
-                    reweight_matrix_uniq = torch.zeros_like(unique_sem_ids, dtype=torch.float32)
-                    for idx, (sem_id, count) in enumerate(zip(unique_sem_ids, counts)):
-                        N = torch.tensor(n_scenes, dtype=torch.float32)
-                        ni = torch.tensor(len(n_scenes_per_sem[sem_id.item()]), dtype=torch.float32)
-                        nid = torch.tensor( count, dtype=torch.float32)
-                        nd = torch.tensor(matched_sim.shape[0], dtype=torch.float32)
-                        # tf-idf
-                        reweight_matrix_uniq[idx] = nid * (1 + torch.log(N/ni)) / nd
-                    reweight_matrix = reweight_matrix_uniq[inverse_indices]
-                    matched_candidate_obj_sim = matched_sim * reweight_matrix
-                    score = matched_candidate_obj_sim.sum().item() / reweight_matrix.sum().item()
-                else:
-                    matched_candidate_obj_sim = torch.max(patch_obj_sim, dim=1)[0]
-                    score = matched_candidate_obj_sim.sum().item()
-                room_score_scans_NT[candidate_scan_id] = score
-            room_sorted_by_scores_NT =  [item[0] for item in sorted(room_score_scans_NT.items(), key=lambda x: x[1], reverse=True)]
-            for k in top_k_list:
-                if target_scan_id in room_sorted_by_scores_NT[:k]:
-                    top_k_recall_non_temporal["R@{}_NT_S".format(k)] += 1
-            retrieval_time_non_temporal += time.time() - start_time
-            
-            matched_obj_idxs = (patch_features_cpu_norm @ candidates_obj_embeds[target_scan_id].T).argmax(dim=1)
-            obj_ids_cpu_scan = obj_ids_cpu[candidates_obj_sg_idxs.cpu()][candata_scan_obj_idxs_cpu[target_scan_id]]
-            matched_obj_ids = obj_ids_cpu_scan[matched_obj_idxs]
-            matched_obj_cates = cadidate_scans_semantic_ids[candata_scan_obj_idxs_cpu[target_scan_id]][matched_obj_idxs]
-            ## calculate matched object ids between patch and all candidate rooms 
-            matched_obj_idxs_allscans = (patch_features_cpu_norm @ obj_3D_embeddings_norm_cpu_scan.T).argmax(dim=1)
-            matched_obj_cates_allscans = cadidate_scans_semantic_ids[matched_obj_idxs_allscans]
-            ### is correct for patch and object match of all candidate rooms 
-            e1i_matrix = assoc_data_dict['e1i_matrix'].cpu().numpy()
-            is_patch_correct_allscans = \
-                np.take_along_axis(e1i_matrix, matched_obj_idxs_allscans.reshape(-1,1).cpu().numpy(), axis=1).reshape(-1)
-            
+            matches_NT = self.matchPatchesToCandidates(patch_scan_sim[batch_i], patch_scan_match[batch_i], 
+                assoc_data_dict, target_scan_id, scan_id2seg, obj_ids_cpu, obj_sem_ids)
+            # temporal
+            assoc_data_dict_temp = data_dict['assoc_data_dict_temp'][batch_i]
+            target_scan_id_temp = data_dict['scan_ids_temp'][batch_i]
+            matches_T = self.matchPatchesToCandidates(patch_scan_sim[batch_i], patch_scan_match[batch_i], 
+                assoc_data_dict_temp, target_scan_id_temp, scan_id2seg, obj_ids_cpu, obj_sem_ids)
+            frame_matches.append((matches_NT, matches_T))
+        
+        # top-k recall
+        start_time = time.time()
+        target_segs_NT = [scan_id2seg[scan_id] for scan_id in data_dict['scan_ids']]
+        hits_NT = room_scoring.topk_hits(room_scores_NT, candidate_mask_NT, target_segs_NT, top_k_list)
+        retrieval_time_non_temporal += time.time() - start_time + scoring_time
+        start_time = time.time()
+        target_segs_T = [scan_id2seg[scan_id] for scan_id in data_dict['scan_ids_temp']]
+        hits_T = room_scoring.topk_hits(room_scores_T, candidate_mask_T, target_segs_T, top_k_list)
+        retrieval_time_temporal += time.time() - start_time + scoring_time
+        for k in top_k_list:
+            top_k_recall_non_temporal["R@{}_NT_S".format(k)] += hits_NT[k].sum().item()
+            top_k_recall_temporal["R@{}_T_S".format(k)] += hits_T[k].sum().item()
+        room_scores_NT_list = room_scores_NT.tolist()
+        room_scores_T_list = room_scores_T.tolist()
+        
+        # approximate retrieval with the object index, compared to the exhaustive scores above
+        if self.use_ann:
+            hits_ann_NT, retrieval_time_ann_NT = self.annRoomRetrieval(
+                patch_features_cpu_norm, candidate_scans_NT, data_dict['scan_ids'], dataset, top_k_list)
+            hits_ann_T, retrieval_time_ann_T = self.annRoomRetrieval(
+                patch_features_cpu_norm, candidate_scans_T, data_dict['scan_ids_temp'], dataset, top_k_list)
+        
+        for batch_i in range(batch_size):
+            target_scan_id = data_dict['scan_ids'][batch_i]
+            target_scan_id_temp = data_dict['scan_ids_temp'][batch_i]
+            assoc_data_dict = data_dict['assoc_data_dict'][batch_i]
+            assoc_data_dict_temp = data_dict['assoc_data_dict_temp'][batch_i]
+            (matched_obj_ids, matched_obj_cates, is_patch_correct_allscans, matched_obj_cates_allscans), \
+                (matched_obj_ids_temp, matched_obj_cates_temp, is_patch_correct_allscans_temp, 
+                 matched_obj_cates_allscans_temp) = frame_matches[batch_i]
+            room_score_scans_NT = {candidate_scan_id: room_scores_NT_list[batch_i][scan_id2seg[candidate_scan_id]] 
+                                   for candidate_scan_id in candidate_scans_NT[batch_i]}
+            room_score_scans_T = {candidate_scan_id: room_scores_T_list[batch_i][scan_id2seg[candidate_scan_id]] 
+                                   for candidate_scan_id in candidate_scans_T[batch_i]}
             
             if self.use_global_descriptor:
                 patch_global_descriptor_pb = patch_global_descriptor_norm[batch_i:batch_i+1]
+                # non-temporal
                 room_score_global_NT = {}
-                for candidate_scan_id in candata_scan_obj_idxs.keys():
+                for candidate_scan_id in candidate_scans_NT[batch_i]:
                     candidate_global_descriptor = obj_global_descriptors[candidate_scan_id]
                     candidate_global_descriptor_norm = F.normalize(candidate_global_descriptor, dim=1)
                     room_score_global_NT[candidate_scan_id] = patch_global_descriptor_pb@candidate_global_descriptor_norm.T
@@ -399,95 +577,16 @@ class RoomRetrivalScore():
                 for k in top_k_list:
                     if target_scan_id in room_sorted_global_scores_NT[:k]:
                         top_k_recall_global_non_temporal["R@{}_NT_G".format(k)] += 1
-                
-            # temporal
-            room_score_scans_T = {}
-            assoc_data_dict_temp = data_dict['assoc_data_dict_temp'][batch_i]
-            candidates_obj_sg_idxs = assoc_data_dict_temp['scans_sg_obj_idxs']
-            candata_scan_obj_idxs = assoc_data_dict_temp['candata_scan_obj_idxs']
-            cadidate_scans_semantic_ids = assoc_data_dict_temp['cadidate_scans_semantic_ids']
-            if self.use_tf_idf:
-                # reweight_matrix_scans = assoc_data_dict_temp['reweight_matrix_scans']
-                # reweight_matrix_scans = torch_util.release_cuda_torch(reweight_matrix_scans)
-                """
-                nid -> number of patched of class that belongs to object i in image d
-                nd -> number of patches in image d
-                N -> total number of rooms
-                ni -> number of rooms that contains object i
-                """
-                n_scenes_per_sem = assoc_data_dict_temp['n_scenes_per_sem'] # ni
-                n_scenes = len(candata_scan_obj_idxs) #  N
-            target_scan_id = data_dict['scan_ids_temp'][batch_i]
-            candidates_objs_embeds_scan = obj_3D_embeddings_norm[candidates_obj_sg_idxs]
-            ## start room retrieval in cpu
-            candata_scan_obj_idxs_cpu = torch_util.release_cuda_torch(candata_scan_obj_idxs)
-            obj_3D_embeddings_norm_cpu_scan = torch_util.release_cuda_torch(candidates_objs_embeds_scan)
-            cadidate_scans_semantic_ids = torch_util.release_cuda_torch(cadidate_scans_semantic_ids)
-            candidates_obj_embeds = {
-                candidate_scan_id: obj_3D_embeddings_norm_cpu_scan[candata_scan_obj_idxs_cpu[candidate_scan_id]] \
-                for candidate_scan_id in candata_scan_obj_idxs_cpu}
-            start_time = time.time()
-            for candidate_scan_id in candidates_obj_embeds:
-                candidate_obj_embeds = candidates_obj_embeds[candidate_scan_id]
-                patch_obj_sim = patch_features_cpu_norm@candidate_obj_embeds.T
-                if self.use_tf_idf:
-                    # reweight_obj_matrixs = reweight_matrix_scans[candidate_scan_id]
-                    # matched_candidate_objs_idxs = patch_obj_sim.argmax(dim=1)
-                    # matched_sim = patch_obj_sim.gather(1, matched_candidate_objs_idxs.unsqueeze(1)).squeeze(1)
-                    # reweight_patch_obj_sim = matched_sim * reweight_obj_matrixs[matched_candidate_objs_idxs]
-                    # score = reweight_patch_obj_sim.sum().item() / reweight_obj_matrixs.sum().item()
-                    matched_candidate_objs_idxs = patch_obj_sim.argmax(dim=1)
-                    matched_sim = patch_obj_sim.gather(1, matched_candidate_objs_idxs.unsqueeze(1)).squeeze(1)
-                    # get semantic category of matched objects
-                    matched_obj_sem_ids = cadidate_scans_semantic_ids[candata_scan_obj_idxs_cpu[candidate_scan_id]][matched_candidate_objs_idxs]
-                    unique_sem_ids, inverse_indices, counts = torch.unique(
-                        matched_obj_sem_ids, return_counts=True, return_inverse=True)
-                    reweight_matrix_uniq = torch.zeros_like(unique_sem_ids, dtype=torch.float32)
-                    for idx, (sem_id, count) in enumerate(zip(unique_sem_ids, counts)):
-                        N = torch.tensor(n_scenes, dtype=torch.float32)
-                        ni = torch.tensor(len(n_scenes_per_sem[sem_id.item()]), dtype=torch.float32)
-                        nid = torch.tensor( count, dtype=torch.float32)
-                        nd = torch.tensor(matched_sim.shape[0], dtype=torch.float32)
-                        # tf-idf
-                        reweight_matrix_uniq[idx] = nid * (1 + torch.log(N/ni)) / nd
-                    reweight_matrix = reweight_matrix_uniq[inverse_indices]
-                    matched_candidate_obj_sim = matched_sim * reweight_matrix
-                    score = matched_candidate_obj_sim.sum().item() / reweight_matrix.sum().item()
-                else:
-                    matched_candidate_obj_sim = torch.max(patch_obj_sim, dim=1)[0]
-                    score = matched_candidate_obj_sim.sum().item()
-                room_score_scans_T[candidate_scan_id] = score
-
-            room_sorted_by_scores = [item[0] for item in sorted(room_score_scans_T.items(), key=lambda x: x[1], reverse=True)]
-            for k in top_k_list:
-                if target_scan_id in room_sorted_by_scores[:k]:
-                    top_k_recall_temporal["R@{}_T_S".format(k)] += 1
-            retrieval_time_temporal += time.time() - start_time
-            
-            ## calculate matched object ids between patch and the target room
-            matched_obj_idxs_temp = (patch_features_cpu_norm @ candidates_obj_embeds[target_scan_id].T).argmax(dim=1)
-            obj_ids_cpu_scan = obj_ids_cpu[candidates_obj_sg_idxs.cpu()][candata_scan_obj_idxs_cpu[target_scan_id]]
-            matched_obj_ids_temp = obj_ids_cpu_scan[matched_obj_idxs_temp]
-            matched_obj_cates_temp = cadidate_scans_semantic_ids[candata_scan_obj_idxs_cpu[target_scan_id]][matched_obj_idxs_temp]
-            ## calculate matched object ids between patch and all candidate rooms 
-            matched_obj_idxs_allscans = (patch_features_cpu_norm @ obj_3D_embeddings_norm_cpu_scan.T).argmax(dim=1)
-            matched_obj_cates_allscans_temp = cadidate_scans_semantic_ids[matched_obj_idxs_allscans]
-            ### is correct for patch and object match of all candidate rooms 
-            e1i_matrix_temp = assoc_data_dict_temp['e1i_matrix'].cpu().numpy()
-            is_patch_correct_allscans_temp = \
-                np.take_along_axis(e1i_matrix_temp, matched_obj_idxs_allscans.reshape(-1,1).cpu().numpy(), axis=1).reshape(-1)
-            
-            if self.use_global_descriptor:
-                patch_global_descriptor_pb = patch_global_descriptor_norm[batch_i:batch_i+1]
+                # temporal
                 room_score_global_T = {}
-                for candidate_scan_id in candata_scan_obj_idxs.keys():
+                for candidate_scan_id in candidate_scans_T[batch_i]:
                     candidate_global_descriptor = obj_global_descriptors[candidate_scan_id]
                     candidate_global_descriptor_norm = F.normalize(candidate_global_descriptor, dim=1)
                     room_score_global_T[candidate_scan_id] = patch_global_descriptor_pb@candidate_global_descriptor_norm.T
                 room_sorted_global_scores_T =  [item[0] for item in 
                                                     sorted(room_score_global_T.items(), key=lambda x: x[1], reverse=True)]
                 for k in top_k_list:
-                    if target_scan_id in room_sorted_global_scores_T[:k]:
+                    if target_scan_id_temp in room_sorted_global_scores_T[:k]:
                         top_k_recall_global["R@{}_T_G".format(k)] += 1
             
             ## gt
@@ -498,9 +597,9 @@ class RoomRetrivalScore():
             # retrieva_record
             scan_id = data_dict['scan_ids'][batch_i]
             if scan_id not in room_retrieval_record:
-                room_retrieval_record[scan_id] = {'frames_retrieval': {}, 'sem_cat_id2name': dataset.obj_nyu40_id2name}
-                room_retrieval_record[scan_id]['candidates_scan_ids'] = dataset.candidate_scans[scan_id]
-                room_retrieval_record[scan_id]['obj_ids'] = dataset.scene_graphs[scan_id]['obj_ids']
+                room_retrieval_record.addScan(scan_id, sem_cat_id2name = dataset.obj_nyu40_id2name, 
+                                              candidates_scan_ids = dataset.candidate_scans[scan_id], 
+                                              obj_ids = dataset.scene_graphs[scan_id]['obj_ids'])
             frame_idx = data_dict['frame_idxs'][batch_i]
             frame_retrieval = {
                 'frame_idx': frame_idx,
@@ -527,7 +626,7 @@ class RoomRetrivalScore():
                 'room_score_scans_NT': room_score_scans_NT,
                 'room_score_scans_T': room_score_scans_T,
             }
-            room_retrieval_record[scan_id]['frames_retrieval'][frame_idx] = frame_retrieval
+            room_retrieval_record.addFrame(scan_id, frame_retrieval)
 
         # average over batch
         for k in top_k_list:
@@ -549,6 +648,12 @@ class RoomRetrivalScore():
         }
         result.update(top_k_recall_temporal)
         result.update(top_k_recall_non_temporal)
+        if self.use_ann:
+            result['time_NT_ANN'] = retrieval_time_ann_NT / (1.0*batch_size)
+            result['time_T_ANN'] = retrieval_time_ann_T / (1.0*batch_size)
+            for k in top_k_list:
+                result["R@{}_NT_ANN".format(k)] = hits_ann_NT[k] / (1.0*batch_size)
+                result["R@{}_T_ANN".format(k)] = hits_ann_T[k] / (1.0*batch_size)
         if self.use_global_descriptor:
             result.update(top_k_recall_global)
             result.update(top_k_recall_global_non_temporal)
@@ -556,54 +661,60 @@ class RoomRetrivalScore():
         return result
 
     def room_retrieval_val(self):
+        # scene graphs embeddings are computed once for all val&test scans
+        if self.use_sg_emb_cache:
+            self.precomputeSceneGraphEmbeddings(self.val_dataset)
+            self.precomputeSceneGraphEmbeddings(self.test_dataset)
+        if self.use_ann:
+            self.registerObjectIndex(self.val_dataset)
+            self.registerObjectIndex(self.test_dataset)
+        
         # val 
         with torch.no_grad():
             data_dicts = tqdm.tqdm(enumerate(self.val_data_loader), total=len(self.val_data_loader))
             for iteration, data_dict in data_dicts:
-                data_dict = torch_util.to_cuda(data_dict)
+                data_dict = torch_util.to_device(data_dict, self.device)
                 result = self.room_retrieval_dict(data_dict, self.val_dataset, self.val_room_retrieval_record, True)
                 self.val_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
         val_items = self.val_room_retrieval_summary.tostringlist()
         # write metric to file
         val_file = osp.join(self.output_dir, 'val_result.txt')
         common.write_to_txt(val_file, val_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_val.pkl')
-        common.write_pkl_data(self.val_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.val_room_retrieval_record.close()
         ## statistics analysis
         val_retrieval_statistics = RetrievalStatistics(
             retrieval_records_dir = self.output_dir,  
-            retrieval_records = self.val_room_retrieval_record, 
-                split= 'val')
+            split= 'val')
         val_retrieval_statistics.generateStaistics()
         
         # test 
         with torch.no_grad():
             data_dicts = tqdm.tqdm(enumerate(self.test_data_loader), total=len(self.test_data_loader))
             for iteration, data_dict in data_dicts:
-                data_dict = torch_util.to_cuda(data_dict)
+                data_dict = torch_util.to_device(data_dict, self.device)
                 result = self.room_retrieval_dict(data_dict, self.test_dataset,self.test_room_retrieval_record, True)
                 self.test_room_retrieval_summary.update_from_result_dict(result)
-                torch.cuda.empty_cache()
+                torch_util.empty_cache(self.device)
         test_items = self.test_room_retrieval_summary.tostringlist()
         # write metric to file
         test_file = osp.join(self.output_dir, 'test_result.txt')
         common.write_to_txt(test_file, test_items)
-        # write retrieval record to file
-        retrieval_record_file = osp.join(self.output_dir, 'retrieval_record_test.pkl')
-        common.write_pkl_data(self.test_room_retrieval_record, retrieval_record_file)
+        # close the retrieval record streamed to file
+        self.test_room_retrieval_record.close()
             
         ## statistics analysis
         test_retrieval_statistics = RetrievalStatistics(
-            retrieval_records_dir = self.output_dir,  retrieval_records = self.test_room_retrieval_record,
-                split= 'test')
+            retrieval_records_dir = self.output_dir,  split= 'test')
         test_retrieval_statistics.generateStaistics()
             
 
 def parse_args(parser=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('--config', dest='config', default='', type=str, help='configuration file name')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
+    parser.add_argument('--num_threads', type=int, default=None, help='intra-op threads on cpu, overrides cfg.device.num_threads')
 
     args = parser.parse_args()
     return parser, args
@@ -612,6 +723,7 @@ def main():
     parser, args = parse_args()
     
     cfg = update_config_room_retrival(config, args.config, ensure_dir=True)
+    cfg = update_config_device(cfg, args.device, args.num_threads)
     
     # copy config file to out dir
     out_dir = osp.join(cfg.output_dir, cfg.val.room_retrieval.method_name)
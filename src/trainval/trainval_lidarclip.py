@@ -37,9 +37,7 @@ class Trainer(EpochBasedTrainer):
         # cfg
         self.cfg = cfg  
         
-        # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        # device set up by the base trainer, from cfg.device or --device
         
         # get data loader
         start_time = time.time()
@@ -89,7 +87,7 @@ class Trainer(EpochBasedTrainer):
         backbone3d_pretrained_file = cfg.model.backbone3D.pretrained
         dim_3d = cfg.model.backbone3D.dim_3d
         self.backbone3d = LidarEncoderSST(backbone3d_cfg_file, dim_3d)
-        self.backbone3d.load_state_dict(torch.load(backbone3d_pretrained_file), strict=False)
+        self.backbone3d.load_state_dict(torch.load(backbone3d_pretrained_file, map_location=torch.device('cpu')), strict=False)
 
         # model to cuda 
         self.model = self.backbone3d
@@ -169,9 +167,9 @@ class Trainer(EpochBasedTrainer):
         
         embeddings = {}
         if self.train_data_type == 'scan':
-            pcs_batch = torch_util.to_cuda([self.train_scan_pcs[scan_id].contiguous() for scan_id in data_dict['scan_ids']])
+            pcs_batch = torch_util.to_device([self.train_scan_pcs[scan_id].contiguous() for scan_id in data_dict['scan_ids']], self.device)
         elif self.train_data_type == 'depth':
-            pcs_batch = torch_util.to_cuda(data_dict['pcs_batch'])
+            pcs_batch = torch_util.to_device(data_dict['pcs_batch'], self.device)
         else:
             raise NotImplementedError('Data type {} not implemented.'.format(self.train_data_type))
         embeddings_3D,_ = self.model_forward(pcs_batch)
@@ -198,9 +196,9 @@ class Trainer(EpochBasedTrainer):
         with torch.no_grad():
             embeddings = {}
             if self.train_data_type == 'scan':
-                pcs_batch = torch_util.to_cuda([self.val_scan_pcs[scan_id].contiguous() for scan_id in data_dict['scan_ids']])
+                pcs_batch = torch_util.to_device([self.val_scan_pcs[scan_id].contiguous() for scan_id in data_dict['scan_ids']], self.device)
             elif self.train_data_type == 'depth':
-                pcs_batch = torch_util.to_cuda(data_dict['pcs_batch'])
+                pcs_batch = torch_util.to_device(data_dict['pcs_batch'], self.device)
             else:
                 raise NotImplementedError('Data type {} not implemented.'.format(self.train_data_type))
             embeddings_3D,_ = self.model_forward(pcs_batch)
@@ -246,13 +244,13 @@ class Trainer(EpochBasedTrainer):
             scans_depthmaps_embeddings = {}
             ## get cur depth scan embeddings
             # curr_scan_depthmap_pcs = data_dict['curr_scan_depthmap_pcs_list'][batch_i]
-            curr_scan_depthmap_pcs = torch_util.to_cuda(self.val_depthmap_pcs[cur_scan_id]) 
+            curr_scan_depthmap_pcs = torch_util.to_device(self.val_depthmap_pcs[cur_scan_id], self.device) 
             depthmaps_pcs = [depthmap_pc.contiguous() for frame_idx, depthmap_pc in curr_scan_depthmap_pcs.items()]
             scans_depthmaps_embeddings[cur_scan_id], _ = self.model_forward(depthmaps_pcs)
             ## get candidate depth scan embeddings
             # candidate_depthmap_pcs = data_dict['candidate_depthmap_pcs_list'][batch_i]
             candidate_scans = data_dict['candidate_scan_ids_list'][batch_i]
-            candidate_depthmap_pcs = {scan_id: torch_util.to_cuda(self.val_depthmap_pcs[scan_id]) for scan_id in candidate_scans}
+            candidate_depthmap_pcs = {scan_id: torch_util.to_device(self.val_depthmap_pcs[scan_id], self.device) for scan_id in candidate_scans}
             for candidate_scan_id, depthmap_pcs in candidate_depthmap_pcs.items():
                 depthmaps_pcs = [depthmap_pc.contiguous() for frame_idx, depthmap_pc in depthmap_pcs.items()]
                 scans_depthmaps_embeddings[candidate_scan_id], _ = self.model_forward(depthmaps_pcs)
@@ -274,7 +272,7 @@ class Trainer(EpochBasedTrainer):
             temporal_scan_id = data_dict['temporal_scan_id_list'][batch_i]
             ## get temporal depth scan embeddings
             # temporal_scan_depthmap_pcs = data_dict['temporal_scan_depthmap_pcs_list'][batch_i]
-            temporal_scan_depthmap_pcs = torch_util.to_cuda(self.val_depthmap_pcs[temporal_scan_id])
+            temporal_scan_depthmap_pcs = torch_util.to_device(self.val_depthmap_pcs[temporal_scan_id], self.device)
             depthmaps_pcs = [depthmap_pc.contiguous() for frame_idx, depthmap_pc in temporal_scan_depthmap_pcs.items()]
             scans_depthmaps_embeddings[temporal_scan_id],_ = self.model_forward(depthmaps_pcs)
             ## remove cur scan embeddings
@@ -325,13 +323,13 @@ class Trainer(EpochBasedTrainer):
             scans_pcs_embeddings = {}
             ## get cur scan embeddings
             # curr_scan_pcs = data_dict['curr_scan_pcs_list'][batch_i]
-            curr_scan_pcs = torch_util.to_cuda(self.val_scan_pcs[cur_scan_id])
+            curr_scan_pcs = torch_util.to_device(self.val_scan_pcs[cur_scan_id], self.device)
             pcs = [curr_scan_pcs.contiguous()]
             scans_pcs_embeddings[cur_scan_id], _ = self.model_forward(pcs)
             ## get candidate scan embeddings
             # candidate_scans_pcs = data_dict['candidate_scan_pcs_list'][batch_i]
             candidate_scans = data_dict['candidate_scan_ids_list'][batch_i]
-            candidate_scans_pcs = {scan_id: torch_util.to_cuda(self.val_scan_pcs[scan_id]) for scan_id in candidate_scans}
+            candidate_scans_pcs = {scan_id: torch_util.to_device(self.val_scan_pcs[scan_id], self.device) for scan_id in candidate_scans}
             for candidate_scan_id, scans_pcs in candidate_scans_pcs.items():
                 pcs = [scans_pcs.contiguous()]
                 scans_pcs_embeddings[candidate_scan_id], _ = self.model_forward(pcs)
@@ -353,7 +351,7 @@ class Trainer(EpochBasedTrainer):
             temporal_scan_id = data_dict['temporal_scan_id_list'][batch_i]
             ## get temporal depth scan embeddings
             # temporal_scan_pcs = data_dict['temporal_scan_pcs_list'][batch_i]
-            temporal_scan_pcs = torch_util.to_cuda(self.val_scan_pcs[temporal_scan_id])
+            temporal_scan_pcs = torch_util.to_device(self.val_scan_pcs[temporal_scan_id], self.device)
             pcs = [temporal_scan_pcs.contiguous()]
             scans_pcs_embeddings[temporal_scan_id],_ = self.model_forward(pcs)
             ## remove cur scan embeddings
@@ -407,6 +405,7 @@ def parse_args(parser=None):
     parser.add_argument('--epoch', type=int, default=None, help='load epoch')
     parser.add_argument('--log_steps', type=int, default=500, help='logging steps')
     parser.add_argument('--local_rank', type=int, default=-1, help='local rank for ddp')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
 
     args = parser.parse_args()
     return parser, args
@@ -49,9 +49,7 @@ class Trainer(EpochBasedTrainer):
         # cfg
         self.cfg = cfg  
         
-        # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        # device set up by the base trainer, from cfg.device or --device
         
         # get data loader
         start_time = time.time()
@@ -80,7 +78,7 @@ class Trainer(EpochBasedTrainer):
         # load backbone
         liploc_pretrained_file = cfg.model.backbone3D.pretrained
         self.liploc_model = LipLocModel.Model(LipLoc_CFG)
-        self.liploc_model.load_state_dict(torch.load(liploc_pretrained_file), strict=True)
+        self.liploc_model.load_state_dict(torch.load(liploc_pretrained_file, map_location=torch.device('cpu')), strict=True)
 
         # model to cuda 
         self.model = self.liploc_model
@@ -225,14 +223,14 @@ class Trainer(EpochBasedTrainer):
             scans_embeddings = {}
             ## get cur scan embeddings
             cur_range_img =  self.val_dataset.getRangeImagesTensor([cur_scan_id])
-            cur_range_img = torch_util.to_cuda(cur_range_img)
+            cur_range_img = torch_util.to_device(cur_range_img, self.device)
             scans_embeddings[cur_scan_id] = self.forward_lidar(cur_range_img).squeeze(0)
             ## get candidate scan embeddings
             candidate_scans = data_dict['candidate_scan_ids_list'][batch_i]
 
             for candidate_scan_id in candidate_scans:
                 range_img = self.val_dataset.getRangeImagesTensor([candidate_scan_id])
-                range_img = torch_util.to_cuda(range_img)
+                range_img = torch_util.to_device(range_img, self.device)
                 scans_embeddings[candidate_scan_id] = self.forward_lidar(range_img).squeeze(0)
             ## calculate similarity
             cur_img_embeddings = self.forward_camera(cur_img).squeeze(0)
@@ -249,7 +247,7 @@ class Trainer(EpochBasedTrainer):
             temporal_scan_id = data_dict['temporal_scan_id_list'][batch_i]
             ## get temporal depth scan embeddings
             temporal_range_img = self.val_dataset.getRangeImagesTensor([temporal_scan_id])
-            temporal_range_img = torch_util.to_cuda(temporal_range_img)
+            temporal_range_img = torch_util.to_device(temporal_range_img, self.device)
             scans_embeddings[temporal_scan_id] = self.forward_lidar(temporal_range_img).squeeze(0)
             ## remove cur scan embeddings
             scans_embeddings.pop(cur_scan_id)
@@ -292,23 +290,28 @@ class Trainer(EpochBasedTrainer):
         self.before_train_epoch(self.epoch)
         self.optimizer.zero_grad()
         total_iterations = len(self.train_loader)
+        # timings of the epoch, the first batch also waits for the loader workers to start
+        self.timer.reset()
 
         for iteration, data_dict in enumerate(self.train_loader):
+            self.timer.add_data_time()
             self.inner_iteration = iteration + 1
             self.iteration += 1
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             self.before_train_step(self.epoch, self.inner_iteration, data_dict)
             self.timer.add_prepare_time()
 
             # forward
-            output_dict, result_dict = self.train_step(self.epoch, self.inner_iteration, data_dict)
+            with self.autocast():
+                output_dict, result_dict = self.train_step(self.epoch, self.inner_iteration, data_dict)
             # backward & optimization
-            result_dict['loss'].backward(retain_graph=True)
+            self.backward(result_dict['loss'])
             self.after_backward(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             self.check_gradients(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             self.optimizer_step(self.epoch)
 
             # after training
+            torch_util.synchronize(self.device)
             self.timer.add_process_time()
             self.after_train_step(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             result_dict = self.release_tensors(result_dict)
@@ -330,8 +333,11 @@ class Trainer(EpochBasedTrainer):
                 )
                 self.logger.info(message)
                 self.write_event('train', summary_dict, self.iteration)
+                self.write_time_event('train', self.timer, self.iteration)
             
-            torch.cuda.empty_cache()
+            self.empty_cache(self.iteration)
+            # logging is neither data loading nor compute
+            self.timer.record_time()
             
         
         
@@ -351,12 +357,14 @@ class Trainer(EpochBasedTrainer):
         pbar = tqdm(enumerate(self.val_loader), total=total_iterations)
 
         for iteration, data_dict in pbar:
+            timer.add_data_time()
             self.inner_iteration = iteration + 1
-            data_dict = torch_util.to_cuda(data_dict)
+            data_dict = torch_util.to_device(data_dict, self.device)
             self.before_val_step(self.epoch, self.inner_iteration, data_dict)
             timer.add_prepare_time()
-            output_dict, result_dict = self.val_step(self.epoch, self.inner_iteration, data_dict)
-            torch.cuda.synchronize()
+            with self.autocast():
+                output_dict, result_dict = self.val_step(self.epoch, self.inner_iteration, data_dict)
+            torch_util.synchronize(self.device)
             timer.add_process_time()
             self.after_val_step(self.epoch, self.inner_iteration, data_dict, output_dict, result_dict)
             result_dict = self.release_tensors(result_dict)
@@ -370,7 +378,8 @@ class Trainer(EpochBasedTrainer):
                 timer=timer,
             )
             pbar.set_description(message)
-            torch.cuda.empty_cache()
+            self.empty_cache(self.inner_iteration)
+            timer.record_time()
             
         # scheduler
         if self.scheduler is not None:
@@ -385,6 +394,7 @@ class Trainer(EpochBasedTrainer):
 
         self.logger.critical(message)
         self.write_event('val', summary_dict, self.epoch)
+        self.write_time_event('val', timer, self.epoch)
         self.set_train_mode()
         
 def parse_args(parser=None):
@@ -395,6 +405,7 @@ def parse_args(parser=None):
     parser.add_argument('--epoch', type=int, default=None, help='load epoch')
     parser.add_argument('--log_steps', type=int, default=500, help='logging steps')
     parser.add_argument('--local_rank', type=int, default=-1, help='local rank for ddp')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
 
     args = parser.parse_args()
     return parser, args
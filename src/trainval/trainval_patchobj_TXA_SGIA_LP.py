@@ -41,9 +41,7 @@ class VLSGModel(pl.LightningModule):
         # cfg
         self.cfg = cfg  
         
-        # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        # device managed by Lightning, through the accelerator of the Trainer
         
         # get data loader
         start_time = time.time()
@@ -37,9 +37,7 @@ class Trainer(EpochBasedTrainer):
         # cfg
         self.cfg = cfg  
         
-        # get device 
-        if not torch.cuda.is_available(): raise RuntimeError('No CUDA devices available.')
-        self.device = torch.device("cuda")
+        # device set up by the base trainer, from cfg.device or --device
         
         # get data loader
         start_time = time.time()
@@ -228,6 +226,7 @@ def parse_args(parser=None):
     parser.add_argument('--epoch', type=int, default=None, help='load epoch')
     parser.add_argument('--log_steps', type=int, default=500, help='logging steps')
     parser.add_argument('--local_rank', type=int, default=-1, help='local rank for ddp')
+    parser.add_argument('--device', type=str, default=None, help='cpu, cuda or auto, overrides cfg.device.name')
 
     args = parser.parse_args()
     return parser, args
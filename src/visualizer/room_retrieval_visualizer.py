@@ -20,6 +20,7 @@ from sympy import N
 sys.path.append('..')
 sys.path.append('../..')
 from utils import common, scan3r
+from utils.retrieval_record import load_retrieval_records
 from configs import update_config_room_retrival, config
 
 class RoomRetrievalVisualizer():
@@ -149,9 +150,7 @@ class RoomRetrievalVisualizer():
             
         # retrieval_result_dir
         self.retrieval_result_dir = retrieval_result_dir
-        self.retrieval_result_file = osp.join(self.retrieval_result_dir, 
-                                              'retrieval_record_{}.pkl'.format(self.split))
-        self.retrieval_result = common.load_pkl_data(self.retrieval_result_file)
+        self.retrieval_result = load_retrieval_records(self.retrieval_result_dir, self.split)
         # vis out dir
         self.vis_out_dir = osp.join(self.retrieval_result_dir, 'vis')
         common.ensure_dir(self.vis_out_dir)
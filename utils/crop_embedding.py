@@ -0,0 +1,85 @@
+import torch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class CropEmbedder():
+    r"""Embeddings of object crops across the frames of a scan, in fixed-size extractor batches.
+
+    The (object, frame) pairs are grouped by frame so that every frame is decoded once, frames
+    are decoded and cropped on a thread pool and the crops of many objects and frames are packed
+    into batches of batch_size, the last one padded with zeros. The pieces are pluggable:
+      load_frame(frame_idx) -> (image, obj_anno), the image and its object-id map
+      crop_fn(image, obj_mask) -> list of (C, H, W) crop tensors of an object, None to skip it
+      extractor((B, C, H, W)) -> (B, D) embedding of every crop
+    The embedding of an object in a frame is the mean over its crops, None for skipped objects.
+    """
+    def __init__(self, extractor, crop_fn, batch_size=64, num_threads=4, prefetch_frames=16,
+                 device=torch.device('cpu'), pad_batches=True):
+        self.extractor = extractor
+        self.crop_fn = crop_fn
+        self.batch_size = batch_size
+        self.num_threads = num_threads
+        self.prefetch_frames = prefetch_frames
+        self.device = device
+        self.pad_batches = pad_batches
+
+    def cropFrame(self, load_frame, frame_idx, obj_ids):
+        image, obj_anno = load_frame(frame_idx)
+        return [(obj_id, self.crop_fn(image, obj_anno == obj_id)) for obj_id in obj_ids]
+
+    def embedBatch(self, crops):
+        num_crops = len(crops)
+        batch = torch.stack(crops)
+        if self.pad_batches and num_crops < self.batch_size:
+            batch = torch.cat([batch, batch.new_zeros((self.batch_size - num_crops,) + batch.shape[1:])])
+        with torch.no_grad():
+            embs = self.extractor(batch.to(self.device))
+        return embs[:num_crops].float()
+
+    def embedScan(self, load_frame, obj_frames):
+        r"""{obj_id: {frame_idx: (D,) np.ndarray or None}} of the frames of every object in obj_frames."""
+        frame_objs = {}
+        for obj_id, frame_idxs in obj_frames.items():
+            for frame_idx in frame_idxs:
+                frame_objs.setdefault(frame_idx, []).append(obj_id)
+        # crops waiting for a batch and the (obj_id, frame_idx) they belong to
+        pending_crops, pending_keys = [], []
+        emb_sums, crop_counts = {}, {}
+
+        def flush(num_crops):
+            embs = self.embedBatch(pending_crops[:num_crops])
+            for key, emb in zip(pending_keys[:num_crops], embs):
+                emb_sums[key] = emb if key not in emb_sums else emb_sums[key] + emb
+            del pending_crops[:num_crops], pending_keys[:num_crops]
+
+        def consume(frame_idx, future):
+            for obj_id, crops in future.result():
+                if crops is None or len(crops) == 0:
+                    continue
+                crop_counts[(obj_id, frame_idx)] = len(crops)
+                pending_crops.extend(crops)
+                pending_keys.extend([(obj_id, frame_idx)] * len(crops))
+            while len(pending_crops) >= self.batch_size:
+                flush(self.batch_size)
+
+        with ThreadPoolExecutor(max(self.num_threads, 1)) as executor:
+            # a sliding window of prefetch_frames frames decoded ahead of the extractor
+            futures = deque()
+            for frame_idx, obj_ids in frame_objs.items():
+                futures.append((frame_idx, executor.submit(self.cropFrame, load_frame, frame_idx, obj_ids)))
+                if len(futures) > self.prefetch_frames:
+                    consume(*futures.popleft())
+            while len(futures) > 0:
+                consume(*futures.popleft())
+            if len(pending_crops) > 0:
+                flush(len(pending_crops))
+
+        # scatter the mean over the crops back, in the frame order of obj_frames
+        obj_visual_emb = {}
+        for obj_id, frame_idxs in obj_frames.items():
+            obj_visual_emb[obj_id] = {}
+            for frame_idx in frame_idxs:
+                key = (obj_id, frame_idx)
+                obj_visual_emb[obj_id][frame_idx] = \
+                    (emb_sums[key] / crop_counts[key]).cpu().numpy() if key in emb_sums else None
+        return obj_visual_emb
@@ -0,0 +1,113 @@
+import random
+import torch
+
+def blur_axis(noise, dim):
+    # mean of every cell and its two neighbours along dim, zeros outside
+    num_cells = noise.shape[dim]
+    zeros = noise.new_zeros(noise.shape[:dim] + (1,) + noise.shape[dim + 1:])
+    padded = torch.cat([zeros, noise, zeros], dim)
+    return (padded.narrow(dim, 0, num_cells) + padded.narrow(dim, 1, num_cells) + padded.narrow(dim, 2, num_cells)) / 3
+
+def smooth_noise(noise):
+    r"""(X, Y, Z, 3) noise smoothed twice by separable 3x3x3 box filters, as the three
+    scipy.ndimage.convolve passes of torch-points3d with mode="constant"."""
+    for _ in range(2):
+        for dim in range(3):
+            noise = blur_axis(noise, dim)
+    return noise
+
+def noise_dims(coords, granularity):
+    # cells of the noise grid of coords, one cell of margin below and two above
+    coords_min = coords.min(0).values
+    return coords_min, (torch.div(coords.max(0).values - coords_min, granularity, rounding_mode='floor')).long() + 3
+
+def trilinear_lookup(volume, coords, origin, spacing):
+    r"""Trilinear interpolation of the (X, Y, Z, C) volume with cell i at origin + i * spacing
+    at the (N, 3) coords, 0 outside the volume as RegularGridInterpolator(fill_value=0)."""
+    dims = torch.tensor(volume.shape[:3], device=coords.device)
+    grid = (coords - origin) / spacing
+    inside = ((grid >= 0) & (grid <= dims - 1)).all(dim=1)
+    cell = torch.minimum(grid.floor().long().clamp(min=0), dims - 2)
+    frac = grid - cell
+    volume_flat = volume.reshape(-1, volume.shape[3])
+    values = coords.new_zeros((coords.shape[0], volume.shape[3]))
+    for corner in range(8):
+        offset = torch.tensor([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1], device=coords.device)
+        weights = torch.where(offset.bool(), frac, 1 - frac).prod(dim=1)
+        idx = cell + offset
+        values += weights.unsqueeze(1) * volume_flat[(idx[:, 0] * dims[1] + idx[:, 1]) * dims[2] + idx[:, 2]]
+    return values * inside.unsqueeze(1)
+
+def elastic_distortion(coords, granularity, magnitude, noise=None):
+    r"""Elastic distortion of the (N, 3) coords by smoothed noise of cell size granularity.
+
+    noise is a smoothed (X, Y, Z, 3) volume at least as large as the grid of the coords, its
+    corner is used, fresh N(0, 1) noise is smoothed if None.
+    """
+    coords_min, dims = noise_dims(coords, granularity)
+    if noise is None:
+        noise = smooth_noise(torch.randn(*dims.tolist(), 3, dtype=coords.dtype, device=coords.device))
+    noise = noise[:dims[0], :dims[1], :dims[2]]
+    return coords + trilinear_lookup(noise, coords, coords_min - granularity, granularity) * magnitude
+
+class ElasticDistortion():
+    r"""Elastic distortion of object points, torch-points3d's augmentation on torch tensors.
+
+    The points of every scene are distorted on the grid of their own bounding box, scene_counts
+    gives the consecutive points of each scene, all points are one scene if None. With
+    noise_pool_size > 0 the noise of a scene is a random crop of one of noise_pool_size volumes
+    smoothed once per granularity, covering noise_pool_extent meters, instead of noise smoothed
+    for every scene. Crops do not fade to zero at the border of the grid as fresh noise does,
+    scenes larger than the pool volumes get fresh noise.
+    """
+    def __init__(self, apply_distorsion=True, granularity=[0.2, 0.8], magnitude=[0.4, 1.6],
+                 noise_pool_size=0, noise_pool_extent=12.):
+        assert len(magnitude) == len(granularity)
+        self._apply_distorsion = apply_distorsion
+        self._granularity = granularity
+        self._magnitude = magnitude
+        self.noise_pool_size = noise_pool_size
+        self.noise_pool_extent = noise_pool_extent
+        # built on first use, in every DataLoader worker with its own seed
+        self.noise_pools = None
+
+    def noisePool(self, granularity_i):
+        if self.noise_pools is None:
+            self.noise_pools = []
+            for granularity in self._granularity:
+                pool_dim = int(self.noise_pool_extent // granularity) + 3
+                self.noise_pools.append(torch.stack([smooth_noise(torch.randn(pool_dim, pool_dim, pool_dim, 3))
+                                                     for _ in range(self.noise_pool_size)]))
+        return self.noise_pools[granularity_i]
+
+    def sampleNoise(self, coords, granularity_i):
+        if self.noise_pool_size == 0:
+            return None
+        noise_pool = self.noisePool(granularity_i)
+        _, dims = noise_dims(coords, self._granularity[granularity_i])
+        pool_dims = torch.tensor(noise_pool.shape[1:4])
+        if (dims > pool_dims).any():
+            return None
+        start = [random.randint(0, int(pool_dim - dim)) for pool_dim, dim in zip(pool_dims, dims)]
+        noise = noise_pool[random.randrange(self.noise_pool_size)]
+        return noise[start[0]:, start[1]:, start[2]:]
+
+    def distortScene(self, pcs_pos):
+        for i in range(len(self._granularity)):
+            noise = self.sampleNoise(pcs_pos, i)
+            pcs_pos = elastic_distortion(pcs_pos, self._granularity[i], self._magnitude[i], noise)
+        return pcs_pos
+
+    def __call__(self, pcs_pos, scene_counts=None):
+        if self._apply_distorsion:
+            if random.random() < 0.95:
+                pcs_pos = pcs_pos.float()
+                scenes_pos = [pcs_pos] if scene_counts is None else torch.split(pcs_pos, list(scene_counts))
+                pcs_pos = torch.cat([self.distortScene(scene_pos) if scene_pos.shape[0] > 0 else scene_pos
+                                     for scene_pos in scenes_pos])
+        return pcs_pos
+
+    def __repr__(self):
+        return "{}(apply_distorsion={}, granularity={}, magnitude={}, noise_pool_size={})".format(
+            self.__class__.__name__, self._apply_distorsion, self._granularity, self._magnitude, self.noise_pool_size,
+        )
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import os.path as osp
+import numpy as np
+
+from utils import common
+
+def files_hash(filenames, chunk_size=1 << 20):
+    r"""sha1 over the content of the given files, used to key caches by checkpoint."""
+    sha1 = hashlib.sha1()
+    for filename in filenames:
+        if filename is None or not osp.isfile(filename):
+            sha1.update(b'none')
+            continue
+        with open(filename, 'rb') as handle:
+            while True:
+                chunk = handle.read(chunk_size)
+                if not chunk:
+                    break
+                sha1.update(chunk)
+    return sha1.hexdigest()
+
+class ScanEmbeddingCache():
+    r"""On-disk store of per-scan embeddings.
+
+    All embeddings live in one contiguous float32 array (embeddings.npy) which is
+    memory-mapped read-only on load; index.pkl maps scan_id -> (start, end) rows
+    and keeps the ids of the rows (e.g. object ids) of each scan.
+    The cache dir is keyed by key_items (checkpoint hash, modules, ...).
+    """
+    def __init__(self, cache_root, key_items):
+        self.key_items = [str(item) for item in key_items]
+        self.key = hashlib.sha1('|'.join(self.key_items).encode()).hexdigest()[:16]
+        self.cache_dir = osp.join(cache_root, self.key)
+        self.emb_file = osp.join(self.cache_dir, 'embeddings.npy')
+        self.index_file = osp.join(self.cache_dir, 'index.pkl')
+
+        self.embeddings = None
+        self.offsets = {}
+        self.ids = {}
+        self.pending = {}
+
+    def exists(self):
+        return osp.isfile(self.emb_file) and osp.isfile(self.index_file)
+
+    def add(self, scan_id, embeddings, ids=None):
+        self.pending[scan_id] = (np.asarray(embeddings, dtype=np.float32), ids)
+
+    def save(self):
+        if len(self.pending) == 0:
+            return
+        # merge with already saved scans
+        if self.exists() and self.embeddings is None:
+            self.load()
+        scans = {scan_id: (np.asarray(self.get(scan_id)), self.ids[scan_id]) for scan_id in self.offsets}
+        scans.update(self.pending)
+
+        offsets = {}
+        ids = {}
+        start = 0
+        for scan_id, (embeddings, scan_ids) in scans.items():
+            offsets[scan_id] = (start, start + embeddings.shape[0])
+            ids[scan_id] = scan_ids
+            start += embeddings.shape[0]
+        embeddings_all = np.concatenate([item[0] for item in scans.values()], axis=0)
+
+        # write to tmp files and rename, so that readers never see partial files
+        common.ensure_dir(self.cache_dir)
+        self.embeddings = None
+        emb_file_tmp = self.emb_file + '.tmp.npy'
+        np.save(emb_file_tmp, embeddings_all)
+        os.replace(emb_file_tmp, self.emb_file)
+        index_file_tmp = self.index_file + '.tmp'
+        common.write_pkl_data({'key_items': self.key_items, 'offsets': offsets, 'ids': ids}, index_file_tmp)
+        os.replace(index_file_tmp, self.index_file)
+        self.pending = {}
+        self.load()
+
+    def load(self):
+        index = common.load_pkl_data(self.index_file)
+        self.offsets = index['offsets']
+        self.ids = index['ids']
+        self.embeddings = np.load(self.emb_file, mmap_mode='r')
+
+    def scan_ids(self):
+        return list(self.offsets.keys())
+
+    def __contains__(self, scan_id):
+        return scan_id in self.offsets
+
+    def get(self, scan_id):
+        start, end = self.offsets[scan_id]
+        return self.embeddings[start:end]
+
+    def get_ids(self, scan_id):
+        return self.ids[scan_id]
+
+    def gather(self, scan_ids):
+        r"""Embeddings of scan_ids concatenated in the given order, (sum N_i, C)."""
+        return np.concatenate([self.get(scan_id) for scan_id in scan_ids], axis=0)
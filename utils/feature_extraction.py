@@ -0,0 +1,179 @@
+import os
+import os.path as osp
+import time
+import zlib
+import torch
+from torch.utils.data import Dataset, DataLoader
+from tqdm import tqdm
+
+from utils import common
+
+def shard_scans(scan_ids, shard_id=0, num_shards=1):
+    # stable split by scan id, every process or node of a run gets the same scans for the same shard
+    return [scan_id for scan_id in scan_ids if zlib.crc32(str(scan_id).encode()) % num_shards == shard_id]
+
+def add_extraction_args(parser):
+    parser.add_argument('--batch_size', type=int, default=None, help='images per backbone batch across scans, the generator default if not set')
+    parser.add_argument('--num_workers', type=int, default=4, help='image decoding workers')
+    parser.add_argument('--shard_id', type=int, default=0, help='shard of the scans processed here')
+    parser.add_argument('--num_shards', type=int, default=1, help='number of processes/nodes the scans are split across')
+    parser.add_argument('--no_resume', action='store_true', help='extract the scans of the manifest again')
+    return parser
+
+class FrameDataset(Dataset):
+    r"""Frames of many scans in scan order, decoded by the load_image of the backbone adapter."""
+    def __init__(self, frames, load_image):
+        self.frames = frames
+        self.load_image = load_image
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, idx):
+        scan_id, frame_idx, img_path = self.frames[idx]
+        start_time = time.time()
+        img = self.load_image(img_path)
+        return scan_id, frame_idx, img, time.time() - start_time
+
+def collate_frames(items):
+    scan_ids, frame_idxs, imgs, decode_times = zip(*items)
+    # images of the same shape are stacked, others (encoded bytes, ...) stay a list
+    if all(torch.is_tensor(img) and img.shape == imgs[0].shape for img in imgs):
+        imgs = torch.stack(imgs)
+    return list(zip(scan_ids, frame_idxs)), imgs, sum(decode_times)
+
+class ExtractionManifest():
+    r"""Scans whose feature shard is complete, extraction of a shard resumes from the scans it lists."""
+    def __init__(self, filename, key):
+        self.filename = filename
+        self.key = key
+        self.scans = {}
+
+    def load(self):
+        if osp.isfile(self.filename):
+            manifest = common.load_pkl_data(self.filename)
+            # restart if the features were extracted with other settings
+            if manifest['key'] == self.key:
+                self.scans = manifest['scans']
+
+    def save(self):
+        filename_tmp = self.filename + '.tmp'
+        common.write_pkl_data({'key': self.key, 'scans': self.scans}, filename_tmp)
+        os.replace(filename_tmp, self.filename)
+
+class FeatureExtractor():
+    r"""2D features of the frames of many scans with any image backbone.
+
+    The backbone plugs in as an adapter with
+      loadImage(img_path) -> decoded and preprocessed image, run in the DataLoader workers
+      extractBatch(imgs) -> (B, *feat_shape) np.ndarray of a batch of images
+    Frames of all scans of the shard are decoded ahead by num_workers processes and fed to the
+    backbone in batches of batch_size that cross scan boundaries. Every scan is written as soon
+    as its last frame is extracted, to <out_dir>/<scan_id>.pkl, or appended to feature_store,
+    and recorded in the manifest of the shard, which extraction resumes from after a crash.
+    """
+    def __init__(self, adapter, out_dir, manifest_name, manifest_key, batch_size=32, num_workers=4,
+                 shard_id=0, num_shards=1, resume=True, feature_store=None, feature_store_dtype='float16',
+                 pad_batches=False, prefetch_factor=4):
+        assert 0 <= shard_id < num_shards
+        # the store is a single appending writer, shards are merged with build_feature_store.py
+        assert feature_store is None or num_shards == 1, 'feature store can not be written by several shards'
+        self.adapter = adapter
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.resume = resume
+        self.feature_store = feature_store
+        self.feature_store_dtype = feature_store_dtype
+        self.pad_batches = pad_batches
+        self.prefetch_factor = prefetch_factor
+        common.ensure_dir(out_dir)
+        self.manifest = ExtractionManifest(osp.join(out_dir, 'manifest_{}_shard{}of{}.pkl'.format(
+            manifest_name, shard_id, num_shards)), manifest_key)
+        self.stage_times = {'decode': 0.0, 'wait': 0.0, 'model': 0.0, 'write': 0.0}
+        self.num_images = 0
+
+    def isDone(self, scan_id):
+        if self.feature_store is not None:
+            return scan_id in self.feature_store
+        return scan_id in self.manifest.scans and osp.isfile(self.scanFile(scan_id))
+
+    def scanFile(self, scan_id):
+        return osp.join(self.out_dir, '{}.pkl'.format(scan_id))
+
+    def writeScan(self, scan_id, imgs_features):
+        start_time = time.time()
+        if self.feature_store is not None:
+            if len(imgs_features) > 0:
+                self.feature_store.add(scan_id, imgs_features)
+        else:
+            # shard written before the manifest lists it, a crash never leaves a listed scan incomplete
+            out_file_tmp = self.scanFile(scan_id) + '.tmp'
+            common.write_pkl_data(imgs_features, out_file_tmp)
+            os.replace(out_file_tmp, self.scanFile(scan_id))
+            self.manifest.scans[scan_id] = len(imgs_features)
+            self.manifest.save()
+        self.stage_times['write'] += time.time() - start_time
+
+    def extractBatch(self, imgs):
+        num_imgs = len(imgs)
+        if self.pad_batches and torch.is_tensor(imgs) and num_imgs < self.batch_size:
+            imgs = torch.cat([imgs, imgs.new_zeros((self.batch_size - num_imgs,) + imgs.shape[1:])])
+        start_time = time.time()
+        with torch.no_grad():
+            features = self.adapter.extractBatch(imgs)
+        self.stage_times['model'] += time.time() - start_time
+        return features[:num_imgs]
+
+    def run(self, image_paths):
+        r"""Extract the features of {scan_id: {frame_idx: img_path}}, the scans of this shard only."""
+        if self.resume:
+            self.manifest.load()
+        if self.feature_store is not None:
+            self.feature_store.openWrite(self.feature_store_dtype, resume=self.resume)
+        scan_ids = shard_scans(list(image_paths.keys()), self.shard_id, self.num_shards)
+        todo_scan_ids = [scan_id for scan_id in scan_ids if not (self.resume and self.isDone(scan_id))]
+        print('[INFO] shard {}/{}: {} scans to extract, {} done before'.format(
+            self.shard_id, self.num_shards, len(todo_scan_ids), len(scan_ids) - len(todo_scan_ids)))
+
+        frames = []
+        num_frames_left = {}
+        for scan_id in todo_scan_ids:
+            frame_idxs = sorted(image_paths[scan_id].keys())
+            num_frames_left[scan_id] = len(frame_idxs)
+            frames += [(scan_id, frame_idx, image_paths[scan_id][frame_idx]) for frame_idx in frame_idxs]
+        for scan_id in todo_scan_ids:
+            if num_frames_left[scan_id] == 0:
+                self.writeScan(scan_id, {})
+
+        data_loader = DataLoader(FrameDataset(frames, self.adapter.loadImage), batch_size=self.batch_size,
+                                 shuffle=False, num_workers=self.num_workers, collate_fn=collate_frames,
+                                 prefetch_factor=self.prefetch_factor if self.num_workers > 0 else None)
+        scans_features = {}
+        wait_start = time.time()
+        for keys, imgs, decode_time in tqdm(data_loader):
+            # time the backbone waits for decoded images, the decode time itself is spent in the workers
+            self.stage_times['wait'] += time.time() - wait_start
+            self.stage_times['decode'] += decode_time
+            features = self.extractBatch(imgs)
+            for (scan_id, frame_idx), feature in zip(keys, features):
+                scans_features.setdefault(scan_id, {})[frame_idx] = feature
+                num_frames_left[scan_id] -= 1
+                if num_frames_left[scan_id] == 0:
+                    self.writeScan(scan_id, scans_features.pop(scan_id))
+            self.num_images += len(keys)
+            wait_start = time.time()
+
+        if self.feature_store is not None:
+            self.feature_store.closeWrite()
+        return todo_scan_ids
+
+    def timingString(self):
+        num_images = max(self.num_images, 1)
+        return 'Feature extraction of {} images: decode {:.3f}s ({:.3f}s per image in the workers, {:.3f}s waited for), ' \
+               'model {:.3f}s ({:.3f}s per image), write {:.3f}s'.format(
+                   self.num_images, self.stage_times['decode'], self.stage_times['decode'] / num_images,
+                   self.stage_times['wait'], self.stage_times['model'], self.stage_times['model'] / num_images,
+                   self.stage_times['write'])
@@ -0,0 +1,101 @@
+import os
+import os.path as osp
+import numpy as np
+
+def frame_index_file(scans_scenes_dir):
+    # files/frame_index.npz next to the scenes dir, the scenes dir holds scan folders only
+    return osp.join(osp.dirname(osp.normpath(scans_scenes_dir)), 'files', 'frame_index.npz')
+
+class FrameIndex():
+    r"""Frame ids, poses and intrinsics of all scans of a scenes dir in one binary file.
+
+    The rows of frame_idxs, poses (N, 4, 4) and quat_trans (N, 7) hold the frames of all scans
+    back to back, scan i owning rows frame_offsets[i]:frame_offsets[i + 1] in sorted frame order.
+    Intrinsics are (S, 3, 3) matrices and (S, 2) width, height of the color and depth cameras.
+    Built once by preprocessing/scan3r/build_frame_index.py, read by utils.scan3r.load_frame_*.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = None
+        self.scan_rows = {}
+        self.frame_rows = {}
+
+    def exists(self):
+        return osp.isfile(self.filename)
+
+    def load(self):
+        with np.load(self.filename) as data:
+            self.data = {key: data[key] for key in data.files}
+        self.scan_rows = {scan_id: i for i, scan_id in enumerate(self.data['scan_ids'].tolist())}
+        self.frame_rows = {}
+        return self
+
+    def __contains__(self, scan_id):
+        return scan_id in self.scan_rows
+
+    def frameRows(self, scan_id):
+        # {frame_idx: row}, built on first access of a scan
+        if scan_id not in self.frame_rows:
+            scan_i = self.scan_rows[scan_id]
+            start, end = self.data['frame_offsets'][scan_i:scan_i + 2]
+            self.frame_rows[scan_id] = {frame_idx: start + i for i, frame_idx in
+                                        enumerate(self.data['frame_idxs'][start:end].tolist())}
+        return self.frame_rows[scan_id]
+
+    def frameIdxs(self, scan_id):
+        return list(self.frameRows(scan_id).keys())
+
+    def rows(self, scan_id, frame_idxs):
+        r"""Rows of frame_idxs, None if a frame is not in the index."""
+        frame_rows = self.frameRows(scan_id)
+        if any(frame_idx not in frame_rows for frame_idx in frame_idxs):
+            return None
+        return np.array([frame_rows[frame_idx] for frame_idx in frame_idxs], dtype=np.int64)
+
+    def poses(self, scan_id, frame_idxs, type='matrix'):
+        rows = self.rows(scan_id, frame_idxs)
+        if rows is None:
+            return None
+        if type == 'matrix':
+            return self.data['poses'][rows]
+        elif type == 'quat_trans':
+            return self.data['quat_trans'][rows]
+        else:
+            raise ValueError("Invalid type")
+
+    def intrinsics(self, scan_id, type='color'):
+        scan_i = self.scan_rows[scan_id]
+        width, height = self.data['{}_size'.format(type)][scan_i]
+        return {'width': float(width), 'height': float(height),
+                'intrinsic_mat': self.data['{}_intrinsics'.format(type)][scan_i].copy()}
+
+    @staticmethod
+    def write(filename, scans):
+        r"""scans: [(scan_id, frame_idxs, poses (F, 4, 4), quat_trans (F, 7), color_info, depth_info)]"""
+        frame_counts = [len(frame_idxs) for _, frame_idxs, _, _, _, _ in scans]
+        data = {
+            'scan_ids': np.array([scan[0] for scan in scans], dtype=str),
+            'frame_offsets': np.concatenate([[0], np.cumsum(frame_counts)]).astype(np.int64),
+            'frame_idxs': np.array([frame_idx for scan in scans for frame_idx in scan[1]], dtype=str),
+            'poses': np.concatenate([np.asarray(scan[2]).reshape(-1, 4, 4) for scan in scans]) if scans else np.zeros((0, 4, 4)),
+            'quat_trans': np.concatenate([np.asarray(scan[3]).reshape(-1, 7) for scan in scans]) if scans else np.zeros((0, 7)),
+        }
+        for type, info_i in (('color', 4), ('depth', 5)):
+            data['{}_intrinsics'.format(type)] = np.array([scan[info_i]['intrinsic_mat'] for scan in scans],
+                                                          dtype=np.float32).reshape(-1, 3, 3)
+            data['{}_size'.format(type)] = np.array([[scan[info_i]['width'], scan[info_i]['height']] for scan in scans],
+                                                    dtype=np.float64).reshape(-1, 2)
+        # written to a tmp file and renamed, readers never see a partial index
+        filename_tmp = filename + '.tmp.npz'
+        np.savez(filename_tmp, **data)
+        os.replace(filename_tmp, filename)
+
+# indexes loaded by this process, by file, None if the file does not exist
+_frame_indexes = {}
+
+def get_frame_index(scans_scenes_dir):
+    filename = frame_index_file(scans_scenes_dir)
+    if filename not in _frame_indexes:
+        frame_index = FrameIndex(filename)
+        _frame_indexes[filename] = frame_index.load() if frame_index.exists() else None
+    return _frame_indexes[filename]
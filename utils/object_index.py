@@ -0,0 +1,162 @@
+import numpy as np
+import torch
+
+from utils import common
+
+def kmeans(x, num_clusters, num_iters=20, seed=0):
+    r"""Lloyd k-means on the rows of x (N, C), returns (num_clusters, C) centroids."""
+    generator = torch.Generator().manual_seed(seed)
+    num_clusters = min(num_clusters, x.shape[0])
+    centroids = x[torch.randperm(x.shape[0], generator=generator)[:num_clusters]].clone()
+    for _ in range(num_iters):
+        assign = torch.cdist(x, centroids).argmin(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, x)
+        counts = torch.bincount(assign, minlength=num_clusters).to(x.dtype).reshape(-1, 1)
+        # keep empty clusters where they are
+        centroids = torch.where(counts > 0, sums / counts.clamp(min=1), centroids)
+    return centroids
+
+class IVFPQIndex():
+    r"""Inverted file index with product-quantized residuals, inner product search on CPU.
+
+    Vectors are assigned to the closest of num_lists coarse centroids, the residuals
+    are split into num_subvectors chunks, each encoded by one of num_codes codewords.
+    A query only visits the nprobe closest lists and scores their vectors with
+    per-query lookup tables: q.x ~ q.c_l + sum_m q_m.codebook_m[code_m].
+    """
+    def __init__(self, num_lists=64, num_subvectors=8, num_codes=256, nprobe=8, num_iters=20, seed=0):
+        assert num_codes <= 256, 'codes are stored as uint8'
+        self.num_lists = num_lists
+        self.num_subvectors = num_subvectors
+        self.num_codes = num_codes
+        self.nprobe = nprobe
+        self.num_iters = num_iters
+        self.seed = seed
+
+        self.centroids = None # (L, C)
+        self.codebooks = None # (M, K, C/M)
+        # vectors sorted by list
+        self.codes = None # (N, M) uint8
+        self.ids = None # (N,)
+        self.list_offsets = None # (L+1,)
+
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return 0 if self.ids is None else self.ids.shape[0]
+
+    def splitSubvectors(self, x):
+        # (N, C) -> (M, N, C/M)
+        assert x.shape[1] % self.num_subvectors == 0, 'dim must be divisible by num_subvectors'
+        return x.reshape(x.shape[0], self.num_subvectors, -1).transpose(0, 1)
+
+    def train(self, x):
+        x = torch.as_tensor(x, dtype=torch.float32)
+        self.centroids = kmeans(x, self.num_lists, self.num_iters, self.seed)
+        self.num_lists = self.centroids.shape[0]
+        residuals = x - self.centroids[self.assign(x)]
+        self.codebooks = torch.stack([kmeans(sub, self.num_codes, self.num_iters, self.seed + m)
+                                      for m, sub in enumerate(self.splitSubvectors(residuals))])
+        self.num_codes = self.codebooks.shape[1]
+
+    def assign(self, x):
+        return torch.cdist(x, self.centroids).argmin(dim=1)
+
+    def encode(self, residuals):
+        sub_residuals = self.splitSubvectors(residuals) # (M, N, C/M)
+        codes = torch.cdist(sub_residuals, self.codebooks).argmin(dim=2) # (M, N)
+        return codes.transpose(0, 1).to(torch.uint8)
+
+    def add(self, x, ids):
+        r"""Add vectors x (N, C) with integer ids (N,), replaces the current content."""
+        x = torch.as_tensor(x, dtype=torch.float32)
+        ids = torch.as_tensor(np.asarray(ids), dtype=torch.long)
+        lists = self.assign(x)
+        codes = self.encode(x - self.centroids[lists])
+        order = torch.argsort(lists, stable=True)
+        self.codes = codes[order]
+        self.ids = ids[order]
+        counts = torch.bincount(lists, minlength=self.num_lists)
+        self.list_offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(counts, dim=0)])
+
+    def search(self, queries, k, nprobe=None):
+        r"""Approximate top-k inner product search.
+
+        Returns (Q, k) scores and ids, -inf and -1 where fewer than k vectors were visited.
+        """
+        nprobe = min(self.nprobe if nprobe is None else nprobe, self.num_lists)
+        queries = torch.as_tensor(queries, dtype=torch.float32)
+        num_queries = queries.shape[0]
+        coarse_scores = queries @ self.centroids.T # (Q, L)
+        probe_scores, probe_lists = torch.topk(coarse_scores, nprobe, dim=1) # (Q, nprobe)
+        # lookup tables, (Q, M, K)
+        luts = torch.einsum('mqd,mkd->qmk', self.splitSubvectors(queries), self.codebooks)
+
+        # visit lists one by one, with all the queries probing them
+        scores_buf = torch.full((num_queries, nprobe, k), float('-inf'))
+        ids_buf = torch.full((num_queries, nprobe, k), -1, dtype=torch.long)
+        for list_idx in torch.unique(probe_lists).tolist():
+            start, end = self.list_offsets[list_idx].item(), self.list_offsets[list_idx + 1].item()
+            if end == start:
+                continue
+            query_idxs, probe_pos = (probe_lists == list_idx).nonzero(as_tuple=True)
+            codes = self.codes[start:end].long() # (N_l, M)
+            lut = luts[query_idxs] # (Q_l, M, K)
+            scores = probe_scores[query_idxs, probe_pos].reshape(-1, 1).repeat(1, end - start) # (Q_l, N_l)
+            for m in range(self.num_subvectors):
+                scores += lut[:, m].index_select(1, codes[:, m])
+            k_l = min(k, end - start)
+            top_scores, top_idxs = torch.topk(scores, k_l, dim=1)
+            scores_buf[query_idxs, probe_pos, :k_l] = top_scores
+            ids_buf[query_idxs, probe_pos, :k_l] = self.ids[start:end][top_idxs]
+
+        scores_buf, ids_buf = scores_buf.reshape(num_queries, -1), ids_buf.reshape(num_queries, -1)
+        top_scores, top_idxs = torch.topk(scores_buf, min(k, scores_buf.shape[1]), dim=1)
+        return top_scores, ids_buf.gather(1, top_idxs)
+
+    def state_dict(self):
+        return {'num_lists': self.num_lists, 'num_subvectors': self.num_subvectors, 'num_codes': self.num_codes,
+                'nprobe': self.nprobe, 'centroids': self.centroids, 'codebooks': self.codebooks,
+                'codes': self.codes, 'ids': self.ids, 'list_offsets': self.list_offsets}
+
+    def load_state_dict(self, state_dict):
+        for key, value in state_dict.items():
+            setattr(self, key, value)
+
+    def save(self, filename):
+        common.write_pkl_data(self.state_dict(), filename)
+
+    def load(self, filename):
+        self.load_state_dict(common.load_pkl_data(filename))
+
+def scan_votes(obj_scores, obj_segs, num_scans, mask=None):
+    r"""Per-scan votes of patches from their retrieved objects.
+
+    A patch votes for a scan with its best retrieved object of that scan, the votes of
+    all patches of a query are summed, same as the exhaustive score without tf-idf.
+    Args:
+        obj_scores, obj_segs: (B, P, k) scores and scan index of retrieved objects, -1 for none
+        mask: (B, S) candidate scans of each query
+    Returns:
+        (B, S) votes, -inf for non-candidate scans
+    """
+    batch_size = obj_scores.shape[0]
+    valid = obj_segs >= 0
+    # retrieved objects outside the candidates do not vote
+    if mask is not None:
+        valid = valid & mask.gather(1, obj_segs.clamp(min=0).reshape(batch_size, -1)).reshape(obj_segs.shape)
+    obj_scores = torch.where(valid, obj_scores.clamp(min=0), torch.zeros_like(obj_scores))
+    obj_segs = obj_segs.clamp(min=0)
+    votes = torch.zeros((batch_size, num_scans), dtype=obj_scores.dtype)
+    for batch_i in range(batch_size):
+        patch_votes = torch.zeros((obj_scores.shape[1], num_scans), dtype=obj_scores.dtype)
+        patch_votes = patch_votes.scatter_reduce(1, obj_segs[batch_i], obj_scores[batch_i], reduce='amax')
+        votes[batch_i] = patch_votes.sum(dim=0)
+    if mask is not None:
+        votes = votes.masked_fill(~mask, float('-inf'))
+    return votes
+
+def shortlist_scans(votes, shortlist_size):
+    r"""(B, N) scans with the most votes, ordered by votes."""
+    return torch.topk(votes, min(shortlist_size, votes.shape[1]), dim=1).indices
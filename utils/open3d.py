@@ -199,4 +199,45 @@ def registration_with_ransac_from_correspondences(
         criteria=o3d.pipelines.registration.RANSACConvergenceCriteria(num_iterations, num_iterations),
     )
 
-    return result.transformation
\ No newline at end of file
+    return result.transformation
+class MeshRaycaster():
+    r"""Vertex colors and labels of a triangle mesh seen by pinhole cameras, many poses per cast.
+
+    The rays of a chunk of poses are stacked into one (F, H, W, 6) tensor and cast with a single
+    RaycastingScene.cast_rays call. A hit pixel takes the color and label of the first vertex of
+    the hit triangle, missed pixels stay 0. With ray_stride > 1 only every ray_stride-th pixel
+    of the full-resolution rays is cast, starting at ray_stride // 2.
+    """
+    def __init__(self, mesh, vertex_labels):
+        self.mesh_triangles = np.asarray(mesh.triangles)
+        self.num_triangles = self.mesh_triangles.shape[0]
+        # color and label of every triangle, the extra last row for missed rays
+        first_vertices = self.mesh_triangles[:, 0]
+        self.triangle_labels = np.zeros(self.num_triangles + 1, dtype=np.int32)
+        self.triangle_labels[:-1] = np.asarray(vertex_labels)[first_vertices]
+        self.triangle_colors = np.zeros((self.num_triangles + 1, 3), dtype=np.uint8)
+        if mesh.has_vertex_colors():
+            self.triangle_colors[:-1] = (np.asarray(mesh.vertex_colors) * 255.0).round()[first_vertices]
+        self.scene = o3d.t.geometry.RaycastingScene()
+        self.scene.add_triangles(o3d.t.geometry.TriangleMesh.from_legacy(mesh))
+
+    def createRays(self, intrinsics, extrinsics_list, width, height, ray_stride=1):
+        offset = ray_stride // 2
+        rays = np.empty((len(extrinsics_list),) + (len(range(offset, height, ray_stride)),
+                        len(range(offset, width, ray_stride)), 6), dtype=np.float32)
+        for i, extrinsics in enumerate(extrinsics_list):
+            rays[i] = o3d.t.geometry.RaycastingScene.create_rays_pinhole(
+                intrinsic_matrix = intrinsics.astype(np.float64),
+                extrinsic_matrix = extrinsics.astype(np.float64),
+                width_px = width, height_px = height
+            ).numpy()[offset::ray_stride, offset::ray_stride]
+        return rays
+
+    def cast(self, rays, return_colors=True):
+        r"""(F, H, W) int32 label maps and (F, H, W, 3) uint8 color maps of (F, H, W, 6) rays."""
+        hit_triangles_ids = self.scene.cast_rays(o3d.core.Tensor(rays))['primitive_ids'].numpy()
+        # missed rays have an invalid id past the triangles, they map to the extra row
+        hit_triangles_ids = np.minimum(hit_triangles_ids, self.num_triangles)
+        label_maps = self.triangle_labels[hit_triangles_ids]
+        color_maps = self.triangle_colors[hit_triangles_ids] if return_colors else None # for visualization
+        return label_maps, color_maps
@@ -0,0 +1,89 @@
+import os
+import os.path as osp
+import numpy as np
+
+from utils import common
+
+def feature_store_dir(feature_folder, split):
+    return osp.join(feature_folder, 'store_{}'.format(split))
+
+class PatchFeatureStore():
+    r"""2D patch features of all frames of a split in one contiguous memory-mapped array.
+
+    features.bin holds the (N, *feat_shape) rows back to back, written scan by scan, the
+    frames of a scan being consecutive rows. index.pkl maps every scan to its first row and
+    frame idxs, a frame is read with one row lookup instead of unpickling the scan's dict.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index_file = osp.join(store_dir, 'index.pkl')
+        self.features_file = osp.join(store_dir, 'features.bin')
+        self.index = None
+        self.features = None
+        self.frame_rows = {}
+        self.features_handle = None
+
+    def exists(self):
+        return osp.isfile(self.index_file)
+
+    def __contains__(self, scan_id):
+        return self.index is not None and scan_id in self.index['scans']
+
+    def saveIndex(self):
+        index_file_tmp = self.index_file + '.tmp'
+        common.write_pkl_data(self.index, index_file_tmp)
+        os.replace(index_file_tmp, self.index_file)
+
+    def openWrite(self, dtype='float16', resume=True):
+        r"""Open for appending scans, resumes from the scans of an existing index."""
+        common.ensure_dir(self.store_dir)
+        if resume and self.exists():
+            self.index = common.load_pkl_data(self.index_file)
+            row_bytes = np.dtype(self.index['dtype']).itemsize * int(np.prod(self.index['feat_shape']))
+            # drop rows appended after the last index update
+            self.features_handle = open(self.features_file, 'r+b' if osp.isfile(self.features_file) else 'w+b')
+            self.features_handle.truncate(self.index['num_rows'] * row_bytes)
+            self.features_handle.seek(0, os.SEEK_END)
+        else:
+            self.index = {'dtype': np.dtype(dtype).str, 'feat_shape': None, 'num_rows': 0, 'scans': {}}
+            self.features_handle = open(self.features_file, 'wb')
+
+    def add(self, scan_id, features_scan):
+        r"""Append the {frame_idx: (*feat_shape)} features of a scan."""
+        assert scan_id not in self.index['scans'], '{} already in the store'.format(scan_id)
+        frame_idxs = sorted(features_scan.keys())
+        features = np.stack([np.asarray(features_scan[frame_idx]) for frame_idx in frame_idxs])
+        features = features.astype(self.index['dtype'], copy=False)
+        if self.index['feat_shape'] is None:
+            self.index['feat_shape'] = tuple(features.shape[1:])
+        assert tuple(features.shape[1:]) == self.index['feat_shape'], \
+            'feature shape {} of {} differs from {}'.format(features.shape[1:], scan_id, self.index['feat_shape'])
+        self.features_handle.write(np.ascontiguousarray(features).tobytes())
+        self.features_handle.flush()
+        self.index['scans'][scan_id] = (self.index['num_rows'], frame_idxs)
+        self.index['num_rows'] += len(frame_idxs)
+        # index after the rows, a crash never leaves rows of the index missing
+        self.saveIndex()
+
+    def closeWrite(self):
+        self.features_handle.close()
+        self.features_handle = None
+
+    def load(self):
+        self.index = common.load_pkl_data(self.index_file)
+        self.features = np.memmap(self.features_file, dtype=np.dtype(self.index['dtype']), mode='r',
+                                  shape=(self.index['num_rows'],) + tuple(self.index['feat_shape']))
+        self.frame_rows = {}
+        for scan_id, (start_row, frame_idxs) in self.index['scans'].items():
+            self.frame_rows[scan_id] = {frame_idx: start_row + i for i, frame_idx in enumerate(frame_idxs)}
+
+    def frameIdxs(self, scan_id):
+        return self.index['scans'][scan_id][1]
+
+    def frame(self, scan_id, frame_idx):
+        r"""Features of a frame, a zero-copy view of its row."""
+        return np.asarray(self.features[self.frame_rows[scan_id][frame_idx]])
+
+    def scan(self, scan_id, frame_idxs=None):
+        frame_idxs = self.frameIdxs(scan_id) if frame_idxs is None else frame_idxs
+        return {frame_idx: self.frame(scan_id, frame_idx) for frame_idx in frame_idxs}
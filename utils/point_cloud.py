@@ -87,6 +87,77 @@ def pcl_farthest_sample(point, npoint, return_idxs = False):
     if return_idxs: return point, centroids.astype(np.int32)
     return point
 
+def batch_by_size(counts, max_batch_points, max_padding=2):
+    # idxs of clouds of similar size, at most max_padding times the points of the smallest
+    # cloud in a batch and max_batch_points padded points per batch
+    order = np.argsort(-counts, kind='stable')
+    sorted_counts = counts[order]
+    batches, start = [], 0
+    while start < len(order):
+        max_count = max(int(sorted_counts[start]), 1)
+        end = min(len(order), start + max(1, max_batch_points // max_count))
+        end = start + max(1, int(np.sum(sorted_counts[start:end] * max_padding >= max_count)))
+        batches.append(order[start:end])
+        start = end
+    return batches
+
+def farthest_point_sample_batch(points_list, npoint, start_idxs=None, max_batch_points=1<<22):
+    r"""Farthest point sampling of many point clouds at once, on the torch CPU threads.
+
+    Clouds are padded to (B, N_max, 3) in batches of similar size, padded points have a
+    distance of -1 so they are never picked. Returns the FPS order of every cloud, (min(N, npoint),)
+    idxs, the same as pcl_farthest_sample started from the same points.
+    """
+    import torch
+    counts = np.array([points.shape[0] for points in points_list], dtype=np.int64)
+    if start_idxs is None:
+        start_idxs = np.random.randint(0, counts)
+    fps_idxs = [None] * len(points_list)
+    for batch in batch_by_size(counts, max_batch_points):
+        batch_counts = torch.from_numpy(counts[batch])
+        max_count = int(batch_counts.max())
+        xyz = np.zeros((3, len(batch), max_count), dtype=points_list[batch[0]].dtype)
+        for batch_i, cloud_i in enumerate(batch):
+            xyz[:, batch_i, :counts[cloud_i]] = points_list[cloud_i][:, :3].T
+        x, y, z = torch.from_numpy(xyz)
+        valid = torch.arange(max_count).unsqueeze(0) < batch_counts.unsqueeze(1)
+        # padded points stay at -1 under the minimum
+        distance = torch.where(valid, 1e10, -1.).to(x.dtype)
+        batch_idxs = torch.arange(len(batch))
+        num_samples = min(npoint, max_count)
+        centroids = torch.zeros((len(batch), num_samples), dtype=torch.long)
+        farthest = torch.from_numpy(np.asarray(start_idxs)[batch]).long()
+        for i in range(num_samples):
+            centroids[:, i] = farthest
+            dx = x - x[batch_idxs, farthest].unsqueeze(1)
+            dy = y - y[batch_idxs, farthest].unsqueeze(1)
+            dz = z - z[batch_idxs, farthest].unsqueeze(1)
+            # summed in the order of np.sum over the last axis
+            dist = dx * dx + dy * dy + dz * dz
+            distance = torch.minimum(distance, dist)
+            farthest = torch.argmax(distance, dim=1)
+        centroids = centroids.numpy()
+        for batch_i, cloud_i in enumerate(batch):
+            fps_idxs[cloud_i] = centroids[batch_i, :min(npoint, counts[cloud_i])]
+    return fps_idxs
+
+def pcl_farthest_sample_multires(points_list, pc_resolutions, max_batch_points=1<<22):
+    r"""Samples of every resolution of many point clouds from one FPS run at the largest resolution.
+
+    A smaller resolution is the prefix of the FPS order, clouds with fewer points than a
+    resolution are sampled randomly with replacement as in pcl_farthest_sample.
+    Returns {pc_resolution: [(pc_resolution, D)]} in the order of points_list.
+    """
+    fps_idxs = farthest_point_sample_batch(points_list, max(pc_resolutions), max_batch_points=max_batch_points)
+    object_points = {pc_resolution: [] for pc_resolution in pc_resolutions}
+    for points, idxs in zip(points_list, fps_idxs):
+        for pc_resolution in pc_resolutions:
+            if points.shape[0] < pc_resolution:
+                object_points[pc_resolution].append(points[np.random.choice(points.shape[0], pc_resolution)])
+            else:
+                object_points[pc_resolution].append(points[idxs[:pc_resolution]])
+    return object_points
+
 def compute_pcl_overlap(source, target, threshold=1e-7):
     import torch
     '''
@@ -0,0 +1,74 @@
+import os
+import os.path as osp
+import numpy as np
+
+from utils import common
+
+def projection_store_dir(data_root_dir):
+    return osp.join(data_root_dir, 'files', 'gt_projection', 'obj_id_u16')
+
+class ProjectionStore():
+    r"""Lossless 2D object-id projections, one uint16 (F, H, W) array per scan.
+
+    <scan_id>.npy holds the object-id maps of the projected frames back to back and is
+    memory-mapped on read, a frame is a view of its chunk of the file. <scan_id>_frames.pkl
+    lists the frame idxs of the rows and is written last, it marks the scan as complete.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.scans = {}
+
+    def scanFile(self, scan_id):
+        return osp.join(self.store_dir, '{}.npy'.format(scan_id))
+
+    def framesFile(self, scan_id):
+        return osp.join(self.store_dir, '{}_frames.pkl'.format(scan_id))
+
+    def __contains__(self, scan_id):
+        return osp.isfile(self.framesFile(scan_id))
+
+    def openScan(self, scan_id, num_frames, height, width):
+        r"""(F, H, W) uint16 memory-mapped array of a scan, filled chunk by chunk with setFrames."""
+        common.ensure_dir(self.store_dir)
+        # written to a tmp file and renamed by closeScan, readers never see partial scans
+        return np.lib.format.open_memmap(self.scanFile(scan_id) + '.tmp.npy', mode='w+', dtype=np.uint16,
+                                         shape=(num_frames, height, width))
+
+    def setFrames(self, scan_id, scan_maps, start, obj_id_maps):
+        if obj_id_maps.size > 0:
+            assert obj_id_maps.min() >= 0 and obj_id_maps.max() <= np.iinfo(np.uint16).max, \
+                'object ids of {} do not fit in uint16'.format(scan_id)
+        scan_maps[start:start + obj_id_maps.shape[0]] = obj_id_maps
+
+    def closeScan(self, scan_id, frame_idxs, scan_maps):
+        assert scan_maps.shape[0] == len(frame_idxs)
+        scan_maps.flush()
+        os.replace(self.scanFile(scan_id) + '.tmp.npy', self.scanFile(scan_id))
+        frames_file_tmp = self.framesFile(scan_id) + '.tmp'
+        common.write_pkl_data(list(frame_idxs), frames_file_tmp)
+        os.replace(frames_file_tmp, self.framesFile(scan_id))
+
+    def write(self, scan_id, frame_idxs, obj_id_maps):
+        r"""Write the (F, H, W) object-id maps of frame_idxs at once, ids must fit in uint16."""
+        obj_id_maps = np.asarray(obj_id_maps)
+        scan_maps = self.openScan(scan_id, *obj_id_maps.shape)
+        self.setFrames(scan_id, scan_maps, 0, obj_id_maps)
+        self.closeScan(scan_id, frame_idxs, scan_maps)
+
+    def load(self, scan_id):
+        if scan_id not in self.scans:
+            frame_idxs = common.load_pkl_data(self.framesFile(scan_id))
+            obj_id_maps = np.load(self.scanFile(scan_id), mmap_mode='r')
+            self.scans[scan_id] = (obj_id_maps, {frame_idx: row for row, frame_idx in enumerate(frame_idxs)})
+        return self.scans[scan_id]
+
+    def frameIdxs(self, scan_id):
+        return list(self.load(scan_id)[1].keys())
+
+    def frame(self, scan_id, frame_idx):
+        obj_id_maps, frame_rows = self.load(scan_id)
+        return obj_id_maps[frame_rows[frame_idx]]
+
+    def scan(self, scan_id, frame_idxs=None):
+        frame_idxs = self.frameIdxs(scan_id) if frame_idxs is None else frame_idxs
+        return {frame_idx: self.frame(scan_id, frame_idx) for frame_idx in frame_idxs}
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import os.path as osp
+from multiprocessing import Pool
+import numpy as np
+import tqdm
+
+from utils import common
+
+# bump when the projection of scan3r.createRangeImage / loadScanMeshRange changes, old caches are not read
+RANGE_IMAGE_VERSION = 1
+
+def range_image_key(pointcloud_cfg):
+    # projection parameters of cfg.data.pointcloud the range images depend on
+    return [RANGE_IMAGE_VERSION, pointcloud_cfg.use_mesh, pointcloud_cfg.fov_up, pointcloud_cfg.fov_down,
+            pointcloud_cfg.range_min, pointcloud_cfg.range_max, pointcloud_cfg.range_W, pointcloud_cfg.range_H]
+
+class RangeImageCache():
+    r"""On-disk store of the (H, W, 3) uint8 depth and color range images of scans.
+
+    The images of all scans live in depth.npy and color.npy, (S, H, W, 3) arrays which are
+    memory-mapped read-only on load; index.pkl maps scan_id -> row. The cache dir is keyed by
+    key_items, see range_image_key.
+    """
+    def __init__(self, cache_root, key_items):
+        self.key_items = [str(item) for item in key_items]
+        self.key = hashlib.sha1('|'.join(self.key_items).encode()).hexdigest()[:16]
+        self.cache_dir = osp.join(cache_root, self.key)
+        self.depth_file = osp.join(self.cache_dir, 'depth.npy')
+        self.color_file = osp.join(self.cache_dir, 'color.npy')
+        self.index_file = osp.join(self.cache_dir, 'index.pkl')
+
+        self.depth = None
+        self.color = None
+        self.rows = {}
+        self.pending = {}
+
+    def exists(self):
+        return osp.isfile(self.depth_file) and osp.isfile(self.color_file) and osp.isfile(self.index_file)
+
+    def add(self, scan_id, depth, color):
+        self.pending[scan_id] = (np.asarray(depth, dtype=np.uint8), np.asarray(color, dtype=np.uint8))
+
+    def save(self):
+        if len(self.pending) == 0:
+            return
+        # merge with already saved scans
+        if self.exists() and self.depth is None:
+            self.load()
+        scans = {scan_id: self.get(scan_id) for scan_id in self.rows}
+        scans.update(self.pending)
+        rows = {scan_id: row for row, scan_id in enumerate(scans)}
+        depth_all = np.stack([item[0] for item in scans.values()])
+        color_all = np.stack([item[1] for item in scans.values()])
+
+        # write to tmp files and rename, so that readers never see partial files
+        common.ensure_dir(self.cache_dir)
+        self.depth = self.color = None
+        for filename, images in ((self.depth_file, depth_all), (self.color_file, color_all)):
+            filename_tmp = filename + '.tmp.npy'
+            np.save(filename_tmp, images)
+            os.replace(filename_tmp, filename)
+        index_file_tmp = self.index_file + '.tmp'
+        common.write_pkl_data({'key_items': self.key_items, 'rows': rows}, index_file_tmp)
+        os.replace(index_file_tmp, self.index_file)
+        self.pending = {}
+        self.load()
+
+    def load(self):
+        self.rows = common.load_pkl_data(self.index_file)['rows']
+        self.depth = np.load(self.depth_file, mmap_mode='r')
+        self.color = np.load(self.color_file, mmap_mode='r')
+
+    def __contains__(self, scan_id):
+        return scan_id in self.rows
+
+    def get(self, scan_id):
+        row = self.rows[scan_id]
+        return self.depth[row], self.color[row]
+
+def load_range_images(job, scan_ids, cache=None, num_workers=0):
+    r"""Depth and color range images of scan_ids, {scan_id: (H, W, 3)} each.
+
+    job(scan_id) returns the (depth, color) images of a scan, it is run in num_workers processes
+    for the scans not in cache, which are then added to it. Cached images are memory-mapped.
+    """
+    if cache is not None and cache.exists():
+        cache.load()
+    todo_scan_ids = [scan_id for scan_id in scan_ids if cache is None or scan_id not in cache]
+    if num_workers > 0 and len(todo_scan_ids) > 1:
+        with Pool(min(num_workers, len(todo_scan_ids))) as pool:
+            images = list(tqdm.tqdm(pool.imap(job, todo_scan_ids), total=len(todo_scan_ids), desc='range images'))
+    else:
+        images = [job(scan_id) for scan_id in tqdm.tqdm(todo_scan_ids, desc='range images')]
+    images = dict(zip(todo_scan_ids, images))
+    if cache is not None and len(todo_scan_ids) > 0:
+        for scan_id, (depth, color) in images.items():
+            cache.add(scan_id, depth, color)
+        cache.save()
+        images = {}
+    depth_imgs, color_imgs = {}, {}
+    for scan_id in scan_ids:
+        depth_imgs[scan_id], color_imgs[scan_id] = images[scan_id] if scan_id in images else cache.get(scan_id)
+    return depth_imgs, color_imgs
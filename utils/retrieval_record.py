@@ -0,0 +1,154 @@
+import glob
+import os
+import os.path as osp
+import numpy as np
+
+from utils import common
+
+# columnar records of room retrieval, written frame by frame during evaluation
+#
+# <record_dir>/scans.pkl holds the per-scan info (candidates, obj_ids, ...), the frames are
+# appended to chunk_XXXXX.npz files of up to chunk_frames frames. In a chunk, every field of
+# the frame records is one column:
+#   scalars (frame_idx, temporal_scan_id, ...)    -> <field>, one value per frame
+#   arrays (per-patch matches, gt annotations, ..) -> <field>, concatenated, and <field>__offsets
+#   dicts {scan_id: score} (room scores)           -> <field>__keys, <field>__values, <field>__offsets
+# the query scan of each frame is the column scan_id.
+
+def record_dir(retrieval_records_dir, split):
+    return osp.join(retrieval_records_dir, 'retrieval_record_{}'.format(split))
+
+def offsets_of(lengths):
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+def encode_frames(scan_ids, frames):
+    r"""Columns of the frame records, frames[i] being a frame of scan scan_ids[i]."""
+    columns = {'scan_id': np.array(scan_ids, dtype=str)}
+    for field, value in frames[0].items():
+        values = [frame[field] for frame in frames]
+        if isinstance(value, dict):
+            columns[field + '__keys'] = np.array([key for item in values for key in item], dtype=str)
+            columns[field + '__values'] = np.array([score for item in values for score in item.values()], dtype=np.float64)
+            columns[field + '__offsets'] = offsets_of([len(item) for item in values])
+        elif not np.isscalar(value):
+            values = [np.asarray(item).reshape(-1) for item in values]
+            columns[field] = np.concatenate(values)
+            columns[field + '__offsets'] = offsets_of([len(item) for item in values])
+        else:
+            columns[field] = np.array(values)
+    return columns
+
+def decode_frames(columns):
+    r"""Frame records of a chunk, [(scan_id, frame_retrieval)], inverse of encode_frames."""
+    fields = [field for field in columns if not field.endswith('__offsets') and not field.endswith('__values')
+              and field != 'scan_id']
+    frames = []
+    for frame_i, scan_id in enumerate(columns['scan_id'].tolist()):
+        frame = {}
+        for field in fields:
+            if field.endswith('__keys'):
+                name = field[:-len('__keys')]
+                start, end = columns[name + '__offsets'][frame_i:frame_i + 2]
+                frame[name] = dict(zip(columns[field][start:end].tolist(), columns[name + '__values'][start:end].tolist()))
+            elif field + '__offsets' in columns:
+                start, end = columns[field + '__offsets'][frame_i:frame_i + 2]
+                frame[field] = columns[field][start:end]
+            else:
+                frame[field] = columns[field][frame_i].item()
+        frames.append((scan_id, frame))
+    return frames
+
+class RetrievalRecordWriter():
+    r"""Streams the frame records of an evaluation to record_dir, a chunk every chunk_frames frames.
+
+    Replaces the nested {scan_id: {'frames_retrieval': {frame_idx: record}, ...}} dict kept in
+    memory, `scan_id in writer` and addScan fill the per-scan info as the dict did.
+    """
+    def __init__(self, record_dir, chunk_frames=1024):
+        self.record_dir = record_dir
+        self.chunk_frames = chunk_frames
+        self.scans = {}
+        self.scan_ids = []
+        self.frames = []
+        self.num_chunks = 0
+        self.num_frames = 0
+        # a new evaluation, the record of a previous run is removed
+        common.ensure_dir(record_dir)
+        for record_file in glob.glob(osp.join(record_dir, 'chunk_*.npz')) + glob.glob(osp.join(record_dir, 'scans.pkl')):
+            os.remove(record_file)
+
+    def __contains__(self, scan_id):
+        return scan_id in self.scans
+
+    def addScan(self, scan_id, **scan_info):
+        self.scans[scan_id] = scan_info
+
+    def addFrame(self, scan_id, frame_retrieval):
+        self.scan_ids.append(scan_id)
+        self.frames.append(frame_retrieval)
+        self.num_frames += 1
+        if len(self.frames) >= self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        if len(self.frames) == 0:
+            return
+        chunk_file = osp.join(self.record_dir, 'chunk_{:05d}.npz'.format(self.num_chunks))
+        chunk_file_tmp = chunk_file + '.tmp.npz'
+        np.savez(chunk_file_tmp, **encode_frames(self.scan_ids, self.frames))
+        os.replace(chunk_file_tmp, chunk_file)
+        self.num_chunks += 1
+        self.scan_ids = []
+        self.frames = []
+
+    def close(self):
+        self.flush()
+        scans_file_tmp = osp.join(self.record_dir, 'scans.pkl.tmp')
+        common.write_pkl_data({'scans': self.scans, 'num_frames': self.num_frames}, scans_file_tmp)
+        os.replace(scans_file_tmp, osp.join(self.record_dir, 'scans.pkl'))
+
+class RetrievalRecordReader():
+    r"""Reads a record written by RetrievalRecordWriter, one chunk in memory at a time."""
+    def __init__(self, record_dir):
+        self.record_dir = record_dir
+        index = common.load_pkl_data(osp.join(record_dir, 'scans.pkl'))
+        self.scans = index['scans']
+        self.num_frames = index['num_frames']
+        self.chunk_files = sorted(glob.glob(osp.join(record_dir, 'chunk_*.npz')))
+
+    @staticmethod
+    def exists(record_dir):
+        return osp.isfile(osp.join(record_dir, 'scans.pkl'))
+
+    def chunks(self):
+        for chunk_file in self.chunk_files:
+            with np.load(chunk_file) as chunk:
+                yield {field: chunk[field] for field in chunk.files}
+
+    def toDict(self):
+        r"""The nested record dict of the evaluation, for the visualizers of small splits."""
+        retrieval_records = {scan_id: dict(scan_info, frames_retrieval={}) for scan_id, scan_info in self.scans.items()}
+        for columns in self.chunks():
+            for scan_id, frame in decode_frames(columns):
+                retrieval_records[scan_id]['frames_retrieval'][frame['frame_idx']] = frame
+        return retrieval_records
+
+def dict_chunks(retrieval_records, chunk_frames=1024):
+    r"""Chunks of columns of a nested record dict, as RetrievalRecordReader.chunks."""
+    scan_ids, frames = [], []
+    for scan_id, record in retrieval_records.items():
+        for frame in record['frames_retrieval'].values():
+            scan_ids.append(scan_id)
+            frames.append(frame)
+            if len(frames) >= chunk_frames:
+                yield encode_frames(scan_ids, frames)
+                scan_ids, frames = [], []
+    if len(frames) > 0:
+        yield encode_frames(scan_ids, frames)
+
+def load_retrieval_records(retrieval_records_dir, split):
+    r"""Nested record dict of a split, from the columnar record or the pickle of older runs."""
+    records_dir = record_dir(retrieval_records_dir, split)
+    if RetrievalRecordReader.exists(records_dir):
+        return RetrievalRecordReader(records_dir).toDict()
+    return common.load_pkl_data(osp.join(retrieval_records_dir, 'retrieval_record_{}.pkl'.format(split)))
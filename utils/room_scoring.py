@@ -0,0 +1,128 @@
+import numpy as np
+import torch
+
+def segment_ids(obj_counts, device=None):
+    r"""Segment (scan) index of every object of scans packed back to back, (sum N_i,)."""
+    obj_counts = torch.as_tensor(obj_counts, dtype=torch.long, device=device).reshape(-1)
+    return torch.repeat_interleave(torch.arange(obj_counts.shape[0], device=obj_counts.device), obj_counts)
+
+def segment_starts(obj_counts):
+    r"""Index of the first object of every scan packed back to back, (S,)."""
+    obj_counts = torch.as_tensor(obj_counts, dtype=torch.long).reshape(-1)
+    return torch.cumsum(obj_counts, dim=0) - obj_counts
+
+def segment_max(values, seg_ids, num_segments):
+    r"""Max and (first) argmax of values (..., O) within each segment given by seg_ids (O,).
+
+    Returns (..., S) max values and (..., S) argmax indices into the last dim of values.
+    Empty segments get -inf and index O.
+    """
+    num_values = values.shape[-1]
+    out_shape = values.shape[:-1] + (num_segments,)
+    index = seg_ids.to(values.device).expand_as(values)
+    seg_max = torch.full(out_shape, float('-inf'), dtype=values.dtype, device=values.device)
+    seg_max = seg_max.scatter_reduce(-1, index, values, reduce='amax', include_self=True)
+    # first index reaching the max of its segment
+    is_max = values == seg_max.gather(-1, index)
+    value_idxs = torch.arange(num_values, device=values.device).expand_as(values)
+    value_idxs = torch.where(is_max, value_idxs, torch.full_like(value_idxs, num_values))
+    seg_argmax = torch.full(out_shape, num_values, dtype=torch.long, device=values.device)
+    seg_argmax = seg_argmax.scatter_reduce(-1, index, value_idxs, reduce='amin', include_self=True)
+    return seg_max, seg_argmax
+
+def patch_scan_similarity(patch_features_norm, obj_embeddings_norm, seg_ids, num_scans):
+    r"""Best matching object of every scan for every patch with a single matmul.
+
+    Args:
+        patch_features_norm: (B, P, C) normalized patch features of all queries
+        obj_embeddings_norm: (O, C) normalized object embeddings of all scans packed back to back
+        seg_ids: (O,) scan index of every object
+    Returns:
+        patch_scan_sim: (B, P, S) max similarity between each patch and objects of each scan
+        patch_scan_match: (B, P, S) index (in O) of the matched object
+    """
+    patch_obj_sim = torch.matmul(patch_features_norm, obj_embeddings_norm.transpose(0, 1)) # (B, P, O)
+    return segment_max(patch_obj_sim, seg_ids, num_scans)
+
+def candidate_mask(candidate_scans_batch, scan_id2seg, num_scans, device=None):
+    r"""(B, S) bool mask of the candidate scans of every query."""
+    mask = torch.zeros((len(candidate_scans_batch), num_scans), dtype=torch.bool, device=device)
+    for batch_i, candidate_scans in enumerate(candidate_scans_batch):
+        segs = [scan_id2seg[scan_id] for scan_id in candidate_scans]
+        mask[batch_i, segs] = True
+    return mask
+
+def topk_hits(scores, mask, target_segs, top_k_list):
+    r"""Whether the target scan is within the top-k candidates, for every k in top_k_list.
+
+    Args:
+        scores: (B, S) room scores, mask: (B, S) candidates of each query, target_segs: (B,)
+    Returns:
+        {k: (B,) bool}
+    """
+    scores = scores.masked_fill(~mask, float('-inf'))
+    max_k = min(max(top_k_list), scores.shape[1])
+    topk_segs = torch.topk(scores, max_k, dim=1).indices # (B, max_k)
+    target_segs = torch.as_tensor(target_segs, device=scores.device).reshape(-1, 1)
+    hits = topk_segs == target_segs
+    return {k: hits[:, :k].any(dim=1) for k in top_k_list}
+
+# tf-idf reweighting, objects are words and scans are documents
+NUM_NYU40_CLASSES = 41 # nyu40 categories 1-40, 0 for undefined
+
+def scan_sem_counts(obj_sem_ids, num_classes=NUM_NYU40_CLASSES):
+    r"""Number of objects of each semantic category in a scan, (K,)."""
+    return np.bincount(np.asarray(obj_sem_ids, dtype=np.int64), minlength=num_classes)
+
+def tf_idf_object_weights(sem_counts, obj_sem_ids, obj_scan_rows, min_weight=1e-3):
+    r"""tf-idf of every object within its scan given the candidate scans.
+
+    Args:
+        sem_counts: (N, K) semantic counts of the N candidate scans
+        obj_sem_ids: (O,) semantic category of every object
+        obj_scan_rows: (O,) row in sem_counts of the scan of every object
+    """
+    sem_counts = sem_counts.float()
+    n_scenes = sem_counts.shape[0]
+    n_scenes_per_sem = (sem_counts > 0).sum(dim=0).float() # number of scans containing each category
+    n_words_per_scene = sem_counts.sum(dim=1) # number of objects of each scan
+    tf = sem_counts[obj_scan_rows, obj_sem_ids] / n_words_per_scene[obj_scan_rows]
+    idf = torch.log(n_scenes / n_scenes_per_sem[obj_sem_ids])
+    return torch.clamp(tf * idf, min=min_weight)
+
+def tf_idf_room_scores(patch_scan_sim, patch_scan_match, obj_sem_ids, sem_counts, mask):
+    r"""tf-idf reweighted room scores of a batch of queries.
+
+    A patch of query d matched to an object of category c in scan s is weighted by
+        nid * (1 + log(N / ni)) / nd
+    nid: number of patches of d matched to category c in s, nd: number of patches,
+    N: number of candidate scans of d, ni: number of candidate scans of d containing c.
+    score(d, s) = sum(weight * sim) / sum(weight)
+
+    Args:
+        patch_scan_sim, patch_scan_match: (B, P, S) from patch_scan_similarity
+        obj_sem_ids: (O,) semantic category of every object
+        sem_counts: (S, K) semantic counts of every scan
+        mask: (B, S) candidate scans of each query
+    Returns:
+        (B, S) scores, -inf for non-candidate scans
+    """
+    batch_size, num_patches, num_scans = patch_scan_sim.shape
+    num_classes = sem_counts.shape[1]
+    dtype = patch_scan_sim.dtype
+    # index O of empty scans maps to category 0
+    obj_sem_ids = torch.cat([obj_sem_ids.long(), obj_sem_ids.new_zeros(1).long()])
+    matched_sems = obj_sem_ids[patch_scan_match].transpose(1, 2).contiguous() # (B, S, P)
+    # nid, bincount of matched categories per query and scan
+    nid = torch.zeros((batch_size, num_scans, num_classes), dtype=dtype, device=patch_scan_sim.device)
+    nid = nid.scatter_add_(2, matched_sems, torch.ones_like(matched_sems, dtype=dtype))
+    nid = nid.gather(2, matched_sems) # (B, S, P)
+    # N and ni given the candidates of each query
+    mask_f = mask.to(dtype)
+    N = mask_f.sum(dim=1).reshape(-1, 1, 1) # (B, 1, 1)
+    ni = torch.matmul(mask_f, (sem_counts > 0).to(dtype)) # (B, K)
+    ni = ni.gather(1, matched_sems.reshape(batch_size, -1)).reshape(matched_sems.shape).clamp(min=1)
+    weights = nid * (1 + torch.log(N / ni)) / num_patches # (B, S, P)
+    sim = patch_scan_sim.transpose(1, 2) # (B, S, P)
+    scores = (sim * weights).sum(dim=2) / weights.sum(dim=2)
+    return scores.masked_fill(~mask, float('-inf'))
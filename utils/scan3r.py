@@ -6,6 +6,8 @@ from plyfile import PlyData, PlyElement
 from scipy.spatial.transform import Rotation as R
 import pickle
 
+from utils.frame_index import get_frame_index
+
 def get_scan_ids(dirname, split):
     filepath = osp.join(dirname, '{}_scans.txt'.format(split))
     scan_ids = np.genfromtxt(filepath, dtype = str)
@@ -23,6 +25,12 @@ def load_intrinsics(data_dir, scan_id, type='color'):
     '''
     Load 3RScan intrinsic information
     '''
+    frame_index = get_frame_index(data_dir)
+    if frame_index is not None and scan_id in frame_index:
+        return frame_index.intrinsics(scan_id, type)
+    return read_intrinsics(data_dir, scan_id, type)
+
+def read_intrinsics(data_dir, scan_id, type='color'):
     info_path = osp.join(data_dir, scan_id, 'sequence', '_info.txt')
 
     width_search_string = 'm_colorWidth' if type == 'color' else 'm_depthWidth'
@@ -64,32 +72,54 @@ def load_ply_data(data_dir, scan_id, label_file_name):
     return ply_data
 
 def load_pose(data_dir, scan_id, frame_id):
+    frame_index = get_frame_index(data_dir)
+    if frame_index is not None and scan_id in frame_index:
+        poses = frame_index.poses(scan_id, [frame_id])
+        if poses is not None:
+            return poses[0]
+    return read_pose(data_dir, scan_id, frame_id)
+
+def read_pose(data_dir, scan_id, frame_id):
     pose_path = osp.join(data_dir, scan_id, 'sequence', 'frame-{}.pose.txt'.format(frame_id))
     pose = np.genfromtxt(pose_path)
     return pose
 
 def load_all_poses(data_dir, scan_id, frame_idxs):
+    # one lookup of all frames in the frame index, frame by frame from the pose files otherwise
+    frame_index = get_frame_index(data_dir)
+    if frame_index is not None and scan_id in frame_index:
+        frame_poses = frame_index.poses(scan_id, list(frame_idxs))
+        if frame_poses is not None:
+            return frame_poses
     frame_poses = []
     for frame_idx in frame_idxs:
-        frame_pose = load_pose(data_dir, scan_id, frame_idx)
+        frame_pose = read_pose(data_dir, scan_id, frame_idx)
         frame_poses.append(frame_pose)
     frame_poses = np.array(frame_poses)
     return frame_poses
 
+def pose_to_quat_trans(frame_pose):
+    T_pose = np.array(frame_pose).reshape(4, 4)
+    # transoformation matrix to quaternion+translation
+    quaternion = R.from_matrix(T_pose[:3, :3]).as_quat()
+    translation = T_pose[:3, 3]
+    ## convert quaternion with translation to 7D vector
+    return np.concatenate([quaternion, translation])
+
 def load_frame_poses(data_dir, scan_id, frame_idxs, type = 'matrix'):
+    frame_index = get_frame_index(data_dir)
+    if frame_index is not None and scan_id in frame_index:
+        poses = frame_index.poses(scan_id, list(frame_idxs), type)
+        if poses is not None:
+            return {frame_idx: pose for frame_idx, pose in zip(frame_idxs, poses)}
     frame_poses = {}
     for frame_idx in frame_idxs:
-        frame_pose = load_pose(data_dir, scan_id, frame_idx)
+        frame_pose = read_pose(data_dir, scan_id, frame_idx)
         frame_pose = frame_pose.reshape(4, 4)
         if type == 'matrix':
             frame_poses[frame_idx] = np.array(frame_pose)
         elif type == 'quat_trans':
-            T_pose = np.array(frame_pose)
-            # transoformation matrix to quaternion+translation
-            quaternion = R.from_matrix(T_pose[:3, :3]).as_quat()
-            translation = T_pose[:3, 3]
-            ## convert quaternion with translation to 7D vector
-            frame_pose = np.concatenate([quaternion, translation])
+            frame_pose = pose_to_quat_trans(frame_pose)
         else:
             raise ValueError("Invalid type")
                                    
@@ -105,6 +135,13 @@ def load_frame_idxs(data_dir, scan_id, skip=None):
     #     frame_idxs = ['{:06d}'.format(frame_idx) for frame_idx in range(0, num_frames, skip)]
     # return frame_idxs
     
+    frame_index = get_frame_index(data_dir)
+    if frame_index is not None and scan_id in frame_index:
+        frame_idxs = frame_index.frameIdxs(scan_id)
+        return frame_idxs if skip is None else frame_idxs[::skip]
+    return read_frame_idxs(data_dir, scan_id, skip)
+
+def read_frame_idxs(data_dir, scan_id, skip=None):
     frames_paths = glob(osp.join(data_dir, scan_id, 'sequence', '*.jpg'))
     frame_names = [osp.basename(frame_path) for frame_path in frames_paths]
     frame_idxs = [frame_name.split('.')[0].split('-')[-1] for frame_name in frame_names]
@@ -145,7 +182,12 @@ def load_depth_paths(data_dir, scan_id, skip=None):
         img_paths[frame_idx] = img_path
     return img_paths
 
-def load_patch_feature_scans(data_root_dir, feature_folder, scan_id, skip=None):
+def load_patch_feature_scans(data_root_dir, feature_folder, scan_id, skip=None, feature_store=None):
+    if feature_store is not None:
+        # rows of the memory-mapped PatchFeatureStore, no copy
+        frame_idxs = feature_store.frameIdxs(scan_id)
+        frame_idxs = frame_idxs if skip is None else frame_idxs[::skip]
+        return feature_store.scan(scan_id, frame_idxs)
     frame_idxs = load_frame_idxs(osp.join(data_root_dir, "scenes"), scan_id, skip)
     features_file = osp.join(osp.join(data_root_dir, "files"), feature_folder, scan_id+".pkl")
     with open(features_file, 'rb') as handle:
@@ -163,14 +205,60 @@ def load_pkl_data(filename):
 
 def load_gt_2D_anno(data_root_dir, scan_id, skip=None):
     import cv2
+    from utils.projection_store import ProjectionStore, projection_store_dir
     anno_imgs = {}
     frame_idxs = load_frame_idxs(osp.join(data_root_dir, "scenes"), scan_id, skip)
+    # lossless uint16 projections if the projector wrote them, the jpg images otherwise
+    projection_store = ProjectionStore(projection_store_dir(data_root_dir))
+    if scan_id in projection_store:
+        return projection_store.scan(scan_id, frame_idxs)
     anno_folder = osp.join(data_root_dir, "files", 'gt_projection/obj_id', scan_id)
     for frame_idx in frame_idxs:
         anno_img_file = osp.join(anno_folder, "frame-{}.jpg".format(frame_idx))
         anno_img = cv2.imread(anno_img_file, cv2.IMREAD_UNCHANGED)
         anno_imgs[frame_idx] = anno_img
     return anno_imgs
+
+def patch_bounds(size, num_patches):
+    patch_size = size / num_patches
+    return [round(i * patch_size) for i in range(num_patches + 1)]
+
+def annotate_patches(obj_id_maps, patch_h, patch_w, th=0.2):
+    r"""Majority object id of every image patch of (F, H, W) object-id maps, (F, patch_h, patch_w).
+
+    A patch keeps its most frequent id if it covers more than th of the patch, 0 otherwise,
+    ties going to the smallest id. Pixels are mapped to patches with the rounded patch bounds
+    and the (patch, id) pairs of a frame counted with one bincount.
+    """
+    obj_id_maps = np.asarray(obj_id_maps)
+    num_frames, height, width = obj_id_maps.shape
+    num_patches = patch_h * patch_w
+    h_bounds, w_bounds = patch_bounds(height, patch_h), patch_bounds(width, patch_w)
+    # patch idx of every pixel, pixels past the last bound are left out
+    row_patch = np.searchsorted(h_bounds, np.arange(h_bounds[-1]), side='right') - 1
+    col_patch = np.searchsorted(w_bounds, np.arange(w_bounds[-1]), side='right') - 1
+    pixel_patch = (row_patch[:, None] * patch_w + col_patch[None, :]).astype(np.int32)
+    patch_sizes = np.bincount(pixel_patch.reshape(-1), minlength=num_patches)
+
+    patch_annos = np.zeros((num_frames, num_patches), dtype=np.int32)
+    for frame_i in range(num_frames):
+        obj_ids = obj_id_maps[frame_i, :h_bounds[-1], :w_bounds[-1]]
+        unique_ids = None
+        num_ids = int(obj_ids.max()) + 1
+        if num_ids * num_patches > obj_ids.size:
+            # compact large ids, kept sorted so that ties still go to the smallest id
+            unique_ids = np.flatnonzero(np.bincount(obj_ids.reshape(-1)))
+            id_lut = np.zeros(num_ids, dtype=np.int32)
+            id_lut[unique_ids] = np.arange(unique_ids.shape[0])
+            obj_ids, num_ids = id_lut[obj_ids], unique_ids.shape[0]
+        keys = pixel_patch * num_ids
+        np.add(keys, obj_ids, out=keys, casting='unsafe')
+        counts = np.bincount(keys.reshape(-1), minlength=num_patches * num_ids).reshape(num_patches, num_ids)
+        max_idxs = np.argmax(counts, axis=1)
+        max_counts = counts[np.arange(num_patches), max_idxs]
+        max_ids = max_idxs if unique_ids is None else unique_ids[max_idxs]
+        patch_annos[frame_i] = np.where(max_counts > th * patch_sizes, max_ids, 0)
+    return patch_annos.reshape(num_frames, patch_h, patch_w)
     
 
 def read_transform_mat(filename):
@@ -420,15 +508,15 @@ def createRangeImage(pcs, colors, center, fov_up, fov_down, proj_W, proj_H, rang
     proj_y = np.minimum(proj_H - 1, proj_y)
     proj_y = np.maximum(0, proj_y).astype(np.int32)  # in [0,H-1]
 
-    # order in decreasing depth
-    order = np.argsort(depth)[::-1]
-    depth = depth[order]
-    proj_y = proj_y[order]
-    proj_x = proj_x[order]
-    colors = colors[order, :]
-
-    indices = np.arange(depth.shape[0])
-    indices = indices[order]
+    # z-buffer, keep the closest point of every pixel by a scatter-min over flattened pixel indices
+    pixels = proj_y.astype(np.int64) * proj_W + proj_x
+    zbuffer = np.full(proj_H * proj_W, np.inf)
+    np.minimum.at(zbuffer, pixels, depth)
+    is_closest = depth == zbuffer[pixels]
+    depth = depth[is_closest]
+    proj_y = proj_y[is_closest]
+    proj_x = proj_x[is_closest]
+    colors = colors[is_closest, :]
 
     proj_range = np.full((proj_H, proj_W, 3), 0,
                         dtype=np.uint8)  # [H,W] range (-1 is no data)
@@ -9,6 +9,7 @@ from scipy.spatial import ConvexHull
 from copy import deepcopy
 import pickle
 from utils import common, scan3r, point_cloud, define
+from utils.elastic_distortion import ElasticDistortion
 import scipy, torch
 import os, threading, queue, subprocess
 import random
@@ -390,9 +391,7 @@ def process_ply_data2scan3r(scan_id, ply_data, rels_dict, objs_dict, rel2idx, cf
     
     # obj points
     points = np.stack([ply_data['x'], ply_data['y'], ply_data['z']]).transpose((1, 0))
-    object_points = {}
-    for pc_resolution in cfg.preprocess.pc_resolutions:
-        object_points[pc_resolution] = []
+    obj_pcls = []
     object_data = objs_dict['objects'] 
     for idx, object in enumerate(object_data):
         
@@ -407,13 +406,13 @@ def process_ply_data2scan3r(scan_id, ply_data, rels_dict, objs_dict, rel2idx, cf
         cx = np.mean(hull.points[hull.vertices,0])
         cy = np.mean(hull.points[hull.vertices,1])
         cz = np.mean(hull.points[hull.vertices,2])
-        for pc_resolution in object_points.keys():
-            obj_pcl = point_cloud.pcl_farthest_sample(obj_pcl, pc_resolution)
-            object_points[pc_resolution].append(obj_pcl)
+        obj_pcls.append(obj_pcl)
         barry_centers.append([cx, cy, cz])
         objects_ids.append(object_id)
         global_objects_ids.append(global_object_id)
         objects_cat.append(global_object_id)
+    # all objects sampled at once, smaller resolutions are prefixes of the largest one
+    object_points = point_cloud.pcl_farthest_sample_multires(obj_pcls, cfg.preprocess.pc_resolutions)
     for pc_resolution in object_points.keys():
         object_points[pc_resolution] = np.array(object_points[pc_resolution])
     
@@ -504,9 +503,7 @@ def process_gt_seg_2scan3r(scan_id, ply_data, objects_info, cfg):
     
     # obj points
     points = np.stack([ply_data['x'], ply_data['y'], ply_data['z']]).transpose((1, 0))
-    object_points = {}
-    for pc_resolution in cfg.preprocess.pc_resolutions:
-        object_points[pc_resolution] = []
+    obj_pcls = []
 
     for key, object in objects_info.items():
         
@@ -521,13 +518,13 @@ def process_gt_seg_2scan3r(scan_id, ply_data, objects_info, cfg):
         cx = np.mean(hull.points[hull.vertices,0])
         cy = np.mean(hull.points[hull.vertices,1])
         cz = np.mean(hull.points[hull.vertices,2])
-        for pc_resolution in object_points.keys():
-            obj_pcl = point_cloud.pcl_farthest_sample(obj_pcl, pc_resolution)
-            object_points[pc_resolution].append(obj_pcl)
+        obj_pcls.append(obj_pcl)
         barry_centers.append([cx, cy, cz])
         objects_ids.append(object_id)
         global_objects_ids.append(global_object_id)
         objects_cat.append(global_object_id)
+    # all objects sampled at once, smaller resolutions are prefixes of the largest one
+    object_points = point_cloud.pcl_farthest_sample_multires(obj_pcls, cfg.preprocess.pc_resolutions)
     for pc_resolution in object_points.keys():
         object_points[pc_resolution] = np.array(object_points[pc_resolution])
     
@@ -689,68 +686,6 @@ def getPatchAnno(gt_anno_2D, patch_w, patch_h, th = 0.5):
                 patch_annos[patch_h_i,patch_w_j] = obj_ids[max_idx]
     return patch_annos
 
-class ElasticDistortion: # from torch-points3d
-    """Apply elastic distortion on sparse coordinate space. First projects the position onto a 
-    voxel grid and then apply the distortion to the voxel grid.
-
-    Parameters
-    ----------
-    granularity: List[float]
-        Granularity of the noise in meters
-    magnitude:List[float]
-        Noise multiplier in meters
-    Returns
-    -------
-    data: Data
-        Returns the same data object with distorted grid
-    """
-
-    def __init__(
-        self, apply_distorsion: bool = True, granularity: list = [0.2, 0.8], magnitude=[0.4, 1.6],
-    ):
-        assert len(magnitude) == len(granularity)
-        self._apply_distorsion = apply_distorsion
-        self._granularity = granularity
-        self._magnitude = magnitude
-
-    @staticmethod
-    def elastic_distortion(coords, granularity, magnitude):
-        coords = coords.numpy()
-        blurx = np.ones((3, 1, 1, 1)).astype("float32") / 3
-        blury = np.ones((1, 3, 1, 1)).astype("float32") / 3
-        blurz = np.ones((1, 1, 3, 1)).astype("float32") / 3
-        coords_min = coords.min(0)
-
-        # Create Gaussian noise tensor of the size given by granularity.
-        noise_dim = ((coords - coords_min).max(0) // granularity).astype(int) + 3
-        noise = np.random.randn(*noise_dim, 3).astype(np.float32)
-
-        # Smoothing.
-        for _ in range(2):
-            noise = scipy.ndimage.filters.convolve(noise, blurx, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blury, mode="constant", cval=0)
-            noise = scipy.ndimage.filters.convolve(noise, blurz, mode="constant", cval=0)
-
-        # Trilinear interpolate noise filters for each spatial dimensions.
-        ax = [
-            np.linspace(d_min, d_max, d)
-            for d_min, d_max, d in zip(coords_min - granularity, coords_min + granularity * (noise_dim - 2), noise_dim)
-        ]
-        interp = scipy.interpolate.RegularGridInterpolator(ax, noise, bounds_error=0, fill_value=0)
-        coords = coords + interp(coords) * magnitude
-        return torch.tensor(coords).float()
-    def __call__(self, pcs_pos):
-        # coords = pcs_pos / self._spatial_resolution
-        if self._apply_distorsion:
-            if random.random() < 0.95:
-                for i in range(len(self._granularity)):
-                    pcs_pos = ElasticDistortion.elastic_distortion(pcs_pos, self._granularity[i], self._magnitude[i],)
-        return pcs_pos
-
-    def __repr__(self):
-        return "{}(apply_distorsion={}, granularity={}, magnitude={})".format(
-            self.__class__.__name__, self._apply_distorsion, self._granularity, self._magnitude,
-        )
         
 def sampleCandidateScenesForEachScan(scan_id, scan_ids, 
                                         refscans2scans, scans2refscans , num_scenes):
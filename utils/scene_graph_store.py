@@ -0,0 +1,142 @@
+import os
+import os.path as osp
+import shutil
+import uuid
+import numpy as np
+
+from utils import common
+
+# columns with one row per object, sliced with the object offsets of each scan
+OBJ_KEYS = ['obj_ids', 'global_obj_ids', 'tot_obj_pts', 'tot_bow_vec_object_attr_feats',
+            'tot_bow_vec_object_edge_feats', 'tot_rel_pose']
+# columns with one row per edge, sliced with the edge offsets of each scan
+EDGE_KEYS = ['edges']
+# columns with one row per scan
+SCAN_KEYS = ['pcl_center']
+
+class SceneGraphStore():
+    r"""Packed columnar store of the scene graphs of a split.
+
+    Every column is one contiguous .npy file of all scans back to back, memory-mapped
+    read-only on load so that DataLoader workers share the pages instead of holding
+    copies of per-scan python objects. obj_offsets.npy / edge_offsets.npy give the
+    (S+1,) row offsets of each scan and index.pkl the order of the scans and the columns.
+    Each write goes to a new version dir that index.pkl, replaced last, points to, so a
+    concurrent reader loads either the previous or the new store, never a mix of both.
+    """
+    def __init__(self, store_dir, obj_keys=OBJ_KEYS, edge_keys=EDGE_KEYS, scan_keys=SCAN_KEYS):
+        self.store_dir = store_dir
+        self.index_file = osp.join(store_dir, 'index.pkl')
+        self.obj_keys = list(obj_keys)
+        self.edge_keys = list(edge_keys)
+        self.scan_keys = list(scan_keys)
+        self.column_dir = store_dir
+        self.columns = {}
+        self.scan_ids = []
+        self.scan_id2row = {}
+        self.obj_offsets = None
+        self.edge_offsets = None
+
+    def exists(self):
+        return osp.isfile(self.index_file)
+
+    def column_file(self, key):
+        return osp.join(self.column_dir, '{}.npy'.format(key))
+
+    def saveArray(self, filename, array):
+        # write to a tmp file and rename, readers never see partial files
+        filename_tmp = filename + '.tmp.npy'
+        np.save(filename_tmp, array)
+        os.replace(filename_tmp, filename)
+
+    def write(self, scene_graphs, scan_ids, count_key='obj_ids'):
+        r"""Pack scene_graphs[scan_id] dicts into the store, count_key is an object column."""
+        previous_version = common.load_pkl_data(self.index_file).get('version') if self.exists() else None
+        version = 'v_{}'.format(uuid.uuid4().hex[:12])
+        self.column_dir = osp.join(self.store_dir, version)
+        common.ensure_dir(self.column_dir)
+        for key in self.obj_keys + self.edge_keys:
+            self.saveArray(self.column_file(key),
+                           np.concatenate([np.asarray(scene_graphs[scan_id][key]) for scan_id in scan_ids]))
+        for key in self.scan_keys:
+            self.saveArray(self.column_file(key), np.stack([np.asarray(scene_graphs[scan_id][key]) for scan_id in scan_ids]))
+        obj_counts = [len(scene_graphs[scan_id][count_key]) for scan_id in scan_ids]
+        edge_counts = [len(scene_graphs[scan_id]['edges']) for scan_id in scan_ids]
+        self.saveArray(self.column_file('obj_offsets'), np.cumsum([0] + obj_counts).astype(np.int64))
+        self.saveArray(self.column_file('edge_offsets'), np.cumsum([0] + edge_counts).astype(np.int64))
+        # index last, it marks the store as complete
+        index = {'scan_ids': list(scan_ids), 'obj_keys': self.obj_keys, 
+                 'edge_keys': self.edge_keys, 'scan_keys': self.scan_keys, 'version': version}
+        index_file_tmp = '{}.{}.tmp'.format(self.index_file, version)
+        common.write_pkl_data(index, index_file_tmp)
+        os.replace(index_file_tmp, self.index_file)
+        # older versions are removed, the previous one is kept for readers that just loaded its index
+        for name in os.listdir(self.store_dir):
+            if name.startswith('v_') and name not in [version, previous_version]:
+                shutil.rmtree(osp.join(self.store_dir, name), ignore_errors=True)
+
+    def load(self):
+        index = common.load_pkl_data(self.index_file)
+        self.scan_ids = index['scan_ids']
+        # stores written before versioning keep their columns in store_dir
+        self.column_dir = osp.join(self.store_dir, index['version']) if 'version' in index else self.store_dir
+        self.obj_keys = index.get('obj_keys', self.obj_keys)
+        self.edge_keys = index.get('edge_keys', self.edge_keys)
+        self.scan_keys = index.get('scan_keys', self.scan_keys)
+        self.scan_id2row = {scan_id: row for row, scan_id in enumerate(self.scan_ids)}
+        for key in self.obj_keys + self.edge_keys + self.scan_keys:
+            self.columns[key] = np.load(self.column_file(key), mmap_mode='r')
+        self.obj_offsets = np.load(self.column_file('obj_offsets'))
+        self.edge_offsets = np.load(self.column_file('edge_offsets'))
+
+    def __contains__(self, scan_id):
+        return scan_id in self.scan_id2row
+
+    def scan(self, scan_id, keys=None):
+        r"""Scene graph of a scan as zero-copy views into the memory-mapped columns."""
+        keys = self.columns.keys() if keys is None else keys
+        row = self.scan_id2row[scan_id]
+        obj_start, obj_end = self.obj_offsets[row], self.obj_offsets[row + 1]
+        edge_start, edge_end = self.edge_offsets[row], self.edge_offsets[row + 1]
+        scene_graph = {}
+        for key in keys:
+            if key in self.obj_keys:
+                scene_graph[key] = np.asarray(self.columns[key][obj_start:obj_end])
+            elif key in self.edge_keys:
+                scene_graph[key] = np.asarray(self.columns[key][edge_start:edge_end])
+            else:
+                scene_graph[key] = np.asarray(self.columns[key][row])
+        return scene_graph
+
+# columns of the preprocessed scene graph bundle, object points are stored per resolution
+BUNDLE_OBJ_KEYS = ['objects_id', 'objects_cat', 'objects_nyu40', 'rel_trans',
+                   'bow_vec_object_attr_feats', 'bow_vec_object_edge_feats']
+
+def bundle_points_key(pc_resolution):
+    return 'obj_points_{}'.format(pc_resolution)
+
+class SceneGraphBundle(SceneGraphStore):
+    r"""Preprocessed scene graphs of a split with scene centers and categories.
+
+    Written once by preprocessing/scan3r/build_sg_bundle.py so that datasets do not load
+    the full scene point cloud of every scan for its center, nor one pickle per scan.
+    Object points of every resolution are stored already centered (float32), the
+    columns are memory-mapped, a dataset only reads the pages of what it uses.
+    """
+    def __init__(self, store_dir, pc_resolutions=(), use_attr_feats=True):
+        obj_keys = [key for key in BUNDLE_OBJ_KEYS if use_attr_feats or key != 'bow_vec_object_attr_feats']
+        obj_keys += [bundle_points_key(pc_resolution) for pc_resolution in pc_resolutions]
+        super().__init__(store_dir, obj_keys, EDGE_KEYS, SCAN_KEYS)
+
+    def write(self, scene_graphs, scan_ids):
+        super().write(scene_graphs, scan_ids, count_key='objects_id')
+
+    def pc_resolutions(self):
+        return [int(key[len('obj_points_'):]) for key in self.obj_keys if key.startswith('obj_points_')]
+
+def store_dir(files_dir_mode, sg_filename, split, pc_resolution, resplit=''):
+    # one store per split, resplit and resolution, datasets of other splits do not overwrite it
+    return osp.join(files_dir_mode, 'sg_store', '{}_{}{}_{}'.format(sg_filename, resplit, split, pc_resolution))
+
+def bundle_dir(files_dir_mode, sg_filename, split, resplit=''):
+    return osp.join(files_dir_mode, 'sg_bundle', '{}_{}{}'.format(sg_filename, resplit, split))
@@ -3,15 +3,14 @@ import time
 
 class Timer:
     def __init__(self):
-        self.total_prepare_time = 0
-        self.total_process_time = 0
-        self.count_prepare_time = 0
-        self.count_process_time = 0
-        self.last_time = time.time()
+        self.reset()
 
     def reset(self):
+        # data: waiting for the data loader, prepare: moving the batch to the device, process: compute
+        self.total_data_time = 0
         self.total_prepare_time = 0
         self.total_process_time = 0
+        self.count_data_time = 0
         self.count_prepare_time = 0
         self.count_process_time = 0
         self.last_time = time.time()
@@ -19,6 +18,12 @@ class Timer:
     def record_time(self):
         self.last_time = time.time()
 
+    def add_data_time(self):
+        current_time = time.time()
+        self.total_data_time += current_time - self.last_time
+        self.count_data_time += 1
+        self.last_time = current_time
+
     def add_prepare_time(self):
         current_time = time.time()
         self.total_prepare_time += current_time - self.last_time
@@ -31,6 +36,14 @@ class Timer:
         self.count_process_time += 1
         self.last_time = current_time
 
+    def get_data_time(self):
+        return self.total_data_time / (self.count_data_time + 1e-12)
+
+    def get_data_ratio(self):
+        # share of the iteration time spent waiting for data, input pipeline stalls when close to 1
+        total_time = self.total_data_time + self.total_prepare_time + self.total_process_time
+        return self.total_data_time / (total_time + 1e-12)
+
     def get_prepare_time(self):
         return self.total_prepare_time / (self.count_prepare_time + 1e-12)
 
@@ -38,7 +51,10 @@ class Timer:
         return self.total_process_time / (self.count_process_time + 1e-12)
 
     def tostring(self):
-        summary = 'time: '
+        summary = ''
+        if self.count_data_time > 0:
+            summary += 'data: {:.3f}s ({:.0%}), '.format(self.get_data_time(), self.get_data_ratio())
+        summary += 'time: '
         if self.count_prepare_time > 0:
             summary += '{:.3f}s/'.format(self.get_prepare_time())
         summary += '{:.3f}s'.format(self.get_process_time())
@@ -4,8 +4,10 @@ import math
 from typing import Callable
 
 import torch
+import torch.nn as nn
 import torch.distributed as dist
 import torch.utils.data
+import torch.utils.checkpoint
 import torch.backends.cudnn as cudnn
 
 def release_cuda(x):
@@ -38,18 +40,105 @@ def release_cuda_torch(x):
             x = x.detach().cpu()
     return x
 
-def to_cuda(x):
-    r"""Move all tensors to cuda."""
+def to_device(x, device, non_blocking=False):
+    r"""Move all tensors to device."""
     if isinstance(x, list):
-        x = [to_cuda(item) for item in x]
+        x = [to_device(item, device, non_blocking) for item in x]
     elif isinstance(x, tuple):
-        x = (to_cuda(item) for item in x)
+        x = (to_device(item, device, non_blocking) for item in x)
     elif isinstance(x, dict):
-        x = {key: to_cuda(value) for key, value in x.items()}
+        x = {key: to_device(value, device, non_blocking) for key, value in x.items()}
     elif isinstance(x, torch.Tensor):
-        x = x.cuda()
+        x = x.to(device, non_blocking=non_blocking)
     return x
 
+def to_cuda(x):
+    r"""Move all tensors to cuda."""
+    return to_device(x, torch.device('cuda'))
+
+def get_device(device='auto'):
+    r"""torch.device of a config/CLI name: 'auto' (cuda if available), 'cuda', 'cuda:<idx>' or 'cpu'."""
+    if device == 'auto':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    if device.startswith('cuda') and not torch.cuda.is_available(): 
+        raise RuntimeError('No CUDA devices available.')
+    return torch.device(device)
+
+def set_cpu_threads(num_threads=0, num_interop_threads=0):
+    r"""Intra-op and inter-op thread pools of the CPU backend, 0 keeps the torch default."""
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads > 0:
+        # can only be set once, before any inter-op parallel work
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            pass
+
+def setup_device(device_cfg, device=None):
+    r"""Device of the cfg.device node (or the device name given on the command line)."""
+    device = get_device(device if device else device_cfg.name)
+    if device.type == 'cpu':
+        set_cpu_threads(device_cfg.num_threads, device_cfg.num_interop_threads)
+    return device
+
+def synchronize(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def empty_cache(device):
+    if device.type == 'cuda':
+        torch.cuda.empty_cache()
+
+def autocast(device, enabled=True, dtype=torch.bfloat16):
+    r"""Mixed precision context of the device type, bfloat16 is the one supported on CPU."""
+    return torch.autocast(device_type=device.type, dtype=dtype, enabled=enabled)
+
+def amp_dtype(device, dtype='auto'):
+    r"""Autocast dtype of a config name: 'auto' (bfloat16 on cpu, float16 on accelerators), 'bf16' or 'fp16'."""
+    if dtype == 'auto':
+        dtype = 'bf16' if device.type == 'cpu' else 'fp16'
+    if dtype not in ['bf16', 'fp16']:
+        raise ValueError('Unknown autocast dtype {}.'.format(dtype))
+    if dtype == 'fp16' and device.type == 'cpu':
+        raise ValueError('float16 autocast is not supported on cpu, use bf16.')
+    return torch.bfloat16 if dtype == 'bf16' else torch.float16
+
+def grad_scaler(device, enabled=True):
+    r"""Loss scaling of float16 training, a pass-through when disabled. float16 autocast is cuda only."""
+    # torch.amp.GradScaler(device) needs torch >= 2.3, the cuda scaler is also in the pinned torch 2.1
+    return torch.cuda.amp.GradScaler(enabled=enabled and device.type == 'cuda')
+
+def set_grad_checkpointing(model, enabled=True):
+    r"""Set the activation checkpointing flag of all submodules supporting it (grad_checkpointing attribute)."""
+    for module in model.modules():
+        if hasattr(module, 'grad_checkpointing'):
+            module.grad_checkpointing = enabled
+
+def checkpoint(function, *inputs, batch_norm_modules=None):
+    r"""Activation checkpointing, the activations of function are recomputed in backward instead of stored.
+
+    Running statistics of the batch norm layers in batch_norm_modules are only updated by the first forward.
+    """
+    num_calls = [0]
+    def run(*inputs):
+        num_calls[0] += 1
+        if num_calls[0] == 1 or batch_norm_modules is None:
+            return function(*inputs)
+        # recomputation in backward, momentum 0 keeps the running statistics
+        batch_norms = [module for module in batch_norm_modules.modules()
+                       if isinstance(module, nn.modules.batchnorm._BatchNorm) and module.track_running_stats]
+        states = [(module.momentum, module.num_batches_tracked.clone()) for module in batch_norms]
+        for module in batch_norms:
+            module.momentum = 0.
+        try:
+            return function(*inputs)
+        finally:
+            for module, (momentum, num_batches_tracked) in zip(batch_norms, states):
+                module.momentum = momentum
+                module.num_batches_tracked.copy_(num_batches_tracked)
+    return torch.utils.checkpoint.checkpoint(run, *inputs, use_reentrant=False)
+
 def initialize(seed=None, cudnn_deterministic=True, autograd_anomaly_detection=False):
     if seed is not None:
         random.seed(seed)
@@ -99,6 +188,8 @@ def build_dataloader(
     pin_memory=False,
     drop_last=False,
     distributed=False,
+    persistent_workers=False,
+    prefetch_factor=None,
 ):
     if distributed:
         sampler = torch.utils.data.DistributedSampler(dataset)
@@ -107,6 +198,10 @@ def build_dataloader(
         sampler = None
         shuffle = shuffle
 
+    # worker options only apply to multi-process loading, pinned memory only with cuda
+    if num_workers == 0:
+        persistent_workers = False
+        prefetch_factor = None
     data_loader = torch.utils.data.DataLoader(
         dataset,
         batch_size=batch_size,
@@ -115,8 +210,10 @@ def build_dataloader(
         sampler=sampler,
         collate_fn=collate_fn,
         worker_init_fn=reset_seed_worker_init_fn,
-        pin_memory=pin_memory,
+        pin_memory=pin_memory and torch.cuda.is_available(),
         drop_last=drop_last,
+        persistent_workers=persistent_workers,
+        prefetch_factor=prefetch_factor,
     )
 
     return data_loader
@@ -7,12 +7,13 @@ from matplotlib.colors import LinearSegmentedColormap
 from copy import deepcopy
 import os.path as osp
 import bisect, pickle
-from collections import Counter
+from functools import partial
 import sys
 sys.path.append('.')
 vlsg_dir = osp.dirname(osp.dirname(__file__))
 sys.path.append(vlsg_dir)
 from utils import common
+from utils.retrieval_record import RetrievalRecordReader, record_dir, dict_chunks
 
 def get_random_color():
     r = random.randint(0, 255)
@@ -81,6 +82,13 @@ def plotBar(metric_title, x_label, y_label, labels, metric_values,
     
 # get correlation between retrieval score and success rate
 class RetrievalStatistics:
+    r"""Statistics of a room retrieval evaluation, computed in one pass over its record.
+
+    The record is read chunk by chunk from the columnar record of utils/retrieval_record.py
+    in retrieval_records_dir (the pickled dict of older runs is read otherwise), or from the
+    given nested retrieval_records dict. Only a few scalars per frame and the confusion
+    matrices are kept in memory.
+    """
     def __init__(self, retrieval_records_dir, retrieval_records = None,
                  temp = True, split = "val"):
         self.undefined = 0
@@ -89,137 +97,111 @@ class RetrievalStatistics:
         self.out_dir = osp.join(retrieval_records_dir, "{}_{}_statistics".format(split, "temp" if temp else "static"))
         common.ensure_dir(self.out_dir)
         
-        if retrieval_records is not None:
-            self.retrieval_records = retrieval_records
+        records_dir = record_dir(retrieval_records_dir, split)
+        if retrieval_records is None and RetrievalRecordReader.exists(records_dir):
+            reader = RetrievalRecordReader(records_dir)
+            self.scans = reader.scans
+            self.chunks = reader.chunks
         else:
-            retrieval_pkl = osp.join(retrieval_records_dir, 
-                                    "retrieval_record_{}.pkl".format(split))
-            retrieval_records = pickle.load(open(retrieval_pkl, "rb"))
-            self.retrieval_records = retrieval_records
+            if retrieval_records is None:
+                retrieval_pkl = osp.join(retrieval_records_dir, 
+                                        "retrieval_record_{}.pkl".format(split))
+                retrieval_records = pickle.load(open(retrieval_pkl, "rb"))
+            self.scans = retrieval_records
+            self.chunks = partial(dict_chunks, retrieval_records)
             
         self.temp = temp
-        self.scan_ids = list(retrieval_records.keys())
+        self.scan_ids = list(self.scans.keys())
+        self.frame_statistics = None
 
-    def get_score_and_sucess(self, scan_id, frame_record):
-        if self.temp:
-            retrieval_scores = frame_record["room_score_scans_T"]
-            target_scan_id = frame_record["temporal_scan_id"]
-        else:
-            retrieval_scores = frame_record["room_score_scans_NT"]
-            target_scan_id = scan_id
-            
-        room_sorted_by_scores = [item[0] for item in sorted(
-            retrieval_scores.items(), key=lambda x: x[1], reverse=True)]
-        
-        success = target_scan_id == room_sorted_by_scores[0]
-        score = retrieval_scores[room_sorted_by_scores[0]]
-        return score, success
-    
-    def get_shannonEntropy(self, scan_id, frame_record):
-        # get success
-        if self.temp:
-            gt_obj_cates = frame_record['gt_obj_cates_temp']
-        else:
-            gt_obj_cates = frame_record['gt_obj_cates']
-        
-        # get Shannon Entropy
-        patch_obj_ids = frame_record['gt_anno']
-        gt_obj_cates = gt_obj_cates[patch_obj_ids != self.undefined]
-        patch_obj_ids = patch_obj_ids[patch_obj_ids != self.undefined]
+    def get_shannonEntropy(self, patch_obj_ids, gt_obj_cates):
+        # Shannon entropy of the objects annotated in the patches of a frame
+        valid = patch_obj_ids != self.undefined
+        gt_obj_cates = gt_obj_cates[valid]
+        patch_obj_ids = patch_obj_ids[valid]
         ## merge instances of cateogory
         wall_cate_id = 1
-        wall_obj_ids = patch_obj_ids[ gt_obj_cates == wall_cate_id ]
-        if len(wall_obj_ids) > 0:
-            patch_obj_ids[ gt_obj_cates == wall_cate_id ] = wall_obj_ids[0]
-        counts = Counter(patch_obj_ids)
-        total = sum(counts.values())
-        entropy = -sum((count/total) * np.log2(count/total) for count in counts.values())
-        return entropy
+        is_wall = gt_obj_cates == wall_cate_id
+        if is_wall.any():
+            patch_obj_ids[is_wall] = patch_obj_ids[is_wall][0]
+        _, counts = np.unique(patch_obj_ids, return_counts=True)
+        probs = counts / max(counts.sum(), 1)
+        return -np.sum(probs * np.log2(probs))
     
-    def get_shannonEntropy_and_sucess(self, scan_id, frame_record):
-        # get success
-        if self.temp:
-            retrieval_scores = frame_record["room_score_scans_T"]
-            target_scan_id = frame_record["temporal_scan_id"]
-            gt_obj_cates = frame_record['gt_obj_cates_temp']
-        else:
-            retrieval_scores = frame_record["room_score_scans_NT"]
-            target_scan_id = scan_id
-            gt_obj_cates = frame_record['gt_obj_cates']
-        room_sorted_by_scores = [item[0] for item in sorted(
-            retrieval_scores.items(), key=lambda x: x[1], reverse=True)]
-        success = target_scan_id == room_sorted_by_scores[0]
-        
-        # get Shannon Entropy
-        entropy = self.get_shannonEntropy(scan_id, frame_record)
-        return entropy, success
-
-    def get_shannonEntropy_and_patchsucess(self, scan_id, frame_record):
-        # get patch success
-        if self.temp:
-            patch_predict = frame_record["matched_obj_ids_temp"]
-            correct_patch_predict_allscans = frame_record["is_patch_correct_allscans_temp"]
-        else:
-            patch_predict = frame_record["matched_obj_ids"]
-            correct_patch_predict_allscans = frame_record["is_patch_correct_allscans"]
-        # patch-match-target scan
-        gt_anno = frame_record['gt_anno']
-        ## filter out undefined
-        patch_predict = patch_predict[gt_anno != self.undefined]
-        correct_patch_predict_allscans = correct_patch_predict_allscans[gt_anno != self.undefined]
-        gt_anno = gt_anno[gt_anno != self.undefined]
-        if len(patch_predict) == 0:
-            return None, None, None
-        match_success_ratio = np.sum(patch_predict == gt_anno) * 1.0 / len(gt_anno)
-        # patch-match-all scans
-        match_success_ratio_allscans = np.sum(correct_patch_predict_allscans) * 1.0 / len(correct_patch_predict_allscans)
-        
-        # get Shannon Entropy
-        entropy = self.get_shannonEntropy(scan_id, frame_record)
-        return entropy, match_success_ratio, match_success_ratio_allscans
+    def get_patchsucess(self, gt_anno, patch_predict, correct_patch_predict_allscans):
+        # patch-object match success ratio of a frame, target scan and all scans, None if no patch
+        valid = gt_anno != self.undefined
+        if not valid.any():
+            return None, None
+        match_success_ratio = np.sum(patch_predict[valid] == gt_anno[valid]) * 1.0 / valid.sum()
+        match_success_ratio_allscans = np.sum(correct_patch_predict_allscans[valid]) * 1.0 / valid.sum()
+        return match_success_ratio, match_success_ratio_allscans
     
-    def get_SceneObjNum_and_sucess(self, scan_id, frame_record):
-        # get success
-        if self.temp:
-            retrieval_scores = frame_record["room_score_scans_T"]
-            target_scan_id = frame_record["temporal_scan_id"]
-        else:
-            retrieval_scores = frame_record["room_score_scans_NT"]
-            target_scan_id = scan_id
-        room_sorted_by_scores = [item[0] for item in sorted(
-            retrieval_scores.items(), key=lambda x: x[1], reverse=True)]
-        success = target_scan_id == room_sorted_by_scores[0]
-        
-        # get scene object number
-        scene_obj_num = self.retrieval_records[scan_id]['obj_ids'].size
-        return scene_obj_num, success
-
-    def get_SceneObjNum_and_patchsucess(self, scan_id, frame_record):
-        # get patch success
-        if self.temp:
-            patch_predict = frame_record["matched_obj_ids_temp"]
-            correct_patch_predict_allscans = frame_record["is_patch_correct_allscans_temp"]
-        else:
-            patch_predict = frame_record["matched_obj_ids"]
-            correct_patch_predict_allscans = frame_record["is_patch_correct_allscans"]
-        # patch-match-target scan
-        gt_anno = frame_record['gt_anno']
-        ## filter out undefined
-        patch_predict = patch_predict[gt_anno != self.undefined]
-        correct_patch_predict_allscans = correct_patch_predict_allscans[gt_anno != self.undefined]
-        gt_anno = gt_anno[gt_anno != self.undefined]
-        if len(patch_predict) == 0:
-            return None, None, None
-        match_success_ratio = np.sum(patch_predict == gt_anno) * 1.0 / len(gt_anno)
-        # patch-match-all scans
-        match_success_ratio_allscans = np.sum(correct_patch_predict_allscans) * 1.0 / len(correct_patch_predict_allscans)
-        
-        # get scene object number
-        scene_obj_num = self.retrieval_records[scan_id]['obj_ids'].size
-        return scene_obj_num, match_success_ratio, match_success_ratio_allscans
+    def collectStatistics(self):
+        r"""Per-frame scalars and semantic confusion matrices, one pass over the record chunks."""
+        if self.frame_statistics is not None:
+            return self.frame_statistics
+        suffix = "_temp" if self.temp else ""
+        scores_field = "room_score_scans_T" if self.temp else "room_score_scans_NT"
+        sem_cat_id2name = self.scans[self.scan_ids[0]].get('sem_cat_id2name') if len(self.scan_ids) else None
+        sem_num = len(sem_cat_id2name) if sem_cat_id2name is not None else 0
+        confusion_matrix = np.zeros(sem_num * sem_num)
+        confusion_matrix_allscans = np.zeros(sem_num * sem_num)
+        stats = {name: [] for name in ['score', 'success', 'rank', 'patch_num', 'entropy', 
+                                       'patch_success', 'patch_success_allscans', 'scene_obj_num']}
+        for columns in self.chunks():
+            scan_ids = columns['scan_id'].tolist()
+            targets = columns['temporal_scan_id'].tolist() if self.temp else scan_ids
+            score_keys = columns[scores_field + '__keys']
+            score_values = columns[scores_field + '__values']
+            score_offsets = columns[scores_field + '__offsets']
+            patch_offsets = columns['gt_anno__offsets']
+            matched_offsets = columns['matched_obj_ids__offsets']
+            for frame_i, scan_id in enumerate(scan_ids):
+                # top-1 and rank of the target, ties in candidate order as a stable sort
+                start, end = score_offsets[frame_i:frame_i + 2]
+                scores = score_values[start:end]
+                target_i = np.flatnonzero(score_keys[start:end] == targets[frame_i])
+                best_i = np.argmax(scores)
+                stats['score'].append(scores[best_i])
+                stats['success'].append(score_keys[start + best_i] == targets[frame_i])
+                if len(target_i) > 0:
+                    target_score = scores[target_i[0]]
+                    stats['rank'].append(np.sum(scores > target_score) + np.sum(scores[:target_i[0]] == target_score))
+                else:
+                    stats['rank'].append(np.inf)
+                stats['patch_num'].append(matched_offsets[frame_i + 1] - matched_offsets[frame_i])
+                # patches
+                start, end = patch_offsets[frame_i:frame_i + 2]
+                gt_anno = columns['gt_anno'][start:end]
+                stats['entropy'].append(self.get_shannonEntropy(gt_anno, columns['gt_obj_cates' + suffix][start:end]))
+                patch_success, patch_success_allscans = self.get_patchsucess(
+                    gt_anno, columns['matched_obj_ids' + suffix][start:end], 
+                    columns['is_patch_correct_allscans' + suffix][start:end])
+                stats['patch_success'].append(np.nan if patch_success is None else patch_success)
+                stats['patch_success_allscans'].append(np.nan if patch_success_allscans is None else patch_success_allscans)
+                stats['scene_obj_num'].append(np.asarray(self.scans[scan_id]['obj_ids']).size)
+            # semantic confusion of all patches of the chunk
+            if sem_num > 0:
+                gt_cates = columns['gt_obj_cates' + suffix].astype(np.int64)
+                valid = gt_cates != self.undefined
+                for matrix, matched_field in ((confusion_matrix, 'matched_obj_cates' + suffix), 
+                                              (confusion_matrix_allscans, 'matched_obj_cates_allscans' + suffix)):
+                    matched_cates = columns[matched_field].astype(np.int64)[valid]
+                    # category 0 matched goes to the last column, as the -1 index did
+                    cells = (gt_cates[valid] - 1) * sem_num + (matched_cates - 1) % sem_num
+                    matrix += np.bincount(cells, minlength=sem_num * sem_num)
+        self.frame_statistics = {name: np.array(values) for name, values in stats.items()}
+        self.frame_statistics['confusion_matrix'] = confusion_matrix.reshape(sem_num, sem_num)
+        self.frame_statistics['confusion_matrix_allscans'] = confusion_matrix_allscans.reshape(sem_num, sem_num)
+        return self.frame_statistics
+    
+    def topKRecall(self, top_k_list = [1, 3, 5]):
+        ranks = self.collectStatistics()['rank']
+        return {k: np.mean(ranks < k) for k in top_k_list}
 
     def generateScoreAccuCorrelation(self, num_bins = 40, fig_size = (20, 5)):
-        scan_ids =  list(self.retrieval_records.keys())
+        stats = self.collectStatistics()
         
         bins = np.linspace(0.4, 1, num_bins + 1)
         num_pos_bins = np.zeros(num_bins)
@@ -228,25 +210,16 @@ class RetrievalStatistics:
         
         scores_list = []
         success_list = []
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                score, success = self.get_score_and_sucess(scan_id, frame_record)
-                patch_num = frame_record['matched_obj_ids'].size
-                
-                score_normed = score * 1.0 / patch_num
-                bin_idx = bisect.bisect(bins, score_normed) -1 
-                scores_list.append(score_normed)
-                if success:
-                    num_pos_bins[bin_idx] += 1
-                    success_list.append(1)
-                else:
-                    num_neg_bins[bin_idx] += 1
-                    success_list.append(0)
+        for score, success, patch_num in zip(stats['score'], stats['success'], stats['patch_num']):
+            score_normed = score * 1.0 / patch_num
+            bin_idx = bisect.bisect(bins, score_normed) -1 
+            scores_list.append(score_normed)
+            if success:
+                num_pos_bins[bin_idx] += 1
+                success_list.append(1)
+            else:
+                num_neg_bins[bin_idx] += 1
+                success_list.append(0)
                     
         retrie_success_ratio = num_pos_bins / (num_pos_bins + num_neg_bins)
         ## normalize to the max value of num_pos_bins and num_neg_bins
@@ -275,22 +248,11 @@ class RetrievalStatistics:
         return correlation
         
     def generateImgObjAccuCorrelation(self, num_bins = 40, fig_size = (20, 5)):
-        scan_ids =  list(self.retrieval_records.keys())
+        stats = self.collectStatistics()
         
         # get shannon entropy and success pairs
-        success_list = []
-        shannon_entropy_list = []
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            # static case
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                shannon, success = self.get_shannonEntropy_and_sucess(scan_id, frame_record)
-                shannon_entropy_list.append(shannon)
-                success_list.append(success)
+        success_list = stats['success'].tolist()
+        shannon_entropy_list = stats['entropy'].tolist()
         
         max_entropy = max(shannon_entropy_list) + 1e-6
         min_entropy = min(shannon_entropy_list)
@@ -333,28 +295,13 @@ class RetrievalStatistics:
         return correlation
   
     def generateImgObjPatchAccuCorrelation(self, num_bins = 40, fig_size = (20, 5)):
-        scan_ids =  list(self.retrieval_records.keys())
+        stats = self.collectStatistics()
         
-        # get shannon entropy and success pairs
-        success_ratio_list = []
-        success_ratio_all_scans_list = []
-        shannon_entropy_list = []
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                shannon, success, success_allscans = \
-                    self.get_shannonEntropy_and_patchsucess(scan_id, frame_record)
-                # skip if no patch
-                if shannon is None or success is None or success_allscans is None:
-                    continue
-                
-                shannon_entropy_list.append(shannon)
-                success_ratio_list.append(success)
-                success_ratio_all_scans_list.append(success_allscans)
+        # get shannon entropy and success pairs, skip frames without patch
+        has_patch = ~np.isnan(stats['patch_success'])
+        success_ratio_list = stats['patch_success'][has_patch].tolist()
+        success_ratio_all_scans_list = stats['patch_success_allscans'][has_patch].tolist()
+        shannon_entropy_list = stats['entropy'][has_patch].tolist()
         
         max_entropy = max(shannon_entropy_list) + 1e-6
         min_entropy = min(shannon_entropy_list)
@@ -405,58 +352,25 @@ class RetrievalStatistics:
         return correlation_entropy_success, correlation_entropy_success_allscans, np.mean(success_arr), np.mean(success_arr_allscans)
        
     def generateSceneObjAccuCorrelation(self, num_bins = 40, fig_size = (20, 5)):
-        scan_ids =  list(self.retrieval_records.keys())
-        
-        # get shannon entropy and success pairs
-        success_ratio_list = []
-        scene_obj_num_list = []
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            # static case
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                scene_obj_num, success = self.get_SceneObjNum_and_sucess(scan_id, frame_record)
-                scene_obj_num_list.append(scene_obj_num)
-                success_ratio_list.append(success)
+        stats = self.collectStatistics()
         
         # calculate correlation
-        scene_obj_num_arr = np.array(scene_obj_num_list)
-        success_arr = np.array(success_ratio_list)
+        scene_obj_num_arr = stats['scene_obj_num']
+        success_arr = stats['success']
         ## calculate correlation
         correlation = np.corrcoef(scene_obj_num_arr, success_arr)[0, 1]
         return correlation
     
     def generateSceneObjPatchAccuCorrelation(self, num_bins = 40, fig_size = (20, 5)):
-        scan_ids =  list(self.retrieval_records.keys())
+        stats = self.collectStatistics()
         
-        # get scene obj num and success pairs
-        success_ratio_list = []
-        success_ratio_all_scans_list = []
-        scene_obj_num_list = []
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                scene_obj_num, success, success_allscans = \
-                    self.get_SceneObjNum_and_patchsucess(scan_id, frame_record)
-                # skip if no patch
-                if scene_obj_num is None or success is None or success_allscans is None:
-                    continue
-                
-                scene_obj_num_list.append(scene_obj_num)
-                success_ratio_list.append(success)
-                success_ratio_all_scans_list.append(success_allscans)
+        # get scene obj num and success pairs, skip frames without patch
+        has_patch = ~np.isnan(stats['patch_success'])
         
         # calculate correlation
-        scene_obj_num_arr = np.array(scene_obj_num_list)
-        success_arr = np.array(success_ratio_list)
-        success_arr_allscans = np.array(success_ratio_all_scans_list)
+        scene_obj_num_arr = stats['scene_obj_num'][has_patch]
+        success_arr = stats['patch_success'][has_patch]
+        success_arr_allscans = stats['patch_success_allscans'][has_patch]
         ## calculate correlation
         correlation_obj_num_success = np.corrcoef(scene_obj_num_arr, success_arr)[0, 1]
         correlation_obj_num_success_allscans = np.corrcoef(
@@ -465,36 +379,10 @@ class RetrievalStatistics:
         return correlation_obj_num_success, correlation_obj_num_success_allscans
        
     def generateSemanticConfusionMatrix(self, topk = 20):
-        scan_ids =  list(self.retrieval_records.keys())
-        sem_cat_id2name = self.retrieval_records[scan_ids[0]]['sem_cat_id2name']
-        sem_num = len(sem_cat_id2name)
-        confusion_matrix = np.zeros((sem_num, sem_num))
-        confusion_matrix_allscans = np.zeros((sem_num, sem_num))
-        for scan_id in scan_ids:
-            record = self.retrieval_records[scan_id]
-            frames_retrieval = record["frames_retrieval"]
-            frame_idxs = list(frames_retrieval.keys())
-            
-            for frame_idx in frame_idxs:
-                frame_record = frames_retrieval[frame_idx]
-                if self.temp:
-                    matched_obj_cates = frame_record["matched_obj_cates_temp"]
-                    matched_obj_cates_allscans = frame_record["matched_obj_cates_allscans_temp"]
-                    gt_obj_cates = frame_record["gt_obj_cates_temp"]
-                else:
-                    matched_obj_cates = frame_record["matched_obj_cates"]
-                    matched_obj_cates_allscans = frame_record["matched_obj_cates_allscans"]
-                    gt_obj_cates = frame_record["gt_obj_cates"]
-                
-                # update confusion matrix
-                for patch_i in range(gt_obj_cates.size):
-                    gt_cate = gt_obj_cates[patch_i]
-                    if gt_cate == self.undefined:
-                        continue
-                    matched_cate = matched_obj_cates[patch_i]
-                    matched_cate_allscans = matched_obj_cates_allscans[patch_i]
-                    confusion_matrix[gt_cate-1, matched_cate-1] += 1
-                    confusion_matrix_allscans[gt_cate-1, matched_cate_allscans-1] += 1
+        stats = self.collectStatistics()
+        sem_cat_id2name = self.scans[self.scan_ids[0]]['sem_cat_id2name']
+        confusion_matrix = stats['confusion_matrix']
+        confusion_matrix_allscans = stats['confusion_matrix_allscans']
                 
         # select topk semantic categories
         cate_num = np.sum(confusion_matrix, axis=1)
@@ -573,10 +461,13 @@ class RetrievalStatistics:
             self.generateImgObjPatchAccuCorrelation()
         SceneObjPatchAccuCorre, SceneObjPatchAllscansAccuCorre = self.generateSceneObjPatchAccuCorrelation()
         self.generateSemanticConfusionMatrix()
+        TopKRecall = self.topKRecall()
 
         # save to txt
         txt_file = osp.join(self.out_dir, "{}_retrieval_statistics.txt".format(self.split))
         with open(txt_file, "w") as f:
+            for k, recall in TopKRecall.items():
+                f.write("R@{}: {}\n".format(k, recall))
             f.write("Score~R1 Pearson Correlation Coeff: {}\n".format(ScoreAccuCorre))
             f.write("ImgObjShannon~R1 Pearson Correlation Coeff: {}\n".format(ImgObjAccuCorre))
             f.write("SceneObj~R1 Pearson Correlation Coeff: {}\n".format(SceneObjAccuCorre))